@@ -29,7 +29,11 @@ main(\*args, \*\*kwargs)
 from abc import ABC, abstractmethod
 import argparse
 from datetime import datetime
+import functools
+import hashlib
+import json
 import logging
+import os
 from pathlib import Path
 import platform
 import re
@@ -83,6 +87,16 @@ class Build(CotainrSubcommand):
         Path to a Conda environment.yml file to install and activate in the
         container. When installing a Conda environment, you must accept the
         Miniforge license terms, as specified during the build process.
+    conda_extra_env : list of str, optional
+        An additional Conda environment, given as NAME=PATH to a Conda
+        environment.yml file, to install next to the conda_env Conda
+        environment, which remains the one activated in the container. The
+        Conda environments are solved and installed concurrently. May be given
+        multiple times.
+    conda_pack : :class:`os.PathLike`, optional
+        Path to a relocatable Conda environment archive, created using
+        conda-pack, to import and activate in the container instead of
+        installing a Conda environment from an environment.yml file.
     system : str
         Which system/partition you will be running the container on. This sets
         base image and other parameters for a simpler container creation.
@@ -91,6 +105,129 @@ class Build(CotainrSubcommand):
     accept_licenses : bool, default=False
         Accept all license terms (if any) needed for completing the container
         build process.
+    no_base_image_cache : bool, default=False
+        Do not use the cache of unpacked base images and bootstrapped Conda
+        base environments, i.e. always unpack the base image and bootstrap
+        Conda from scratch.
+    persistent_session : bool, default=False
+        Run all commands in the container sandbox in a single long-lived shell
+        session instead of starting a new container process for each command.
+    sandbox_root : :class:`os.PathLike`, optional
+        Directory in which to create the temporary container sandbox, e.g. a
+        node-local disk. Defaults to the COTAINR_SANDBOX_ROOT environment
+        variable, the "sandbox-root" of the chosen system, or the default
+        temporary directory, in that order.
+    no_space_check : bool, default=False
+        Skip checking that there is enough free space in the sandbox root
+        before the build, e.g. if the rough estimate of the space needed is
+        too large.
+    sif_compression : {"gzip", "zstd", "lz4", "none"}, optional
+        The compression algorithm used for the squashfs file system in the SIF
+        container image. Defaults to the "sif-compression" of the chosen system
+        or the default of the container runtime.
+    sif_compression_level : int, optional
+        The compression level used with the gzip or zstd SIF compression.
+        Defaults to the "sif-compression-level" of the chosen system.
+    sif_block_size : str, optional
+        The block size of the squashfs file system in the SIF container image,
+        e.g. 1M. Defaults to the "sif-block-size" of the chosen system.
+    mksquashfs_processors : int, optional
+        The number of processors used for creating the SIF container image.
+        Defaults to the "mksquashfs-processors" of the chosen system or all
+        available processors.
+    force_rebuild : bool, default=False
+        Always build the container, even if an existing container image at
+        `image_path` was built from the same inputs.
+    keep_sandbox : bool, default=False
+        Keep the container sandbox after the build, e.g. for debugging. The
+        path to the kept sandbox is shown when the build finishes.
+    no_background_cleanup : bool, default=False
+        Delete the container sandbox before cotainr exits instead of in a
+        background process that may keep running after cotainr exits.
+    usage_report : :class:`os.PathLike`, optional
+        Path to a JSON file in which to write a report of the size and number
+        of inodes of the container sandbox after each build stage. The sandbox
+        is only measured when a report is requested.
+    deduplicate_files : bool, default=False
+        Replace identical files in the container by hardlinks before building
+        the container image, e.g. to speed up building images with large Conda
+        environments.
+    layered : bool, default=False
+        Build the container image as the base image with the Conda
+        environment added as a separate overlay layer. The base image is
+        cached such that only the Conda environment layer is rebuilt when it
+        changes.
+    installer_cache_max_age : float, default=24
+        The maximum age in hours of the cached check for the latest Miniforge
+        installer release before checking for a new release.
+    conda_pkgs_cache : bool, default=False
+        Use a persistent Conda package cache, shared across builds, such that
+        Conda packages are only downloaded once.
+    conda_pkgs_cache_max_size : float, default=20
+        The maximum size in GiB of the Conda package cache. The least recently
+        used packages are evicted from the cache to stay below it.
+    conda_update_base : {"always", "never", "stale"}, default="always"
+        When to update Conda in the Conda base environment: always, never, or
+        only when the base environment is older than the
+        conda_update_base_max_age.
+    conda_update_base_max_age : float, default=7
+        The maximum age in days of the Conda base environment before it is
+        updated when conda_update_base is "stale".
+    conda_solver : {"conda", "classic", "libmamba", "mamba", "micromamba"}, default="conda"
+        The tool used to solve and install the Conda environment: conda with
+        its default solver, conda with the classic or libmamba solver, mamba,
+        or micromamba.
+    conda_env_lock : {"use", "refresh", "ignore"}, default="use"
+        How to use the cache of solved Conda environments: install from the
+        cached solution of the Conda environment, if any, refresh the cached
+        solution by solving the Conda environment, or ignore the cache.
+    conda_installer : :class:`os.PathLike`, optional
+        The path to a local Miniforge installer to use instead of downloading
+        the latest Miniforge installer.
+    conda_channel_mirror : list of str, optional
+        The url, e.g. file:///srv/mirrors/conda-forge or
+        http://localhost:8000/conda-forge, of a local Conda channel mirror.
+        The last part of the url is the name of the mirrored channel. May be
+        given multiple times.
+    offline : bool, default=False
+        Build the container without network access. Requires a local base
+        image, and for adding a Conda environment, a local Miniforge installer
+        and local mirrors of all Conda channels used. Fails before starting
+        the build if any of them are not available.
+    conda_host_dry_run : bool, default=False
+        Solve the Conda environments using conda on the host, for the
+        architecture of the container, while the base image is unpacked, such
+        that an unsolvable Conda environment fails the build before Conda is
+        installed in the container.
+    pip_requirements : :class:`os.PathLike`, optional
+        Path to a pip requirements.txt file to install in the Conda
+        environment after creating it.
+    pip_installer : {"pip", "uv"}, default="pip"
+        The tool used to install the pip requirements. pip must be included in
+        the Conda environment, whereas uv is installed in the Conda base
+        environment.
+    pip_wheel_cache : bool, default=False
+        Use a persistent pip/uv wheel cache, shared across builds, such that
+        wheels are only downloaded or built once.
+    pip_jobs : int, optional
+        The number of concurrent downloads, builds, and installs of pip
+        requirements when using uv.
+    slim : {"conservative", "aggressive"}, optional
+        Remove files not needed at runtime from the Conda installation: static
+        libraries and documentation (conservative), and additionally headers,
+        test suites, Python bytecode caches, and debug symbols (aggressive).
+    slim_keep : list of str, optional
+        A glob pattern, relative to the Conda installation, of files to never
+        remove when slimming, e.g. "include/python*". May be given multiple
+        times.
+    slim_remove : list of str, optional
+        A glob pattern, relative to the Conda installation, of additional
+        files to remove when slimming. May be given multiple times.
+    compile_bytecode : {"timestamp", "checked-hash", "unchecked-hash"}, optional
+        Compile all Python modules in the site-packages of the Conda
+        environment to bytecode, using the given bytecode invalidation mode
+        (unchecked-hash if no mode is given), to avoid recompiling them on
+        every import from the read-only container.
     verbosity : int, optional
         The verbosity of the output from cotainr: -1 for only CRITICAL, 0 (the
         default) for cotainr INFO and subprocess WARNING, 1 for subprocess
@@ -107,8 +244,43 @@ class Build(CotainrSubcommand):
         image_path,
         base_image=None,
         conda_env=None,
+        conda_extra_env=None,
+        conda_pack=None,
         system=None,
         accept_licenses=False,
+        no_base_image_cache=False,
+        persistent_session=False,
+        sandbox_root=None,
+        no_space_check=False,
+        sif_compression=None,
+        sif_compression_level=None,
+        sif_block_size=None,
+        mksquashfs_processors=None,
+        force_rebuild=False,
+        keep_sandbox=False,
+        no_background_cleanup=False,
+        usage_report=None,
+        deduplicate_files=False,
+        layered=False,
+        installer_cache_max_age=24,
+        conda_pkgs_cache=False,
+        conda_pkgs_cache_max_size=20,
+        conda_update_base="always",
+        conda_update_base_max_age=7,
+        conda_solver="conda",
+        conda_env_lock="use",
+        conda_installer=None,
+        conda_channel_mirror=None,
+        offline=False,
+        conda_host_dry_run=False,
+        pip_requirements=None,
+        pip_installer="pip",
+        pip_wheel_cache=False,
+        pip_jobs=None,
+        slim=None,
+        slim_keep=None,
+        slim_remove=None,
+        compile_bytecode=None,
         verbosity=0,
         log_to_file=False,
         no_color=False,
@@ -125,17 +297,9 @@ class Build(CotainrSubcommand):
             no_color=no_color,
         )
         self.image_path = Path(image_path).resolve()
-        if self.image_path.exists():
-            overwrite_text = (
-                f"{self.image_path} already exists. Would you like to overwrite it?"
-            )
-            if not util.answer_is_yes(overwrite_text):
-                logger.critical(
-                    "You have chosen not to overwrite %s. Exiting.", self.image_path
-                )
-                sys.exit(0)
-
         self.accept_licenses = accept_licenses
+        self.no_base_image_cache = no_base_image_cache
+        self.persistent_session = persistent_session
         self.base_image = base_image
         systems = util.get_systems()
         if system is not None:
@@ -144,6 +308,29 @@ class Build(CotainrSubcommand):
                 self.base_image = self.system["base-image"]
             else:
                 raise KeyError("System does not exist")
+        system_config = getattr(self, "system", {})
+        if sandbox_root is None:
+            sandbox_root = os.environ.get("COTAINR_SANDBOX_ROOT") or system_config.get(
+                "sandbox-root"
+            )
+        self.sandbox_root = sandbox_root
+        self.no_space_check = no_space_check
+        self.sif_options = {
+            "compression": sif_compression,
+            "compression_level": sif_compression_level,
+            "block_size": sif_block_size,
+            "processors": mksquashfs_processors,
+        }
+        for option, system_key in [
+            ("compression", "sif-compression"),
+            ("compression_level", "sif-compression-level"),
+            ("block_size", "sif-block-size"),
+            ("processors", "mksquashfs-processors"),
+        ]:
+            if self.sif_options[option] is None:
+                self.sif_options[option] = system_config.get(system_key)
+        # Fail early on invalid settings rather than after the build
+        container.SingularitySandbox.get_mksquashfs_args(**self.sif_options)
         if conda_env is not None:
             self.conda_env = Path(conda_env).resolve()
             if not self.conda_env.exists():
@@ -152,6 +339,130 @@ class Build(CotainrSubcommand):
                 )
         else:
             self.conda_env = None
+        self.conda_extra_envs = {}
+        for extra_env in conda_extra_env or []:
+            name, sep, path = extra_env.partition("=")
+            if not sep or not re.fullmatch(r"[A-Za-z0-9_.-]+", name):
+                raise ValueError(
+                    f"Invalid Conda extra env {extra_env!r}. Must be NAME=PATH with "
+                    "a NAME of letters, digits, '_', '.', or '-'."
+                )
+            if name in ("base", "conda_container_env", *self.conda_extra_envs):
+                raise ValueError(f"The Conda env name '{name}' is already in use.")
+            if self.conda_env is None:
+                raise ValueError(
+                    "Extra Conda environments can only be added together with a "
+                    "Conda env file."
+                )
+            self.conda_extra_envs[name] = Path(path).resolve()
+            if not self.conda_extra_envs[name].exists():
+                raise FileNotFoundError(
+                    f"The provided Conda env file '{self.conda_extra_envs[name]}' "
+                    "does not exist."
+                )
+        if conda_pack is not None:
+            if self.conda_env is not None:
+                raise ValueError(
+                    "Only one of a Conda env file and a conda-pack archive may be "
+                    "added to the container."
+                )
+            self.conda_pack = Path(conda_pack).resolve()
+            if not self.conda_pack.exists():
+                raise FileNotFoundError(
+                    f"The provided conda-pack archive '{self.conda_pack}' does not "
+                    "exist."
+                )
+        else:
+            self.conda_pack = None
+
+        self.keep_sandbox = keep_sandbox
+        self.no_background_cleanup = no_background_cleanup
+        self.deduplicate_files = deduplicate_files
+        self.layered = layered
+        self.installer_cache_max_age = installer_cache_max_age
+        self.conda_pkgs_cache = conda_pkgs_cache
+        self.conda_pkgs_cache_max_size = conda_pkgs_cache_max_size
+        self.conda_update_base = conda_update_base
+        self.conda_update_base_max_age = conda_update_base_max_age
+        self.conda_solver = conda_solver
+        self.conda_env_lock = conda_env_lock
+        self.conda_installer = (
+            Path(conda_installer).resolve() if conda_installer is not None else None
+        )
+        self.conda_channel_mirrors = list(conda_channel_mirror or [])
+        self.offline = offline
+        if self.offline:
+            self._check_offline_artifacts()
+        elif self.conda_installer is not None or self.conda_channel_mirrors:
+            pack.CondaInstall.check_local_artifacts(
+                local_installer=self.conda_installer,
+                channel_mirrors=self.conda_channel_mirrors,
+            )
+        if conda_host_dry_run:
+            if self.conda_env is None:
+                raise ValueError(
+                    "A host dry run solve requires a Conda env file to solve."
+                )
+            if self.offline:
+                raise ValueError("A host dry run solve is not possible offline.")
+            if not (os.environ.get("CONDA_EXE") or shutil.which("conda")):
+                raise FileNotFoundError(
+                    "conda must be available on the host for a host dry run solve."
+                )
+        self.conda_host_dry_run = conda_host_dry_run
+        if pip_requirements is not None:
+            if self.conda_env is None:
+                raise ValueError(
+                    "Pip requirements can only be installed in a Conda environment "
+                    "added using a Conda env file."
+                )
+            self.pip_requirements = Path(pip_requirements).resolve()
+            if not self.pip_requirements.exists():
+                raise FileNotFoundError(
+                    f"The provided pip requirements file '{self.pip_requirements}' "
+                    "does not exist."
+                )
+        else:
+            self.pip_requirements = None
+        self.pip_installer = pip_installer
+        self.pip_wheel_cache = pip_wheel_cache
+        self.pip_jobs = pip_jobs
+        if slim is not None and slim not in ("conservative", "aggressive"):
+            raise ValueError(
+                f"Invalid {slim=}. Must be one of 'conservative' or 'aggressive'."
+            )
+        self.slim = slim
+        self.slim_keep = list(slim_keep or [])
+        self.slim_remove = list(slim_remove or [])
+        if compile_bytecode is not None and compile_bytecode not in (
+            "timestamp",
+            "checked-hash",
+            "unchecked-hash",
+        ):
+            raise ValueError(
+                f"Invalid {compile_bytecode=}. Must be one of 'timestamp', "
+                "'checked-hash', or 'unchecked-hash'."
+            )
+        self.compile_bytecode = compile_bytecode
+        self.usage_report = (
+            Path(usage_report).resolve() if usage_report is not None else None
+        )
+        self.force_rebuild = force_rebuild
+        self.fingerprint = self._compute_build_fingerprint()
+        self.image_up_to_date = False
+        if self.image_path.exists():
+            if self._existing_image_is_up_to_date():
+                self.image_up_to_date = True
+            else:
+                overwrite_text = (
+                    f"{self.image_path} already exists. Would you like to overwrite it?"
+                )
+                if not util.answer_is_yes(overwrite_text):
+                    logger.critical(
+                        "You have chosen not to overwrite %s. Exiting.",
+                        self.image_path,
+                    )
+                    sys.exit(0)
 
     @classmethod
     def add_arguments(cls, *, parser):
@@ -170,11 +481,25 @@ class Build(CotainrSubcommand):
             "--system",
             help=_extract_help_from_docstring(arg="system", docstring=cls.__doc__),
         )
-        parser.add_argument(
+        conda_group = parser.add_mutually_exclusive_group()
+        conda_group.add_argument(
             "--conda-env",
             help=_extract_help_from_docstring(arg="conda_env", docstring=cls.__doc__),
             type=Path,
         )
+        conda_group.add_argument(
+            "--conda-pack",
+            help=_extract_help_from_docstring(arg="conda_pack", docstring=cls.__doc__),
+            type=Path,
+        )
+        parser.add_argument(
+            "--conda-extra-env",
+            help=_extract_help_from_docstring(
+                arg="conda_extra_env", docstring=cls.__doc__
+            ),
+            action="append",
+            metavar="NAME=PATH",
+        )
         parser.add_argument(
             "--accept-licenses",
             help=_extract_help_from_docstring(
@@ -182,6 +507,241 @@ class Build(CotainrSubcommand):
             ),
             action="store_true",
         )
+        parser.add_argument(
+            "--no-base-image-cache",
+            help=_extract_help_from_docstring(
+                arg="no_base_image_cache", docstring=cls.__doc__
+            ),
+            action="store_true",
+        )
+        parser.add_argument(
+            "--persistent-session",
+            help=_extract_help_from_docstring(
+                arg="persistent_session", docstring=cls.__doc__
+            ),
+            action="store_true",
+        )
+        parser.add_argument(
+            "--sandbox-root",
+            help=_extract_help_from_docstring(
+                arg="sandbox_root", docstring=cls.__doc__
+            ),
+            type=Path,
+        )
+        parser.add_argument(
+            "--no-space-check",
+            help=_extract_help_from_docstring(
+                arg="no_space_check", docstring=cls.__doc__
+            ),
+            action="store_true",
+        )
+        parser.add_argument(
+            "--sif-compression",
+            help=_extract_help_from_docstring(
+                arg="sif_compression", docstring=cls.__doc__
+            ),
+            choices=list(container.SIF_COMPRESSION_LEVELS),
+        )
+        parser.add_argument(
+            "--sif-compression-level",
+            help=_extract_help_from_docstring(
+                arg="sif_compression_level", docstring=cls.__doc__
+            ),
+            type=int,
+        )
+        parser.add_argument(
+            "--sif-block-size",
+            help=_extract_help_from_docstring(
+                arg="sif_block_size", docstring=cls.__doc__
+            ),
+        )
+        parser.add_argument(
+            "--mksquashfs-processors",
+            help=_extract_help_from_docstring(
+                arg="mksquashfs_processors", docstring=cls.__doc__
+            ),
+            type=int,
+        )
+        parser.add_argument(
+            "--force-rebuild",
+            help=_extract_help_from_docstring(
+                arg="force_rebuild", docstring=cls.__doc__
+            ),
+            action="store_true",
+        )
+        parser.add_argument(
+            "--keep-sandbox",
+            help=_extract_help_from_docstring(
+                arg="keep_sandbox", docstring=cls.__doc__
+            ),
+            action="store_true",
+        )
+        parser.add_argument(
+            "--no-background-cleanup",
+            help=_extract_help_from_docstring(
+                arg="no_background_cleanup", docstring=cls.__doc__
+            ),
+            action="store_true",
+        )
+        parser.add_argument(
+            "--usage-report",
+            help=_extract_help_from_docstring(
+                arg="usage_report", docstring=cls.__doc__
+            ),
+            type=Path,
+        )
+        parser.add_argument(
+            "--deduplicate-files",
+            help=_extract_help_from_docstring(
+                arg="deduplicate_files", docstring=cls.__doc__
+            ),
+            action="store_true",
+        )
+        parser.add_argument(
+            "--layered",
+            help=_extract_help_from_docstring(arg="layered", docstring=cls.__doc__),
+            action="store_true",
+        )
+        parser.add_argument(
+            "--installer-cache-max-age",
+            help=_extract_help_from_docstring(
+                arg="installer_cache_max_age", docstring=cls.__doc__
+            ),
+            type=float,
+            default=24,
+            metavar="HOURS",
+        )
+        parser.add_argument(
+            "--conda-pkgs-cache",
+            help=_extract_help_from_docstring(
+                arg="conda_pkgs_cache", docstring=cls.__doc__
+            ),
+            action="store_true",
+        )
+        parser.add_argument(
+            "--conda-pkgs-cache-max-size",
+            help=_extract_help_from_docstring(
+                arg="conda_pkgs_cache_max_size", docstring=cls.__doc__
+            ),
+            type=float,
+            default=20,
+            metavar="GIB",
+        )
+        parser.add_argument(
+            "--conda-update-base",
+            help=_extract_help_from_docstring(
+                arg="conda_update_base", docstring=cls.__doc__
+            ),
+            choices=["always", "never", "stale"],
+            default="always",
+        )
+        parser.add_argument(
+            "--conda-update-base-max-age",
+            help=_extract_help_from_docstring(
+                arg="conda_update_base_max_age", docstring=cls.__doc__
+            ),
+            type=float,
+            default=7,
+            metavar="DAYS",
+        )
+        parser.add_argument(
+            "--conda-solver",
+            help=_extract_help_from_docstring(
+                arg="conda_solver", docstring=cls.__doc__
+            ),
+            choices=["conda", "classic", "libmamba", "mamba", "micromamba"],
+            default="conda",
+        )
+        parser.add_argument(
+            "--conda-env-lock",
+            help=_extract_help_from_docstring(
+                arg="conda_env_lock", docstring=cls.__doc__
+            ),
+            choices=["use", "refresh", "ignore"],
+            default="use",
+        )
+        parser.add_argument(
+            "--conda-installer",
+            help=_extract_help_from_docstring(
+                arg="conda_installer", docstring=cls.__doc__
+            ),
+            type=Path,
+            metavar="PATH",
+        )
+        parser.add_argument(
+            "--conda-channel-mirror",
+            help=_extract_help_from_docstring(
+                arg="conda_channel_mirror", docstring=cls.__doc__
+            ),
+            action="append",
+            metavar="URL",
+        )
+        parser.add_argument(
+            "--offline",
+            help=_extract_help_from_docstring(arg="offline", docstring=cls.__doc__),
+            action="store_true",
+        )
+        parser.add_argument(
+            "--conda-host-dry-run",
+            help=_extract_help_from_docstring(
+                arg="conda_host_dry_run", docstring=cls.__doc__
+            ),
+            action="store_true",
+        )
+        parser.add_argument(
+            "--pip-requirements",
+            help=_extract_help_from_docstring(
+                arg="pip_requirements", docstring=cls.__doc__
+            ),
+            type=Path,
+        )
+        parser.add_argument(
+            "--pip-installer",
+            help=_extract_help_from_docstring(
+                arg="pip_installer", docstring=cls.__doc__
+            ),
+            choices=["pip", "uv"],
+            default="pip",
+        )
+        parser.add_argument(
+            "--pip-wheel-cache",
+            help=_extract_help_from_docstring(
+                arg="pip_wheel_cache", docstring=cls.__doc__
+            ),
+            action="store_true",
+        )
+        parser.add_argument(
+            "--pip-jobs",
+            help=_extract_help_from_docstring(arg="pip_jobs", docstring=cls.__doc__),
+            type=int,
+            metavar="N",
+        )
+        parser.add_argument(
+            "--slim",
+            help=_extract_help_from_docstring(arg="slim", docstring=cls.__doc__),
+            choices=["conservative", "aggressive"],
+        )
+        parser.add_argument(
+            "--slim-keep",
+            help=_extract_help_from_docstring(arg="slim_keep", docstring=cls.__doc__),
+            action="append",
+            metavar="GLOB",
+        )
+        parser.add_argument(
+            "--slim-remove",
+            help=_extract_help_from_docstring(arg="slim_remove", docstring=cls.__doc__),
+            action="append",
+            metavar="GLOB",
+        )
+        parser.add_argument(
+            "--compile-bytecode",
+            help=_extract_help_from_docstring(
+                arg="compile_bytecode", docstring=cls.__doc__
+            ),
+            choices=["timestamp", "checked-hash", "unchecked-hash"],
+            nargs="?",
+            const="unchecked-hash",
+        )
         verbose_quiet_group = parser.add_mutually_exclusive_group()
         verbose_quiet_group.add_argument(
             "--verbose",
@@ -217,25 +777,103 @@ class Build(CotainrSubcommand):
 
     def execute(self):
         """Execute the "build" subcommand."""
+        if self.image_up_to_date:
+            logger.info(
+                "%s is up to date with the build inputs (fingerprint %s). Skipping"
+                " build. Use --force-rebuild to rebuild it.",
+                self.image_path,
+                self.fingerprint,
+            )
+            return
+
         t_start_build = time.time()
-        with tracing.ConsoleSpinner():
+        with tracing.ConsoleSpinner(), util.StagePipeline() as pipeline:
             logger.info("Creating Singularity Sandbox")
-            with container.SingularitySandbox(
-                base_image=self.base_image, log_settings=self.log_settings
-            ) as sandbox:
+            sandbox = container.SingularitySandbox(
+                base_image=self.base_image,
+                log_settings=self.log_settings,
+                use_base_image_cache=not self.no_base_image_cache,
+                persistent_session=self.persistent_session,
+                sandbox_root=self.sandbox_root,
+                extra_space_estimate=self._extra_space_estimate(),
+                check_free_space=not self.no_space_check,
+                keep_sandbox=self.keep_sandbox,
+                background_cleanup=not self.no_background_cleanup,
+                track_usage=self.usage_report is not None,
+            )
+            if self.conda_env is not None:
+                # Prepare the Conda installation while the base image is unpacked
+                predicted_architecture = sandbox.predict_architecture()
+                self._submit_conda_preparation_stages(
+                    pipeline=pipeline, architecture=predicted_architecture
+                )
+            with sandbox:
+                pipeline.checkpoint(name="base_image")
+                layer_paths = []
+                env_prefixes = []
                 if self.conda_env is not None:
+                    self._await_conda_preparation_stages(
+                        pipeline=pipeline,
+                        predicted_architecture=predicted_architecture,
+                        architecture=sandbox.architecture,
+                    )
                     # Install supplied conda env
                     logger.info("Installing Conda environment: %s", self.conda_env)
                     conda_env_name = "conda_container_env"
                     conda_env_file = sandbox.sandbox_dir / self.conda_env.name
                     shutil.copyfile(self.conda_env, conda_env_file)
+                    conda_env_files = {conda_env_name: conda_env_file}
+                    for name, path in self.conda_extra_envs.items():
+                        logger.info("Installing Conda environment %s: %s", name, path)
+                        conda_env_files[name] = (
+                            sandbox.sandbox_dir / f"conda_env_{name}.yml"
+                        )
+                        shutil.copyfile(path, conda_env_files[name])
                     conda_install = pack.CondaInstall(
                         sandbox=sandbox,
                         license_accepted=self.accept_licenses,
                         log_settings=self.log_settings,
+                        installer_cache_max_age=self.installer_cache_max_age * 60 * 60,
+                        pkgs_cache_dir=(
+                            util.get_cache_dir() / "conda_pkgs"
+                            if self.conda_pkgs_cache
+                            else None
+                        ),
+                        pkgs_cache_max_size=int(self.conda_pkgs_cache_max_size * 2**30),
+                        update_base=self.conda_update_base,
+                        update_base_max_age=(
+                            self.conda_update_base_max_age * 24 * 60 * 60
+                        ),
+                        use_base_prefix_cache=not self.no_base_image_cache,
+                        solver=self.conda_solver,
+                        env_lock=self.conda_env_lock,
+                        local_installer=self.conda_installer,
+                        channel_mirrors=self.conda_channel_mirrors,
+                        wheel_cache_dir=(
+                            util.get_cache_dir() / "pip_wheels"
+                            if self.pip_wheel_cache
+                            else None
+                        ),
                     )
-                    conda_install.add_environment(
-                        path=conda_env_file, name=conda_env_name
+                    conda_install.add_environments(envs=conda_env_files)
+                    if self.pip_requirements is not None:
+                        logger.info(
+                            "Installing pip requirements: %s", self.pip_requirements
+                        )
+                        pip_requirements_file = (
+                            sandbox.sandbox_dir / self.pip_requirements.name
+                        )
+                        shutil.copyfile(self.pip_requirements, pip_requirements_file)
+                        conda_install.add_pip_requirements(
+                            path=pip_requirements_file,
+                            name=conda_env_name,
+                            installer=self.pip_installer,
+                            jobs=self.pip_jobs,
+                        )
+                    layer_paths.append(conda_install.prefix)
+                    env_prefixes.extend(
+                        f"{conda_install.prefix}/envs/{name}"
+                        for name in conda_env_files
                     )
 
                     sandbox.add_to_env(shell_script=f"conda activate {conda_env_name}")
@@ -246,19 +884,417 @@ class Build(CotainrSubcommand):
                     logger.info(
                         "Finished installing conda environment: %s", self.conda_env
                     )
+                    pipeline.checkpoint(name="conda_install")
+                elif self.conda_pack is not None:
+                    # Import supplied conda-pack archive
+                    logger.info("Importing conda-pack archive: %s", self.conda_pack)
+                    conda_pack_import = pack.CondaPackImport(
+                        sandbox=sandbox, archive_path=self.conda_pack
+                    )
+                    conda_pack_import.import_environment()
+                    layer_paths.append(conda_pack_import.prefix)
+                    env_prefixes.append(conda_pack_import.prefix)
+                    logger.info(
+                        "Finished importing conda-pack archive: %s", self.conda_pack
+                    )
+                    pipeline.checkpoint(name="conda_pack_import")
+
+                if self.slim is not None and layer_paths:
+                    logger.info("Slimming Conda installation (%s profile)", self.slim)
+                    self._slim_conda_prefixes(sandbox=sandbox, prefixes=layer_paths)
+                    pipeline.checkpoint(name="slimming")
+
+                if self.compile_bytecode is not None:
+                    logger.info("Compiling Python modules to bytecode")
+                    for env_prefix in env_prefixes:
+                        pack.compile_bytecode(
+                            sandbox=sandbox,
+                            env_prefix=env_prefix,
+                            invalidation_mode=self.compile_bytecode,
+                        )
+                    pipeline.checkpoint(name="bytecode_compilation")
 
                 logger.info("Adding metadata to container")
-                sandbox.add_metadata()
+                sandbox.add_metadata(fingerprint=self.fingerprint)
+                if self.deduplicate_files:
+                    logger.info("Deduplicating files in container")
+                    sandbox.deduplicate_files()
                 logger.info("Building container image")
-                sandbox.build_image(path=self.image_path)
+                if self.layered:
+                    sandbox.build_layered_image(
+                        path=self.image_path,
+                        layer_paths=layer_paths,
+                        **self.sif_options,
+                    )
+                else:
+                    sandbox.build_image(path=self.image_path, **self.sif_options)
+                pipeline.checkpoint(name="image")
+
+                # Report the image as finished before the sandbox is torn down
+                t_end_build = time.time()
+                logger.info(
+                    "Finished building %s in %s",
+                    self.image_path,
+                    time.strftime("%H:%M:%S", time.gmtime(t_end_build - t_start_build)),
+                )
+                pipeline.log_timings()
+                self._log_command_usage(command_usage=sandbox.command_usage)
 
-            t_end_build = time.time()
-            logger.info(
-                "Finished building %s in %s",
-                self.image_path,
-                time.strftime("%H:%M:%S", time.gmtime(t_end_build - t_start_build)),
+            if self.usage_report is not None:
+                self._write_usage_report(
+                    usage=sandbox.usage_report, command_usage=sandbox.command_usage
+                )
+
+    def _await_conda_preparation_stages(
+        self, *, pipeline, predicted_architecture, architecture
+    ):
+        """
+        Wait for the Conda preparation stages to finish.
+
+        A failure to fetch the Miniforge installer is ignored, as it is fetched
+        again when installing Conda. A failure to solve a Conda environment on
+        the host fails the build.
+
+        Parameters
+        ----------
+        pipeline : :class:`~cotainr.util.StagePipeline`
+            The pipeline running the Conda preparation stages.
+        predicted_architecture : str
+            The predicted architecture of the container sandbox that the Conda
+            installation was prepared for.
+        architecture : str
+            The actual architecture of the container sandbox.
+        """
+        if self.conda_installer is None:
+            try:
+                pipeline.result(name="miniforge_installer")
+            except (OSError, RuntimeError, ValueError) as e:
+                logger.debug("Unable to prefetch the Miniforge installer: %s", e)
+        if self.conda_host_dry_run:
+            for name in ["conda_container_env", *self.conda_extra_envs]:
+                pipeline.result(name=f"host_dry_run[{name}]")
+        if predicted_architecture != architecture:
+            logger.warning(
+                "The Conda installation was prepared for the %s architecture, but "
+                "the container sandbox architecture is %s",
+                predicted_architecture,
+                architecture,
+            )
+
+    def _check_offline_artifacts(self):
+        """
+        Check that all artifacts needed for an offline build are available.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the base image, the local Miniforge installer, or a Conda
+            channel mirror is not available.
+        ValueError
+            If a local Miniforge installer or Conda channel mirrors are needed
+            but not given, or if a Conda channel is not mirrored.
+        """
+        if not container.SingularitySandbox(
+            base_image=self.base_image,
+            use_base_image_cache=not self.no_base_image_cache,
+        ).base_image_is_available_locally():
+            raise FileNotFoundError(
+                f"The base image '{self.base_image}' is not available offline. "
+                "Use a local image file or a cached base image pinned by a digest."
+            )
+
+        if self.conda_env is not None:
+            if self.conda_installer is None:
+                raise ValueError(
+                    "A local Miniforge installer must be given using "
+                    "--conda-installer to add a Conda environment offline."
+                )
+            if not self.conda_channel_mirrors:
+                raise ValueError(
+                    "Local Conda channel mirrors must be given using "
+                    "--conda-channel-mirror to add a Conda environment offline."
+                )
+
+        for env_path in [self.conda_env, *self.conda_extra_envs.values()]:
+            pack.CondaInstall.check_local_artifacts(
+                local_installer=self.conda_installer,
+                channel_mirrors=self.conda_channel_mirrors,
+                env_path=env_path,
             )
 
+    def _compute_build_fingerprint(self):
+        """
+        Compute a fingerprint of the build inputs.
+
+        The fingerprint is the SHA256 digest of the base image digest, the
+        Conda environment file or conda-pack archive content, the local
+        Miniforge installer content, the Conda channel mirrors, the cotainr
+        version, and the build options affecting the content of the container
+        image.
+
+        Returns
+        -------
+        fingerprint : str or None
+            The "sha256:<hex digest>" fingerprint or None if the base image
+            digest cannot be resolved, e.g. for mutable references like
+            "docker://ubuntu:latest".
+        """
+        base_image_digest = container.SingularitySandbox(
+            base_image=self.base_image
+        ).resolve_base_image_digest()
+        if base_image_digest is None:
+            logger.debug(
+                "Unable to fingerprint the build inputs without a base image digest"
+            )
+            return None
+
+        build_inputs = {
+            "base_image_digest": base_image_digest,
+            "conda_env_sha256": (
+                util.compute_sha256(path=self.conda_env)
+                if self.conda_env is not None
+                else None
+            ),
+            "conda_extra_envs_sha256": {
+                name: util.compute_sha256(path=path)
+                for name, path in self.conda_extra_envs.items()
+            },
+            "conda_pack_sha256": (
+                util.compute_sha256(path=self.conda_pack)
+                if self.conda_pack is not None
+                else None
+            ),
+            "pip_requirements_sha256": (
+                util.compute_sha256(path=self.pip_requirements)
+                if self.pip_requirements is not None
+                else None
+            ),
+            "pip_installer": self.pip_installer,
+            "cotainr_version": _cotainr_version,
+            "sif_options": self.sif_options,
+            "layered": self.layered,
+            "conda_solver": self.conda_solver,
+            "conda_installer_sha256": (
+                util.compute_sha256(path=self.conda_installer)
+                if self.conda_installer is not None
+                else None
+            ),
+            "conda_channel_mirrors": {
+                mirror_url.rsplit("/", 1)[-1]: mirror_url
+                for mirror_url in (
+                    pack._channel_mirror_url(mirror=mirror)
+                    for mirror in self.conda_channel_mirrors
+                )
+            },
+            "conda_update_base": [
+                self.conda_update_base,
+                self.conda_update_base_max_age,
+            ],
+            "slim": [self.slim, self.slim_keep, self.slim_remove],
+            "compile_bytecode": self.compile_bytecode,
+        }
+        fingerprint = hashlib.sha256(
+            json.dumps(build_inputs, sort_keys=True).encode()
+        ).hexdigest()
+        return f"sha256:{fingerprint}"
+
+    def _extra_space_estimate(self):
+        """
+        Estimate the space added to the sandbox by the Conda environment.
+
+        Returns
+        -------
+        extra_space_estimate : tuple of int or None
+            The (bytes, inodes) estimate of the space added to the sandbox by
+            the Conda environment, or None if no Conda environment is added.
+        """
+        if self.conda_env is not None:
+            env_bytes, env_inodes = pack.CondaInstall.space_estimate
+            n_envs = 1 + len(self.conda_extra_envs)
+            return (n_envs * env_bytes, n_envs * env_inodes)
+        if self.conda_pack is not None:
+            return pack.CondaPackImport.estimate_space(archive_path=self.conda_pack)
+
+        return None
+
+    def _existing_image_is_up_to_date(self):
+        """
+        Check if the existing container image was built from the same inputs.
+
+        Returns
+        -------
+        up_to_date : bool
+            True if the fingerprint of the existing container image at
+            `image_path` matches the fingerprint of the build inputs.
+        """
+        if self.force_rebuild or self.fingerprint is None:
+            return False
+
+        labels = container.get_image_labels(path=self.image_path) or {}
+        return labels.get("cotainr.fingerprint") == self.fingerprint
+
+    def _slim_conda_prefixes(self, *, sandbox, prefixes):
+        """
+        Remove files not needed at runtime from the Conda prefixes.
+
+        Parameters
+        ----------
+        sandbox : :class:`~cotainr.container.SingularitySandbox`
+            The sandbox containing the Conda prefixes.
+        prefixes : list of str
+            The Conda prefixes in the container to slim.
+        """
+        t_start = time.monotonic()
+        savings = {}
+        for prefix in prefixes:
+            prefix_savings = pack.slim_prefix(
+                path=sandbox.sandbox_dir / prefix.lstrip("/"),
+                profile=self.slim,
+                keep=self.slim_keep,
+                remove=self.slim_remove,
+            )
+            for category, bytes_saved in prefix_savings.items():
+                savings[category] = savings.get(category, 0) + bytes_saved
+        for category, bytes_saved in savings.items():
+            logger.info("Slimming saved %.1f MiB of %s", bytes_saved / 2**20, category)
+        logger.info(
+            "Slimming saved %.1f MiB in total (in %.1f s)",
+            sum(savings.values()) / 2**20,
+            time.monotonic() - t_start,
+        )
+        sandbox.record_usage(stage="slimming")
+
+    @staticmethod
+    def _log_command_usage(*, command_usage, max_commands=5):
+        """
+        Log a summary of the resources used by the commands run in the build.
+
+        The total resource usage is logged along with that of the commands
+        with the longest wall time. The CPU utilization, i.e. the CPU time
+        relative to the wall time, and the block I/O of a command show whether
+        it is CPU bound, I/O bound, or mostly waiting, e.g. on the network.
+
+        Parameters
+        ----------
+        command_usage : list of dict
+            The resources used by each command run during the build.
+        max_commands : int, default=5
+            The maximum number of commands to log the resource usage of.
+        """
+        if not command_usage:
+            return
+
+        def format_usage(usage):
+            details = [f"{usage['wall_time']:.1f} s wall"]
+            if usage["user_time"] is not None and usage["system_time"] is not None:
+                cpu_time = usage["user_time"] + usage["system_time"]
+                details.append(
+                    f"{usage['user_time']:.1f} s user + {usage['system_time']:.1f} s "
+                    f"system CPU ({cpu_time / max(usage['wall_time'], 1e-6):.0%})"
+                )
+            if usage["max_rss"] is not None:
+                details.append(f"{usage['max_rss'] / 2**20:.0f} MiB peak RSS")
+            if usage["block_input"] is not None and usage["block_output"] is not None:
+                details.append(
+                    f"{usage['block_input']} block reads, "
+                    f"{usage['block_output']} block writes"
+                )
+            return ", ".join(details)
+
+        def total(key):
+            values = [usage[key] for usage in command_usage]
+            return sum(value for value in values if value is not None)
+
+        logger.info(
+            "Ran %d commands: %s",
+            len(command_usage),
+            format_usage(
+                {
+                    "wall_time": total("wall_time"),
+                    "user_time": total("user_time"),
+                    "system_time": total("system_time"),
+                    "max_rss": max(
+                        (usage["max_rss"] or 0 for usage in command_usage), default=0
+                    ),
+                    "block_input": total("block_input"),
+                    "block_output": total("block_output"),
+                }
+            ),
+        )
+        for usage in sorted(
+            command_usage, key=lambda usage: usage["wall_time"], reverse=True
+        )[:max_commands]:
+            command = usage["command"]
+            if len(command) > 60:
+                command = command[:57] + "..."
+            logger.info("  %s: %s", command, format_usage(usage))
+
+    def _submit_conda_preparation_stages(self, *, pipeline, architecture):
+        """
+        Submit the Conda preparation stages that do not need the sandbox.
+
+        The Miniforge installer is fetched into the installer cache, unless a
+        local installer is used, and, if requested, the Conda environments are
+        solved on the host.
+
+        Parameters
+        ----------
+        pipeline : :class:`~cotainr.util.StagePipeline`
+            The pipeline to run the Conda preparation stages in.
+        architecture : str
+            The predicted architecture of the container sandbox.
+        """
+        logger.debug(
+            "Preparing the Conda installation for the %s architecture", architecture
+        )
+        if self.conda_installer is None:
+            pipeline.submit(
+                name="miniforge_installer",
+                func=functools.partial(
+                    pack.CondaInstall.fetch_miniforge_installer,
+                    architecture=architecture,
+                    installer_cache_max_age=self.installer_cache_max_age * 60 * 60,
+                ),
+            )
+        if self.conda_host_dry_run:
+            conda_env_files = {
+                "conda_container_env": self.conda_env,
+                **self.conda_extra_envs,
+            }
+            for name, path in conda_env_files.items():
+                pipeline.submit(
+                    name=f"host_dry_run[{name}]",
+                    func=functools.partial(
+                        pack.solve_environment_on_host,
+                        path=path,
+                        architecture=architecture,
+                    ),
+                )
+
+    def _write_usage_report(self, *, usage, command_usage=()):
+        """
+        Write the sandbox usage report to the `usage_report` JSON file.
+
+        Parameters
+        ----------
+        usage : list of dict
+            The sandbox usage recorded after each build stage.
+        command_usage : list of dict, default=()
+            The resources used by each command run during the build.
+        """
+        self.usage_report.write_text(
+            json.dumps(
+                {
+                    "image_path": str(self.image_path),
+                    "stages": usage,
+                    "commands": list(command_usage),
+                },
+                indent=2,
+            )
+            + "\n"
+        )
+        logger.info("Wrote sandbox usage report to %s", self.usage_report)
+
 
 class Info(CotainrSubcommand):
     """
@@ -1,4 +1,4 @@
-"""
+r"""
 cotainr - a user space Apptainer/Singularity container builder.
 
 Copyright DeiC, deic.dk
@@ -11,22 +11,65 @@ Classes
 -------
 SingularitySandbox
     A Singularity container sandbox context manager.
+
+Functions
+---------
+get_image_labels(\*, path)
+    Get the metadata labels of a SIF container image.
 """
 
+import dataclasses
 import json
 import logging
 import os
 from pathlib import Path
+import platform
+import re
 import shlex
+import shutil
+import stat
 import subprocess
 import sys
+import tempfile
 from tempfile import TemporaryDirectory
+import time
 
 from . import __version__ as _cotainr_version
 from . import tracing, util
 
 logger = logging.getLogger(__name__)
 
+# Heuristics used when estimating the space needed for a sandbox
+_BASE_IMAGE_UNPACK_FACTOR = 3  # unpacked size relative to the (compressed) image
+_DEFAULT_UNPACKED_BASE_IMAGE_SIZE = 2**30  # if the image size is unknown
+_BYTES_PER_INODE = 32 * 2**10  # average file size in an unpacked image
+
+# SIF descriptor architecture codes for `singularity sif add --partarch`
+_SIF_ARCH_CODES = {
+    "i386": 1,
+    "i686": 1,
+    "x86_64": 2,
+    "armv7l": 3,
+    "aarch64": 4,
+    "ppc64": 5,
+    "ppc64le": 6,
+    "s390x": 11,
+}
+
+# The "uname -m" architectures of the Go architectures recorded in SIF files
+_SIF_GO_ARCHITECTURES = {
+    "386": "i686",
+    "amd64": "x86_64",
+    "arm": "armv7l",
+    "arm64": "aarch64",
+    "ppc64": "ppc64",
+    "ppc64le": "ppc64le",
+    "s390x": "s390x",
+}
+
+# Supported SIF squashfs compression algorithms and their compression level range
+SIF_COMPRESSION_LEVELS = {"gzip": (1, 9), "zstd": (1, 22), "lz4": None, "none": None}
+
 
 class SingularitySandbox:
     """
@@ -45,11 +88,70 @@ class SingularitySandbox:
     log_settings : :class:`~cotainr.tracing.LogSettings`, optional
         The data used to setup the logging machinery (the default is None which
         implies that the logging machinery is not used).
+    use_base_image_cache : bool, default=True
+        Whether or not to use the cache of unpacked base image sandboxes.
+    persistent_session : bool, default=False
+        Whether or not to run commands in the container sandbox in a single
+        long-lived shell session instead of starting a new container process
+        for each command.
+    sandbox_root : :class:`os.PathLike`, optional
+        The directory in which to create the sandbox (the default is None which
+        implies that the value of the COTAINR_SANDBOX_ROOT environment variable
+        is used, if set, or the default temporary directory location
+        otherwise). Environment variables in the path are expanded.
+    extra_space_estimate : tuple of int, optional
+        The estimated number of (bytes, inodes) added to the sandbox on top of
+        the base image, used when checking that the sandbox root has enough
+        free space (the default is None which implies (0, 0)).
+    check_free_space : bool, default=True
+        Whether or not to check that there is enough free space for the
+        sandbox before unpacking the base image.
+    keep_sandbox : bool, default=False
+        Whether or not to keep the sandbox when exiting the sandbox context,
+        e.g. for debugging.
+    background_cleanup : bool, default=False
+        Whether or not to delete the sandbox in a detached background process
+        when exiting the sandbox context instead of waiting for it to be
+        deleted.
+    track_usage : bool, default=False
+        Whether or not to measure the disk usage of the sandbox when calling
+        :meth:`record_usage`.
 
     Attributes
     ----------
     base_image : str
         Base image to use for the container.
+    use_base_image_cache : bool
+        Whether or not the cache of unpacked base image sandboxes is used.
+    persistent_session : bool
+        Whether or not commands are run in a persistent shell session in the
+        container sandbox.
+    sandbox_root : :class:`pathlib.Path` or None
+        The directory in which the sandbox is created or None if it is
+        created in the default temporary directory location.
+    extra_space_estimate : tuple of int
+        The estimated number of (bytes, inodes) added to the sandbox on top of
+        the base image.
+    check_free_space : bool
+        Whether or not the free space is checked before unpacking the base
+        image.
+    keep_sandbox : bool
+        Whether or not the sandbox is kept when exiting the sandbox context.
+    background_cleanup : bool
+        Whether or not the sandbox is deleted in a background process.
+    track_usage : bool
+        Whether or not the disk usage of the sandbox is measured.
+    usage_report : list of dict
+        The disk usage of the sandbox recorded after each build stage, each
+        entry containing the "stage" name and the "bytes" and "inodes" used.
+    command_usage : list of dict
+        The resources used by each command run, each entry containing the
+        "command" and the fields of its :class:`~cotainr.util.ResourceUsage`.
+        For commands run in the container sandbox, the "command" is the
+        command run in the container.
+    bind_paths : dict
+        The host paths bind mounted in the container sandbox when running
+        commands, mapped to their paths in the container.
     sandbox_dir : :class:`os.PathLike` or None
         The path to the temporary directory containing the sandbox if within a
         sandbox context, otherwise it is None.
@@ -60,11 +162,84 @@ class SingularitySandbox:
     architecture : str or None.
         The machine architecture of the sandbox as returned by `uname -m`. Its
         value is `None` (unknown) until entering the the sandbox context.
+
+    Notes
+    -----
+    Unpacked base image sandboxes are cached in the "base_sandboxes" folder in
+    the :func:`cotainr cache directory <cotainr.util.get_cache_dir>`, keyed by
+    the SHA256 digest of the base image. Only base images with a resolvable
+    digest, i.e. local image files and references pinned by a sha256 digest,
+    are cached. On a cache hit, the sandbox is cloned from the cache using
+    reflinks or hardlinks, if supported by the file system, instead of being
+    unpacked from the base image. The `.singularity.d` folder, which is
+    modified in place by cotainr, is always a full copy.
+
+    When using a persistent session, the session is started by the first
+    command run in the container sandbox and restarted after any change to the
+    sourced environment, i.e. after calls to :meth:`add_to_env`, such that
+    commands always run in the environment they would run in with a new
+    container process.
+
+    Before unpacking the base image, the free space and inodes in the sandbox
+    root are checked against a rough estimate of the size of the sandbox. A
+    RuntimeError is raised if the location is too small. On a base image cache
+    miss, the cache directory is only checked against the estimated size of
+    the unpacked base image. If the cache directory is too small, the base
+    image is unpacked directly into the sandbox without caching it.
+
+    When exiting the sandbox context, the sandbox is first moved out of the
+    temporary directory by a rename within the same file system. With
+    `keep_sandbox`, it is moved to a "cotainr_sandbox_*" folder next to the
+    temporary directory and left there. With `background_cleanup`, it is moved
+    to a "cotainr_trash_*" folder which is deleted by a detached `rm -rf`
+    process that may outlive the Python process, such that deleting a sandbox
+    with hundreds of thousands of files does not delay the caller. If the
+    detached process fails to delete the folder, its error messages are left in
+    a "cotainr_trash_*.errors" file which is reported and removed when the next
+    sandbox is created in the same location.
+
+    Host paths added using :meth:`add_bind_path` are only bind mounted when
+    running commands in the container sandbox. Their (empty) mount points are
+    removed from the sandbox before building the container image, such that
+    nothing from the host paths ends up in the container image.
     """
 
-    def __init__(self, *, base_image, log_settings=None):
+    def __init__(
+        self,
+        *,
+        base_image,
+        log_settings=None,
+        use_base_image_cache=True,
+        persistent_session=False,
+        sandbox_root=None,
+        extra_space_estimate=None,
+        check_free_space=True,
+        keep_sandbox=False,
+        background_cleanup=False,
+        track_usage=False,
+    ):
         """Construct the SingularitySandbox context manager."""
         self.base_image = base_image
+        self.use_base_image_cache = use_base_image_cache
+        self.persistent_session = persistent_session
+        if sandbox_root is None:
+            sandbox_root = os.environ.get("COTAINR_SANDBOX_ROOT") or None
+        self.sandbox_root = (
+            Path(os.path.expandvars(sandbox_root)).expanduser().resolve()
+            if sandbox_root is not None
+            else None
+        )
+        self.extra_space_estimate = (
+            tuple(extra_space_estimate) if extra_space_estimate is not None else (0, 0)
+        )
+        self.check_free_space = check_free_space
+        self.keep_sandbox = keep_sandbox
+        self.background_cleanup = background_cleanup
+        self.track_usage = track_usage
+        self.usage_report = []
+        self.command_usage = []
+        self.bind_paths = {}
+        self._session = None
         self.sandbox_dir = None
         self.architecture = None
         if log_settings is not None:
@@ -91,23 +266,27 @@ class SingularitySandbox:
         self._origin = Path().resolve()
 
         # Create sandbox
-        self._tmp_dir = TemporaryDirectory()
+        if self.sandbox_root is not None:
+            self.sandbox_root.mkdir(parents=True, exist_ok=True)
+        self._tmp_dir = TemporaryDirectory(dir=self.sandbox_root)
+        self._report_failed_removals(path=Path(self._tmp_dir.name).parent)
         self.sandbox_dir = Path(self._tmp_dir.name) / "singularity_sandbox"
-        self.sandbox_dir.mkdir(exist_ok=False)
-        self._subprocess_runner(
-            args=self._add_verbosity_arg(
-                args=[
-                    "singularity",
-                    "--nocolor",
-                    "build",
-                    "--force",  # sandbox_dir.mkdir() checks for existing sandbox image
-                    "--sandbox",
-                    "--fix-perms",
-                    self.sandbox_dir,
-                    self.base_image,
-                ]
-            ),
-        )
+        logger.debug("Creating sandbox in %s", self.sandbox_dir)
+        try:
+            self._check_free_space(path=self._tmp_dir.name)
+            base_image_digest = (
+                self.resolve_base_image_digest() if self.use_base_image_cache else None
+            )
+            if base_image_digest is None or not self._create_sandbox_from_cache(
+                base_image_digest=base_image_digest
+            ):
+                self.sandbox_dir.mkdir(exist_ok=False)
+                self._unpack_base_image(sandbox_dir=self.sandbox_dir)
+        except BaseException:
+            self._tmp_dir.cleanup()
+            self.sandbox_dir = None
+            raise
+        self.record_usage(stage="base_image")
 
         # Change directory to the sandbox
         os.chdir(self.sandbox_dir)
@@ -122,11 +301,43 @@ class SingularitySandbox:
 
     def __exit__(self, exc_type, exc_value, traceback):
         """Exit and destroy sandbox context."""
+        self._close_session()
         os.chdir(self._origin)
+        if self.keep_sandbox:
+            kept_sandbox_dir = self._move_sandbox_out_of_tmp_dir(
+                prefix="cotainr_sandbox_"
+            )
+            logger.info("Keeping sandbox in %s", kept_sandbox_dir)
+        elif self.background_cleanup:
+            trash_dir = self._move_sandbox_out_of_tmp_dir(
+                prefix="cotainr_trash_"
+            ).parent
+            self._remove_in_background(path=trash_dir)
         self._tmp_dir.cleanup()
         self.sandbox_dir = None
 
-    def add_metadata(self):
+    def add_bind_path(self, *, host_path, container_path):
+        """
+        Bind mount `host_path` at `container_path` when running commands.
+
+        Parameters
+        ----------
+        host_path : :class:`os.PathLike`
+            The existing directory on the host to bind mount.
+        container_path : str
+            The absolute path in the container at which to mount `host_path`.
+        """
+        self._assert_within_sandbox_context()
+
+        (self.sandbox_dir / container_path.lstrip("/")).mkdir(
+            parents=True, exist_ok=True
+        )
+        self.bind_paths[Path(host_path).resolve()] = container_path
+
+        # Make sure that the bind path is mounted for any following command
+        self._close_session()
+
+    def add_metadata(self, *, fingerprint=None):
         """
         Add metadata to the container sandbox.
 
@@ -134,10 +345,17 @@ class SingularitySandbox:
           - "cotainr.command": The full command line used to build the container.
           - "cotainr.version": The version of cotainr used to build the container.
           - "cotainr.url": The cotainr project url.
+          - "cotainr.fingerprint": The fingerprint of the build inputs, if given.
 
         The container metadata may be inspected by running `singularity inspect` on the
         built container image file.
 
+        Parameters
+        ----------
+        fingerprint : str, optional
+            The fingerprint of the build inputs used to detect if the built
+            container image is up to date.
+
         Notes
         -----
         The metadata entries are added to the `.singularity.d/labels.json
@@ -148,13 +366,13 @@ class SingularitySandbox:
         self._assert_within_sandbox_context()
 
         labels_path = self.sandbox_dir / ".singularity.d/labels.json"
-        with open(labels_path, "r+") as f:
-            metadata = json.load(f)
-            metadata["cotainr.command"] = " ".join(sys.argv)
-            metadata["cotainr.version"] = _cotainr_version
-            metadata["cotainr.url"] = "https://github.com/DeiC-HPC/cotainr"
-            f.seek(0)
-            json.dump(metadata, f)
+        metadata = json.loads(labels_path.read_text())
+        metadata["cotainr.command"] = " ".join(sys.argv)
+        metadata["cotainr.version"] = _cotainr_version
+        metadata["cotainr.url"] = "https://github.com/DeiC-HPC/cotainr"
+        if fingerprint is not None:
+            metadata["cotainr.fingerprint"] = fingerprint
+        self._write_file(path=labels_path, content=json.dumps(metadata))
 
     def add_to_env(self, *, shell_script):
         """
@@ -169,13 +387,48 @@ class SingularitySandbox:
         self._assert_within_sandbox_context()
 
         env_file = self.sandbox_dir / ".singularity.d/env/92-cotainr-env.sh"
-        if not env_file.exists():
-            self._create_file(f=env_file)
+        existing_content = env_file.read_text() if env_file.exists() else ""
+        self._write_file(path=env_file, content=existing_content + shell_script + "\n")
+
+        # Make sure that the updated env is sourced by any following command
+        self._close_session()
+
+    def base_image_is_available_locally(self):
+        """
+        Check if the base image is available without network access.
+
+        The base image is available locally if it is a local image file or
+        sandbox directory, or if it is pinned by a digest for which an
+        unpacked base image sandbox is cached.
+
+        Returns
+        -------
+        is_available : bool
+            True if the base image is available locally.
+        """
+        if Path(str(self.base_image)).exists():
+            return True
 
-        with env_file.open(mode="a") as f:
-            f.write(shell_script + "\n")
+        base_image_digest = self.resolve_base_image_digest()
+        return (
+            self.use_base_image_cache
+            and base_image_digest is not None
+            and (
+                util.get_cache_dir()
+                / "base_sandboxes"
+                / base_image_digest.replace(":", "-")
+            ).is_dir()
+        )
 
-    def build_image(self, *, path):
+    def build_image(
+        self,
+        *,
+        path,
+        compression=None,
+        compression_level=None,
+        block_size=None,
+        processors=None,
+    ):
         """
         Build a SIF image file from sandbox.
 
@@ -186,34 +439,444 @@ class SingularitySandbox:
         ----------
         path : :class:`os.PathLike`
             Path to the built container image.
+        compression : {"gzip", "zstd", "lz4", "none"}, optional
+            The squashfs compression algorithm (the default is None which
+            implies the default of the container runtime).
+        compression_level : int, optional
+            The compression level for the gzip or zstd compression algorithms.
+        block_size : int or str, optional
+            The squashfs block size in bytes, optionally with a K or M suffix,
+            e.g. "1M".
+        processors : int, optional
+            The number of processors used by mksquashfs (the default is None
+            which implies all available processors).
+
+        Notes
+        -----
+        The squashfs settings are passed to the container runtime using the
+        `--mksquashfs-args` option to `singularity build`.
         """
         self._assert_within_sandbox_context()
 
+        mksquashfs_args = self.get_mksquashfs_args(
+            compression=compression,
+            compression_level=compression_level,
+            block_size=block_size,
+            processors=processors,
+        )
+        self._remove_bind_points()
+        build_args = ["singularity", "--nocolor", "build", "--force"]
+        if mksquashfs_args:
+            logger.info("Using mksquashfs args: %s", shlex.join(mksquashfs_args))
+            build_args.extend(["--mksquashfs-args", shlex.join(mksquashfs_args)])
+
+        t_start = time.monotonic()
         self._subprocess_runner(
-            args=self._add_verbosity_arg(
+            args=self._add_verbosity_arg(args=[*build_args, path, self.sandbox_dir]),
+        )
+        logger.info(
+            "Built SIF image %s in %.1f seconds", path, time.monotonic() - t_start
+        )
+
+    def build_layered_image(
+        self,
+        *,
+        path,
+        layer_paths=(),
+        compression=None,
+        compression_level=None,
+        block_size=None,
+        processors=None,
+    ):
+        """
+        Build a SIF image file from the base image and an overlay layer.
+
+        Instead of squashing the full sandbox, the SIF image of the base image
+        is reused as is, and the `layer_paths` in the sandbox, e.g. a Conda
+        installation, are squashed into a separate overlay partition which is
+        added to a copy of the base image SIF. The SIF images of non-local
+        base images are cached such that only the overlay layer is squashed
+        when rebuilding with changes on top of the same base image.
+
+        Parameters
+        ----------
+        path : :class:`os.PathLike`
+            Path to the built container image.
+        layer_paths : iterable of str, optional
+            Absolute paths in the container to include in the overlay layer.
+            The sandbox environment and metadata files are always included.
+        compression : {"gzip", "zstd", "lz4", "none"}, optional
+            The squashfs compression algorithm of the overlay layer.
+        compression_level : int, optional
+            The compression level for the gzip or zstd compression algorithms.
+        block_size : int or str, optional
+            The squashfs block size in bytes, optionally with a K or M suffix.
+        processors : int, optional
+            The number of processors used by mksquashfs.
+
+        Raises
+        ------
+        RuntimeError
+            If the architecture of the sandbox is not supported in SIF files.
+
+        Notes
+        -----
+        The overlay layer is added as a read-only squashfs overlay partition
+        using `singularity sif add`, which is applied on top of the base image
+        when running the container. Any changes made to the sandbox outside of
+        the `layer_paths` are not included in the container image.
+
+        A squashfs partition is used rather than the ext3 overlay partition
+        created by `singularity overlay create`, as the layer is read-only and
+        may then be compressed like the base image. The sandbox environment and
+        metadata files in the layer take precedence over those in the base
+        image, such that the image labels include the metadata of the build.
+        """
+        self._assert_within_sandbox_context()
+
+        if self.architecture not in _SIF_ARCH_CODES:
+            raise RuntimeError(
+                f"Layered builds are not supported for the {self.architecture} "
+                "architecture."
+            )
+        mksquashfs_args = self.get_mksquashfs_args(
+            compression=compression,
+            compression_level=compression_level,
+            block_size=block_size,
+            processors=processors,
+        )
+        self._remove_bind_points()
+        layer_paths = [
+            *layer_paths,
+            "/.singularity.d/env/92-cotainr-env.sh",
+            "/.singularity.d/labels.json",
+        ]
+
+        t_start = time.monotonic()
+        base_sif = self._get_base_sif()
+        with TemporaryDirectory(dir=self._tmp_dir.name, prefix="layer_") as layer_dir:
+            # Collect the layer, using hardlinks if possible, as the sandbox
+            # is discarded after building the container image.
+            layer_root = Path(layer_dir) / "root"
+            layer_root.mkdir()
+            for layer_path in layer_paths:
+                rel_path = Path(layer_path).relative_to("/")
+                if not (self.sandbox_dir / rel_path).exists():
+                    logger.debug("Skipping non-existing layer path %s", layer_path)
+                    continue
+                (layer_root / rel_path).parent.mkdir(parents=True, exist_ok=True)
+                util.clone_tree(
+                    src=self.sandbox_dir / rel_path, dst=layer_root / rel_path
+                )
+
+            layer_image = Path(layer_dir) / "layer.sqfs"
+            logger.info("Squashing the overlay layer: %s", ", ".join(layer_paths))
+            self._subprocess_runner(
                 args=[
-                    "singularity",
-                    "--nocolor",
-                    "build",
-                    "--force",
-                    path,
-                    self.sandbox_dir,
+                    "mksquashfs",
+                    layer_root,
+                    layer_image,
+                    "-noappend",
+                    "-no-progress",
+                    *mksquashfs_args,
                 ]
-            ),
+            )
+
+            # Add the layer to a copy of the base image SIF and atomically move
+            # the result into place.
+            path = Path(path)
+            with tempfile.NamedTemporaryFile(
+                dir=path.parent, prefix=f".{path.name}.", delete=False
+            ) as f:
+                tmp_image = Path(f.name)
+            try:
+                shutil.copyfile(base_sif, tmp_image)
+                self._subprocess_runner(
+                    args=self._add_verbosity_arg(
+                        args=[
+                            "singularity",
+                            "--nocolor",
+                            "sif",
+                            "add",
+                            "--datatype",
+                            "4",  # partition
+                            "--partfs",
+                            "1",  # squashfs
+                            "--parttype",
+                            "4",  # overlay
+                            "--partarch",
+                            str(_SIF_ARCH_CODES[self.architecture]),
+                            "--groupid",
+                            "1",
+                            tmp_image,
+                            layer_image,
+                        ]
+                    ),
+                )
+                os.replace(tmp_image, path)
+            except BaseException:
+                tmp_image.unlink(missing_ok=True)
+                raise
+
+        logger.info(
+            "Built layered SIF image %s in %.1f seconds",
+            path,
+            time.monotonic() - t_start,
         )
 
-    def run_command_in_container(self, *, cmd, custom_log_dispatcher=None):
+    def deduplicate_files(self):
+        """
+        Replace identical files in the sandbox by hardlinks.
+
+        Reduces the amount of data that mksquashfs has to read and compress
+        when building the SIF image file, e.g. for license files and shared
+        libraries duplicated across Conda packages.
+
+        Returns
+        -------
+        dedup_stats : tuple of int
+            The number of (bytes saved, files replaced by hardlinks).
+        """
+        self._assert_within_sandbox_context()
+
+        t_start = time.monotonic()
+        bytes_saved, files_linked = util.deduplicate_tree(path=self.sandbox_dir)
+        logger.info(
+            "Replaced %d duplicate files by hardlinks, saving %.1f MiB (in %.1f s)",
+            files_linked,
+            bytes_saved / 2**20,
+            time.monotonic() - t_start,
+        )
+        self.record_usage(stage="deduplication")
+
+        return bytes_saved, files_linked
+
+    @staticmethod
+    def get_mksquashfs_args(
+        *, compression=None, compression_level=None, block_size=None, processors=None
+    ):
+        """
+        Get the mksquashfs arguments for building a SIF image file.
+
+        Parameters
+        ----------
+        compression : {"gzip", "zstd", "lz4", "none"}, optional
+            The squashfs compression algorithm.
+        compression_level : int, optional
+            The compression level for the gzip or zstd compression algorithms.
+        block_size : int or str, optional
+            The squashfs block size in bytes, optionally with a K or M suffix.
+        processors : int, optional
+            The number of processors used by mksquashfs.
+
+        Returns
+        -------
+        mksquashfs_args : list of str
+            The mksquashfs arguments, empty if all settings are None.
+
+        Raises
+        ------
+        ValueError
+            If any of the settings are invalid.
+        """
+        mksquashfs_args = []
+        if compression is not None:
+            if compression not in SIF_COMPRESSION_LEVELS:
+                raise ValueError(
+                    f"Invalid SIF compression '{compression}'. Valid choices are: "
+                    f"{', '.join(SIF_COMPRESSION_LEVELS)}."
+                )
+            if compression == "none":
+                mksquashfs_args.extend(["-noI", "-noD", "-noF", "-noX"])
+            else:
+                mksquashfs_args.extend(["-comp", compression])
+
+        if compression_level is not None:
+            level_range = SIF_COMPRESSION_LEVELS.get(compression)
+            if level_range is None:
+                raise ValueError(
+                    "A SIF compression level requires the gzip or zstd compression."
+                )
+            if not level_range[0] <= int(compression_level) <= level_range[1]:
+                raise ValueError(
+                    f"Invalid {compression} compression level {compression_level}. "
+                    f"Must be between {level_range[0]} and {level_range[1]}."
+                )
+            mksquashfs_args.extend(["-Xcompression-level", str(int(compression_level))])
+
+        if block_size is not None:
+            match = re.fullmatch(r"(\d+)([KkMm]?)", str(block_size))
+            block_size_bytes = (
+                int(match.group(1))
+                * {"": 1, "k": 2**10, "m": 2**20}[match.group(2).lower()]
+                if match is not None
+                else None
+            )
+            if (
+                block_size_bytes is None
+                or not 2**12 <= block_size_bytes <= 2**20
+                or block_size_bytes & (block_size_bytes - 1)
+            ):
+                raise ValueError(
+                    f"Invalid SIF block size '{block_size}'. Must be a power of two "
+                    "between 4K and 1M."
+                )
+            mksquashfs_args.extend(["-b", str(block_size_bytes)])
+
+        if processors is not None:
+            if int(processors) < 1:
+                raise ValueError(
+                    f"Invalid number of mksquashfs processors {processors}. Must be "
+                    "at least 1."
+                )
+            mksquashfs_args.extend(["-processors", str(int(processors))])
+
+        return mksquashfs_args
+
+    def predict_architecture(self):
+        """
+        Predict the machine architecture of the sandbox before creating it.
+
+        For local SIF base images, the architecture recorded in the SIF file
+        is used. Otherwise, the architecture of the host is used, which is
+        what `uname -m` reports in the sandbox unless the base image is run
+        under emulation. Thus, the prediction must be checked against the
+        `architecture` once in the sandbox context.
+
+        Returns
+        -------
+        architecture : str
+            The predicted machine architecture of the sandbox as returned by
+            `uname -m`.
+        """
+        if self.architecture is not None:
+            return self.architecture
+
+        base_image_path = Path(str(self.base_image))
+        try:
+            with open(base_image_path, "rb") as f:
+                is_sif = b"SIF_MAGIC" in f.read(64)
+        except OSError:
+            is_sif = False
+        if is_sif:
+            try:
+                process = subprocess.run(
+                    ["singularity", "--nocolor", "sif", "list", str(base_image_path)],
+                    capture_output=True,
+                    check=True,
+                    text=True,
+                )
+                go_arch = re.search(r"\(Squashfs/\*System/(\w+)\)", process.stdout)
+                if go_arch is not None and go_arch.group(1) in _SIF_GO_ARCHITECTURES:
+                    return _SIF_GO_ARCHITECTURES[go_arch.group(1)]
+            except (OSError, subprocess.CalledProcessError) as e:
+                logger.debug(
+                    "Unable to list the SIF descriptors of %s: %s", base_image_path, e
+                )
+
+        return platform.machine()
+
+    def record_usage(self, *, stage):
+        """
+        Record the disk usage of the sandbox after a build stage.
+
+        The usage is logged and added to the `usage_report`. Does nothing
+        unless `track_usage` is enabled.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the build stage that has just finished.
+        """
+        self._assert_within_sandbox_context()
+        if not self.track_usage:
+            return
+
+        t_start = time.monotonic()
+        usage_bytes, usage_inodes = util.get_tree_usage(path=self.sandbox_dir)
+        logger.info(
+            "Sandbox usage after %s: %.1f MiB in %d inodes (measured in %.1f s)",
+            stage,
+            usage_bytes / 2**20,
+            usage_inodes,
+            time.monotonic() - t_start,
+        )
+        self.usage_report.append(
+            {"stage": stage, "bytes": usage_bytes, "inodes": usage_inodes}
+        )
+
+    def resolve_base_image_digest(self):
+        """
+        Resolve the SHA256 digest of the base image, if possible.
+
+        The digest is resolved for references pinned by a digest, e.g.
+        "docker://alpine@sha256:...", and for local image files. For local image
+        files, the digest is memoized in the cache directory based on the file
+        path, size, inode, and modification time to avoid re-hashing it on every
+        build.
+
+        Returns
+        -------
+        base_image_digest : str or None
+            The "sha256:<hex digest>" of the base image or None if the digest
+            cannot be resolved, e.g. for mutable references like
+            "docker://ubuntu:latest" or sandbox directories.
+        """
+        base_image = str(self.base_image)
+        pinned_digest = re.search(r"@sha256:([0-9a-f]{64})$", base_image)
+        if pinned_digest is not None:
+            return f"sha256:{pinned_digest.group(1)}"
+
+        base_image_path = Path(base_image).resolve()
+        try:
+            if not base_image_path.is_file():
+                raise FileNotFoundError(f"{base_image_path} is not a file")
+            stat = base_image_path.stat()
+        except OSError:
+            logger.debug("Unable to resolve a digest for base image %s", base_image)
+            return None
+
+        file_id = [stat.st_size, stat.st_ino, stat.st_mtime_ns]
+        memo_path = util.get_cache_dir() / "base_sandboxes/digests.json"
+        try:
+            memo = json.loads(memo_path.read_text())
+        except (OSError, ValueError):
+            memo = {}
+        memoized = memo.get(str(base_image_path), {})
+        if memoized.get("file_id") == file_id:
+            return memoized["digest"]
+
+        digest = f"sha256:{util.compute_sha256(path=base_image_path)}"
+        memo[str(base_image_path)] = {"file_id": file_id, "digest": digest}
+        try:
+            memo_path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                mode="w", dir=memo_path.parent, delete=False
+            ) as f:
+                json.dump(memo, f)
+            os.replace(f.name, memo_path)
+        except OSError as e:
+            logger.debug("Unable to memoize base image digest: %s", e)
+
+        return digest
+
+    def run_command_in_container(self, *, cmd, env=None, custom_log_dispatcher=None):
         """
         Run a command in the container sandbox.
 
         Wraps `singularity exec` of the `cmd` in the container sandbox`
         allowing for running commands inside the container sandbox context,
-        e.g. for installing software in the container sandbox.
+        e.g. for installing software in the container sandbox. If
+        `persistent_session` is enabled, the command is instead run in the
+        persistent shell session in the container sandbox.
 
         Parameters
         ----------
         cmd : str
             The command to run in the container sandbox.
+        env : dict, optional
+            Environment variables to set for the command only (the default is
+            None which implies that no extra environment variables are set).
         custom_log_dispatcher : :class:`~cotainr.tracing.LogDispatcher`, optional
             The custom log dispatcher to use when running the command (the
             default is None which implies that the `SingularitySandbox` log
@@ -246,22 +909,22 @@ class SingularitySandbox:
         """
         self._assert_within_sandbox_context()
 
-        try:
-            process = self._subprocess_runner(
-                custom_log_dispatcher=custom_log_dispatcher,
-                args=self._add_verbosity_arg(
-                    args=[
-                        "singularity",
-                        "--nocolor",
-                        "exec",
-                        "--writable",
-                        "--no-home",
-                        "--no-umask",
-                        self.sandbox_dir,
-                        *shlex.split(cmd),
-                    ]
-                ),
+        if env:
+            cmd = (
+                shlex.join(["env", *(f"{key}={value}" for key, value in env.items())])
+                + f" {cmd}"
             )
+
+        try:
+            if self.persistent_session:
+                process = self._run_command_in_session(
+                    cmd=cmd, custom_log_dispatcher=custom_log_dispatcher
+                )
+            else:
+                process = self._subprocess_runner(
+                    custom_log_dispatcher=custom_log_dispatcher,
+                    args=[*self._exec_args(), *shlex.split(cmd)],
+                )
         except subprocess.CalledProcessError as e:
             singularity_fatal_error = "\n".join(
                 [line for line in e.stderr.split("\n") if line.startswith("FATAL")]
@@ -312,24 +975,456 @@ class SingularitySandbox:
 
         return args
 
-    def _create_file(self, *, f):
+    def _check_free_space(self, *, path, base_image_only=False):
         """
-        Create any file `f` in an existing folder in the Singularity container.
+        Check that there is enough free space for the sandbox at `path`.
 
-        The file permissions will ignore the system umask.
+        The free bytes and inodes on the file system containing `path` are
+        compared to an estimate of the size of the sandbox. File systems that
+        do not report the number of inodes, e.g. btrfs, are only checked for
+        free bytes. Nothing is checked unless `check_free_space` is enabled.
 
         Parameters
         ----------
-        f : :class:`pathlib.PosixPath`
-            For example, Path("sandbox_dir/.singularity.d/env/92-cotainr-env.sh")
+        path : :class:`os.PathLike`
+            A path on the file system to check.
+        base_image_only : bool, default=False
+            Whether or not to only check for the space needed for the unpacked
+            base image, excluding the `extra_space_estimate`.
+
+        Raises
+        ------
+        RuntimeError
+            If there are not enough free bytes or inodes on the file system.
         """
-        self._assert_within_sandbox_context()
+        if not self.check_free_space:
+            return
 
-        # ensure that the file is created *within* the container to get correct permissions, etc.
-        self.run_command_in_container(cmd=f"touch {f}")
+        required_bytes, required_inodes = self._estimate_sandbox_space(
+            base_image_only=base_image_only
+        )
+        fs_stats = os.statvfs(path)
+        free_bytes = fs_stats.f_bavail * fs_stats.f_frsize
+        free_inodes = fs_stats.f_favail
+        logger.debug(
+            "Free space in %s: %d bytes, %d inodes. Estimated need: %d bytes, %d inodes",
+            path,
+            free_bytes,
+            free_inodes,
+            required_bytes,
+            required_inodes,
+        )
+        if free_bytes < required_bytes or (
+            fs_stats.f_files > 0 and free_inodes < required_inodes
+        ):
+            raise RuntimeError(
+                f"Not enough free space in {path} for the container sandbox. "
+                f"Available: {free_bytes / 2**30:.1f} GiB and {free_inodes} inodes. "
+                f"Estimated need: {required_bytes / 2**30:.1f} GiB and "
+                f"{required_inodes} inodes. Choose another sandbox root location "
+                "or skip this check."
+            )
+
+    def _close_session(self):
+        """Close the persistent shell session, if any."""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def _create_sandbox_from_cache(self, *, base_image_digest):
+        """
+        Create the sandbox by cloning a cached unpacked base image.
 
-        if not f.exists():
-            raise FileNotFoundError(f"Creating file {f} failed.")
+        The base image is unpacked into the cache on a cache miss, if there is
+        enough free space for it in the cache directory.
+
+        Parameters
+        ----------
+        base_image_digest : str
+            The digest of the base image, used as the cache key.
+
+        Returns
+        -------
+        created : bool
+            True if the sandbox was created from the cache, False if there is
+            not enough free space in the cache directory to add the base image.
+        """
+        cache_dir = util.get_cache_dir() / "base_sandboxes"
+        cached_sandbox_dir = cache_dir / base_image_digest.replace(":", "-")
+        if cached_sandbox_dir.is_dir():
+            logger.info(
+                "Base image cache hit for %s (%s)", self.base_image, base_image_digest
+            )
+        else:
+            logger.info(
+                "Base image cache miss for %s (%s). Adding it to the cache in %s",
+                self.base_image,
+                base_image_digest,
+                cache_dir,
+            )
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            try:
+                self._check_free_space(path=cache_dir, base_image_only=True)
+            except RuntimeError as e:
+                logger.warning("Not caching the base image: %s", e)
+                return False
+            with TemporaryDirectory(dir=cache_dir, prefix=".tmp_") as tmp_dir:
+                tmp_sandbox_dir = Path(tmp_dir) / "singularity_sandbox"
+                tmp_sandbox_dir.mkdir()
+                self._unpack_base_image(sandbox_dir=tmp_sandbox_dir)
+                try:
+                    tmp_sandbox_dir.rename(cached_sandbox_dir)
+                except OSError:
+                    # Another cotainr process populated the cache in the meantime
+                    if not cached_sandbox_dir.is_dir():
+                        raise
+
+        clone_method = util.clone_tree(src=cached_sandbox_dir, dst=self.sandbox_dir)
+        if (
+            clone_method == "hardlink"
+            and (cached_sandbox_dir / ".singularity.d").is_dir()
+        ):
+            # Replace the shared .singularity.d inodes by a full copy as
+            # its files are modified in place when building the container
+            singularity_d = self.sandbox_dir / ".singularity.d"
+            shutil.rmtree(singularity_d)
+            shutil.copytree(
+                cached_sandbox_dir / ".singularity.d", singularity_d, symlinks=True
+            )
+        logger.debug(
+            "Created sandbox %s from cache using %s", self.sandbox_dir, clone_method
+        )
+        return True
+
+    def _estimate_sandbox_space(self, *, base_image_only=False):
+        """
+        Estimate the space needed for the sandbox.
+
+        The estimate is based on the size of the base image, if it is a local
+        file, along with the `extra_space_estimate`.
+
+        Parameters
+        ----------
+        base_image_only : bool, default=False
+            Whether or not to only estimate the space needed for the unpacked
+            base image, excluding the `extra_space_estimate`.
+
+        Returns
+        -------
+        required_bytes : int
+            The estimated number of bytes needed for the sandbox.
+        required_inodes : int
+            The estimated number of inodes needed for the sandbox.
+        """
+        base_image_path = Path(str(self.base_image))
+        if base_image_path.is_file():
+            base_bytes = base_image_path.stat().st_size * _BASE_IMAGE_UNPACK_FACTOR
+        else:
+            base_bytes = _DEFAULT_UNPACKED_BASE_IMAGE_SIZE
+        extra_bytes, extra_inodes = (
+            (0, 0) if base_image_only else self.extra_space_estimate
+        )
+
+        return (
+            base_bytes + extra_bytes,
+            base_bytes // _BYTES_PER_INODE + extra_inodes,
+        )
+
+    def _exec_args(self):
+        """
+        Get the arguments for executing a command in the container sandbox.
+
+        Returns
+        -------
+        args : list
+            The `singularity exec` command line arguments to which the
+            command to run in the container sandbox must be appended.
+        """
+        return self._add_verbosity_arg(
+            args=[
+                "singularity",
+                "--nocolor",
+                "exec",
+                "--writable",
+                "--no-home",
+                "--no-umask",
+                *(
+                    arg
+                    for host_path, container_path in self.bind_paths.items()
+                    for arg in ("--bind", f"{host_path}:{container_path}")
+                ),
+                self.sandbox_dir,
+            ]
+        )
+
+    def _get_base_sif(self):
+        """
+        Get a SIF image file of the base image.
+
+        Local SIF base images are used as is. Other base images are built into
+        a SIF image file which is cached in the "base_sifs" folder in the
+        cotainr cache directory, if the base image digest can be resolved.
+
+        Returns
+        -------
+        base_sif : :class:`pathlib.Path`
+            The path to the SIF image file of the base image.
+        """
+        # Relative paths are relative to the directory the sandbox was entered from
+        base_image_path = self._origin / str(self.base_image)
+        if base_image_path.is_file():
+            with open(base_image_path, "rb") as f:
+                if b"SIF_MAGIC" in f.read(64):
+                    return base_image_path.resolve()
+
+        base_image_digest = self.resolve_base_image_digest()
+        if base_image_digest is None:
+            logger.info(
+                "Unable to cache the SIF image of %s without a digest", self.base_image
+            )
+            sif_dir = Path(self._tmp_dir.name)
+        else:
+            sif_dir = util.get_cache_dir() / "base_sifs"
+            cached_sif = sif_dir / f"{base_image_digest.replace(':', '-')}.sif"
+            if cached_sif.is_file():
+                logger.info("Base SIF cache hit for %s", self.base_image)
+                return cached_sif
+            logger.info("Base SIF cache miss for %s", self.base_image)
+            sif_dir.mkdir(parents=True, exist_ok=True)
+
+        with tempfile.NamedTemporaryFile(
+            dir=sif_dir, prefix=".tmp_", suffix=".sif", delete=False
+        ) as f:
+            tmp_sif = Path(f.name)
+        try:
+            self._subprocess_runner(
+                args=self._add_verbosity_arg(
+                    args=[
+                        "singularity",
+                        "--nocolor",
+                        "build",
+                        "--force",
+                        tmp_sif,
+                        base_image_path
+                        if base_image_path.exists()
+                        else self.base_image,
+                    ]
+                ),
+            )
+            base_sif = (
+                cached_sif if base_image_digest is not None else sif_dir / "base.sif"
+            )
+            os.replace(tmp_sif, base_sif)
+        except BaseException:
+            tmp_sif.unlink(missing_ok=True)
+            raise
+
+        return base_sif
+
+    def _move_sandbox_out_of_tmp_dir(self, *, prefix):
+        """
+        Move the sandbox to a new folder next to the temporary directory.
+
+        Parameters
+        ----------
+        prefix : str
+            The prefix of the name of the new folder.
+
+        Returns
+        -------
+        moved_sandbox_dir : :class:`pathlib.Path`
+            The new path of the sandbox.
+        """
+        new_dir = Path(
+            tempfile.mkdtemp(prefix=prefix, dir=Path(self._tmp_dir.name).parent)
+        )
+        moved_sandbox_dir = new_dir / self.sandbox_dir.name
+        if self.sandbox_dir.exists():
+            self.sandbox_dir.rename(moved_sandbox_dir)
+        return moved_sandbox_dir
+
+    def _record_command_usage(self, *, command, process):
+        """
+        Record the resource usage of a command in the `command_usage`.
+
+        Parameters
+        ----------
+        command : str
+            The command that was run.
+        process : :class:`subprocess.CompletedProcess`
+            The completed process of the command. Nothing is recorded unless
+            it has a `resource_usage`.
+        """
+        resource_usage = getattr(process, "resource_usage", None)
+        if resource_usage is not None:
+            self.command_usage.append(
+                {"command": command, **dataclasses.asdict(resource_usage)}
+            )
+
+    def _remove_in_background(self, *, path):
+        """
+        Remove `path` in a detached background process.
+
+        If the first attempt fails, e.g. due to read-only folders, the
+        background process makes everything in `path` writable and tries again.
+        The error messages of a failed retry are left in a "<path>.errors"
+        file, which is reported by :meth:`_report_failed_removals`. Falls back
+        to removing `path` in the foreground if the background process cannot
+        be started.
+
+        Parameters
+        ----------
+        path : :class:`os.PathLike`
+            The path to remove.
+        """
+        logger.debug("Removing %s in the background", path)
+        errors_file = Path(f"{path}.errors")
+        try:
+            subprocess.Popen(
+                [
+                    "sh",
+                    "-c",
+                    'rm -rf -- "$1" 2>/dev/null'
+                    ' || { chmod -R u+rwX -- "$1"; rm -rf -- "$1"; } 2>"$2"'
+                    ' || exit 1; rm -f -- "$2"',
+                    "sh",
+                    str(path),
+                    str(errors_file),
+                ],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+        except OSError as e:
+            logger.debug("Unable to remove %s in the background: %s", path, e)
+            self._remove_in_foreground(path=path)
+
+    @staticmethod
+    def _remove_in_foreground(*, path):
+        """
+        Remove `path`, making read-only folders writable if needed.
+
+        A warning is logged for anything that cannot be removed.
+
+        Parameters
+        ----------
+        path : :class:`os.PathLike`
+            The path to remove.
+        """
+        path = Path(path)
+
+        def rmtree(path, *, onexc):
+            if sys.version_info >= (3, 12):
+                shutil.rmtree(path, onexc=onexc)
+            else:
+                shutil.rmtree(
+                    path,
+                    onerror=lambda func, path, exc_info: onexc(func, path, exc_info[1]),
+                )
+
+        def log_failure(func, failed_path, exc):
+            logger.warning("Unable to remove %s: %s", failed_path, exc)
+
+        def make_writable_and_retry(func, failed_path, exc):
+            failed_path = Path(failed_path)
+            if not os.path.lexists(failed_path):
+                return
+            try:
+                if failed_path != path:
+                    failed_path.parent.chmod(stat.S_IRWXU)
+                if (
+                    func is not os.rmdir
+                    and failed_path.is_dir()
+                    and not failed_path.is_symlink()
+                ):
+                    # Unable to list the folder, so remove its contents anew
+                    failed_path.chmod(stat.S_IRWXU)
+                    rmtree(failed_path, onexc=log_failure)
+                else:
+                    func(failed_path)
+            except OSError as e:
+                logger.warning("Unable to remove %s: %s", failed_path, e)
+
+        rmtree(path, onexc=make_writable_and_retry)
+
+    @staticmethod
+    def _report_failed_removals(*, path):
+        """
+        Report sandboxes in `path` that failed to be removed in the background.
+
+        The "cotainr_trash_*.errors" files left by :meth:`_remove_in_background`
+        are logged as warnings and removed.
+
+        Parameters
+        ----------
+        path : :class:`os.PathLike`
+            The directory in which the sandboxes were removed.
+        """
+        for errors_file in sorted(Path(path).glob("cotainr_trash_*.errors")):
+            try:
+                errors = errors_file.read_text().strip()
+                errors_file.unlink()
+            except OSError as e:
+                logger.debug("Unable to read %s: %s", errors_file, e)
+                continue
+            logger.warning(
+                "Unable to remove the sandbox in %s in the background: %s",
+                errors_file.with_suffix(""),
+                errors,
+            )
+
+    def _remove_bind_points(self):
+        """Remove the empty mount points of the bind paths from the sandbox."""
+        for container_path in self.bind_paths.values():
+            try:
+                (self.sandbox_dir / container_path.lstrip("/")).rmdir()
+            except OSError as e:
+                logger.debug("Unable to remove bind point %s: %s", container_path, e)
+        self.bind_paths = {}
+        self._close_session()
+
+    def _run_command_in_session(self, *, cmd, custom_log_dispatcher=None):
+        """
+        Run a command in the persistent shell session in the container sandbox.
+
+        The session is (re)started if it is not running.
+
+        Parameters
+        ----------
+        cmd : str
+            The command to run in the container sandbox.
+        custom_log_dispatcher : :class:`~cotainr.tracing.LogDispatcher`, optional
+            The custom log dispatcher to use when running the command (the
+            default is None which implies that the `SingularitySandbox` log
+            dispatcher is used).
+
+        Returns
+        -------
+        process : :class:`subprocess.CompletedProcess`
+            Information about the process that ran in the container sandbox.
+        """
+        if self._session is None or not self._session.is_alive:
+            self._close_session()
+            self._session = util.CommandSession(args=[*self._exec_args(), "/bin/sh"])
+
+        # Quote the command as it would otherwise be passed as separate
+        # arguments to singularity exec, i.e. without shell interpretation.
+        quoted_cmd = shlex.join(shlex.split(cmd))
+        if custom_log_dispatcher is not None:
+            with custom_log_dispatcher.prefix_stderr_name(
+                prefix=self.__class__.__name__
+            ):
+                process = self._session.run(
+                    cmd=quoted_cmd, log_dispatcher=custom_log_dispatcher
+                )
+        else:
+            process = self._session.run(
+                cmd=quoted_cmd, log_dispatcher=self.log_dispatcher
+            )
+        self._record_command_usage(command=quoted_cmd, process=process)
+
+        return process
 
     def _subprocess_runner(self, *, custom_log_dispatcher=None, args, **kwargs):
         """
@@ -357,15 +1452,81 @@ class SingularitySandbox:
             with custom_log_dispatcher.prefix_stderr_name(
                 prefix=self.__class__.__name__
             ):
-                return util.stream_subprocess(
+                process = util.stream_subprocess(
                     log_dispatcher=custom_log_dispatcher, args=args, **kwargs
                 )
         else:
             # Use the SingularitySandbox log_dispatcher
-            return util.stream_subprocess(
+            process = util.stream_subprocess(
                 log_dispatcher=self.log_dispatcher, args=args, **kwargs
             )
 
+        # Only record the command run in the container for `singularity exec`
+        args = [str(arg) for arg in args]
+        if "exec" in args and str(self.sandbox_dir) in args:
+            args = args[args.index(str(self.sandbox_dir)) + 1 :]
+        self._record_command_usage(command=shlex.join(args), process=process)
+
+        return process
+
+    def _unpack_base_image(self, *, sandbox_dir):
+        """
+        Unpack the base image into the (existing) `sandbox_dir`.
+
+        Parameters
+        ----------
+        sandbox_dir : :class:`os.PathLike`
+            The directory to unpack the base image sandbox into.
+        """
+        self._subprocess_runner(
+            args=self._add_verbosity_arg(
+                args=[
+                    "singularity",
+                    "--nocolor",
+                    "build",
+                    "--force",  # sandbox_dir.mkdir() checks for existing sandbox image
+                    "--sandbox",
+                    "--fix-perms",
+                    sandbox_dir,
+                    self.base_image,
+                ]
+            ),
+        )
+
+    def _write_file(self, *, path, content, mode=0o644):
+        """
+        Atomically write `content` to the file `path` in the container sandbox.
+
+        The file is written on the host, i.e. without starting a container
+        process, to a temporary file in the same folder which then replaces
+        `path`. Thus, any existing file at `path` is either left untouched or
+        fully replaced. The file permissions are set to `mode`, ignoring the
+        system umask.
+
+        Parameters
+        ----------
+        path : :class:`pathlib.Path`
+            The file to write in an existing folder in the sandbox, e.g.
+            Path("sandbox_dir/.singularity.d/env/92-cotainr-env.sh").
+        content : str
+            The content to write to the file.
+        mode : int, default=0o644
+            The file permissions.
+        """
+        self._assert_within_sandbox_context()
+
+        with tempfile.NamedTemporaryFile(
+            mode="w", dir=path.parent, prefix=f".{path.name}.", delete=False
+        ) as f:
+            try:
+                f.write(content)
+                f.flush()
+                os.fchmod(f.fileno(), mode)
+            except BaseException:
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, path)
+
     @staticmethod
     def _map_log_level(msg):
         """
@@ -395,3 +1556,37 @@ class SingularitySandbox:
         else:
             # If no prefix on message, assume its INFO level
             return logging.INFO
+
+
+def get_image_labels(*, path):
+    """
+    Get the metadata labels of a SIF container image.
+
+    Parameters
+    ----------
+    path : :class:`os.PathLike`
+        Path to the container image.
+
+    Returns
+    -------
+    labels : dict or None
+        The metadata labels of the container image or None if the container
+        image could not be inspected.
+    """
+    try:
+        process = subprocess.run(
+            ["singularity", "--nocolor", "inspect", "--json", "--labels", str(path)],
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+        return json.loads(process.stdout)["data"]["attributes"]["labels"]
+    except (
+        OSError,
+        subprocess.CalledProcessError,
+        ValueError,
+        KeyError,
+        TypeError,
+    ) as e:
+        logger.debug("Unable to inspect the labels of %s: %s", path, e)
+        return None
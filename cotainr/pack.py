@@ -1,4 +1,4 @@
-"""
+r"""
 cotainr - a user space Apptainer/Singularity container builder.
 
 Copyright DeiC, deic.dk
@@ -11,22 +11,111 @@ Classes
 -------
 CondaInstall
     A Conda installation in a container sandbox.
+CondaPackImport
+    A prebuilt conda-pack environment imported into a container sandbox.
+
+Functions
+---------
+compile_bytecode(\*, sandbox, env_prefix, invalidation_mode="unchecked-hash")
+    Compile the Python modules in a Conda environment to bytecode.
+slim_prefix(\*, path, profile="conservative", keep=(), remove=())
+    Remove files not needed at runtime from the Conda prefix `path`.
+solve_environment_on_host(\*, path, architecture)
+    Solve a Conda environment on the host without installing it.
 """
 
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import email.utils
+import fnmatch
+import hashlib
+import http.client
+import json
 import logging
+import os
 from pathlib import Path
 import random
 import re
+import shlex
+import shutil
+import stat
 import subprocess
 import sys
+import tarfile
+import tempfile
 import time
 import urllib.error
+import urllib.parse
 import urllib.request
 
 from . import tracing, util
 
 logger = logging.getLogger(__name__)
 
+_MINIFORGE_RELEASES_URL = "https://github.com/conda-forge/miniforge/releases"
+_MINIFORGE_MAX_HEADER_SIZE = 2**20
+_MINIFORGE_LICENSE_RE = re.compile(
+    rb"<<\s*'?EOF'?\n(?P<license>.*?)\nEOF\n", flags=re.DOTALL
+)
+_PKGS_CACHE_MOUNT_POINT = "/opt/cotainr/conda_pkgs_cache"
+_CONDA_PACKAGE_SUFFIXES = (".conda", ".tar.bz2")
+_BASE_PREFIX_CACHE_MAX_ENTRIES = 4
+_CHANNEL_MIRRORS_MOUNT_POINT = "/opt/cotainr/conda_channel_mirrors"
+_CONDA_CONFIG_MOUNT_POINT = "/opt/cotainr/conda_config"
+_CONDA_PACK_DECOMPRESSORS = {
+    ".gz": ["pigz", "-dc"],
+    ".tgz": ["pigz", "-dc"],
+    ".zst": ["zstd", "-dc", "-T0"],
+}
+_CONDA_PACK_MAX_BUFFERED_SIZE = 2**26
+_SLIM_PROFILES = {
+    "conservative": {
+        "static_libraries": ["*.a"],
+        "docs": ["share/doc/*", "share/gtk-doc/*", "share/info/*", "share/man/*"],
+    },
+    "aggressive": {
+        "static_libraries": ["*.a"],
+        "docs": ["share/doc/*", "share/gtk-doc/*", "share/info/*", "share/man/*"],
+        "headers": ["include/*"],
+        "tests": [
+            "lib/python*/test/*",
+            "lib/python*/site-packages/*/tests/*",
+            "lib/python*/site-packages/*/test/*",
+        ],
+        "pycache": ["*/__pycache__/*"],
+        "debug_symbols": [],
+    },
+}
+_INVALIDATION_MODES = ("timestamp", "checked-hash", "unchecked-hash")
+_COMPILE_BYTECODE_SCRIPT = """\
+import compileall, py_compile, sys
+mode = py_compile.PycInvalidationMode[sys.argv[1].upper().replace("-", "_")]
+force = mode is not py_compile.PycInvalidationMode.TIMESTAMP
+for path in sys.argv[2:]:
+    compileall.compile_dir(
+        path, quiet=1, workers=0, invalidation_mode=mode, force=force
+    )
+"""
+_WHEEL_CACHE_MOUNT_POINT = "/opt/cotainr/pip_wheel_cache"
+_PIP_INSTALLERS = ("pip", "uv")
+_CONDA_SUBDIRS = {
+    "x86_64": "linux-64",
+    "aarch64": "linux-aarch64",
+    "arm64": "linux-aarch64",
+    "ppc64le": "linux-ppc64le",
+}
+_SOLVERS = ("conda", "classic", "libmamba", "mamba", "micromamba")
+_MAMBA_LOG_LEVELS = {
+    "trace": logging.DEBUG,
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+    "critical": logging.CRITICAL,
+}
+_MAMBA_LOG_LEVEL_RE = re.compile(rf"^(?P<level>{'|'.join(_MAMBA_LOG_LEVELS)})\s+\S")
+
 
 class CondaInstall:
     """
@@ -49,6 +138,47 @@ class CondaInstall:
     log_settings : :class:`~cotainr.tracing.LogSettings`, optional
         The data used to setup the logging machinery (the default is None which
         implies that the logging machinery is not used).
+    installer_cache_max_age : float, default=86400
+        The maximum age in seconds of the cached resolution of the latest
+        Miniforge release before checking for a new release.
+    pkgs_cache_dir : :class:`os.PathLike`, optional
+        The directory on the host to use as a persistent Conda package cache
+        shared across builds (the default is None which implies that packages
+        are downloaded into the sandbox and removed after installation).
+    pkgs_cache_max_size : int, default=21474836480
+        The maximum size in bytes of the Conda package cache. The least
+        recently used packages are evicted from the cache to stay below it.
+    update_base : {"always", "never", "stale"}, default="always"
+        When to update Conda in the base environment after bootstrapping it:
+        always, never, or only when the base environment is older than
+        `update_base_max_age`.
+    update_base_max_age : float, default=604800
+        The maximum age in seconds of the base environment before it is
+        updated when `update_base` is "stale".
+    use_base_prefix_cache : bool, default=True
+        Whether or not to use the cache of bootstrapped Conda base
+        environments.
+    solver : {"conda", "classic", "libmamba", "mamba", "micromamba"}, default="conda"
+        The tool used to solve and install Conda environments: conda with its
+        default solver, conda with the classic or libmamba solver, mamba, or
+        micromamba.
+    env_lock : {"use", "refresh", "ignore"}, default="use"
+        How to use the cache of solved Conda environments: install from a
+        cached solution if available and otherwise cache the solution, always
+        solve and cache the solution, or neither use nor update the cache.
+    local_installer : :class:`os.PathLike`, optional
+        The path to a local Miniforge installer to use instead of downloading
+        the latest Miniforge installer (the default is None which implies that
+        the latest Miniforge installer is downloaded).
+    channel_mirrors : iterable of str, optional
+        The urls of local Conda channel mirrors, either "file://" urls (or
+        plain paths) or "http(s)://" urls, e.g. of a local HTTP server. The
+        last part of the url is the name of the mirrored channel, e.g.
+        "file:///srv/mirrors/conda-forge" mirrors the "conda-forge" channel.
+    wheel_cache_dir : :class:`os.PathLike`, optional
+        The directory on the host to use as a persistent pip/uv wheel cache
+        shared across builds (the default is None which implies that no cache
+        is used when installing pip requirements).
 
     Attributes
     ----------
@@ -62,6 +192,33 @@ class CondaInstall:
         The log dispatcher used to process stdout/stderr message from
         Singularity commands that run in sandbox, if the logging machinery is
         used.
+    space_estimate : tuple of int
+        A rough estimate of the (bytes, inodes) added to a sandbox by a
+        Conda installation with a typical scientific Conda environment.
+    installer_cache_max_age : float
+        The maximum age in seconds of the cached latest Miniforge release.
+    pkgs_cache_dir : :class:`pathlib.Path` or None
+        The host directory used as a persistent Conda package cache, if any.
+    pkgs_cache_max_size : int
+        The maximum size in bytes of the Conda package cache.
+    update_base : str
+        When to update Conda in the base environment.
+    update_base_max_age : float
+        The maximum age in seconds of the base environment when `update_base`
+        is "stale".
+    use_base_prefix_cache : bool
+        Whether or not the cache of bootstrapped Conda base environments is
+        used.
+    solver : str
+        The tool used to solve and install Conda environments.
+    env_lock : str
+        How the cache of solved Conda environments is used.
+    local_installer : :class:`pathlib.Path` or None
+        The path to the local Miniforge installer, if any.
+    channel_mirrors : list of str
+        The urls of the local Conda channel mirrors.
+    wheel_cache_dir : :class:`pathlib.Path` or None
+        The host directory used as a persistent pip/uv wheel cache, if any.
 
     Notes
     -----
@@ -70,8 +227,70 @@ class CondaInstall:
     channels/repositories and packages specified in the Conda environment, e.g.
     if `using the default Anaconda repositories
     <https://www.anaconda.com/blog/anaconda-commercial-edition-faq>`_.
+
+    Miniforge installers are cached in the "miniforge_installers" folder in the
+    :func:`cotainr cache directory <cotainr.util.get_cache_dir>`, keyed by
+    release version and architecture, and verified against the SHA256 digest
+    published with the release. The latest release version is only resolved
+    online if the cached resolution is older than `installer_cache_max_age`,
+    such that repeated builds do not need any network access.
+
+    When using a `pkgs_cache_dir`, it is bind mounted in the container sandbox
+    and used as the Conda `pkgs_dirs` when installing packages, such that
+    packages are only downloaded once across builds. The package cache is
+    never part of the container image. After each installation, the packages
+    used are marked as recently used and the least recently used packages are
+    evicted if the package cache is larger than `pkgs_cache_max_size`.
+
+    Bootstrapped (and updated) Conda base environments are cached in the
+    "conda_base_prefixes" folder in the cotainr cache directory, keyed by the
+    Miniforge installer digest, the container architecture, and the `prefix`.
+    On a cache hit, the base environment is copied into the sandbox instead of
+    running the installer. A cached base environment is only replaced if
+    updating it changed its packages, and only the most recently used cached
+    base environments are kept. The age of a base environment, used with the
+    "stale" `update_base` policy, is the time since it was last updated or,
+    if it has never been updated, the age of the Miniforge release.
+
+    The Conda base environment is always bootstrapped and managed using conda.
+    Only the Conda environments added using :meth:`add_environment` are
+    created using the chosen `solver`. The mamba tool is included with
+    Miniforge whereas micromamba is installed in the Conda base environment
+    when adding the first Conda environment. The mamba and micromamba tools
+    use the same verbosity flags as conda, but a different format of their
+    log messages, which is taken into account when inferring log levels.
+
+    Several Conda environments may be added concurrently using
+    :meth:`add_environments`. To avoid concurrent writes to the same package
+    folder, each Conda environment then uses a private package folder for
+    downloads, in front of the shared package folder (or package cache) from
+    which already downloaded packages are reused.
+
+    Solved Conda environments are cached as explicit package lists, i.e. the
+    package urls and MD5 hashes, in the "conda_env_locks" folder in the
+    cotainr cache directory, keyed by the Conda environment file content,
+    including its channels, and the container architecture. Installing from
+    such a lock requires no solve. Conda environments with pip dependencies
+    are not locked as the explicit package list does not include them.
+
+    Channel mirrors are configured as Conda `custom_channels` in a condarc
+    file that is only mounted in the container sandbox while installing
+    packages, such that the Conda configuration in the container image is not
+    changed. Local "file://" channel mirrors are mounted in the container
+    sandbox as well. Use :meth:`check_local_artifacts` to check that a local
+    installer and channel mirrors are available before starting a build.
+
+    Pip requirements added using :meth:`add_pip_requirements` are installed
+    using pip or uv in a separate stage after creating the Conda environment.
+    When using a `wheel_cache_dir`, it is bind mounted in the container
+    sandbox and used as the pip/uv cache, with a subfolder per tool. Both
+    tools cache downloaded and locally built wheels and only reuse those
+    compatible with the Python version and architecture in the container.
+    The wheel cache is never part of the container image.
     """
 
+    space_estimate = (5 * 2**30, 100_000)
+
     def __init__(
         self,
         *,
@@ -79,16 +298,68 @@ class CondaInstall:
         prefix="/opt/cotainr/conda",
         license_accepted=False,
         log_settings=None,
+        installer_cache_max_age=24 * 60 * 60,
+        pkgs_cache_dir=None,
+        pkgs_cache_max_size=20 * 2**30,
+        update_base="always",
+        update_base_max_age=7 * 24 * 60 * 60,
+        use_base_prefix_cache=True,
+        solver="conda",
+        env_lock="use",
+        local_installer=None,
+        channel_mirrors=(),
+        wheel_cache_dir=None,
     ):
         """Bootstrap a conda installation."""
+        if solver not in _SOLVERS:
+            raise ValueError(
+                f"Invalid {solver=}. Must be one of {', '.join(_SOLVERS)}."
+            )
+        if env_lock not in ("use", "refresh", "ignore"):
+            raise ValueError(
+                f"Invalid {env_lock=}. Must be one of 'use', 'refresh', or 'ignore'."
+            )
+        if update_base not in ("always", "never", "stale"):
+            raise ValueError(
+                f"Invalid {update_base=}. Must be one of 'always', 'never', or 'stale'."
+            )
         self.sandbox = sandbox
         self.prefix = prefix
         self.license_accepted = license_accepted
+        self.installer_cache_max_age = installer_cache_max_age
+        self.pkgs_cache_dir = (
+            Path(pkgs_cache_dir).resolve() if pkgs_cache_dir is not None else None
+        )
+        self.pkgs_cache_max_size = pkgs_cache_max_size
+        self.update_base = update_base
+        self.update_base_max_age = update_base_max_age
+        self.use_base_prefix_cache = use_base_prefix_cache
+        self.solver = solver
+        self.env_lock = env_lock
+        self.local_installer = (
+            Path(local_installer).resolve() if local_installer is not None else None
+        )
+        self.channel_mirrors = [
+            _channel_mirror_url(mirror=mirror) for mirror in channel_mirrors
+        ]
+        self.wheel_cache_dir = (
+            Path(wheel_cache_dir).resolve() if wheel_cache_dir is not None else None
+        )
+        self._installer_sha256 = None
+        self._base_updated_time = None
+        self._base_prefix_changed = False
+        self._base_prefix_checked = False
+        self._micromamba_installed = False
+        self._log_settings = log_settings
         if log_settings is not None:
             self._verbosity = log_settings.verbosity
             self.log_dispatcher = tracing.LogDispatcher(
                 name=__class__.__name__,
-                map_log_level_func=self._map_log_level,
+                map_log_level_func=(
+                    self._map_mamba_log_level
+                    if solver in ("mamba", "micromamba")
+                    else self._map_log_level
+                ),
                 filters=self._logging_filters,
                 log_settings=log_settings,
             )
@@ -116,18 +387,147 @@ class CondaInstall:
                 log_level=logging.WARNING,
             )
 
+        # Mount the channel mirrors configuration, if any
+        if self.channel_mirrors:
+            self._mount_channel_mirrors()
+
+        # Mount the persistent package cache, if any
+        if self.pkgs_cache_dir is not None:
+            self.pkgs_cache_dir.mkdir(parents=True, exist_ok=True)
+            self.sandbox.add_bind_path(
+                host_path=self.pkgs_cache_dir, container_path=_PKGS_CACHE_MOUNT_POINT
+            )
+
         # Bootstrap Conda environment in container
-        self._bootstrap_conda(installer_path=conda_installer_path)
+        if not self._restore_cached_base_prefix():
+            self._bootstrap_conda(installer_path=conda_installer_path)
+        self._update_pkgs_cache(env_prefix=self.prefix)
+        self.sandbox.record_usage(stage="conda_bootstrap")
 
         # Remove unneeded files
         conda_installer_path.unlink()
         self.cleanup_unused_files()
+        self._cache_base_prefix()
+
+    @staticmethod
+    def check_local_artifacts(
+        *, local_installer=None, channel_mirrors=(), env_path=None
+    ):
+        """
+        Check that a local installer and local channel mirrors are available.
+
+        Parameters
+        ----------
+        local_installer : :class:`os.PathLike`, optional
+            The path to a local Miniforge installer.
+        channel_mirrors : iterable of str, optional
+            The urls of local Conda channel mirrors.
+        env_path : :class:`os.PathLike`, optional
+            The path to a Conda environment file whose channels must all be
+            mirrored by the `channel_mirrors`.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the local installer or a channel mirror is not available.
+        ValueError
+            If a channel used in the Conda environment file is not mirrored.
+        """
+        if local_installer is not None and not Path(local_installer).is_file():
+            raise FileNotFoundError(
+                f"The local Miniforge installer '{local_installer}' does not exist."
+            )
+
+        mirrored_channels = set()
+        for mirror in channel_mirrors:
+            mirror_url = _channel_mirror_url(mirror=mirror)
+            repodata_url = f"{mirror_url}/noarch/repodata.json"
+            if mirror_url.startswith("file://"):
+                available = Path(urllib.parse.urlparse(repodata_url).path).is_file()
+            else:
+                try:
+                    request = urllib.request.Request(repodata_url, method="HEAD")
+                    with urllib.request.urlopen(request, timeout=10):  # nosec B310
+                        available = True
+                except (urllib.error.URLError, OSError):
+                    available = False
+            if not available:
+                raise FileNotFoundError(
+                    f"The Conda channel mirror '{mirror}' is not available. "
+                    f"Unable to access {repodata_url}."
+                )
+            mirrored_channels.add(mirror_url.rsplit("/", maxsplit=1)[-1])
+
+        if env_path is not None:
+            unmirrored_channels = [
+                channel
+                for channel in _read_env_channels(path=env_path)
+                if "://" not in channel and channel not in mirrored_channels
+            ]
+            if unmirrored_channels:
+                raise ValueError(
+                    f"The Conda channels {', '.join(unmirrored_channels)} used in "
+                    f"'{env_path}' are not mirrored by any of the Conda channel "
+                    "mirrors."
+                )
+
+    @staticmethod
+    def fetch_miniforge_installer(
+        *, architecture, installer_cache_max_age=24 * 60 * 60
+    ):
+        """
+        Fetch the latest Miniforge installer into the installer cache.
+
+        The installer is only downloaded if it is not already in the installer
+        cache. As no container sandbox is needed, the installer may be fetched
+        while the container sandbox is being created.
+
+        Parameters
+        ----------
+        architecture : str
+            The container architecture as returned by "uname -m".
+        installer_cache_max_age : float, default=86400
+            The maximum age in seconds of the cached resolution of the latest
+            Miniforge release before checking for a new release.
+
+        Returns
+        -------
+        cached_installer : pathlib.Path
+            The path to the installer in the installer cache.
+
+        Raises
+        ------
+        RuntimeError
+            If the downloaded installer does not match its published SHA256
+            digest.
+        ValueError
+            If the architecture is not supported.
+        urllib.error.URLError
+            If three attempts at downloading the installer all fail.
+        """
+        install_script = CondaInstall._get_install_script(architecture)
+        version = CondaInstall._resolve_latest_miniforge_version(
+            max_age=installer_cache_max_age
+        )
+        cached_installer = (
+            util.get_cache_dir() / "miniforge_installers" / version / install_script
+        )
+        if CondaInstall._cached_installer_is_valid(cached_installer=cached_installer):
+            logger.info("Using cached Miniforge installer %s", cached_installer)
+        else:
+            CondaInstall._download_installer_to_cache(
+                url=f"{_MINIFORGE_RELEASES_URL}/download/{version}/{install_script}",
+                cached_installer=cached_installer,
+            )
+
+        return cached_installer
 
     def add_environment(self, *, path, name):
         """
         Add an exported Conda environment to the Conda install.
 
-        Equivalent to calling "conda env create -f `path` -n `name`".
+        Equivalent to calling "conda env create -f `path` -n `name`", or the
+        equivalent command of the chosen `solver`.
 
         Parameters
         ----------
@@ -137,10 +537,164 @@ class CondaInstall:
         name : str
             The name to use for the installed Conda environment.
         """
-        self._run_command_in_sandbox(
-            cmd=f"conda env create -f {path} -n {name}" + self._conda_verbosity_arg
+        self._install_solver()
+        self._create_environment(path=path, name=name, env=self._conda_install_env)
+        self._update_pkgs_cache(env_prefix=f"{self.prefix}/envs/{name}")
+        self.sandbox.record_usage(stage=f"conda_add_environment[{name}]")
+
+    def add_environments(self, *, envs, max_workers=None):
+        """
+        Add several exported Conda environments to the Conda install.
+
+        The Conda environments are solved and installed concurrently, each
+        downloading packages to a private package folder while reusing the
+        packages already in the shared package cache. The output of each
+        Conda environment is logged by its own log dispatcher, named after the
+        Conda environment, as log dispatchers must not be shared between
+        threads. Afterwards, the newly downloaded packages are merged into the
+        package cache, if one is used. When using a persistent session in the
+        sandbox, the Conda environments are added one after another.
+
+        Parameters
+        ----------
+        envs : dict
+            The paths to the exported env.yml files describing the Conda
+            environments to install, keyed by the names to use for the
+            installed Conda environments.
+        max_workers : int, optional
+            The maximum number of Conda environments to add concurrently (the
+            default is None which implies the :class:`ThreadPoolExecutor
+            <concurrent.futures.ThreadPoolExecutor>` default).
+        """
+        if len(envs) < 2 or self.sandbox.persistent_session:
+            for name, path in envs.items():
+                self.add_environment(path=path, name=name)
+            return
+
+        self._install_solver()
+        shared_pkgs_dir = (
+            _PKGS_CACHE_MOUNT_POINT
+            if self.pkgs_cache_dir is not None
+            else f"{self.prefix}/pkgs"
         )
 
+        def create_environment(name, path, log_dispatcher):
+            env = dict(self._conda_install_env or {})
+            env["CONDA_PKGS_DIRS"] = f"{self.prefix}/pkgs_{name},{shared_pkgs_dir}"
+            self._create_environment(
+                path=path, name=name, env=env, log_dispatcher=log_dispatcher
+            )
+
+        log_dispatchers = {
+            name: (
+                tracing.LogDispatcher(
+                    name=f"{__class__.__name__}[{name}]",
+                    map_log_level_func=self.log_dispatcher.map_log_level,
+                    filters=self._logging_filters,
+                    log_settings=self._log_settings,
+                )
+                if self.log_dispatcher is not None
+                else None
+            )
+            for name in envs
+        }
+        t_start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(create_environment, name, path, log_dispatchers[name])
+                for name, path in envs.items()
+            ]
+            for future in futures:
+                future.result()
+        logger.info(
+            "Added %d Conda environments concurrently in %.1f s",
+            len(envs),
+            time.monotonic() - t_start,
+        )
+
+        for name in envs:
+            self._merge_private_pkgs_dir(name=name)
+            self._update_pkgs_cache(env_prefix=f"{self.prefix}/envs/{name}")
+            self.sandbox.record_usage(stage=f"conda_add_environment[{name}]")
+
+    def add_pip_requirements(self, *, path, name, installer="pip", jobs=None):
+        """
+        Install pip requirements in a Conda environment.
+
+        Equivalent to calling "pip install -r `path`" using the Python in the
+        Conda environment `name`, or "uv pip install -r `path`" targeting it.
+
+        Parameters
+        ----------
+        path : :class:`os.PathLike`
+            The path to the pip requirements.txt file.
+        name : str
+            The name of the Conda environment in which to install the
+            requirements.
+        installer : {"pip", "uv"}, default="pip"
+            The tool used to install the requirements. The pip tool must be
+            included in the Conda environment whereas uv is temporarily
+            installed in the Conda base environment and removed once the
+            requirements are installed.
+        jobs : int, optional
+            The number of concurrent downloads, builds and installs when using
+            uv (the default is None which implies the uv defaults). Ignored by
+            pip which has no such concurrency.
+
+        Raises
+        ------
+        ValueError
+            If `installer` is not a valid installer.
+        """
+        if installer not in _PIP_INSTALLERS:
+            raise ValueError(
+                f"Invalid {installer=}. Must be one of {', '.join(_PIP_INSTALLERS)}."
+            )
+
+        env_prefix = f"{self.prefix}/envs/{name}"
+        env = {}
+        if self.wheel_cache_dir is not None:
+            (self.wheel_cache_dir / installer).mkdir(parents=True, exist_ok=True)
+            if self.wheel_cache_dir not in self.sandbox.bind_paths:
+                self.sandbox.add_bind_path(
+                    host_path=self.wheel_cache_dir,
+                    container_path=_WHEEL_CACHE_MOUNT_POINT,
+                )
+            cache_dir = f"{_WHEEL_CACHE_MOUNT_POINT}/{installer}"
+            env["PIP_CACHE_DIR" if installer == "pip" else "UV_CACHE_DIR"] = cache_dir
+        else:
+            # Do not leave a cache in the container image
+            env["PIP_NO_CACHE_DIR" if installer == "pip" else "UV_NO_CACHE"] = "1"
+
+        if installer == "uv":
+            self._run_command_in_sandbox(
+                cmd="conda install -y -n base -c conda-forge uv"
+                + self._conda_verbosity_arg,
+                env=self._conda_install_env,
+            )
+            # The cache is on another file system than the sandbox, if mounted
+            env["UV_LINK_MODE"] = "copy"
+            if jobs is not None:
+                for concurrency in ("DOWNLOADS", "BUILDS", "INSTALLS"):
+                    env[f"UV_CONCURRENT_{concurrency}"] = str(jobs)
+            cmd = f"{self.prefix}/bin/uv pip install --python {env_prefix}/bin/python"
+        else:
+            if jobs is not None:
+                logger.debug("Ignoring jobs=%s as pip installs sequentially", jobs)
+            env["PIP_DISABLE_PIP_VERSION_CHECK"] = "1"
+            cmd = f"{env_prefix}/bin/python -m pip install"
+
+        try:
+            self._run_command_in_sandbox(cmd=f"{cmd} -r {path}", env=env)
+        finally:
+            if installer == "uv":
+                # Do not leave uv in the Conda base environment of the image
+                self._run_command_in_sandbox(
+                    cmd="conda remove -y -n base uv" + self._conda_verbosity_arg,
+                    env=self._conda_install_env,
+                )
+        self.sandbox.record_usage(stage=f"pip_install[{name}]")
+
     def cleanup_unused_files(self):
         """
         Remove all unused Conda files.
@@ -150,6 +704,7 @@ class CondaInstall:
         self._run_command_in_sandbox(
             cmd="conda clean -y -a" + self._conda_verbosity_arg
         )
+        self.sandbox.record_usage(stage="conda_cleanup")
 
     def _bootstrap_conda(self, *, installer_path):
         """
@@ -173,13 +728,76 @@ class CondaInstall:
         # Check that we correctly use the newly installed Conda from now on
         self._check_conda_bootstrap_integrity()
 
-        # Update the installed Conda package manager to the latest version
-        self._run_command_in_sandbox(
-            cmd=(
-                "conda update -y -n base -c conda-forge conda"
-                + self._conda_verbosity_arg
-            )
-        )
+        # The base environment is as old as the Miniforge release
+        self._base_updated_time = installer_path.stat().st_mtime
+        self._base_prefix_changed = True
+        self._update_base_if_due()
+
+    def _cache_base_prefix(self):
+        """
+        Add the bootstrapped Conda base environment to the cache.
+
+        The base environment is only (re)cached if it has been bootstrapped or
+        its packages have been updated since it was restored from the cache.
+        Otherwise, only the time of its last update check is recorded. The
+        least recently used cached base environments are evicted such that at
+        most `_BASE_PREFIX_CACHE_MAX_ENTRIES` are kept.
+        """
+        cached_prefix = self._cached_base_prefix_path
+        if cached_prefix is None:
+            return
+
+        if not self._base_prefix_changed:
+            if self._base_prefix_checked:
+                try:
+                    cached_prefix.with_suffix(".json").write_text(
+                        json.dumps({"updated": self._base_updated_time})
+                    )
+                except OSError as e:
+                    logger.debug("Unable to update the base environment cache: %s", e)
+            return
+
+        try:
+            cached_prefix.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.TemporaryDirectory(
+                dir=cached_prefix.parent, prefix=".tmp_"
+            ) as tmp_dir:
+                tmp_prefix = Path(tmp_dir) / "prefix"
+                util.clone_tree(
+                    src=Path(self.sandbox.sandbox_dir) / self.prefix.lstrip("/"),
+                    dst=tmp_prefix,
+                    allow_hardlinks=False,
+                )
+                if cached_prefix.exists():
+                    shutil.rmtree(cached_prefix)
+                os.replace(tmp_prefix, cached_prefix)
+                cached_prefix.with_suffix(".json").write_text(
+                    json.dumps({"updated": self._base_updated_time})
+                )
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.warning("Unable to cache the Conda base environment: %s", e)
+        else:
+            logger.debug("Cached the Conda base environment in %s", cached_prefix)
+            self._evict_cached_base_prefixes(cache_dir=cached_prefix.parent)
+
+    @property
+    def _cached_base_prefix_path(self):
+        """
+        Get the path of the Conda base environment in the cache.
+
+        Returns
+        -------
+        cached_prefix : :class:`pathlib.Path` or None
+            The path of the cached base environment, or None if the cache is
+            not used or the Miniforge installer digest is unknown.
+        """
+        if not self.use_base_prefix_cache or self._installer_sha256 is None:
+            return None
+
+        key = hashlib.sha256(
+            f"{self._installer_sha256}:{self.sandbox.architecture}:{self.prefix}".encode()
+        ).hexdigest()
+        return util.get_cache_dir() / "conda_base_prefixes" / key
 
     def _check_conda_bootstrap_integrity(self):
         """Raise RuntimeError if multiple interfering Conda installs are found."""
@@ -191,6 +809,51 @@ class CondaInstall:
                 f"{source_check_process.stdout.strip()}. Aborting!"
             )
 
+    def _create_environment(self, *, path, name, env, log_dispatcher=None):
+        """
+        Create a Conda environment from its cached lock or by solving it.
+
+        Parameters
+        ----------
+        path : :class:`os.PathLike`
+            The path to the exported env.yml file describing the Conda
+            environment to install.
+        name : str
+            The name to use for the installed Conda environment.
+        env : dict or None
+            The environment variables to use when installing Conda packages.
+        log_dispatcher : :class:`~cotainr.tracing.LogDispatcher`, optional
+            The log dispatcher to use instead of the `log_dispatcher`.
+        """
+        env_lock_path = self._get_env_lock_path(path=path)
+        if (
+            env_lock_path is not None
+            and self.env_lock == "use"
+            and env_lock_path.is_file()
+        ):
+            logger.info("Installing Conda environment from lock %s", env_lock_path)
+            sandbox_env_lock_path = Path(path).with_name(f"{name}.lock.txt")
+            shutil.copyfile(env_lock_path, sandbox_env_lock_path)
+            self._run_command_in_sandbox(
+                cmd=f"conda create -y -n {name} --file {sandbox_env_lock_path}"
+                + self._conda_verbosity_arg,
+                env=env,
+                log_dispatcher=log_dispatcher,
+            )
+            sandbox_env_lock_path.unlink()
+            return
+
+        self._run_command_in_sandbox(
+            cmd=self._get_create_environment_cmd(path=path, name=name)
+            + self._conda_verbosity_arg,
+            env=env,
+            log_dispatcher=log_dispatcher,
+        )
+        if env_lock_path is not None:
+            self._store_env_lock(
+                name=name, env_lock_path=env_lock_path, log_dispatcher=log_dispatcher
+            )
+
     def _display_message(self, *, msg, log_level=None):
         """
         Display a message to the user.
@@ -222,14 +885,14 @@ class CondaInstall:
         """
         Extract and display Miniforge installer license for acceptance.
 
-        Runs the Miniforge bootstrap installer to extract the license, displays
+        Extracts the license from the Miniforge bootstrap installer, displays
         it to the user, and prompts for acceptance of the license terms. Exits
         if the license terms are not accepted.
 
         Parameters
         ----------
         installer_path : pathlib.Path
-            The path of the Miniforge installer to run to bootstrap Conda.
+            The path of the Miniforge installer to extract the license from.
 
         Raises
         ------
@@ -238,37 +901,23 @@ class CondaInstall:
 
         Notes
         -----
-        This assumes that the Miniforge installer, as it is run, prompts the
-        user for pressing ENTER to display the license, then displays the
-        license and prompts the user to answer "yes" to accept the license
-        terms.
-
-        We try to "forward" this flow to the user by extracting the text shown
-        when running the installer and pressing ENTER. We then prompt for a
-        "yes" to the license terms.
+        The Miniforge installer, when run, displays its license and prompts
+        the user to answer "yes" to accept the license terms. We try to
+        "forward" this flow to the user by extracting the license from the
+        installer, without running it, and then prompt for a "yes" to the
+        license terms.
         """
-        with subprocess.Popen(
-            ["bash", f"{installer_path.name}"],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            text=True,
-        ) as process:
-            license_text, _ = process.communicate(
-                # "press" ENTER to display the license and capture it
-                "\n"
-            )
-            process.kill()  # We only use this process to extract the license
-
+        license_text = CondaInstall._extract_miniforge_license(
+            installer_path=installer_path
+        )
         util._flush_stdin_buffer()
         if license_text:
-            license_text = license_text.replace(
-                # remove prompt for pressing enter (as we have already done this...)
-                "Please, press ENTER to continue\n>>> ",
-                "\n",
-            )
-            # Remove "[yes|no]"" and ">>>" from license text as answer_is_yes
-            # adds them as part of the input handling
-            license_text = license_text.replace(" [yes|no]\n>>> ", "")
+            license_text = (
+                "In order to continue the installation process, please review the "
+                "license\nagreement.\n\n"
+                f"{license_text}\n\n"
+                "Do you accept the license terms?"
+            )
             logger.debug(f"The Miniforge displayed license is: {license_text}")
             # prompt user for acceptance of license terms
             if not util.answer_is_yes(license_text):
@@ -285,8 +934,125 @@ class CondaInstall:
             )
         else:
             raise RuntimeError(
-                "No license seems to be displayed by the Miniforge installer."
+                "No license seems to be included in the Miniforge installer."
+            )
+
+    @staticmethod
+    def _evict_cached_base_prefixes(*, cache_dir):
+        """
+        Evict the least recently used Conda base environments from the cache.
+
+        Parameters
+        ----------
+        cache_dir : :class:`pathlib.Path`
+            The folder of the cached Conda base environments.
+        """
+        metadata_paths = sorted(
+            cache_dir.glob("*.json"), key=lambda path: path.stat().st_mtime
+        )
+        for metadata_path in metadata_paths[:-_BASE_PREFIX_CACHE_MAX_ENTRIES]:
+            logger.debug(
+                "Evicting cached Conda base environment %s",
+                metadata_path.with_suffix(""),
+            )
+            try:
+                metadata_path.unlink()
+                shutil.rmtree(metadata_path.with_suffix(""))
+            except OSError as e:
+                logger.debug("Unable to evict the cached base environment: %s", e)
+
+    @staticmethod
+    def _extract_miniforge_license(*, installer_path):
+        """
+        Extract the license text from the Miniforge installer.
+
+        The Miniforge installer is a shell script header followed by a binary
+        payload. The license is included in the header as a heredoc that is
+        displayed to the user when running the installer. Only the start of
+        the installer is read to find it.
+
+        Parameters
+        ----------
+        installer_path : pathlib.Path
+            The path of the Miniforge installer.
+
+        Returns
+        -------
+        license_text : str or None
+            The license text, or None if no license is found in the installer.
+        """
+        with open(installer_path, "rb") as f:
+            header = f.read(_MINIFORGE_MAX_HEADER_SIZE).split(b"@@END_HEADER@@")[0]
+
+        license_match = _MINIFORGE_LICENSE_RE.search(
+            header, max(header.find(b"review the license"), 0)
+        )
+        if license_match is None:
+            return None
+
+        return license_match.group("license").decode(errors="replace")
+
+    def _get_create_environment_cmd(self, *, path, name):
+        """
+        Get the command for creating a Conda environment using the `solver`.
+
+        Parameters
+        ----------
+        path : :class:`os.PathLike`
+            The path to the exported env.yml file describing the Conda
+            environment to install.
+        name : str
+            The name to use for the installed Conda environment.
+
+        Returns
+        -------
+        cmd : str
+            The command to run in the container sandbox, without any verbosity
+            arg.
+        """
+        if self.solver in ("classic", "libmamba"):
+            return f"conda env create --solver={self.solver} -f {path} -n {name}"
+        elif self.solver == "mamba":
+            return f"mamba create -y -f {path} -n {name}"
+        elif self.solver == "micromamba":
+            return f"micromamba create -y -r {self.prefix} -f {path} -n {name}"
+        else:
+            return f"conda env create -f {path} -n {name}"
+
+    def _get_env_lock_path(self, *, path):
+        """
+        Get the path of the cached lock of a Conda environment.
+
+        Parameters
+        ----------
+        path : :class:`os.PathLike`
+            The path to the exported env.yml file describing the Conda
+            environment.
+
+        Returns
+        -------
+        env_lock_path : :class:`pathlib.Path` or None
+            The path of the lock in the cache, or None if the cache of solved
+            Conda environments is not used for the Conda environment.
+        """
+        if self.env_lock == "ignore":
+            return None
+
+        env_content = Path(path).read_bytes()
+        if re.search(rb"^\s*-\s*pip\s*:", env_content, flags=re.MULTILINE):
+            logger.info(
+                "Not using the Conda environment lock cache for %s as it includes "
+                "pip dependencies",
+                path,
             )
+            return None
+
+        key = hashlib.sha256(
+            env_content
+            + f"\0{self.sandbox.architecture}".encode()
+            + "".join(f"\0{mirror}" for mirror in self.channel_mirrors).encode()
+        ).hexdigest()
+        return util.get_cache_dir() / "conda_env_locks" / f"{key}.txt"
 
     @staticmethod
     def _get_install_script(architecture):
@@ -317,64 +1083,377 @@ class CondaInstall:
 
         return install_script
 
-    def _download_miniforge_installer(self, *, installer_path):
+    @staticmethod
+    def _cached_installer_is_valid(*, cached_installer):
         """
-        Download the Miniforge installer to `installer_path`.
+        Check a cached installer against its cached SHA256 digest.
 
         Parameters
         ----------
-        installer_path : pathlib.Path
-            The path to download the conda installer to.
+        cached_installer : pathlib.Path
+            The path to the cached installer.
+
+        Returns
+        -------
+        is_valid : bool
+            True if the cached installer exists and matches its digest.
+        """
+        sha256_path = cached_installer.with_name(cached_installer.name + ".sha256")
+        try:
+            expected_sha256 = sha256_path.read_text().split()[0]
+            return util.compute_sha256(path=cached_installer) == expected_sha256
+        except (OSError, IndexError):
+            return False
+
+    @staticmethod
+    def _download_installer_to_cache(*, url, cached_installer):
+        """
+        Download and verify an installer and add it to the installer cache.
+
+        Parameters
+        ----------
+        url : str
+            The url of the installer. Its SHA256 digest must be published at
+            the same url with an added ".sha256" suffix.
+        cached_installer : pathlib.Path
+            The path to the installer in the cache.
 
         Raises
         ------
         RuntimeError
-            If the container sandbox architecture is unknown.
-        urllib.error.URLError
-            If three attempts at downloading the installer all fail.
+            If the downloaded installer does not match its published digest.
         """
-        architecture = self.sandbox.architecture
-        if architecture is None:
+        logger.info("Downloading Miniforge installer %s", url)
+        sha256_content, _ = CondaInstall._read_url(url=url + ".sha256")
+        expected_sha256 = sha256_content.decode().split()[0]
+
+        cached_installer.parent.mkdir(parents=True, exist_ok=True)
+        partial_installer = cached_installer.with_name(
+            f".partial_{cached_installer.name}"
+        )
+        CondaInstall._download_url_to_file(url=url, path=partial_installer)
+        actual_sha256 = util.compute_sha256(path=partial_installer)
+        if actual_sha256 != expected_sha256:
+            partial_installer.unlink()
             raise RuntimeError(
-                f"Cotainr's CondaInstall got '{architecture=}' "
-                "which indicates that it is not running in a container sandbox context."
+                f"The SHA256 digest {actual_sha256} of the downloaded Miniforge "
+                f"installer {url} does not match the published digest "
+                f"{expected_sha256}."
             )
 
-        install_script = CondaInstall._get_install_script(architecture)
-        miniforge_installer_url = (
-            "https://github.com/conda-forge/miniforge/releases/latest/download/"
-            + install_script
+        with tempfile.NamedTemporaryFile(
+            dir=cached_installer.parent, prefix=".tmp_", delete=False
+        ) as f:
+            f.write(sha256_content)
+        os.replace(
+            f.name, cached_installer.with_name(cached_installer.name + ".sha256")
         )
+        os.replace(partial_installer, cached_installer)
 
-        # Make up to 3 attempts at downloading the installer
-        for retry in range(3):
-            try:
-                with urllib.request.urlopen(miniforge_installer_url) as url:  # nosec B310
-                    installer_path.write_bytes(url.read())
+    @staticmethod
+    def _download_url_to_file(*, url, path, chunk_size=2**20):
+        """
+        Download the content of `url` to `path` in chunks, resuming on failure.
+
+        The content is streamed to `path` such that only a single chunk is held
+        in memory. If the download is interrupted, it is resumed from the end
+        of `path` using an HTTP Range request. An existing `path`, e.g. from an
+        earlier interrupted download, is resumed as well. The modification
+        time of `path` is set to the Last-Modified time reported for the url,
+        if any.
 
+        Parameters
+        ----------
+        url : str
+            The url to download.
+        path : pathlib.Path
+            The path to download the content of `url` to.
+        chunk_size : int, default=1048576
+            The number of bytes to read from the url at a time.
+
+        Raises
+        ------
+        urllib.error.URLError
+            If three attempts in a row at downloading the url all fail without
+            any progress.
+        """
+        start_time = time.monotonic()
+        downloaded_bytes = 0
+        failed_attempts = 0
+        while True:
+            offset = path.stat().st_size if path.exists() else 0
+            request = urllib.request.Request(url)
+            if offset > 0:
+                logger.debug("Resuming download of %s from byte %d", url, offset)
+                request.add_header("Range", f"bytes={offset}-")
+
+            received_bytes = 0
+            try:
+                with urllib.request.urlopen(request) as response:  # nosec B310
+                    if offset > 0 and response.status != 206:
+                        # The server ignored the Range request, start over
+                        offset = 0
+                    content_length = response.headers.get("Content-Length")
+                    last_modified = response.headers.get("Last-Modified")
+                    with open(path, "ab" if offset > 0 else "wb") as f:
+                        while chunk := response.read(chunk_size):
+                            f.write(chunk)
+                            received_bytes += len(chunk)
+
+                if content_length is not None and received_bytes < int(content_length):
+                    raise urllib.error.URLError(
+                        f"Incomplete download of {url}: got {received_bytes} of "
+                        f"{content_length} bytes"
+                    )
+                downloaded_bytes += received_bytes
                 break
 
-            except urllib.error.URLError as e:
+            except urllib.error.HTTPError as e:
+                if e.code == 416:
+                    # Range not satisfiable, i.e. the partial download is invalid
+                    path.unlink(missing_ok=True)
                 url_error = e
+            except (urllib.error.URLError, OSError, http.client.HTTPException) as e:
+                url_error = (
+                    e
+                    if isinstance(e, urllib.error.URLError)
+                    else urllib.error.URLError(e)
+                )
 
-                # Exponential back-off
-                time.sleep(2**retry + random.uniform(0.001, 1))  # nosec B311
+            downloaded_bytes += received_bytes
+            if received_bytes > 0:
+                failed_attempts = 0
+            else:
+                failed_attempts += 1
+                if failed_attempts == 3:
+                    raise url_error
 
-        else:
-            raise url_error
+            logger.debug("Download of %s interrupted: %s", url, url_error)
+
+            # Exponential back-off
+            time.sleep(2**failed_attempts + random.uniform(0.001, 1))  # nosec B311
+
+        if last_modified is not None:
+            try:
+                mtime = email.utils.parsedate_to_datetime(last_modified).timestamp()
+                os.utime(path, (mtime, mtime))
+            except (TypeError, ValueError) as e:
+                logger.debug("Invalid Last-Modified time %s: %s", last_modified, e)
+
+        elapsed_time = time.monotonic() - start_time
+        logger.info(
+            "Downloaded %.1f MiB in %.1f seconds (%.1f MiB/s)",
+            downloaded_bytes / 2**20,
+            elapsed_time,
+            downloaded_bytes / 2**20 / max(elapsed_time, 1e-6),
+        )
 
-    def _run_command_in_sandbox(self, *, cmd):
+    def _download_miniforge_installer(self, *, installer_path):
         """
-        Wrap the sandbox command runner to use class specific log_dispatcher.
+        Download the Miniforge installer to `installer_path`.
 
-        Wraps calls to `self.sandbox.run_command_in_container` to use
-        self.log_dispatcher for log handling instead of the sandbox's log
-        dispatcher.
+        The local installer is used, if any. Otherwise, the installer is
+        served from the installer cache, if possible, or downloaded, verified,
+        and added to the cache.
+
+        Parameters
+        ----------
+        installer_path : pathlib.Path
+            The path to download the conda installer to.
+
+        Raises
+        ------
+        RuntimeError
+            If the container sandbox architecture is unknown or if the
+            downloaded installer does not match its published SHA256 digest.
+        urllib.error.URLError
+            If three attempts at downloading the installer all fail.
+        """
+        architecture = self.sandbox.architecture
+        if architecture is None:
+            raise RuntimeError(
+                f"Cotainr's CondaInstall got '{architecture=}' "
+                "which indicates that it is not running in a container sandbox context."
+            )
+
+        if self.local_installer is not None:
+            logger.info("Using local Miniforge installer %s", self.local_installer)
+            shutil.copy2(self.local_installer, installer_path)
+            self._installer_sha256 = util.compute_sha256(path=installer_path)
+            return
+
+        cached_installer = self.fetch_miniforge_installer(
+            architecture=architecture,
+            installer_cache_max_age=self.installer_cache_max_age,
+        )
+        self._installer_sha256 = (
+            cached_installer.with_name(cached_installer.name + ".sha256")
+            .read_text()
+            .split()[0]
+        )
+        try:
+            os.link(cached_installer, installer_path)
+        except OSError:
+            shutil.copy2(cached_installer, installer_path)
+
+    @staticmethod
+    def _read_url(*, url, method="GET"):
+        """
+        Read the content of `url`, retrying on failure.
+
+        Parameters
+        ----------
+        url : str
+            The url to read.
+        method : str, default="GET"
+            The HTTP method to use.
+
+        Returns
+        -------
+        content : bytes
+            The content of the url.
+        final_url : str
+            The url of the content after following any redirects.
+
+        Raises
+        ------
+        urllib.error.URLError
+            If three attempts at reading the url all fail.
+        """
+        request = urllib.request.Request(url, method=method)
+
+        # Make up to 3 attempts at reading the url
+        for retry in range(3):
+            try:
+                with urllib.request.urlopen(request) as response:  # nosec B310
+                    return response.read(), response.geturl()
+
+            except urllib.error.URLError as e:
+                url_error = e
+
+                # Exponential back-off
+                time.sleep(2**retry + random.uniform(0.001, 1))  # nosec B311
+
+        raise url_error
+
+    @staticmethod
+    def _resolve_latest_miniforge_version(*, max_age):
+        """
+        Resolve the version of the latest Miniforge release.
+
+        The resolved version is cached for `max_age` seconds. If the latest
+        release cannot be resolved online, any previously cached version is
+        used.
+
+        Parameters
+        ----------
+        max_age : float
+            The maximum age in seconds of the cached resolution of the latest
+            Miniforge release.
+
+        Returns
+        -------
+        version : str
+            The version of the latest Miniforge release, e.g. "24.11.0-0".
+        """
+        latest_path = util.get_cache_dir() / "miniforge_installers/latest.json"
+        try:
+            latest = json.loads(latest_path.read_text())
+        except (OSError, ValueError):
+            latest = {}
+        if "version" in latest and time.time() - latest.get("resolved", 0) < max_age:
+            return latest["version"]
+
+        try:
+            _, final_url = CondaInstall._read_url(
+                url=f"{_MINIFORGE_RELEASES_URL}/latest", method="HEAD"
+            )
+        except urllib.error.URLError:
+            if "version" not in latest:
+                raise
+            logger.warning(
+                "Unable to check for a new Miniforge release. Using the cached "
+                "release %s",
+                latest["version"],
+            )
+            return latest["version"]
+
+        version = final_url.rstrip("/").rsplit("/", maxsplit=1)[-1]
+        logger.debug("Resolved the latest Miniforge release to %s", version)
+        try:
+            latest_path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                mode="w", dir=latest_path.parent, prefix=".tmp_", delete=False
+            ) as f:
+                json.dump({"version": version, "resolved": time.time()}, f)
+            os.replace(f.name, latest_path)
+        except OSError as e:
+            logger.debug("Unable to cache the latest Miniforge release: %s", e)
+
+        return version
+
+    def _restore_cached_base_prefix(self):
+        """
+        Restore the Conda base environment from the cache, if possible.
+
+        Returns
+        -------
+        restored : bool
+            True if the base environment was restored from the cache.
+        """
+        cached_prefix = self._cached_base_prefix_path
+        if cached_prefix is None:
+            return False
+
+        try:
+            metadata = json.loads(cached_prefix.with_suffix(".json").read_text())
+        except (OSError, ValueError) as e:
+            logger.debug("Conda base environment cache miss: %s", e)
+            return False
+
+        sandbox_prefix = Path(self.sandbox.sandbox_dir) / self.prefix.lstrip("/")
+        try:
+            sandbox_prefix.parent.mkdir(parents=True, exist_ok=True)
+            util.clone_tree(
+                src=cached_prefix, dst=sandbox_prefix, allow_hardlinks=False
+            )
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.warning("Unable to use the cached Conda base environment: %s", e)
+            shutil.rmtree(sandbox_prefix, ignore_errors=True)
+            return False
+
+        logger.info("Using cached Conda base environment %s", cached_prefix)
+        try:
+            # Mark the cached base environment as recently used
+            os.utime(cached_prefix.with_suffix(".json"))
+        except OSError as e:
+            logger.debug("Unable to update the base environment cache: %s", e)
+        self.sandbox.add_to_env(
+            shell_script=f"source {self.prefix + '/etc/profile.d/conda.sh'}"
+        )
+        self._check_conda_bootstrap_integrity()
+        self._base_updated_time = metadata["updated"]
+        self._update_base_if_due()
+
+        return True
+
+    def _run_command_in_sandbox(self, *, cmd, env=None, log_dispatcher=None):
+        """
+        Wrap the sandbox command runner to use class specific log_dispatcher.
+
+        Wraps calls to `self.sandbox.run_command_in_container` to use
+        self.log_dispatcher for log handling instead of the sandbox's log
+        dispatcher.
 
         Parameters
         ----------
         cmd : str
             The command to run in the container sandbox.
+        env : dict, optional
+            Environment variables to set for the command only.
+        log_dispatcher : :class:`~cotainr.tracing.LogDispatcher`, optional
+            The log dispatcher to use instead of the `log_dispatcher`, e.g.
+            when running commands concurrently.
 
         Returns
         -------
@@ -382,8 +1461,279 @@ class CondaInstall:
             Information about the process that ran in the container sandbox.
         """
         return self.sandbox.run_command_in_container(
-            cmd=cmd, custom_log_dispatcher=self.log_dispatcher
+            cmd=cmd,
+            env=env,
+            custom_log_dispatcher=(
+                log_dispatcher if log_dispatcher is not None else self.log_dispatcher
+            ),
+        )
+
+    def _store_env_lock(self, *, name, env_lock_path, log_dispatcher=None):
+        """
+        Store the explicit package list of a Conda environment as its lock.
+
+        Parameters
+        ----------
+        name : str
+            The name of the installed Conda environment.
+        env_lock_path : :class:`pathlib.Path`
+            The path of the lock in the cache.
+        log_dispatcher : :class:`~cotainr.tracing.LogDispatcher`, optional
+            The log dispatcher to use instead of the `log_dispatcher`.
+        """
+        process = self._run_command_in_sandbox(
+            cmd=f"conda list --explicit --md5 -n {name}", log_dispatcher=log_dispatcher
+        )
+        if "@EXPLICIT" not in process.stdout:
+            logger.warning("Unable to lock the Conda environment %s", name)
+            return
+
+        try:
+            env_lock_path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                mode="w", dir=env_lock_path.parent, prefix=".tmp_", delete=False
+            ) as f:
+                f.write(process.stdout)
+            os.replace(f.name, env_lock_path)
+        except OSError as e:
+            logger.warning("Unable to store the Conda environment lock: %s", e)
+        else:
+            logger.debug("Stored the Conda environment lock %s", env_lock_path)
+
+    def _list_base_packages(self):
+        """
+        List the packages in the Conda base environment.
+
+        Returns
+        -------
+        packages : str
+            The explicit package list of the Conda base environment.
+        """
+        return self._run_command_in_sandbox(cmd="conda list --explicit -n base").stdout
+
+    def _update_base_if_due(self):
+        """
+        Update Conda in the base environment according to `update_base`.
+
+        If the base environment was restored from the cache, its packages are
+        compared before and after the update to tell if it must be recached.
+        """
+        base_age = time.time() - self._base_updated_time
+        if self.update_base == "never" or (
+            self.update_base == "stale" and base_age < self.update_base_max_age
+        ):
+            logger.info(
+                "Skipping update of the Conda base environment (%.1f days old)",
+                base_age / (24 * 60 * 60),
+            )
+            return
+
+        packages_before = (
+            None if self._base_prefix_changed else self._list_base_packages()
+        )
+
+        # Update the installed Conda package manager to the latest version
+        self._run_command_in_sandbox(
+            cmd=(
+                "conda update -y -n base -c conda-forge conda"
+                + self._conda_verbosity_arg
+            ),
+            env=self._conda_install_env,
         )
+        self._base_updated_time = time.time()
+        self._base_prefix_checked = True
+        if (
+            packages_before is not None
+            and self._list_base_packages() == packages_before
+        ):
+            logger.debug("The Conda base environment is already up to date")
+        else:
+            self._base_prefix_changed = True
+
+    def _update_pkgs_cache(self, *, env_prefix):
+        """
+        Mark the packages used by a Conda environment and evict old packages.
+
+        The packages installed in the Conda environment are marked as recently
+        used in the package cache by updating their modification times. Then
+        the least recently used packages are evicted until the package cache
+        is no larger than `pkgs_cache_max_size`.
+
+        Parameters
+        ----------
+        env_prefix : str
+            The prefix of the Conda environment in the container.
+        """
+        if self.pkgs_cache_dir is None:
+            return
+
+        # Mark the packages installed in the environment as recently used
+        env_dir = Path(self.sandbox.sandbox_dir) / env_prefix.lstrip("/")
+        for meta_path in (env_dir / "conda-meta").glob("*.json"):
+            try:
+                package_file = json.loads(meta_path.read_text())["fn"]
+            except (OSError, ValueError, KeyError):
+                continue
+            for cache_path in self._pkgs_cache_entries(package_file=package_file):
+                cache_path.touch(exist_ok=True)
+
+        # Collect size and last use of each package in the cache
+        packages = []
+        for entry in self.pkgs_cache_dir.iterdir():
+            if not entry.name.endswith(_CONDA_PACKAGE_SUFFIXES):
+                continue
+            entries = self._pkgs_cache_entries(package_file=entry.name)
+            last_used = max(path.stat().st_mtime for path in entries)
+            size = sum(
+                util.get_tree_usage(path=path)[0]
+                if path.is_dir()
+                else path.stat().st_blocks * 512
+                for path in entries
+            )
+            packages.append((last_used, size, entries))
+
+        # Evict the least recently used packages
+        cache_size = sum(size for _, size, _ in packages)
+        evicted_size = 0
+        for _, size, entries in sorted(packages, key=lambda package: package[0]):
+            if cache_size - evicted_size <= self.pkgs_cache_max_size:
+                break
+            for path in entries:
+                if path.is_dir():
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    path.unlink(missing_ok=True)
+            evicted_size += size
+
+        logger.info(
+            "Conda package cache %s uses %.1f MiB after evicting %.1f MiB",
+            self.pkgs_cache_dir,
+            (cache_size - evicted_size) / 2**20,
+            evicted_size / 2**20,
+        )
+
+    def _install_solver(self):
+        """Install micromamba in the Conda base environment, if it is used."""
+        if self.solver == "micromamba" and not self._micromamba_installed:
+            self._run_command_in_sandbox(
+                cmd=(
+                    "conda install -y -n base -c conda-forge micromamba"
+                    + self._conda_verbosity_arg
+                ),
+                env=self._conda_install_env,
+            )
+            self._micromamba_installed = True
+
+    def _merge_private_pkgs_dir(self, *, name):
+        """
+        Merge the private package folder of a Conda environment.
+
+        The packages downloaded to the private package folder used when adding
+        the Conda environment `name` concurrently with other Conda
+        environments are moved to the package cache, if one is used. The
+        private package folder is then removed.
+
+        Parameters
+        ----------
+        name : str
+            The name of the Conda environment.
+        """
+        private_pkgs_dir = (
+            Path(self.sandbox.sandbox_dir) / self.prefix.lstrip("/") / f"pkgs_{name}"
+        )
+        if not private_pkgs_dir.is_dir():
+            return
+
+        if self.pkgs_cache_dir is not None:
+            for entry in private_pkgs_dir.iterdir():
+                if not entry.name.endswith(_CONDA_PACKAGE_SUFFIXES):
+                    continue
+                package_name = entry.name
+                for suffix in _CONDA_PACKAGE_SUFFIXES:
+                    package_name = package_name.removesuffix(suffix)
+                for path in (entry, private_pkgs_dir / package_name):
+                    if path.exists() and not (self.pkgs_cache_dir / path.name).exists():
+                        shutil.move(path, self.pkgs_cache_dir / path.name)
+        shutil.rmtree(private_pkgs_dir)
+
+    def _mount_channel_mirrors(self):
+        """
+        Mount the channel mirrors configuration in the container sandbox.
+
+        A condarc file, configuring the channel mirrors as Conda
+        `custom_channels`, is created next to the sandbox and mounted in the
+        container sandbox together with any local "file://" channel mirrors.
+        """
+        config_dir = Path(self.sandbox.sandbox_dir).parent / "conda_config"
+        config_dir.mkdir(exist_ok=True)
+        custom_channels = {}
+        for mirror_url in self.channel_mirrors:
+            mirror_base_url, channel = mirror_url.rsplit("/", maxsplit=1)
+            if mirror_url.startswith("file://"):
+                self.sandbox.add_bind_path(
+                    host_path=urllib.parse.urlparse(mirror_url).path,
+                    container_path=f"{_CHANNEL_MIRRORS_MOUNT_POINT}/{channel}",
+                )
+                mirror_base_url = f"file://{_CHANNEL_MIRRORS_MOUNT_POINT}"
+            custom_channels[channel] = mirror_base_url
+
+        # JSON is valid YAML, i.e. a valid condarc
+        (config_dir / "condarc").write_text(
+            json.dumps(
+                {"custom_channels": custom_channels, "notify_outdated_conda": False}
+            )
+        )
+        self.sandbox.add_bind_path(
+            host_path=config_dir, container_path=_CONDA_CONFIG_MOUNT_POINT
+        )
+
+    def _pkgs_cache_entries(self, *, package_file):
+        """
+        Get the existing package cache entries for a Conda package file.
+
+        Parameters
+        ----------
+        package_file : str
+            The file name of the Conda package, e.g. "zlib-1.3-h4ab18f5_0.conda".
+
+        Returns
+        -------
+        entries : list of :class:`pathlib.Path`
+            The package file and its extracted package folder in the package
+            cache, if they exist.
+        """
+        package_name = package_file
+        for suffix in _CONDA_PACKAGE_SUFFIXES:
+            package_name = package_name.removesuffix(suffix)
+
+        return [
+            path
+            for path in (
+                self.pkgs_cache_dir / package_file,
+                self.pkgs_cache_dir / package_name,
+            )
+            if path.exists()
+        ]
+
+    @property
+    def _conda_install_env(self):
+        """
+        Get the environment variables to use when installing Conda packages.
+
+        Returns
+        -------
+        env : dict or None
+            The Conda environment variables pointing the Conda `pkgs_dirs` to
+            the mounted package cache and the Conda configuration to the
+            mounted channel mirrors configuration, or None if neither is used.
+        """
+        env = {}
+        if self.pkgs_cache_dir is not None:
+            env["CONDA_PKGS_DIRS"] = _PKGS_CACHE_MOUNT_POINT
+        if self.channel_mirrors:
+            env["CONDARC"] = f"{_CONDA_CONFIG_MOUNT_POINT}/condarc"
+
+        return env or None
 
     @property
     def _conda_verbosity_arg(self):
@@ -471,6 +1821,32 @@ class CondaInstall:
 
         return logging_filters
 
+    @staticmethod
+    def _map_mamba_log_level(msg):
+        """
+        Attempt to infer log level for a message from mamba or micromamba.
+
+        Mamba and micromamba prefix their log messages by the lower case log
+        level, e.g. "info     libmamba ...". Other messages, e.g. from conda,
+        are mapped using :meth:`_map_log_level`.
+
+        Parameters
+        ----------
+        msg : str
+            The message to infer log level for.
+
+        Returns
+        -------
+        log_level : int
+            One of the standard log levels (DEBUG, INFO, WARNING, ERROR, or
+            CRITICAL).
+        """
+        mamba_log_level_match = _MAMBA_LOG_LEVEL_RE.match(msg)
+        if mamba_log_level_match is not None:
+            return _MAMBA_LOG_LEVELS[mamba_log_level_match.group("level")]
+
+        return CondaInstall._map_log_level(msg)
+
     @staticmethod
     def _map_log_level(msg):
         """
@@ -504,3 +1880,722 @@ class CondaInstall:
         else:
             # If no prefix on message, assume its INFO level
             return logging.INFO
+
+
+class CondaPackImport:
+    """
+    A prebuilt conda-pack environment imported into a container sandbox.
+
+    Extracts a relocatable Conda environment archive created by `conda-pack
+    <https://conda.github.io/conda-pack/>`_ into a prefix in the container
+    sandbox, fixes up the prefixes hardcoded in it, and activates it. This
+    avoids bootstrapping Conda and solving and installing the Conda
+    environment in the container sandbox.
+
+    Parameters
+    ----------
+    sandbox : :class:`~cotainr.container.SingularitySandbox`
+        The sandbox into which the Conda environment should be imported.
+    archive_path : :class:`os.PathLike`
+        The path to the conda-pack archive, e.g. a .tar.gz file.
+    prefix : str, default="/opt/cotainr/conda_env"
+        The prefix in the container at which to extract the Conda environment.
+    max_workers : int, optional
+        The maximum number of threads writing extracted files (the default is
+        None which implies the :class:`ThreadPoolExecutor
+        <concurrent.futures.ThreadPoolExecutor>` default).
+
+    Attributes
+    ----------
+    sandbox : :class:`~cotainr.container.SingularitySandbox`
+        The sandbox into which the Conda environment is imported.
+    archive_path : :class:`pathlib.Path`
+        The path to the conda-pack archive.
+    prefix : str
+        The prefix in the container of the Conda environment.
+    max_workers : int or None
+        The maximum number of threads writing extracted files.
+    space_estimate : tuple of int
+        A rough estimate of the (bytes, inodes) added to a sandbox by the
+        Conda environment.
+
+    Notes
+    -----
+    The archive is streamed, i.e. it is decompressed and extracted in a single
+    pass, with the decompression done by `pigz` (for gzip) or `zstd` (for
+    zstandard) running in parallel with the extraction, if available, and the
+    extracted files written by a pool of threads.
+    """
+
+    def __init__(
+        self,
+        *,
+        sandbox,
+        archive_path,
+        prefix="/opt/cotainr/conda_env",
+        max_workers=None,
+    ):
+        """Set up the import of a conda-pack archive."""
+        self.sandbox = sandbox
+        self.archive_path = Path(archive_path).resolve()
+        if not self.archive_path.is_file():
+            raise FileNotFoundError(
+                f"The conda-pack archive '{self.archive_path}' does not exist."
+            )
+        self.prefix = prefix
+        self.max_workers = max_workers
+        self.space_estimate = self.estimate_space(archive_path=self.archive_path)
+
+    @staticmethod
+    def estimate_space(*, archive_path):
+        """
+        Estimate the space needed to extract a conda-pack archive.
+
+        Parameters
+        ----------
+        archive_path : :class:`os.PathLike`
+            The path to the conda-pack archive.
+
+        Returns
+        -------
+        space_estimate : tuple of int
+            A rough estimate of the (bytes, inodes) needed to extract the
+            archive, assuming a compression ratio of 4 and an average file
+            size of 32 KiB.
+        """
+        archive_size = Path(archive_path).stat().st_size
+        return (4 * archive_size, 4 * archive_size // 2**15)
+
+    def import_environment(self):
+        """
+        Import the Conda environment into the container sandbox.
+
+        Extracts the archive into the prefix in the container sandbox,
+        preserving the modification times of its members, runs the
+        "conda-unpack" script included in the archive to fix up the
+        prefixes hardcoded in the Conda environment, and activates the Conda
+        environment in the container.
+
+        Raises
+        ------
+        ValueError
+            If the archive is not a conda-pack archive or if an archive member
+            would be extracted outside of the prefix.
+        """
+        prefix_dir = self.sandbox.sandbox_dir / self.prefix.lstrip("/")
+        prefix_dir.mkdir(parents=True, exist_ok=True)
+        t_start = time.time()
+        self._extract_archive(prefix_dir=prefix_dir)
+        logger.debug(
+            "Extracted %s in %.1f seconds", self.archive_path, time.time() - t_start
+        )
+        if not (prefix_dir / "bin/conda-unpack").is_file():
+            raise ValueError(
+                f"The archive '{self.archive_path}' does not seem to be created by "
+                "conda-pack. It contains no bin/conda-unpack script."
+            )
+
+        # Run conda-unpack using the Python of the Conda environment, as its
+        # shebang may refer to another Python, e.g. the first one on the PATH
+        self.sandbox.run_command_in_container(
+            cmd=f"{self.prefix}/bin/python {self.prefix}/bin/conda-unpack"
+        )
+        self.sandbox.add_to_env(
+            shell_script=(
+                f"export CONDA_PREFIX={self.prefix}\n"
+                f'export PATH="{self.prefix}/bin:$PATH"\n'
+                f"for script in {self.prefix}/etc/conda/activate.d/*.sh; do\n"
+                '    [ -f "$script" ] && . "$script"\n'
+                "done"
+            )
+        )
+        self.sandbox.record_usage(stage="conda_pack_import")
+
+    @contextlib.contextmanager
+    def _decompressed_stream(self):
+        """
+        Open the archive as a stream of tar data.
+
+        The archive is decompressed by an external, parallel decompressor if
+        one is available for its compression. Otherwise, the decompression is
+        left to :mod:`tarfile`.
+
+        Yields
+        ------
+        stream : file object
+            The stream of tar data.
+        mode : str
+            The :func:`tarfile.open` stream mode to use for the stream.
+        """
+        decompressor = _CONDA_PACK_DECOMPRESSORS.get(self.archive_path.suffix)
+        if decompressor is None or shutil.which(decompressor[0]) is None:
+            with self.archive_path.open("rb") as stream:
+                yield stream, "r|*"
+            return
+
+        logger.debug("Decompressing %s using %s", self.archive_path, decompressor[0])
+        with subprocess.Popen(
+            [*decompressor, str(self.archive_path)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        ) as process:
+            try:
+                yield process.stdout, "r|"
+            except BaseException:
+                process.kill()
+                raise
+
+            # Drain any trailing data before waiting for the decompressor
+            while process.stdout.read(2**20):
+                pass
+            stderr = process.stderr.read()
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(
+                process.returncode, process.args, stderr=stderr
+            )
+
+    def _extract_archive(self, *, prefix_dir):
+        """
+        Extract the archive into `prefix_dir`.
+
+        The archive is read sequentially while regular files are written by a
+        pool of threads. Files larger than _CONDA_PACK_MAX_BUFFERED_SIZE are
+        written directly to bound the memory used for buffering file content.
+        Hardlinks are created once all regular files have been written. The
+        modes and modification times of directories are set last, such that
+        they are not changed by writing their content. Existing paths are
+        replaced rather than written through, such that a symlink in the
+        archive cannot redirect a later member outside of `prefix_dir`.
+
+        Parameters
+        ----------
+        prefix_dir : :class:`pathlib.Path`
+            The directory into which the archive is extracted.
+
+        Raises
+        ------
+        ValueError
+            If an archive member would be extracted, or hardlinked to a file,
+            outside of `prefix_dir`.
+        """
+        prefix_dir = prefix_dir.resolve()
+        hardlinks = []
+        directories = []
+        max_pending = 4 * (self.max_workers or os.cpu_count() or 1)
+        pending = set()
+        with contextlib.ExitStack() as stack:
+            stream, mode = stack.enter_context(self._decompressed_stream())
+            archive = stack.enter_context(tarfile.open(fileobj=stream, mode=mode))
+            executor = stack.enter_context(
+                ThreadPoolExecutor(max_workers=self.max_workers)
+            )
+            for member in archive:
+                target = self._get_member_target(
+                    name=member.name, prefix_dir=prefix_dir
+                )
+                if member.isdir():
+                    if target.is_symlink():
+                        target.unlink()
+                    target.mkdir(parents=True, exist_ok=True)
+                    directories.append((target, member.mode, member.mtime))
+                elif member.issym():
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    target.unlink(missing_ok=True)
+                    target.symlink_to(member.linkname)
+                    os.utime(
+                        target, (member.mtime, member.mtime), follow_symlinks=False
+                    )
+                elif member.islnk():
+                    hardlinks.append((member.name, member.linkname))
+                elif member.isfile():
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    file_obj = archive.extractfile(member)
+                    if member.size > _CONDA_PACK_MAX_BUFFERED_SIZE:
+                        with self._open_member_target(path=target) as f:
+                            shutil.copyfileobj(file_obj, f, length=2**20)
+                            f.flush()
+                            os.fchmod(f.fileno(), member.mode)
+                            os.utime(f.fileno(), (member.mtime, member.mtime))
+                        continue
+
+                    pending.add(
+                        executor.submit(
+                            self._write_member,
+                            path=target,
+                            content=file_obj.read(),
+                            mode=member.mode,
+                            mtime=member.mtime,
+                        )
+                    )
+                    if len(pending) >= max_pending:
+                        done, pending = concurrent.futures.wait(
+                            pending, return_when=concurrent.futures.FIRST_COMPLETED
+                        )
+                        for future in done:
+                            future.result()
+                else:
+                    logger.debug("Skipping special file %s in archive", member.name)
+
+            for future in concurrent.futures.as_completed(pending):
+                future.result()
+
+        for name, linkname in hardlinks:
+            # Symlinks extracted after the hardlink member may have changed
+            # where both paths resolve to
+            target = self._get_member_target(name=name, prefix_dir=prefix_dir)
+            source = self._get_member_target(name=linkname, prefix_dir=prefix_dir)
+            if not source.resolve().is_relative_to(prefix_dir):
+                raise ValueError(
+                    f"The archive member '{name}' links to '{linkname}' outside "
+                    "of the Conda environment prefix."
+                )
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.unlink(missing_ok=True)
+            os.link(source, target, follow_symlinks=False)
+
+        for directory, mode, mtime in reversed(directories):
+            fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW)
+            try:
+                os.fchmod(fd, mode | 0o700)
+                os.utime(fd, (mtime, mtime))
+            finally:
+                os.close(fd)
+
+    @staticmethod
+    def _get_member_target(*, name, prefix_dir):
+        """
+        Get the path to which an archive member is extracted.
+
+        Parameters
+        ----------
+        name : str
+            The name of the archive member.
+        prefix_dir : :class:`pathlib.Path`
+            The resolved directory into which the archive is extracted.
+
+        Returns
+        -------
+        target : :class:`pathlib.Path`
+            The path to which the archive member is extracted.
+
+        Raises
+        ------
+        ValueError
+            If the archive member would be extracted outside of `prefix_dir`.
+        """
+        target = prefix_dir / name
+        if (
+            Path(name).is_absolute()
+            or ".." in Path(name).parts
+            or not target.parent.resolve().is_relative_to(prefix_dir)
+        ):
+            raise ValueError(
+                f"The archive member '{name}' would be extracted outside of "
+                "the Conda environment prefix."
+            )
+
+        return target
+
+    @staticmethod
+    def _open_member_target(*, path):
+        """
+        Open a new file at `path` for writing an archive member.
+
+        Any existing file or symlink at `path` is removed first, and the file
+        is created exclusively, such that the content is never written through
+        a symlink or into an existing hardlink.
+
+        Parameters
+        ----------
+        path : :class:`pathlib.Path`
+            The path to which the archive member is extracted.
+
+        Returns
+        -------
+        file : file object
+            The binary file object opened for writing.
+        """
+        path.unlink(missing_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600)
+        return os.fdopen(fd, "wb")
+
+    @staticmethod
+    def _write_member(*, path, content, mode, mtime):
+        """Write the `content` of an archive member to `path` with `mode`."""
+        with CondaPackImport._open_member_target(path=path) as f:
+            f.write(content)
+            f.flush()
+            os.fchmod(f.fileno(), mode)
+            os.utime(f.fileno(), (mtime, mtime))
+
+
+def compile_bytecode(*, sandbox, env_prefix, invalidation_mode="unchecked-hash"):
+    """
+    Compile the Python modules in a Conda environment to bytecode.
+
+    The container image is read-only at runtime, so Python cannot write
+    bytecode for modules that are not compiled when the image is built. Such
+    modules are compiled on every import instead. Thus, all modules in the
+    site-packages of the Conda environment are compiled, in parallel, using
+    the Python interpreter of the Conda environment in the container sandbox.
+    Modules that fail to compile, e.g. templates with invalid syntax, are
+    reported and skipped. With the hash based invalidation modes, existing
+    bytecode, e.g. timestamp based bytecode written when installing packages,
+    is recompiled.
+
+    Parameters
+    ----------
+    sandbox : :class:`~cotainr.container.SingularitySandbox`
+        The sandbox containing the Conda environment.
+    env_prefix : str
+        The prefix in the container of the Conda environment.
+    invalidation_mode : {"timestamp", "checked-hash", "unchecked-hash"}, default="unchecked-hash"
+        How Python checks if the bytecode is up to date with the source: by
+        the source timestamp, by the source hash, or not at all. Since the
+        container image is read-only, the bytecode cannot become outdated and
+        "unchecked-hash" avoids reading the source on import.
+
+    Returns
+    -------
+    modules_compiled : int
+        The number of modules compiled.
+
+    Raises
+    ------
+    ValueError
+        If `invalidation_mode` is not a valid invalidation mode.
+    """
+    if invalidation_mode not in _INVALIDATION_MODES:
+        raise ValueError(
+            f"Invalid {invalidation_mode=}. "
+            f"Must be one of {', '.join(_INVALIDATION_MODES)}."
+        )
+
+    env_dir = sandbox.sandbox_dir / env_prefix.lstrip("/")
+    site_packages_dirs = sorted(env_dir.glob("lib/python*/site-packages"))
+    if not site_packages_dirs:
+        logger.warning("No site-packages found in %s to compile", env_prefix)
+        return 0
+
+    def bytecode_files():
+        # The (path, mtime) of all bytecode files in the site-packages
+        return {
+            (pyc_path, pyc_path.stat().st_mtime_ns)
+            for site_packages_dir in site_packages_dirs
+            for pyc_path in site_packages_dir.glob("**/__pycache__/*.pyc")
+        }
+
+    existing_bytecode_files = bytecode_files()
+    t_start = time.monotonic()
+    sandbox.run_command_in_container(
+        cmd=shlex.join(
+            [
+                f"{env_prefix}/bin/python",
+                "-c",
+                _COMPILE_BYTECODE_SCRIPT,
+                invalidation_mode,
+                *(
+                    f"/{path.relative_to(sandbox.sandbox_dir)}"
+                    for path in site_packages_dirs
+                ),
+            ]
+        )
+    )
+    modules_compiled = len(bytecode_files() - existing_bytecode_files)
+    logger.info(
+        "Compiled %d Python modules in %s to bytecode (in %.1f s)",
+        modules_compiled,
+        env_prefix,
+        time.monotonic() - t_start,
+    )
+    sandbox.record_usage(stage=f"bytecode_compilation[{env_prefix}]")
+
+    return modules_compiled
+
+
+def slim_prefix(*, path, profile="conservative", keep=(), remove=(), max_workers=None):
+    """
+    Remove files not needed at runtime from the Conda prefix `path`.
+
+    The files removed are given by the slimming `profile`, grouped in
+    categories. The "conservative" profile removes static libraries and
+    documentation. The "aggressive" profile additionally removes headers,
+    test suites, and Python bytecode caches, and strips debug symbols from
+    shared libraries and executables using `strip`, if available.
+
+    Parameters
+    ----------
+    path : :class:`os.PathLike`
+        The path to the Conda prefix on the host.
+    profile : {"conservative", "aggressive"}, default="conservative"
+        The slimming profile to use.
+    keep : iterable of str, optional
+        Glob patterns of files to never remove, e.g. "include/python*/*".
+    remove : iterable of str, optional
+        Glob patterns of additional files to remove, reported in the "custom"
+        category.
+    max_workers : int, optional
+        The maximum number of threads used for stripping debug symbols (the
+        default is None which implies the :class:`ThreadPoolExecutor
+        <concurrent.futures.ThreadPoolExecutor>` default).
+
+    Returns
+    -------
+    savings : dict
+        The number of bytes saved in each category of the profile.
+
+    Raises
+    ------
+    ValueError
+        If `profile` is not a valid slimming profile.
+
+    Notes
+    -----
+    The glob patterns are matched against the paths relative to `path` using
+    :func:`fnmatch.fnmatch`, i.e. "*" also matches "/".
+    """
+    if profile not in _SLIM_PROFILES:
+        raise ValueError(
+            f"Invalid {profile=}. Must be one of {', '.join(_SLIM_PROFILES)}."
+        )
+
+    path = Path(path)
+    categories = dict(_SLIM_PROFILES[profile])
+    if remove:
+        categories["custom"] = list(remove)
+    savings = dict.fromkeys(categories, 0)
+    strip_candidates = []
+    slimmed_dirs = set()
+    for dir_path, dir_names, file_names in os.walk(path):
+        # Symlinks to directories are not followed, but may be removed
+        for file_name in file_names + [
+            dir_name
+            for dir_name in dir_names
+            if os.path.islink(os.path.join(dir_path, dir_name))
+        ]:
+            file_path = os.path.join(dir_path, file_name)
+            rel_path = os.path.relpath(file_path, path)
+            if any(fnmatch.fnmatch(rel_path, pattern) for pattern in keep):
+                continue
+
+            category = next(
+                (
+                    category
+                    for category, patterns in categories.items()
+                    if any(fnmatch.fnmatch(rel_path, pattern) for pattern in patterns)
+                ),
+                None,
+            )
+            file_stat = os.lstat(file_path)
+            if category is not None:
+                os.unlink(file_path)
+                slimmed_dirs.add(dir_path)
+                if stat.S_ISREG(file_stat.st_mode) and file_stat.st_nlink == 1:
+                    savings[category] += file_stat.st_size
+            elif (
+                "debug_symbols" in categories
+                and stat.S_ISREG(file_stat.st_mode)
+                and file_stat.st_nlink == 1
+            ):
+                strip_candidates.append(file_path)
+
+    # Remove the directories emptied by the slimming, deepest first such that
+    # parents emptied by removing them are also removed
+    for dir_path in sorted(slimmed_dirs, key=len, reverse=True):
+        while (
+            dir_path != str(path)
+            and os.path.isdir(dir_path)
+            and not os.listdir(dir_path)
+        ):
+            os.rmdir(dir_path)
+            dir_path = os.path.dirname(dir_path)
+
+    if "debug_symbols" in categories:
+        savings["debug_symbols"] = _strip_debug_symbols(
+            paths=strip_candidates, max_workers=max_workers
+        )
+
+    return savings
+
+
+def solve_environment_on_host(*, path, architecture):
+    """
+    Solve a Conda environment on the host without installing it.
+
+    The Conda environment is solved for the Linux platform of the container
+    architecture using a dry run of conda on the host. As no container
+    sandbox is needed, it may be done while the container sandbox is being
+    created, to find an unsolvable Conda environment before installing Conda
+    in the container sandbox.
+
+    Parameters
+    ----------
+    path : :class:`os.PathLike`
+        The path to the Conda environment file.
+    architecture : str
+        The container architecture as returned by "uname -m".
+
+    Raises
+    ------
+    FileNotFoundError
+        If conda is not available on the host.
+    RuntimeError
+        If the Conda environment cannot be solved.
+    ValueError
+        If the architecture is not supported.
+
+    Notes
+    -----
+    The host conda is used with its own configuration, e.g. its channel
+    priority, which may differ from that of the conda used in the container.
+    """
+    if architecture not in _CONDA_SUBDIRS:
+        raise ValueError(
+            f"Unable to solve Conda environments for {architecture=}. "
+            f"Must be one of {', '.join(_CONDA_SUBDIRS)}."
+        )
+    conda_exe = os.environ.get("CONDA_EXE") or shutil.which("conda")
+    if conda_exe is None:
+        raise FileNotFoundError(
+            "conda must be available on the host to solve a Conda environment "
+            "on the host."
+        )
+
+    t_start = time.monotonic()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        process = subprocess.run(
+            [
+                conda_exe,
+                "env",
+                "create",
+                "--dry-run",
+                "--json",
+                "--file",
+                str(path),
+                "--prefix",
+                str(Path(tmp_dir) / "conda_env"),
+            ],
+            capture_output=True,
+            text=True,
+            env={**os.environ, "CONDA_SUBDIR": _CONDA_SUBDIRS[architecture]},
+        )
+    if process.returncode != 0:
+        try:
+            message = json.loads(process.stdout)["message"]
+        except (ValueError, KeyError, TypeError):
+            message = process.stderr.strip()
+        raise RuntimeError(
+            f"Unable to solve the Conda environment {path} on the host: {message}"
+        )
+
+    logger.info(
+        "Solved Conda environment %s on the host (in %.1f s)",
+        path,
+        time.monotonic() - t_start,
+    )
+
+
+def _channel_mirror_url(*, mirror):
+    """
+    Normalize a Conda channel mirror to a url without a trailing slash.
+
+    Parameters
+    ----------
+    mirror : str
+        The url or local path of the Conda channel mirror.
+
+    Returns
+    -------
+    mirror_url : str
+        The url of the Conda channel mirror, i.e. a "file://" url for a local
+        path.
+    """
+    if "://" not in mirror:
+        return Path(mirror).resolve().as_uri()
+
+    return mirror.rstrip("/")
+
+
+def _read_env_channels(*, path):
+    """
+    Read the channels listed in a Conda environment file.
+
+    Parameters
+    ----------
+    path : :class:`os.PathLike`
+        The path to the Conda environment file.
+
+    Returns
+    -------
+    channels : list of str
+        The channels listed in the Conda environment file, or the default
+        "conda-forge" channel of Miniforge if no channels are listed.
+
+    Notes
+    -----
+    Only the block style list and the flow style list (on a single line) of
+    channels are supported, which covers Conda environment files exported by
+    `conda env export`.
+    """
+    channels = []
+    in_channels = False
+    for line in Path(path).read_text().splitlines():
+        flow_channels = re.match(r"^channels:\s*\[(?P<channels>.*)\]", line)
+        if flow_channels is not None:
+            channels.extend(
+                channel.strip().strip("'\"")
+                for channel in flow_channels.group("channels").split(",")
+                if channel.strip()
+            )
+        elif re.match(r"^channels:\s*$", line):
+            in_channels = True
+        elif in_channels:
+            channel = re.match(r"^\s*-\s*(?P<channel>\S+)", line)
+            if channel is not None:
+                channels.append(channel.group("channel").strip("'\""))
+            elif line.strip() and not line.lstrip().startswith("#"):
+                in_channels = False
+
+    return channels or ["conda-forge"]
+
+
+def _strip_debug_symbols(*, paths, max_workers=None):
+    """
+    Strip debug symbols from the ELF files among `paths`.
+
+    Parameters
+    ----------
+    paths : list of str
+        The paths to the candidate files.
+    max_workers : int, optional
+        The maximum number of threads used for stripping files.
+
+    Returns
+    -------
+    bytes_saved : int
+        The number of bytes saved by stripping debug symbols.
+    """
+    strip = shutil.which("strip")
+    if strip is None:
+        logger.warning("Unable to strip debug symbols as strip is not available")
+        return 0
+
+    def strip_file(file_path):
+        try:
+            with open(file_path, "rb") as f:
+                if f.read(4) != b"\x7fELF":
+                    return 0
+            size = os.stat(file_path).st_size
+            subprocess.run(
+                [strip, "--strip-debug", file_path],
+                check=True,
+                capture_output=True,
+            )
+            return size - os.stat(file_path).st_size
+        except (OSError, subprocess.CalledProcessError) as e:
+            # E.g. unreadable files or files for a foreign architecture
+            logger.debug("Unable to strip debug symbols from %s: %s", file_path, e)
+            return 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return sum(executor.map(strip_file, paths))
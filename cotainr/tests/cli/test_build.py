@@ -8,13 +8,20 @@ Licensed under the European Union Public License (EUPL) 1.2
 """
 
 import argparse
+import io
+import json
+import logging
 from pathlib import Path
+import platform
 import re
 import shlex
+import tarfile
 
 import pytest
 
 from cotainr.cli import Build, CotainrCLI
+import cotainr.pack
+import cotainr.util
 
 from ..container.patches import (
     patch_disable_add_metadata,
@@ -43,6 +50,73 @@ class TestConstructor:
         assert exc_msg.endswith("' does not exist.")
         assert conda_env in exc_msg
 
+    def test_specifying_conda_extra_env(self):
+        Path("some_conda_env_6021.yml").touch()
+        Path("tools_6021.yml").touch()
+        build = Build(
+            image_path="some_image_path_6021",
+            base_image="some_base_image_6021",
+            conda_env="some_conda_env_6021.yml",
+            conda_extra_env=["tools_6021=tools_6021.yml"],
+        )
+        assert build.conda_extra_envs == {
+            "tools_6021": Path("tools_6021.yml").resolve()
+        }
+
+    @pytest.mark.parametrize(
+        "conda_extra_env,error_msg",
+        [
+            (["tools_6021.yml"], "^Invalid Conda extra env 'tools_6021.yml'"),
+            (["tools 6021=tools_6021.yml"], "^Invalid Conda extra env"),
+            (["base=tools_6021.yml"], "^The Conda env name 'base' is already in use"),
+            (
+                ["tools=tools_6021.yml", "tools=tools_6021.yml"],
+                "^The Conda env name 'tools' is already in use",
+            ),
+        ],
+    )
+    def test_invalid_conda_extra_env(self, conda_extra_env, error_msg):
+        Path("some_conda_env_6021.yml").touch()
+        Path("tools_6021.yml").touch()
+        with pytest.raises(ValueError, match=error_msg):
+            Build(
+                image_path="some_image_path_6021",
+                base_image="some_base_image_6021",
+                conda_env="some_conda_env_6021.yml",
+                conda_extra_env=conda_extra_env,
+            )
+
+    def test_conda_extra_env_without_conda_env(self):
+        Path("tools_6021.yml").touch()
+        with pytest.raises(ValueError, match="^Extra Conda environments can only be"):
+            Build(
+                image_path="some_image_path_6021",
+                base_image="some_base_image_6021",
+                conda_extra_env=["tools=tools_6021.yml"],
+            )
+
+    def test_nonexisting_conda_pack(self):
+        with pytest.raises(
+            FileNotFoundError,
+            match="^The provided conda-pack archive '.*some_env_6021.tar.gz' does not",
+        ):
+            Build(
+                image_path="some_image_path_6021",
+                base_image="some_base_image_6021",
+                conda_pack="some_env_6021.tar.gz",
+            )
+
+    def test_both_conda_env_and_conda_pack(self):
+        Path("some_conda_env_6021").touch()
+        Path("some_env_6021.tar.gz").touch()
+        with pytest.raises(ValueError, match="^Only one of a Conda env file and"):
+            Build(
+                image_path="some_image_path_6021",
+                base_image="some_base_image_6021",
+                conda_env="some_conda_env_6021",
+                conda_pack="some_env_6021.tar.gz",
+            )
+
     @pytest.mark.parametrize(
         "base_image,system",
         [("some_base_image_6021", None), (None, "some_system_6021")],
@@ -133,6 +207,153 @@ class TestConstructor:
             answer in stdout for answer in answer_sequence[:-1]
         )
 
+    def test_no_fingerprint_for_mutable_base_image(self):
+        build = Build(
+            image_path="some_image_path_6021", base_image="docker://ubuntu:latest"
+        )
+        assert build.fingerprint is None
+
+    def test_fingerprint(self):
+        base_image = Path("some_base_image_6021.sif")
+        base_image.write_bytes(b"some base image 6021")
+        conda_env = Path("some_conda_env_6021.yml")
+        conda_env.write_text("some conda env 6021")
+        build = Build(
+            image_path="some_image_path_6021",
+            base_image=base_image,
+            conda_env=conda_env,
+        )
+        assert build.fingerprint.startswith("sha256:")
+
+        # Same inputs, same fingerprint
+        assert (
+            Build(
+                image_path="some_image_path_6021",
+                base_image=base_image,
+                conda_env=conda_env,
+            ).fingerprint
+            == build.fingerprint
+        )
+
+        # Changed inputs, new fingerprint
+        conda_env.write_text("some other conda env 6021")
+        assert (
+            Build(
+                image_path="some_image_path_6021",
+                base_image=base_image,
+                conda_env=conda_env,
+            ).fingerprint
+            != build.fingerprint
+        )
+        assert (
+            Build(
+                image_path="some_image_path_6021",
+                base_image=base_image,
+                sif_compression="zstd",
+            ).fingerprint
+            != Build(
+                image_path="some_image_path_6021", base_image=base_image
+            ).fingerprint
+        )
+
+    @pytest.mark.parametrize(
+        "build_option",
+        [
+            {"conda_update_base": "never"},
+            {"conda_update_base": "stale", "conda_update_base_max_age": 1},
+        ],
+    )
+    def test_fingerprint_build_options(self, build_option):
+        base_image = Path("some_base_image_6021.sif")
+        base_image.write_bytes(b"some base image 6021")
+        conda_env = Path("some_conda_env_6021.yml")
+        conda_env.write_text("some conda env 6021")
+        default_build = Build(
+            image_path="some_image_path_6021",
+            base_image=base_image,
+            conda_env=conda_env,
+        )
+        build = Build(
+            image_path="some_image_path_6021",
+            base_image=base_image,
+            conda_env=conda_env,
+            **build_option,
+        )
+        assert build.fingerprint != default_build.fingerprint
+
+    def test_fingerprint_local_conda_artifacts(self):
+        base_image = Path("some_base_image_6021.sif")
+        base_image.write_bytes(b"some base image 6021")
+        conda_env = Path("some_conda_env_6021.yml")
+        conda_env.write_text("some conda env 6021")
+        conda_installer = Path("Miniforge3-6021.sh")
+        conda_installer.write_text("some installer 6021")
+        (Path("mirrors_6021/conda-forge/noarch")).mkdir(parents=True)
+        Path("mirrors_6021/conda-forge/noarch/repodata.json").write_text("{}")
+
+        def fingerprint(**kwargs):
+            return Build(
+                image_path="some_image_path_6021",
+                base_image=base_image,
+                conda_env=conda_env,
+                **kwargs,
+            ).fingerprint
+
+        installer_fingerprint = fingerprint(conda_installer=conda_installer)
+        assert installer_fingerprint != fingerprint()
+        conda_installer.write_text("some other installer 6021")
+        assert fingerprint(conda_installer=conda_installer) != installer_fingerprint
+
+        # Mirrors are normalized before being fingerprinted
+        mirror_fingerprint = fingerprint(
+            conda_channel_mirror=["mirrors_6021/conda-forge"]
+        )
+        assert mirror_fingerprint != fingerprint()
+        assert (
+            fingerprint(
+                conda_channel_mirror=[
+                    f"{Path('mirrors_6021/conda-forge').resolve().as_uri()}/"
+                ]
+            )
+            == mirror_fingerprint
+        )
+
+    @pytest.mark.parametrize("force_rebuild", [False, True])
+    def test_already_existing_up_to_date_image(
+        self, force_rebuild, factory_mock_input, monkeypatch
+    ):
+        monkeypatch.setattr("builtins.input", factory_mock_input("yes"))
+        image_path = Path("some_image_path_6021")
+        image_path.touch()
+        base_image = Path("some_base_image_6021.sif")
+        base_image.write_bytes(b"some base image 6021")
+        fingerprint = Build(
+            image_path="another_image_path_6021", base_image=base_image
+        ).fingerprint
+        monkeypatch.setattr(
+            "cotainr.container.get_image_labels",
+            lambda *, path: {"cotainr.fingerprint": fingerprint},
+        )
+        build = Build(
+            image_path=image_path, base_image=base_image, force_rebuild=force_rebuild
+        )
+        assert build.image_up_to_date != force_rebuild
+
+    def test_already_existing_outdated_image(
+        self, factory_mock_input, monkeypatch, capsys
+    ):
+        monkeypatch.setattr("builtins.input", factory_mock_input("no"))
+        image_path = Path("some_image_path_6021")
+        image_path.touch()
+        base_image = Path("some_base_image_6021.sif")
+        base_image.write_bytes(b"some base image 6021")
+        monkeypatch.setattr(
+            "cotainr.container.get_image_labels",
+            lambda *, path: {"cotainr.fingerprint": "sha256:outdated_6021"},
+        )
+        with pytest.raises(SystemExit):
+            Build(image_path=image_path, base_image=base_image)
+
     def test_specifying_accept_licenses(self):
         # See also the matching TestAddArguments test below
         image_path = "some_image_path_6021"
@@ -142,6 +363,220 @@ class TestConstructor:
         )
         assert build.accept_licenses
 
+    def test_specifying_no_base_image_cache(self):
+        # See also the matching TestAddArguments test below
+        image_path = "some_image_path_6021"
+        base_image = "some_base_image_6021"
+        build = Build(
+            image_path=image_path, base_image=base_image, no_base_image_cache=True
+        )
+        assert build.no_base_image_cache
+
+    def test_pip_requirements_without_conda_env(self):
+        Path("requirements_6021.txt").touch()
+        with pytest.raises(ValueError, match="^Pip requirements can only be installed"):
+            Build(
+                image_path="some_image_path_6021",
+                base_image="some_base_image_6021",
+                pip_requirements="requirements_6021.txt",
+            )
+
+    def test_nonexisting_pip_requirements(self):
+        Path("some_conda_env_6021.yml").touch()
+        with pytest.raises(
+            FileNotFoundError,
+            match="^The provided pip requirements file '.*requirements_6021.txt' does",
+        ):
+            Build(
+                image_path="some_image_path_6021",
+                base_image="some_base_image_6021",
+                conda_env="some_conda_env_6021.yml",
+                pip_requirements="requirements_6021.txt",
+            )
+
+    def test_invalid_slim_profile(self):
+        with pytest.raises(ValueError, match="^Invalid slim='minimal'"):
+            Build(
+                image_path="some_image_path_6021",
+                base_image="some_base_image_6021",
+                slim="minimal",
+            )
+
+    def test_invalid_compile_bytecode(self):
+        with pytest.raises(ValueError, match="^Invalid compile_bytecode='never'"):
+            Build(
+                image_path="some_image_path_6021",
+                base_image="some_base_image_6021",
+                compile_bytecode="never",
+            )
+
+    def test_offline_base_image_not_available(self):
+        # See also the matching TestAddArguments test below
+        with pytest.raises(
+            FileNotFoundError,
+            match="^The base image 'docker://some_base_image_6021' is not available",
+        ):
+            Build(
+                image_path="some_image_path_6021",
+                base_image="docker://some_base_image_6021",
+                offline=True,
+            )
+
+    def test_offline_conda_env_without_local_artifacts(self):
+        Path("my_conda_env_6021.yml").touch()
+        Path("my_base_image_6021.sif").touch()
+        with pytest.raises(ValueError, match="^A local Miniforge installer must be"):
+            Build(
+                image_path="some_image_path_6021",
+                base_image="my_base_image_6021.sif",
+                conda_env="my_conda_env_6021.yml",
+                offline=True,
+            )
+
+    def test_offline_with_local_artifacts(self):
+        Path("my_base_image_6021.sif").touch()
+        Path("Miniforge3-6021.sh").touch()
+        (Path("conda-forge") / "noarch").mkdir(parents=True)
+        Path("conda-forge/noarch/repodata.json").write_text("{}")
+        Path("my_conda_env_6021.yml").write_text(
+            "channels:\n  - conda-forge\ndependencies:\n  - python\n"
+        )
+        build = Build(
+            image_path="some_image_path_6021",
+            base_image="my_base_image_6021.sif",
+            conda_env="my_conda_env_6021.yml",
+            conda_installer="Miniforge3-6021.sh",
+            conda_channel_mirror=["conda-forge"],
+            offline=True,
+        )
+        assert build.offline
+        assert build.conda_installer == Path("Miniforge3-6021.sh").resolve()
+        assert build.conda_channel_mirrors == ["conda-forge"]
+
+    def test_conda_host_dry_run_without_conda_env(self):
+        with pytest.raises(ValueError, match="^A host dry run solve requires a Conda"):
+            Build(
+                image_path="some_image_path_6021",
+                base_image="some_base_image_6021",
+                conda_host_dry_run=True,
+            )
+
+    def test_conda_host_dry_run_without_host_conda(self, monkeypatch):
+        monkeypatch.delenv("CONDA_EXE", raising=False)
+        monkeypatch.setattr("shutil.which", lambda cmd: None)
+        Path("my_conda_env_6021.yml").touch()
+        with pytest.raises(FileNotFoundError, match="^conda must be available"):
+            Build(
+                image_path="some_image_path_6021",
+                base_image="some_base_image_6021",
+                conda_env="my_conda_env_6021.yml",
+                conda_host_dry_run=True,
+            )
+
+    def test_specifying_keep_sandbox(self):
+        # See also the matching TestAddArguments test below
+        build = Build(
+            image_path="some_image_path_6021",
+            base_image="some_base_image_6021",
+            keep_sandbox=True,
+        )
+        assert build.keep_sandbox
+
+    def test_specifying_no_space_check(self):
+        # See also the matching TestAddArguments test below
+        build = Build(
+            image_path="some_image_path_6021",
+            base_image="some_base_image_6021",
+            no_space_check=True,
+        )
+        assert build.no_space_check
+
+    def test_specifying_no_background_cleanup(self):
+        # See also the matching TestAddArguments test below
+        build = Build(
+            image_path="some_image_path_6021",
+            base_image="some_base_image_6021",
+            no_background_cleanup=True,
+        )
+        assert build.no_background_cleanup
+
+    def test_specifying_persistent_session(self):
+        # See also the matching TestAddArguments test below
+        image_path = "some_image_path_6021"
+        base_image = "some_base_image_6021"
+        build = Build(
+            image_path=image_path, base_image=base_image, persistent_session=True
+        )
+        assert build.persistent_session
+
+    @pytest.mark.parametrize(
+        ["arg", "env_var", "system_config", "expected"],
+        [
+            (None, None, None, None),
+            ("arg_6021", "env_6021", "sys_6021", "arg_6021"),
+            (None, "env_6021", "sys_6021", "env_6021"),
+            (None, None, "sys_6021", "sys_6021"),
+        ],
+    )
+    def test_specifying_sandbox_root(
+        self, arg, env_var, system_config, expected, monkeypatch
+    ):
+        # See also the matching TestAddArguments test below
+        monkeypatch.setattr(
+            "cotainr.util.get_systems",
+            lambda: {
+                "some_system_6021": {
+                    "base-image": "some_base_image_6021",
+                    **({"sandbox-root": system_config} if system_config else {}),
+                }
+            },
+        )
+        if env_var is not None:
+            monkeypatch.setenv("COTAINR_SANDBOX_ROOT", env_var)
+        else:
+            monkeypatch.delenv("COTAINR_SANDBOX_ROOT", raising=False)
+        build = Build(
+            image_path="some_image_path_6021",
+            system="some_system_6021",
+            sandbox_root=arg,
+        )
+        assert build.sandbox_root == expected
+
+    def test_specifying_sif_options(self, monkeypatch):
+        # See also the matching TestAddArguments test below
+        monkeypatch.setattr(
+            "cotainr.util.get_systems",
+            lambda: {
+                "some_system_6021": {
+                    "base-image": "some_base_image_6021",
+                    "sif-compression": "zstd",
+                    "sif-compression-level": 19,
+                    "mksquashfs-processors": 8,
+                }
+            },
+        )
+        build = Build(
+            image_path="some_image_path_6021",
+            system="some_system_6021",
+            sif_compression_level=3,
+            sif_block_size="1M",
+        )
+        assert build.sif_options == {
+            "compression": "zstd",
+            "compression_level": 3,
+            "block_size": "1M",
+            "processors": 8,
+        }
+
+    def test_invalid_sif_options(self):
+        with pytest.raises(ValueError, match="^A SIF compression level requires"):
+            Build(
+                image_path="some_image_path_6021",
+                base_image="some_base_image_6021",
+                sif_compression="lz4",
+                sif_compression_level=3,
+            )
+
     def test_specifying_log_to_file(self):
         # See also the matching TestAddArguments test below
         image_path = "some_image_path_6021"
@@ -236,6 +671,45 @@ class TestAddArguments:
         assert isinstance(args.conda_env, Path)
         assert args.conda_env.name == conda_env
 
+    def test_specifying_conda_extra_env_arg(self):
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        args = parser.parse_args(
+            args=shlex.split(
+                "some_image_path_6021 --base-image=some_base_image_6021 "
+                "--conda-env=env_6021.yml --conda-extra-env=tools=tools_6021.yml "
+                "--conda-extra-env=docs=docs_6021.yml"
+            )
+        )
+        assert args.conda_extra_env == ["tools=tools_6021.yml", "docs=docs_6021.yml"]
+
+    def test_specifying_conda_pack_arg(self):
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        image_path = "some_image_path_6021"
+        base_image = "some_base_image_6021"
+        args = parser.parse_args(
+            args=shlex.split(
+                f"{image_path} --base-image={base_image} --conda-pack=env_6021.tar.gz"
+            )
+        )
+        assert args.conda_pack == Path("env_6021.tar.gz")
+
+    def test_specifying_both_conda_env_and_conda_pack(self, capsys):
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        with pytest.raises(SystemExit):
+            parser.parse_args(
+                args=shlex.split(
+                    "some_image_path_6021 --base-image=some_base_image_6021 "
+                    "--conda-env=env_6021.yml --conda-pack=env_6021.tar.gz"
+                )
+            )
+        assert (
+            "argument --conda-pack: not allowed with argument --conda-env"
+            in capsys.readouterr().err
+        )
+
     def test_specifying_accept_licenses(self):
         # See also the matching TestConstructor test above
         parser = argparse.ArgumentParser()
@@ -249,6 +723,274 @@ class TestAddArguments:
         )
         assert args.accept_licenses
 
+    @pytest.mark.parametrize(
+        ["arg", "dest"],
+        [
+            ("--no-base-image-cache", "no_base_image_cache"),
+            ("--persistent-session", "persistent_session"),
+            ("--conda-host-dry-run", "conda_host_dry_run"),
+        ],
+    )
+    def test_specifying_flags(self, arg, dest):
+        # See also the matching TestConstructor tests above
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        image_path = "some_image_path_6021"
+        base_image = "some_base_image_6021"
+        args = parser.parse_args(
+            args=shlex.split(f"{image_path} --base-image={base_image}")
+        )
+        assert not getattr(args, dest)
+        args = parser.parse_args(
+            args=shlex.split(f"{image_path} --base-image={base_image} {arg}")
+        )
+        assert getattr(args, dest)
+
+    def test_specifying_sandbox_root(self):
+        # See also the matching TestConstructor test above
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        image_path = "some_image_path_6021"
+        base_image = "some_base_image_6021"
+        args = parser.parse_args(
+            args=shlex.split(
+                f"{image_path} --base-image={base_image} --sandbox-root=/dev/shm"
+            )
+        )
+        assert args.sandbox_root == Path("/dev/shm")
+
+    def test_specifying_sif_options(self):
+        # See also the matching TestConstructor test above
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        image_path = "some_image_path_6021"
+        base_image = "some_base_image_6021"
+        args = parser.parse_args(
+            args=shlex.split(
+                f"{image_path} --base-image={base_image} --sif-compression=gzip "
+                "--sif-compression-level=6 --sif-block-size=256K "
+                "--mksquashfs-processors=4"
+            )
+        )
+        assert args.sif_compression == "gzip"
+        assert args.sif_compression_level == 6
+        assert args.sif_block_size == "256K"
+        assert args.mksquashfs_processors == 4
+
+    def test_invalid_sif_compression(self, capsys):
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        with pytest.raises(SystemExit):
+            parser.parse_args(
+                args=shlex.split(
+                    "some_image_path_6021 --base-image=some_base_image_6021 "
+                    "--sif-compression=xz_6021"
+                )
+            )
+        assert "invalid choice: 'xz_6021'" in capsys.readouterr().err
+
+    def test_specifying_keep_sandbox(self):
+        # See also the matching TestConstructor test above
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        image_path = "some_image_path_6021"
+        base_image = "some_base_image_6021"
+        args = parser.parse_args(
+            args=shlex.split(f"{image_path} --base-image={base_image} --keep-sandbox")
+        )
+        assert args.keep_sandbox
+
+    def test_specifying_no_space_check(self):
+        # See also the matching TestConstructor test above
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        image_path = "some_image_path_6021"
+        base_image = "some_base_image_6021"
+        args = parser.parse_args(
+            args=shlex.split(f"{image_path} --base-image={base_image} --no-space-check")
+        )
+        assert args.no_space_check
+
+    def test_specifying_no_background_cleanup(self):
+        # See also the matching TestConstructor test above
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        image_path = "some_image_path_6021"
+        base_image = "some_base_image_6021"
+        args = parser.parse_args(
+            args=shlex.split(
+                f"{image_path} --base-image={base_image} --no-background-cleanup"
+            )
+        )
+        assert args.no_background_cleanup
+
+    def test_specifying_usage_report(self):
+        # See also the matching TestExecute test below
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        image_path = "some_image_path_6021"
+        base_image = "some_base_image_6021"
+        args = parser.parse_args(
+            args=shlex.split(
+                f"{image_path} --base-image={base_image} --usage-report=report.json"
+            )
+        )
+        assert args.usage_report == Path("report.json")
+
+    def test_specifying_deduplicate_files(self):
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        image_path = "some_image_path_6021"
+        base_image = "some_base_image_6021"
+        args = parser.parse_args(
+            args=shlex.split(
+                f"{image_path} --base-image={base_image} --deduplicate-files"
+            )
+        )
+        assert args.deduplicate_files
+
+    def test_specifying_layered(self):
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        image_path = "some_image_path_6021"
+        base_image = "some_base_image_6021"
+        args = parser.parse_args(
+            args=shlex.split(f"{image_path} --base-image={base_image} --layered")
+        )
+        assert args.layered
+
+    def test_specifying_installer_cache_max_age(self):
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        image_path = "some_image_path_6021"
+        base_image = "some_base_image_6021"
+        args = parser.parse_args(
+            args=shlex.split(
+                f"{image_path} --base-image={base_image} --installer-cache-max-age=0.5"
+            )
+        )
+        assert args.installer_cache_max_age == 0.5
+
+    def test_specifying_conda_pkgs_cache(self):
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        image_path = "some_image_path_6021"
+        base_image = "some_base_image_6021"
+        args = parser.parse_args(
+            args=shlex.split(
+                f"{image_path} --base-image={base_image} --conda-pkgs-cache "
+                "--conda-pkgs-cache-max-size=2.5"
+            )
+        )
+        assert args.conda_pkgs_cache
+        assert args.conda_pkgs_cache_max_size == 2.5
+
+    @pytest.mark.parametrize(
+        "solver", ["conda", "classic", "libmamba", "mamba", "micromamba"]
+    )
+    def test_specifying_conda_solver(self, solver):
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        image_path = "some_image_path_6021"
+        base_image = "some_base_image_6021"
+        args = parser.parse_args(
+            args=shlex.split(
+                f"{image_path} --base-image={base_image} --conda-solver={solver}"
+            )
+        )
+        assert args.conda_solver == solver
+
+    @pytest.mark.parametrize("env_lock", ["use", "refresh", "ignore"])
+    def test_specifying_conda_env_lock(self, env_lock):
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        image_path = "some_image_path_6021"
+        base_image = "some_base_image_6021"
+        args = parser.parse_args(
+            args=shlex.split(
+                f"{image_path} --base-image={base_image} --conda-env-lock={env_lock}"
+            )
+        )
+        assert args.conda_env_lock == env_lock
+
+    def test_specifying_pip_requirements(self):
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        args = parser.parse_args(
+            args=shlex.split(
+                "some_image_path_6021 --base-image=some_base_image_6021 "
+                "--pip-requirements=requirements_6021.txt --pip-installer=uv "
+                "--pip-wheel-cache --pip-jobs=8"
+            )
+        )
+        assert args.pip_requirements == Path("requirements_6021.txt")
+        assert args.pip_installer == "uv"
+        assert args.pip_wheel_cache
+        assert args.pip_jobs == 8
+
+    def test_specifying_slim(self):
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        args = parser.parse_args(
+            args=shlex.split(
+                "some_image_path_6021 --base-image=some_base_image_6021 "
+                "--slim=aggressive --slim-keep='include/python*' "
+                "--slim-remove='*.csv' --slim-remove='*/examples/*'"
+            )
+        )
+        assert args.slim == "aggressive"
+        assert args.slim_keep == ["include/python*"]
+        assert args.slim_remove == ["*.csv", "*/examples/*"]
+
+    @pytest.mark.parametrize(
+        "arg,compile_bytecode",
+        [
+            ("", None),
+            ("--compile-bytecode", "unchecked-hash"),
+            ("--compile-bytecode=timestamp", "timestamp"),
+            ("--compile-bytecode=checked-hash", "checked-hash"),
+        ],
+    )
+    def test_specifying_compile_bytecode(self, arg, compile_bytecode):
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        args = parser.parse_args(
+            args=shlex.split(
+                f"some_image_path_6021 --base-image=some_base_image_6021 {arg}"
+            )
+        )
+        assert args.compile_bytecode == compile_bytecode
+
+    def test_specifying_offline_artifacts(self):
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        image_path = "some_image_path_6021"
+        base_image = "some_base_image_6021"
+        args = parser.parse_args(
+            args=shlex.split(
+                f"{image_path} --base-image={base_image} --offline "
+                "--conda-installer=Miniforge3-6021.sh "
+                "--conda-channel-mirror=file:///mirrors/conda-forge "
+                "--conda-channel-mirror=http://localhost:6021/bioconda"
+            )
+        )
+        assert args.offline
+        assert args.conda_installer == Path("Miniforge3-6021.sh")
+        assert args.conda_channel_mirror == [
+            "file:///mirrors/conda-forge",
+            "http://localhost:6021/bioconda",
+        ]
+
+    def test_specifying_force_rebuild(self):
+        parser = argparse.ArgumentParser()
+        Build.add_arguments(parser=parser)
+        image_path = "some_image_path_6021"
+        base_image = "some_base_image_6021"
+        args = parser.parse_args(
+            args=shlex.split(f"{image_path} --base-image={base_image} --force-rebuild")
+        )
+        assert args.force_rebuild
+
     @pytest.mark.parametrize(
         ["verbose_arg", "verbosity"],
         [
@@ -358,6 +1100,105 @@ class TestExecute:
             for s in ["'singularity'", "'build'", f"{image_path}"]
         )
 
+    def test_deduplicate_files(
+        self,
+        patch_disable_singularity_sandbox_subprocess_runner,
+        patch_disable_add_metadata,
+        patch_disable_console_spinner,
+        caplog,
+    ):
+        with caplog.at_level("INFO", logger="cotainr"):
+            Build(
+                image_path="some_image_path_6021",
+                base_image="some_base_image_6021",
+                deduplicate_files=True,
+            ).execute()
+        messages = [rec.getMessage() for rec in caplog.records]
+        assert messages.index("Deduplicating files in container") < messages.index(
+            "Building container image"
+        )
+        assert any(msg.startswith("Replaced 0 duplicate files") for msg in messages)
+
+    def test_layered_build(
+        self,
+        patch_disable_singularity_sandbox_subprocess_runner,
+        patch_disable_add_metadata,
+        patch_disable_console_spinner,
+        monkeypatch,
+        capsys,
+    ):
+        def mock_build_layered_image(self, *, path, layer_paths, **kwargs):
+            print(f"PATCH: Built layered image {path} with {layer_paths=}")
+
+        monkeypatch.setattr(
+            "cotainr.container.SingularitySandbox.build_layered_image",
+            mock_build_layered_image,
+        )
+        image_path = "some_image_path_6021"
+        Build(
+            image_path=image_path, base_image="some_base_image_6021", layered=True
+        ).execute()
+        build_cmd = capsys.readouterr().out.strip().split("\n")[-1]
+        assert build_cmd == (
+            f"PATCH: Built layered image {Path(image_path).resolve()} with "
+            "layer_paths=[]"
+        )
+
+    def test_up_to_date_image(
+        self,
+        patch_disable_singularity_sandbox_subprocess_runner,
+        patch_disable_console_spinner,
+        caplog,
+        capsys,
+    ):
+        build = Build(
+            image_path="some_image_path_6021", base_image="some_base_image_6021"
+        )
+        build.image_up_to_date = True
+        build.fingerprint = "sha256:fingerprint_6021"
+        with caplog.at_level("INFO", logger="cotainr.cli"):
+            build.execute()
+        assert capsys.readouterr().out == ""
+        assert "up to date" in caplog.records[-1].getMessage()
+        assert "sha256:fingerprint_6021" in caplog.records[-1].getMessage()
+
+    def test_usage_report(
+        self,
+        patch_disable_singularity_sandbox_subprocess_runner,
+        patch_disable_add_metadata,
+        patch_disable_console_spinner,
+    ):
+        image_path = "some_image_path_6021"
+        base_image = "some_base_image_6021"
+        usage_report = Path("usage_report_6021.json")
+        Build(
+            image_path=image_path, base_image=base_image, usage_report=usage_report
+        ).execute()
+        report = json.loads(usage_report.read_text())
+        assert report["image_path"] == str(Path(image_path).resolve())
+        (base_image_stage,) = report["stages"]
+        assert base_image_stage["stage"] == "base_image"
+        assert set(base_image_stage) == {"stage", "bytes", "inodes"}
+        assert report["commands"] == []
+
+    def test_no_usage_tracking_by_default(
+        self,
+        patch_disable_singularity_sandbox_subprocess_runner,
+        patch_disable_add_metadata,
+        patch_disable_console_spinner,
+        caplog,
+        monkeypatch,
+    ):
+        def mock_get_tree_usage(*, path):
+            raise AssertionError("PATCH: Sandbox usage measured")
+
+        monkeypatch.setattr(cotainr.util, "get_tree_usage", mock_get_tree_usage)
+        with caplog.at_level("INFO", logger="cotainr.container"):
+            Build(
+                image_path="some_image_path_6021", base_image="some_base_image_6021"
+            ).execute()
+        assert "Sandbox usage after" not in caplog.text
+
     def test_include_conda_env(
         self,
         patch_disable_singularity_sandbox_subprocess_runner,
@@ -401,6 +1242,7 @@ class TestExecute:
             conda_bootstrap_cmd,
             conda_bootstrap_clean_cmd,
             conda_env_create_cmd,
+            conda_env_lock_cmd,
             conda_clean_cmd,
             sandbox_build_cmd,
         ) = capsys.readouterr().out.strip().split("\n")
@@ -424,6 +1266,7 @@ class TestExecute:
                 "'conda_container_env'",
             ]
         )
+        assert "'conda', 'list', '--explicit'" in conda_env_lock_cmd
         assert conda_clean_cmd.startswith("PATCH: Ran command in sandbox:")
         assert "'conda', 'clean'" in conda_clean_cmd
         assert sandbox_build_cmd.startswith("PATCH: Ran command in sandbox:")
@@ -441,6 +1284,160 @@ class TestExecute:
             flags=re.MULTILINE,
         )
 
+    def test_include_conda_pack(
+        self,
+        patch_disable_singularity_sandbox_subprocess_runner,
+        patch_fake_singularity_sandbox_env_folder,
+        patch_save_singularity_sandbox_context,
+        patch_disable_add_metadata,
+        patch_disable_console_spinner,
+        capsys,
+    ):
+        conda_pack = Path("some_env_6021.tar")
+        with tarfile.open(conda_pack, mode="w") as archive:
+            member = tarfile.TarInfo(name="bin/conda-unpack")
+            member.size = 10
+            archive.addfile(member, io.BytesIO(b"#!/bin/sh\n"))
+        saved_sandbox_dir = Path(f"./{patch_save_singularity_sandbox_context}")
+        Build(
+            image_path="some_image_path_6021",
+            base_image="some_base_image_6021",
+            conda_pack=conda_pack,
+        ).execute()
+
+        # Check that the conda-pack archive has been extracted and activated
+        assert (saved_sandbox_dir / "opt/cotainr/conda_env/bin/conda-unpack").exists()
+        assert (
+            'export PATH="/opt/cotainr/conda_env/bin:$PATH"'
+            in (saved_sandbox_dir / ".singularity.d/env/92-cotainr-env.sh").read_text()
+        )
+
+        # Check that conda is not bootstrapped
+        (
+            sandbox_create_cmd,
+            sandbox_uname_cmd,
+            conda_unpack_cmd,
+            sandbox_build_cmd,
+        ) = capsys.readouterr().out.strip().split("\n")
+        assert (
+            "'/opt/cotainr/conda_env/bin/python', "
+            "'/opt/cotainr/conda_env/bin/conda-unpack'"
+        ) in conda_unpack_cmd
+        assert "'build'" in sandbox_build_cmd
+
+    def test_slim_conda_prefix(
+        self,
+        patch_disable_singularity_sandbox_subprocess_runner,
+        patch_fake_singularity_sandbox_env_folder,
+        patch_save_singularity_sandbox_context,
+        patch_disable_add_metadata,
+        patch_disable_console_spinner,
+        caplog,
+    ):
+        conda_pack = Path("some_env_6021.tar")
+        with tarfile.open(conda_pack, mode="w") as archive:
+            for name, content in [
+                ("bin/conda-unpack", b"#!/bin/sh\n"),
+                ("lib/libz.a", b"static library 6021"),
+                ("share/man/man1/python.1", b"man page 6021"),
+            ]:
+                member = tarfile.TarInfo(name=name)
+                member.size = len(content)
+                archive.addfile(member, io.BytesIO(content))
+        saved_sandbox_dir = Path(f"./{patch_save_singularity_sandbox_context}")
+        Build(
+            image_path="some_image_path_6021",
+            base_image="some_base_image_6021",
+            conda_pack=conda_pack,
+            slim="conservative",
+            slim_keep=["share/man/*"],
+        ).execute()
+
+        prefix_dir = saved_sandbox_dir / "opt/cotainr/conda_env"
+        assert not (prefix_dir / "lib/libz.a").exists()
+        assert (prefix_dir / "share/man/man1/python.1").exists()
+        assert "Slimming saved 0.0 MiB of static_libraries" in caplog.text
+        assert "Slimming saved 0.0 MiB in total" in caplog.text
+
+    def test_conda_preparation_stages(
+        self,
+        patch_disable_singularity_sandbox_subprocess_runner,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_fake_singularity_sandbox_env_folder,
+        patch_disable_add_metadata,
+        patch_disable_console_spinner,
+        caplog,
+        monkeypatch,
+    ):
+        solved_envs = []
+
+        def mock_solve_environment_on_host(*, path, architecture):
+            solved_envs.append((path.name, architecture))
+
+        monkeypatch.setenv("CONDA_EXE", "/host/bin/conda_6021")
+        monkeypatch.setattr(
+            cotainr.pack, "solve_environment_on_host", mock_solve_environment_on_host
+        )
+        Path("some_conda_env_6021.yml").write_text("Some conda env content 6021")
+        Path("extra_env_6021.yml").write_text("Some extra conda env content 6021")
+        caplog.set_level(logging.INFO)
+        Build(
+            image_path="some_image_path_6021",
+            base_image="some_base_image_6021",
+            conda_env="some_conda_env_6021.yml",
+            conda_extra_env=["extra=extra_env_6021.yml"],
+            conda_host_dry_run=True,
+            accept_licenses=True,
+        ).execute()
+
+        # The installer is fetched and the environments are solved for the host
+        assert patch_disable_conda_install_download_miniforge_installer == [
+            platform.machine()
+        ]
+        assert sorted(solved_envs) == [
+            ("extra_env_6021.yml", platform.machine()),
+            ("some_conda_env_6021.yml", platform.machine()),
+        ]
+        critical_path_msg = next(
+            rec.getMessage()
+            for rec in caplog.records
+            if rec.getMessage().startswith("Critical path of the build: ")
+        )
+        assert re.search(
+            r" -> conda_install \(\d+\.\d s\) -> image \(\d+\.\d s\)$",
+            critical_path_msg,
+        )
+
+    def test_failing_host_dry_run(
+        self,
+        patch_disable_singularity_sandbox_subprocess_runner,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_disable_console_spinner,
+        capsys,
+        monkeypatch,
+    ):
+        def mock_solve_environment_on_host(*, path, architecture):
+            raise RuntimeError("PATCH: Unable to solve 6021")
+
+        monkeypatch.setenv("CONDA_EXE", "/host/bin/conda_6021")
+        monkeypatch.setattr(
+            cotainr.pack, "solve_environment_on_host", mock_solve_environment_on_host
+        )
+        Path("some_conda_env_6021.yml").write_text("Some conda env content 6021")
+        with pytest.raises(RuntimeError, match="^PATCH: Unable to solve 6021$"):
+            Build(
+                image_path="some_image_path_6021",
+                base_image="some_base_image_6021",
+                conda_env="some_conda_env_6021.yml",
+                conda_host_dry_run=True,
+                accept_licenses=True,
+            ).execute()
+
+        # Conda is not installed in the container
+        assert "PATCH: Bootstrapped Conda" not in capsys.readouterr().out
+
     def test_no_beforehand_license_acceptance(
         self,
         patch_disable_singularity_sandbox_subprocess_runner,
@@ -461,6 +1458,53 @@ class TestExecute:
             ).execute()
 
 
+class Test_LogCommandUsage:
+    def test_summary(self, caplog):
+        command_usage = [
+            {
+                "command": "conda env create -f env_6021.yml",
+                "wall_time": 60.0,
+                "user_time": 50.0,
+                "system_time": 4.0,
+                "max_rss": 2**30,
+                "block_input": 10,
+                "block_output": 20,
+            },
+            {
+                "command": "x" * 100,
+                "wall_time": 30.0,
+                "user_time": 1.0,
+                "system_time": 2.0,
+                "max_rss": 2**20,
+                "block_input": 6000,
+                "block_output": 21,
+            },
+            {
+                "command": "ls /opt_6021",
+                "wall_time": 0.5,
+                "user_time": None,
+                "system_time": None,
+                "max_rss": None,
+                "block_input": None,
+                "block_output": None,
+            },
+        ]
+        caplog.set_level(logging.INFO)
+        Build._log_command_usage(command_usage=command_usage, max_commands=2)
+        assert [rec.getMessage() for rec in caplog.records] == [
+            "Ran 3 commands: 90.5 s wall, 51.0 s user + 6.0 s system CPU (63%), "
+            "1024 MiB peak RSS, 6010 block reads, 41 block writes",
+            "  conda env create -f env_6021.yml: 60.0 s wall, 50.0 s user + 4.0 s "
+            "system CPU (90%), 1024 MiB peak RSS, 10 block reads, 20 block writes",
+            f"  {'x' * 57}...: 30.0 s wall, 1.0 s user + 2.0 s system CPU (10%), "
+            "1 MiB peak RSS, 6000 block reads, 21 block writes",
+        ]
+
+    def test_no_commands(self, caplog):
+        Build._log_command_usage(command_usage=[])
+        assert not caplog.records
+
+
 class TestHelpMessage:
     def test_CLI_subcommand_help_message(self, argparse_options_line, capsys):
         with pytest.raises(SystemExit):
@@ -473,7 +1517,30 @@ class TestHelpMessage:
         target = (
             # Capsys apparently assumes an 80 char terminal (?) - thus extra '\n'
             "usage: cotainr build [-h] (--base-image BASE_IMAGE | --system SYSTEM)\n"
-            "                     [--conda-env CONDA_ENV] [--accept-licenses]\n"
+            "                     [--conda-env CONDA_ENV | --conda-pack CONDA_PACK]\n"
+            "                     [--conda-extra-env NAME=PATH] [--accept-licenses]\n"
+            "                     [--no-base-image-cache] [--persistent-session]\n"
+            "                     [--sandbox-root SANDBOX_ROOT] [--no-space-check]\n"
+            "                     [--sif-compression {gzip,zstd,lz4,none}]\n"
+            "                     [--sif-compression-level SIF_COMPRESSION_LEVEL]\n"
+            "                     [--sif-block-size SIF_BLOCK_SIZE]\n"
+            "                     [--mksquashfs-processors MKSQUASHFS_PROCESSORS]\n"
+            "                     [--force-rebuild] [--keep-sandbox]\n"
+            "                     [--no-background-cleanup] [--usage-report USAGE_REPORT]\n"
+            "                     [--deduplicate-files] [--layered]\n"
+            "                     [--installer-cache-max-age HOURS] [--conda-pkgs-cache]\n"
+            "                     [--conda-pkgs-cache-max-size GIB]\n"
+            "                     [--conda-update-base {always,never,stale}]\n"
+            "                     [--conda-update-base-max-age DAYS]\n"
+            "                     [--conda-solver {conda,classic,libmamba,mamba,micromamba}]\n"
+            "                     [--conda-env-lock {use,refresh,ignore}]\n"
+            "                     [--conda-installer PATH] [--conda-channel-mirror URL]\n"
+            "                     [--offline] [--conda-host-dry-run]\n"
+            "                     [--pip-requirements PIP_REQUIREMENTS]\n"
+            "                     [--pip-installer {pip,uv}] [--pip-wheel-cache]\n"
+            "                     [--pip-jobs N] [--slim {conservative,aggressive}]\n"
+            "                     [--slim-keep GLOB] [--slim-remove GLOB]\n"
+            "                     [--compile-bytecode [{timestamp,checked-hash,unchecked-hash}]]\n"
             "                     [--verbose | --quiet] [--log-to-file] [--no-color]\n"
             "                     image_path\n\n"
             "Build a container.\n\n"
@@ -494,8 +1561,150 @@ class TestHelpMessage:
             "                        activate in the container. When installing a Conda\n"
             "                        environment, you must accept the Miniforge license\n"
             "                        terms, as specified during the build process\n"
+            "  --conda-pack CONDA_PACK\n"
+            "                        path to a relocatable Conda environment archive,\n"
+            "                        created using conda-pack, to import and activate in\n"
+            "                        the container instead of installing a Conda\n"
+            "                        environment from an environment.yml file\n"
+            "  --conda-extra-env NAME=PATH\n"
+            "                        an additional Conda environment, given as NAME=PATH to\n"
+            "                        a Conda environment.yml file, to install next to the\n"
+            "                        conda_env Conda environment, which remains the one\n"
+            "                        activated in the container. The Conda environments are\n"
+            "                        solved and installed concurrently. May be given\n"
+            "                        multiple times\n"
             "  --accept-licenses     accept all license terms (if any) needed for\n"
             "                        completing the container build process\n"
+            "  --no-base-image-cache\n"
+            "                        do not use the cache of unpacked base images and\n"
+            "                        bootstrapped Conda base environments, i.e. always\n"
+            "                        unpack the base image and bootstrap Conda from scratch\n"
+            "  --persistent-session  run all commands in the container sandbox in a single\n"
+            "                        long-lived shell session instead of starting a new\n"
+            "                        container process for each command\n"
+            "  --sandbox-root SANDBOX_ROOT\n"
+            "                        directory in which to create the temporary container\n"
+            "                        sandbox, e.g. a node-local disk. Defaults to the\n"
+            "                        COTAINR_SANDBOX_ROOT environment variable, the\n"
+            '                        "sandbox-root" of the chosen system, or the default\n'
+            "                        temporary directory, in that order\n"
+            "  --no-space-check      skip checking that there is enough free space in the\n"
+            "                        sandbox root before the build, e.g. if the rough\n"
+            "                        estimate of the space needed is too large\n"
+            "  --sif-compression {gzip,zstd,lz4,none}\n"
+            "                        the compression algorithm used for the squashfs file\n"
+            "                        system in the SIF container image. Defaults to the\n"
+            '                        "sif-compression" of the chosen system or the default\n'
+            "                        of the container runtime\n"
+            "  --sif-compression-level SIF_COMPRESSION_LEVEL\n"
+            "                        the compression level used with the gzip or zstd SIF\n"
+            '                        compression. Defaults to the "sif-compression-level"\n'
+            "                        of the chosen system\n"
+            "  --sif-block-size SIF_BLOCK_SIZE\n"
+            "                        the block size of the squashfs file system in the SIF\n"
+            '                        container image, e.g. 1M. Defaults to the "sif-block-\n'
+            '                        size" of the chosen system\n'
+            "  --mksquashfs-processors MKSQUASHFS_PROCESSORS\n"
+            "                        the number of processors used for creating the SIF\n"
+            '                        container image. Defaults to the "mksquashfs-\n'
+            '                        processors" of the chosen system or all available\n'
+            "                        processors\n"
+            "  --force-rebuild       always build the container, even if an existing\n"
+            "                        container image at `image_path` was built from the\n"
+            "                        same inputs\n"
+            "  --keep-sandbox        keep the container sandbox after the build, e.g. for\n"
+            "                        debugging. The path to the kept sandbox is shown when\n"
+            "                        the build finishes\n"
+            "  --no-background-cleanup\n"
+            "                        delete the container sandbox before cotainr exits\n"
+            "                        instead of in a background process that may keep\n"
+            "                        running after cotainr exits\n"
+            "  --usage-report USAGE_REPORT\n"
+            "                        path to a JSON file in which to write a report of the\n"
+            "                        size and number of inodes of the container sandbox\n"
+            "                        after each build stage. The sandbox is only measured\n"
+            "                        when a report is requested\n"
+            "  --deduplicate-files   replace identical files in the container by hardlinks\n"
+            "                        before building the container image, e.g. to speed up\n"
+            "                        building images with large Conda environments\n"
+            "  --layered             build the container image as the base image with the\n"
+            "                        Conda environment added as a separate overlay layer.\n"
+            "                        The base image is cached such that only the Conda\n"
+            "                        environment layer is rebuilt when it changes\n"
+            "  --installer-cache-max-age HOURS\n"
+            "                        the maximum age in hours of the cached check for the\n"
+            "                        latest Miniforge installer release before checking for\n"
+            "                        a new release\n"
+            "  --conda-pkgs-cache    use a persistent Conda package cache, shared across\n"
+            "                        builds, such that Conda packages are only downloaded\n"
+            "                        once\n"
+            "  --conda-pkgs-cache-max-size GIB\n"
+            "                        the maximum size in GiB of the Conda package cache.\n"
+            "                        The least recently used packages are evicted from the\n"
+            "                        cache to stay below it\n"
+            "  --conda-update-base {always,never,stale}\n"
+            "                        when to update Conda in the Conda base environment:\n"
+            "                        always, never, or only when the base environment is\n"
+            "                        older than the conda_update_base_max_age\n"
+            "  --conda-update-base-max-age DAYS\n"
+            "                        the maximum age in days of the Conda base environment\n"
+            '                        before it is updated when conda_update_base is "stale"\n'
+            "  --conda-solver {conda,classic,libmamba,mamba,micromamba}\n"
+            "                        the tool used to solve and install the Conda\n"
+            "                        environment: conda with its default solver, conda with\n"
+            "                        the classic or libmamba solver, mamba, or micromamba\n"
+            "  --conda-env-lock {use,refresh,ignore}\n"
+            "                        how to use the cache of solved Conda environments:\n"
+            "                        install from the cached solution of the Conda\n"
+            "                        environment, if any, refresh the cached solution by\n"
+            "                        solving the Conda environment, or ignore the cache\n"
+            "  --conda-installer PATH\n"
+            "                        the path to a local Miniforge installer to use instead\n"
+            "                        of downloading the latest Miniforge installer\n"
+            "  --conda-channel-mirror URL\n"
+            "                        the url, e.g. file:///srv/mirrors/conda-forge or\n"
+            "                        http://localhost:8000/conda-forge, of a local Conda\n"
+            "                        channel mirror. The last part of the url is the name\n"
+            "                        of the mirrored channel. May be given multiple times\n"
+            "  --offline             build the container without network access. Requires a\n"
+            "                        local base image, and for adding a Conda environment,\n"
+            "                        a local Miniforge installer and local mirrors of all\n"
+            "                        Conda channels used. Fails before starting the build\n"
+            "                        if any of them are not available\n"
+            "  --conda-host-dry-run  solve the Conda environments using conda on the host,\n"
+            "                        for the architecture of the container, while the base\n"
+            "                        image is unpacked, such that an unsolvable Conda\n"
+            "                        environment fails the build before Conda is installed\n"
+            "                        in the container\n"
+            "  --pip-requirements PIP_REQUIREMENTS\n"
+            "                        path to a pip requirements.txt file to install in the\n"
+            "                        Conda environment after creating it\n"
+            "  --pip-installer {pip,uv}\n"
+            "                        the tool used to install the pip requirements. pip\n"
+            "                        must be included in the Conda environment, whereas uv\n"
+            "                        is installed in the Conda base environment\n"
+            "  --pip-wheel-cache     use a persistent pip/uv wheel cache, shared across\n"
+            "                        builds, such that wheels are only downloaded or built\n"
+            "                        once\n"
+            "  --pip-jobs N          the number of concurrent downloads, builds, and\n"
+            "                        installs of pip requirements when using uv\n"
+            "  --slim {conservative,aggressive}\n"
+            "                        remove files not needed at runtime from the Conda\n"
+            "                        installation: static libraries and documentation\n"
+            "                        (conservative), and additionally headers, test suites,\n"
+            "                        Python bytecode caches, and debug symbols (aggressive)\n"
+            "  --slim-keep GLOB      a glob pattern, relative to the Conda installation, of\n"
+            "                        files to never remove when slimming, e.g.\n"
+            '                        "include/python*". May be given multiple times\n'
+            "  --slim-remove GLOB    a glob pattern, relative to the Conda installation, of\n"
+            "                        additional files to remove when slimming. May be given\n"
+            "                        multiple times\n"
+            "  --compile-bytecode [{timestamp,checked-hash,unchecked-hash}]\n"
+            "                        compile all Python modules in the site-packages of the\n"
+            "                        Conda environment to bytecode, using the given\n"
+            "                        bytecode invalidation mode (unchecked-hash if no mode\n"
+            "                        is given), to avoid recompiling them on every import\n"
+            "                        from the read-only container\n"
             "  --verbose, -v         increase the verbosity of the output from cotainr. Can\n"
             "                        be used multiple times: Once for subprocess output,\n"
             "                        twice for subprocess INFO, three times for VERBOSE,\n"
@@ -9,7 +9,6 @@ Licensed under the European Union Public License (EUPL) 1.2
 
 import builtins
 import contextlib
-import io
 import logging
 import os
 from pathlib import Path
@@ -110,6 +109,20 @@ def context_set_umask():
     return set_umask
 
 
+@pytest.fixture(autouse=True)
+def context_cotainr_cache_dir(tmp_path, monkeypatch):
+    """
+    Force the cotainr cache directory to be a temporary directory.
+
+    Protects the cache directory of the user running the tests from being
+    populated by running a test, by making this an "autouse" fixture.
+    """
+    cache_dir = tmp_path / "cotainr_cache"
+    monkeypatch.setenv("COTAINR_CACHE_DIR", str(cache_dir))
+
+    return cache_dir
+
+
 @pytest.fixture
 def data_log_level_names_mapping():
     """
@@ -181,22 +194,6 @@ def factory_mock_input_sequence():
     return create_mock_input
 
 
-@pytest.fixture
-def patch_urllib_urlopen_as_bytes_stream(monkeypatch):
-    """
-    Disable urllib.request.urlopen(...).
-
-    The `urlopen` contextmanager is replaced by a mock that returns a bytes
-    message about the URL content that would have been opened.
-    """
-
-    @contextlib.contextmanager
-    def mock_urlopen(url, *args, **kwargs):
-        yield io.BytesIO(f"PATCH: Bytes returned by urlopen for {url=}".encode())
-
-    monkeypatch.setattr(urllib.request, "urlopen", mock_urlopen)
-
-
 @pytest.fixture
 def patch_urllib_urlopen_force_fail(monkeypatch):
     """
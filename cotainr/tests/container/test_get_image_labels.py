@@ -0,0 +1,64 @@
+"""
+cotainr - a user space Apptainer/Singularity container builder.
+
+Copyright DeiC, deic.dk
+Licensed under the European Union Public License (EUPL) 1.2
+- see the LICENSE file for details.
+
+"""
+
+import json
+import subprocess
+
+import pytest
+
+from cotainr.container import get_image_labels
+
+
+class TestGetImageLabels:
+    def test_labels(self, monkeypatch):
+        def mock_run(args, **kwargs):
+            assert args == [
+                "singularity",
+                "--nocolor",
+                "inspect",
+                "--json",
+                "--labels",
+                "some_image_6021.sif",
+            ]
+            stdout = json.dumps(
+                {
+                    "data": {"attributes": {"labels": {"some_label_6021": "6021"}}},
+                    "type": "container",
+                }
+            )
+            return subprocess.CompletedProcess(args, 0, stdout=stdout, stderr="")
+
+        monkeypatch.setattr(subprocess, "run", mock_run)
+        assert get_image_labels(path="some_image_6021.sif") == {
+            "some_label_6021": "6021"
+        }
+
+    @pytest.mark.parametrize(
+        "error",
+        [
+            FileNotFoundError("singularity"),
+            subprocess.CalledProcessError(255, "singularity"),
+        ],
+    )
+    def test_inspect_fails(self, error, monkeypatch):
+        def mock_run(args, **kwargs):
+            raise error
+
+        monkeypatch.setattr(subprocess, "run", mock_run)
+        assert get_image_labels(path="some_image_6021.sif") is None
+
+    def test_unexpected_output(self, monkeypatch):
+        monkeypatch.setattr(
+            subprocess,
+            "run",
+            lambda args, **kwargs: subprocess.CompletedProcess(
+                args, 0, stdout="not json 6021", stderr=""
+            ),
+        )
+        assert get_image_labels(path="some_image_6021.sif") is None
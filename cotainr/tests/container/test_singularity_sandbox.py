@@ -7,13 +7,20 @@ Licensed under the European Union Public License (EUPL) 1.2
 
 """
 
+import hashlib
+import json
 import logging
+import os
 from pathlib import Path
+import platform
+import subprocess
+import time
 
 import pytest
 
-from cotainr.container import SingularitySandbox
+from cotainr.container import SingularitySandbox, get_image_labels
 from cotainr.tracing import LogDispatcher, LogSettings
+import cotainr.util
 
 from ..util.patches import patch_disable_stream_subprocess
 from .data import data_cached_alpine_sif
@@ -78,6 +85,857 @@ class TestContext:
         assert not sandbox_dir.exists()
 
 
+class TestTeardown:
+    @pytest.fixture
+    def patch_record_popen(self, monkeypatch):
+        popen_args = []
+
+        def mock_popen(args, **kwargs):
+            assert kwargs["start_new_session"]
+            popen_args.append(args)
+
+        monkeypatch.setattr(subprocess, "Popen", mock_popen)
+        return popen_args
+
+    def test_keep_sandbox(self, caplog, patch_disable_stream_subprocess, tmp_path):
+        sandbox = SingularitySandbox(
+            base_image="my_base_image_6021",
+            sandbox_root=tmp_path / "sandbox_root_6021",
+            keep_sandbox=True,
+        )
+        sandbox.architecture = "test"
+        with caplog.at_level(logging.INFO, logger="cotainr.container"):
+            with sandbox:
+                (sandbox.sandbox_dir / "some_file_6021").write_text("6021")
+
+        (kept_dir,) = (tmp_path / "sandbox_root_6021").iterdir()
+        assert kept_dir.name.startswith("cotainr_sandbox_")
+        kept_sandbox_dir = kept_dir / "singularity_sandbox"
+        assert (kept_sandbox_dir / "some_file_6021").read_text() == "6021"
+        assert caplog.records[-1].getMessage() == (
+            f"Keeping sandbox in {kept_sandbox_dir}"
+        )
+
+    def test_background_cleanup(
+        self, patch_disable_stream_subprocess, patch_record_popen, tmp_path
+    ):
+        sandbox = SingularitySandbox(
+            base_image="my_base_image_6021",
+            sandbox_root=tmp_path / "sandbox_root_6021",
+            background_cleanup=True,
+        )
+        sandbox.architecture = "test"
+        with sandbox:
+            (sandbox.sandbox_dir / "some_file_6021").write_text("6021")
+
+        (trash_dir,) = (tmp_path / "sandbox_root_6021").iterdir()
+        assert trash_dir.name.startswith("cotainr_trash_")
+        assert (trash_dir / "singularity_sandbox/some_file_6021").exists()
+        ((sh, opt, script, _, removed_path, errors_file),) = patch_record_popen
+        assert [sh, opt] == ["sh", "-c"]
+        assert 'rm -rf -- "$1"' in script
+        assert 'chmod -R u+rwX -- "$1"' in script
+        assert removed_path == str(trash_dir)
+        assert errors_file == f"{trash_dir}.errors"
+
+    def test_background_cleanup_script(self, tmp_path):
+        trash_dir = tmp_path / "cotainr_trash_6021"
+        (trash_dir / "read_only_dir").mkdir(parents=True)
+        (trash_dir / "read_only_dir/some_file_6021").write_text("6021")
+        (trash_dir / "read_only_dir").chmod(0o500)
+        sandbox = SingularitySandbox(base_image="my_base_image_6021")
+        sandbox._remove_in_background(path=trash_dir)
+        for _ in range(100):
+            if not trash_dir.exists():
+                break
+            time.sleep(0.05)
+        assert not trash_dir.exists()
+        assert not Path(f"{trash_dir}.errors").exists()
+
+    def test_report_failed_removals(
+        self, caplog, patch_disable_stream_subprocess, tmp_path
+    ):
+        sandbox_root = tmp_path / "sandbox_root_6021"
+        sandbox_root.mkdir()
+        errors_file = sandbox_root / "cotainr_trash_6021.errors"
+        errors_file.write_text("rm: cannot remove 'some_file_6021'\n")
+        sandbox = SingularitySandbox(
+            base_image="my_base_image_6021", sandbox_root=sandbox_root
+        )
+        sandbox.architecture = "test"
+        with sandbox:
+            pass
+
+        assert not errors_file.exists()
+        assert caplog.records[0].levelname == "WARNING"
+        assert caplog.records[0].getMessage() == (
+            f"Unable to remove the sandbox in {sandbox_root / 'cotainr_trash_6021'} "
+            "in the background: rm: cannot remove 'some_file_6021'"
+        )
+
+    def test_background_cleanup_fallback(
+        self, monkeypatch, patch_disable_stream_subprocess, tmp_path
+    ):
+        def mock_popen(args, **kwargs):
+            raise FileNotFoundError("rm")
+
+        monkeypatch.setattr(subprocess, "Popen", mock_popen)
+        sandbox = SingularitySandbox(
+            base_image="my_base_image_6021",
+            sandbox_root=tmp_path / "sandbox_root_6021",
+            background_cleanup=True,
+        )
+        sandbox.architecture = "test"
+        with sandbox:
+            (sandbox.sandbox_dir / "some_file_6021").write_text("6021")
+
+        assert not any((tmp_path / "sandbox_root_6021").iterdir())
+
+    def test_foreground_removal_of_read_only_dirs(self, caplog, tmp_path):
+        removed_dir = tmp_path / "removed_dir_6021"
+        (removed_dir / "read_only_dir/sub_dir").mkdir(parents=True)
+        (removed_dir / "read_only_dir/sub_dir/some_file_6021").write_text("6021")
+        (removed_dir / "read_only_dir/sub_dir").chmod(0o500)
+        (removed_dir / "read_only_dir").chmod(0o000)
+        SingularitySandbox._remove_in_foreground(path=removed_dir)
+        assert not removed_dir.exists()
+        assert not caplog.records
+
+    def test_foreground_removal_failure(self, caplog, monkeypatch, tmp_path):
+        def mock_unlink(path, *args, **kwargs):
+            raise PermissionError(f"PATCH: Unable to unlink {path}")
+
+        removed_dir = tmp_path / "removed_dir_6021"
+        removed_dir.mkdir()
+        (removed_dir / "some_file_6021").write_text("6021")
+        monkeypatch.setattr(os, "unlink", mock_unlink)
+        SingularitySandbox._remove_in_foreground(path=removed_dir)
+        assert [rec.levelname for rec in caplog.records] == ["WARNING", "WARNING"]
+        assert (
+            caplog.records[0]
+            .getMessage()
+            .startswith(f"Unable to remove {removed_dir / 'some_file_6021'}: ")
+        )
+        assert (
+            caplog.records[1]
+            .getMessage()
+            .startswith(f"Unable to remove {removed_dir}: ")
+        )
+
+
+class TestBaseImageCache:
+    def test_cache_miss_and_hit(
+        self, caplog, capsys, context_cotainr_cache_dir, patch_disable_stream_subprocess
+    ):
+        caplog.set_level(logging.INFO, logger="cotainr.container")
+        base_image = Path("base_image_6021.sif")
+        base_image.write_bytes(b"some base image 6021")
+        digest = hashlib.sha256(b"some base image 6021").hexdigest()
+        cached_sandbox_dir = (
+            context_cotainr_cache_dir / f"base_sandboxes/sha256-{digest}"
+        )
+        sandbox = SingularitySandbox(base_image=base_image)
+        sandbox.architecture = "test"
+
+        # First build populates the cache
+        with sandbox:
+            pass
+        assert "Base image cache miss" in caplog.text
+        assert "'--sandbox'" in capsys.readouterr().out
+        assert cached_sandbox_dir.is_dir()
+
+        # Second build clones the cache without unpacking the base image
+        (cached_sandbox_dir / ".singularity.d").mkdir()
+        (cached_sandbox_dir / ".singularity.d/labels.json").write_text("{}")
+        (cached_sandbox_dir / "some_file_6021").write_text("cached 6021")
+        caplog.clear()
+        with sandbox:
+            assert (sandbox.sandbox_dir / "some_file_6021").read_text() == "cached 6021"
+            labels_path = sandbox.sandbox_dir / ".singularity.d/labels.json"
+            assert labels_path.read_text() == "{}"
+            assert (
+                labels_path.stat().st_ino
+                != (cached_sandbox_dir / ".singularity.d/labels.json").stat().st_ino
+            )
+        assert "Base image cache hit" in caplog.text
+        assert "'--sandbox'" not in capsys.readouterr().out
+
+    def test_bypass_cache(
+        self, capsys, context_cotainr_cache_dir, patch_disable_stream_subprocess
+    ):
+        base_image = Path("base_image_6021.sif")
+        base_image.write_bytes(b"some base image 6021")
+        sandbox = SingularitySandbox(base_image=base_image, use_base_image_cache=False)
+        sandbox.architecture = "test"
+        with sandbox:
+            pass
+        assert "'--sandbox'" in capsys.readouterr().out
+        assert not context_cotainr_cache_dir.exists()
+
+    def test_not_cacheable_base_image(
+        self, capsys, context_cotainr_cache_dir, patch_disable_stream_subprocess
+    ):
+        sandbox = SingularitySandbox(base_image="docker://my_base_image_6021:latest")
+        sandbox.architecture = "test"
+        with sandbox:
+            pass
+        assert "'--sandbox'" in capsys.readouterr().out
+        assert not context_cotainr_cache_dir.exists()
+
+
+class TestBuildLayeredImage:
+    @pytest.fixture
+    def fake_sif(self):
+        base_sif = Path("base_image_6021.sif").resolve()
+        base_sif.write_bytes(b"#!/usr/bin/env run-singularity\nSIF_MAGIC_6021")
+        return base_sif
+
+    def test_layered_image(
+        self,
+        capsys,
+        fake_sif,
+        patch_disable_stream_subprocess,
+        patch_fake_singularity_sandbox_env_folder,
+    ):
+        image_path = Path("image_6021.sif").resolve()
+        sandbox = SingularitySandbox(base_image=fake_sif)
+        sandbox.architecture = "x86_64"
+        with sandbox:
+            conda_dir = sandbox.sandbox_dir / "opt/cotainr/conda"
+            conda_dir.mkdir(parents=True)
+            (conda_dir / "some_file_6021").write_text("6021")
+            (sandbox.sandbox_dir / "some_other_file_6021").write_text("6021")
+            sandbox.add_to_env(shell_script="some_script_6021")
+            capsys.readouterr()
+            sandbox.build_layered_image(
+                path=image_path,
+                layer_paths=["/opt/cotainr/conda"],
+                compression="lz4",
+            )
+
+        # Layered image is a copy of the base image SIF with a layer added
+        assert image_path.read_bytes() == fake_sif.read_bytes()
+        mksquashfs_cmd, sif_add_cmd = capsys.readouterr().out.strip().split("\n")
+        assert "args=['mksquashfs', " in mksquashfs_cmd
+        assert "'-noappend', '-no-progress', '-comp', 'lz4']" in mksquashfs_cmd
+        assert (
+            "'sif', 'add', '--datatype', '4', '--partfs', '1', '--parttype', '4', "
+            "'--partarch', '2', '--groupid', '1'"
+        ) in sif_add_cmd
+
+    def test_layer_content(
+        self,
+        fake_sif,
+        monkeypatch,
+        patch_disable_stream_subprocess,
+        patch_fake_singularity_sandbox_env_folder,
+    ):
+        layer_content = []
+
+        def mock_subprocess_runner(self, *, args, **kwargs):
+            if args[0] == "mksquashfs":
+                layer_content.extend(
+                    str(p.relative_to(args[1])) for p in sorted(args[1].rglob("*"))
+                )
+
+        monkeypatch.setattr(
+            SingularitySandbox, "_subprocess_runner", mock_subprocess_runner
+        )
+        sandbox = SingularitySandbox(base_image=fake_sif)
+        sandbox.architecture = "aarch64"
+        with sandbox:
+            conda_dir = sandbox.sandbox_dir / "opt/cotainr/conda"
+            conda_dir.mkdir(parents=True)
+            (conda_dir / "some_file_6021").write_text("6021")
+            (sandbox.sandbox_dir / "some_other_file_6021").write_text("6021")
+            sandbox.add_to_env(shell_script="some_script_6021")
+            sandbox.build_layered_image(
+                path="image_6021.sif", layer_paths=["/opt/cotainr/conda"]
+            )
+
+        assert layer_content == [
+            ".singularity.d",
+            ".singularity.d/env",
+            ".singularity.d/env/92-cotainr-env.sh",
+            "opt",
+            "opt/cotainr",
+            "opt/cotainr/conda",
+            "opt/cotainr/conda/some_file_6021",
+        ]
+
+    def test_unsupported_architecture(self, fake_sif, patch_disable_stream_subprocess):
+        sandbox = SingularitySandbox(base_image=fake_sif)
+        sandbox.architecture = "test"
+        with sandbox:
+            with pytest.raises(
+                RuntimeError, match="^Layered builds are not supported for the test"
+            ):
+                sandbox.build_layered_image(path="image_6021.sif")
+
+    @pytest.mark.singularity_integration
+    def test_run_layered_image(
+        self, data_cached_alpine_sif, singularity_exec, tmp_path
+    ):
+        # Test that the squashfs overlay partition is applied on top of the
+        # base image when running and inspecting the layered image.
+        image_path = tmp_path / "layered_image_6021.sif"
+        with SingularitySandbox(base_image=data_cached_alpine_sif) as sandbox:
+            layer_dir = sandbox.sandbox_dir / "opt/cotainr/layer_6021"
+            layer_dir.mkdir(parents=True)
+            (layer_dir / "some_file_6021").write_text("some content 6021")
+            sandbox.add_to_env(shell_script="export LAYER_VAR_6021=layer_6021")
+            sandbox.add_metadata(fingerprint="sha256:fingerprint_6021")
+            sandbox.build_layered_image(
+                path=image_path, layer_paths=["/opt/cotainr/layer_6021"]
+            )
+
+        layer_file_content = singularity_exec(
+            f"{image_path} cat /opt/cotainr/layer_6021/some_file_6021"
+        ).stdout
+        assert layer_file_content == "some content 6021"
+        layer_var = singularity_exec(f"{image_path} printenv LAYER_VAR_6021").stdout
+        assert layer_var.strip() == "layer_6021"
+        base_image_os_release = singularity_exec(
+            f"{data_cached_alpine_sif} cat /etc/os-release"
+        ).stdout
+        layered_image_os_release = singularity_exec(
+            f"{image_path} cat /etc/os-release"
+        ).stdout
+        assert layered_image_os_release == base_image_os_release
+        labels = get_image_labels(path=image_path)
+        assert labels["cotainr.fingerprint"] == "sha256:fingerprint_6021"
+
+
+class Test_GetBaseSif:
+    def test_local_sif(self, patch_disable_stream_subprocess):
+        base_sif = Path("base_image_6021.sif")
+        base_sif.write_bytes(b"#!/usr/bin/env run-singularity\nSIF_MAGIC_6021")
+        abs_base_sif = base_sif.resolve()
+        sandbox = SingularitySandbox(base_image=base_sif)
+        sandbox.architecture = "test"
+        with sandbox:
+            assert sandbox._get_base_sif() == abs_base_sif
+
+    def test_cached_base_sif(
+        self, caplog, capsys, context_cotainr_cache_dir, patch_disable_stream_subprocess
+    ):
+        digest = hashlib.sha256(b"6021").hexdigest()
+        base_image = f"docker://alpine@sha256:{digest}"
+        sandbox = SingularitySandbox(base_image=base_image)
+        sandbox.architecture = "test"
+        with caplog.at_level(logging.INFO, logger="cotainr.container"):
+            with sandbox:
+                capsys.readouterr()
+                base_sif = sandbox._get_base_sif()
+                assert base_sif == (
+                    context_cotainr_cache_dir / f"base_sifs/sha256-{digest}.sif"
+                )
+                assert base_sif.is_file()
+                assert base_image in capsys.readouterr().out
+                assert sandbox._get_base_sif() == base_sif
+                assert capsys.readouterr().out == ""
+
+        messages = [rec.getMessage() for rec in caplog.records]
+        assert f"Base SIF cache miss for {base_image}" in messages
+        assert f"Base SIF cache hit for {base_image}" in messages
+
+    def test_uncacheable_base_image(
+        self, capsys, context_cotainr_cache_dir, patch_disable_stream_subprocess
+    ):
+        sandbox = SingularitySandbox(
+            base_image="docker://alpine:latest", use_base_image_cache=False
+        )
+        sandbox.architecture = "test"
+        with sandbox:
+            base_sif = sandbox._get_base_sif()
+            assert base_sif.parent == sandbox.sandbox_dir.parent
+        assert not (context_cotainr_cache_dir / "base_sifs").exists()
+
+
+class TestDeduplicateFiles:
+    def test_deduplication(self, caplog, patch_disable_stream_subprocess):
+        sandbox = SingularitySandbox(base_image="my_base_image_6021", track_usage=True)
+        sandbox.architecture = "test"
+        with caplog.at_level(logging.INFO, logger="cotainr.container"):
+            with sandbox:
+                for file_name in ["f1_6021", "f2_6021", "f3_6021"]:
+                    (sandbox.sandbox_dir / file_name).write_bytes(b"6021" * 2**10)
+                    os.utime(sandbox.sandbox_dir / file_name, (6021, 6021))
+                assert sandbox.deduplicate_files() == (2 * 4 * 2**10, 2)
+                assert (sandbox.sandbox_dir / "f1_6021").stat().st_nlink == 3
+
+        messages = [rec.getMessage() for rec in caplog.records]
+        assert any(
+            msg.startswith("Replaced 2 duplicate files by hardlinks, saving 0.0 MiB")
+            for msg in messages
+        )
+        assert sandbox.usage_report[-1]["stage"] == "deduplication"
+
+
+class TestGetMksquashfsArgs:
+    @pytest.mark.parametrize(
+        ["kwargs", "mksquashfs_args"],
+        [
+            ({}, []),
+            ({"compression": "gzip"}, ["-comp", "gzip"]),
+            ({"compression": "lz4"}, ["-comp", "lz4"]),
+            ({"compression": "none"}, ["-noI", "-noD", "-noF", "-noX"]),
+            (
+                {"compression": "gzip", "compression_level": 9},
+                ["-comp", "gzip", "-Xcompression-level", "9"],
+            ),
+            ({"block_size": 4096}, ["-b", "4096"]),
+            ({"block_size": "128k"}, ["-b", "131072"]),
+            ({"processors": "2"}, ["-processors", "2"]),
+        ],
+    )
+    def test_valid_settings(self, kwargs, mksquashfs_args):
+        assert SingularitySandbox.get_mksquashfs_args(**kwargs) == mksquashfs_args
+
+    @pytest.mark.parametrize(
+        ["kwargs", "error_msg"],
+        [
+            ({"compression": "xz_6021"}, "^Invalid SIF compression 'xz_6021'"),
+            ({"compression_level": 3}, "^A SIF compression level requires"),
+            (
+                {"compression": "lz4", "compression_level": 3},
+                "^A SIF compression level requires",
+            ),
+            (
+                {"compression": "zstd", "compression_level": 23},
+                "^Invalid zstd compression level 23",
+            ),
+            ({"block_size": "3K"}, "^Invalid SIF block size '3K'"),
+            ({"block_size": "2M"}, "^Invalid SIF block size '2M'"),
+            ({"block_size": "1G"}, "^Invalid SIF block size '1G'"),
+            ({"processors": 0}, "^Invalid number of mksquashfs processors 0"),
+        ],
+    )
+    def test_invalid_settings(self, kwargs, error_msg):
+        with pytest.raises(ValueError, match=error_msg):
+            SingularitySandbox.get_mksquashfs_args(**kwargs)
+
+
+class TestSandboxRoot:
+    def test_default_location(self, patch_disable_stream_subprocess, monkeypatch):
+        monkeypatch.delenv("COTAINR_SANDBOX_ROOT", raising=False)
+        sandbox = SingularitySandbox(base_image="my_base_image_6021")
+        assert sandbox.sandbox_root is None
+
+    def test_sandbox_root(self, patch_disable_stream_subprocess, tmp_path):
+        sandbox_root = tmp_path / "sandbox_root_6021/not_yet_existing"
+        sandbox = SingularitySandbox(
+            base_image="my_base_image_6021", sandbox_root=sandbox_root
+        )
+        sandbox.architecture = "test"
+        with sandbox:
+            assert sandbox.sandbox_dir.parent.parent == sandbox_root
+        assert sandbox_root.is_dir()
+        assert not any(sandbox_root.iterdir())
+
+    def test_env_var_and_expansion(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("SOME_SCRATCH_6021", str(tmp_path))
+        monkeypatch.setenv("COTAINR_SANDBOX_ROOT", "$SOME_SCRATCH_6021/root_6021")
+        sandbox = SingularitySandbox(base_image="my_base_image_6021")
+        assert sandbox.sandbox_root == tmp_path / "root_6021"
+
+    def test_explicit_root_overrides_env_var(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("COTAINR_SANDBOX_ROOT", str(tmp_path / "env_6021"))
+        sandbox = SingularitySandbox(
+            base_image="my_base_image_6021", sandbox_root=tmp_path / "arg_6021"
+        )
+        assert sandbox.sandbox_root == tmp_path / "arg_6021"
+
+
+class Test_CheckFreeSpace:
+    @pytest.fixture
+    def patch_statvfs(self, monkeypatch):
+        def set_statvfs(
+            *, free_bytes, free_inodes, total_inodes=10**6, path_part="sandbox_root"
+        ):
+            statvfs = os.statvfs
+
+            class StubStatvfs:
+                f_frsize = 4096
+                f_bavail = free_bytes // 4096
+                f_favail = free_inodes
+                f_files = total_inodes
+
+            monkeypatch.setattr(
+                os,
+                "statvfs",
+                lambda path: StubStatvfs() if path_part in str(path) else statvfs(path),
+            )
+
+        return set_statvfs
+
+    @pytest.mark.parametrize(
+        ["free_bytes", "free_inodes"], [(2**20, 10**6), (2**40, 10)]
+    )
+    def test_not_enough_space(
+        self,
+        free_bytes,
+        free_inodes,
+        patch_disable_stream_subprocess,
+        patch_statvfs,
+        tmp_path,
+        capsys,
+    ):
+        patch_statvfs(free_bytes=free_bytes, free_inodes=free_inodes)
+        sandbox_root = tmp_path / "sandbox_root_6021"
+        sandbox = SingularitySandbox(
+            base_image="my_base_image_6021", sandbox_root=sandbox_root
+        )
+        with pytest.raises(
+            RuntimeError, match="^Not enough free space in .*sandbox_root_6021"
+        ):
+            with sandbox:
+                pass
+
+        # Fail before unpacking the base image and clean up
+        assert capsys.readouterr().out == ""
+        assert sandbox.sandbox_dir is None
+        assert not any(sandbox_root.iterdir())
+
+    def test_unknown_inodes(
+        self, patch_disable_stream_subprocess, patch_statvfs, tmp_path
+    ):
+        patch_statvfs(free_bytes=2**40, free_inodes=0, total_inodes=0)
+        sandbox = SingularitySandbox(
+            base_image="my_base_image_6021", sandbox_root=tmp_path / "sandbox_root_6021"
+        )
+        sandbox.architecture = "test"
+        with sandbox:
+            pass
+
+    def test_extra_space_estimate(
+        self, patch_disable_stream_subprocess, patch_statvfs, tmp_path
+    ):
+        patch_statvfs(free_bytes=2 * 2**30, free_inodes=10**6)
+        sandbox = SingularitySandbox(
+            base_image="my_base_image_6021",
+            sandbox_root=tmp_path / "sandbox_root_6021",
+            extra_space_estimate=(2**30, 0),
+        )
+        sandbox.architecture = "test"
+        with sandbox:
+            pass
+        sandbox.extra_space_estimate = (2 * 2**30, 0)
+        with pytest.raises(RuntimeError, match="^Not enough free space"):
+            with sandbox:
+                pass
+
+    def test_skip_check(self, patch_disable_stream_subprocess, patch_statvfs, tmp_path):
+        patch_statvfs(free_bytes=0, free_inodes=0)
+        sandbox = SingularitySandbox(
+            base_image="my_base_image_6021",
+            sandbox_root=tmp_path / "sandbox_root_6021",
+            check_free_space=False,
+        )
+        sandbox.architecture = "test"
+        with sandbox:
+            pass
+
+    def test_cache_dir_only_checked_for_base_image(
+        self,
+        capsys,
+        context_cotainr_cache_dir,
+        patch_disable_stream_subprocess,
+        patch_statvfs,
+    ):
+        patch_statvfs(free_bytes=2**30, free_inodes=10**6, path_part="cotainr_cache")
+        base_image = Path("base_image_6021.sif")
+        base_image.write_bytes(b"some base image 6021")
+        sandbox = SingularitySandbox(
+            base_image=base_image, extra_space_estimate=(5 * 2**30, 10**5)
+        )
+        sandbox.architecture = "test"
+        with sandbox:
+            pass
+        assert list((context_cotainr_cache_dir / "base_sandboxes").glob("sha256-*"))
+
+    def test_cache_dir_too_small(
+        self,
+        caplog,
+        capsys,
+        context_cotainr_cache_dir,
+        patch_disable_stream_subprocess,
+        patch_statvfs,
+    ):
+        patch_statvfs(free_bytes=0, free_inodes=0, path_part="cotainr_cache")
+        base_image = Path("base_image_6021.sif")
+        base_image.write_bytes(b"some base image 6021")
+        sandbox = SingularitySandbox(base_image=base_image)
+        sandbox.architecture = "test"
+        with sandbox:
+            sandbox_dir = sandbox.sandbox_dir
+        # The base image is unpacked into the sandbox without caching it
+        assert f"PosixPath('{sandbox_dir}')" in capsys.readouterr().out
+        assert not list((context_cotainr_cache_dir / "base_sandboxes").glob("sha256-*"))
+        assert caplog.records[-1].levelname == "WARNING"
+        assert (
+            caplog.records[-1]
+            .getMessage()
+            .startswith("Not caching the base image: Not enough free space in ")
+        )
+
+    def test_cleanup_after_failed_unpack(self, monkeypatch, tmp_path):
+        def mock_unpack_base_image(self, *, sandbox_dir):
+            raise RuntimeError("PATCH: Unable to unpack 6021")
+
+        monkeypatch.setattr(
+            SingularitySandbox, "_unpack_base_image", mock_unpack_base_image
+        )
+        sandbox_root = tmp_path / "sandbox_root_6021"
+        sandbox = SingularitySandbox(
+            base_image="my_base_image_6021", sandbox_root=sandbox_root
+        )
+        with pytest.raises(RuntimeError, match="Unable to unpack 6021"):
+            with sandbox:
+                pass
+        assert sandbox.sandbox_dir is None
+        assert not any(sandbox_root.iterdir())
+
+
+class Test_EstimateSandboxSpace:
+    def test_local_base_image(self):
+        base_image = Path("base_image_6021.sif")
+        base_image.write_bytes(b"0" * 2**20)
+        sandbox = SingularitySandbox(
+            base_image=base_image, extra_space_estimate=(10, 20)
+        )
+        required_bytes, required_inodes = sandbox._estimate_sandbox_space()
+        assert required_bytes > 2**20
+        assert required_bytes % 2**20 == 10
+        assert required_inodes > 20
+        assert sandbox._estimate_sandbox_space(base_image_only=True) == (
+            required_bytes - 10,
+            required_inodes - 20,
+        )
+
+    def test_unknown_base_image(self):
+        sandbox = SingularitySandbox(base_image="docker://some_image_6021")
+        required_bytes, required_inodes = sandbox._estimate_sandbox_space()
+        assert required_bytes > 0
+        assert required_inodes > 0
+
+
+class TestRecordUsage:
+    def test_not_tracking_usage(self, patch_disable_stream_subprocess):
+        sandbox = SingularitySandbox(base_image="my_base_image_6021")
+        sandbox.architecture = "test"
+        with sandbox:
+            sandbox.record_usage(stage="some_stage_6021")
+        assert sandbox.usage_report == []
+
+    def test_tracking_usage(self, caplog, patch_disable_stream_subprocess):
+        sandbox = SingularitySandbox(base_image="my_base_image_6021", track_usage=True)
+        sandbox.architecture = "test"
+        with caplog.at_level(logging.INFO, logger="cotainr.container"):
+            with sandbox:
+                (sandbox.sandbox_dir / "some_file_6021").write_bytes(b"6021" * 2**18)
+                sandbox.record_usage(stage="some_stage_6021")
+
+        assert [entry["stage"] for entry in sandbox.usage_report] == [
+            "base_image",
+            "some_stage_6021",
+        ]
+        base_entry, stage_entry = sandbox.usage_report
+        assert base_entry["inodes"] == 1
+        assert stage_entry["inodes"] == 2
+        assert stage_entry["bytes"] >= base_entry["bytes"] + 2**20
+        assert (
+            caplog.records[-1]
+            .getMessage()
+            .startswith("Sandbox usage after some_stage_6021: ")
+        )
+
+    def test_outside_sandbox_context(self):
+        sandbox = SingularitySandbox(base_image="my_base_image_6021", track_usage=True)
+        with pytest.raises(ValueError, match="^The operation is only valid inside"):
+            sandbox.record_usage(stage="some_stage_6021")
+
+
+class TestResolveBaseImageDigest:
+    def test_pinned_digest(self):
+        digest = "0123456789abcdef" * 4
+        sandbox = SingularitySandbox(base_image=f"docker://alpine@sha256:{digest}")
+        assert sandbox.resolve_base_image_digest() == f"sha256:{digest}"
+
+    @pytest.mark.parametrize(
+        "base_image",
+        ["docker://alpine:latest", "library://alpine", "non_existing_file_6021"],
+    )
+    def test_unresolvable_digest(self, base_image):
+        sandbox = SingularitySandbox(base_image=base_image)
+        assert sandbox.resolve_base_image_digest() is None
+
+    def test_directory(self):
+        Path("sandbox_dir_6021").mkdir()
+        sandbox = SingularitySandbox(base_image="sandbox_dir_6021")
+        assert sandbox.resolve_base_image_digest() is None
+
+    def test_memoized_local_file_digest(self, monkeypatch):
+        base_image = Path("base_image_6021.sif")
+        base_image.write_bytes(b"some base image 6021")
+        digest = hashlib.sha256(b"some base image 6021").hexdigest()
+        sandbox = SingularitySandbox(base_image=base_image)
+        assert sandbox.resolve_base_image_digest() == f"sha256:{digest}"
+
+        def mock_compute_sha256(*, path):
+            raise AssertionError("PATCH: The digest should have been memoized")
+
+        monkeypatch.setattr(cotainr.util, "compute_sha256", mock_compute_sha256)
+        assert sandbox.resolve_base_image_digest() == f"sha256:{digest}"
+
+        # A modified file must be re-hashed
+        base_image.write_bytes(b"some other base image 6021")
+        with pytest.raises(AssertionError, match="should have been memoized"):
+            sandbox.resolve_base_image_digest()
+
+
+class TestBaseImageIsAvailableLocally:
+    def test_local_base_image(self):
+        Path("base_image_6021.sif").touch()
+        sandbox = SingularitySandbox(base_image="base_image_6021.sif")
+        assert sandbox.base_image_is_available_locally()
+
+    @pytest.mark.parametrize("use_base_image_cache", [True, False])
+    def test_cached_pinned_base_image(
+        self, use_base_image_cache, context_cotainr_cache_dir
+    ):
+        digest = "0123456789abcdef" * 4
+        (context_cotainr_cache_dir / f"base_sandboxes/sha256-{digest}").mkdir(
+            parents=True
+        )
+        sandbox = SingularitySandbox(
+            base_image=f"docker://alpine@sha256:{digest}",
+            use_base_image_cache=use_base_image_cache,
+        )
+        assert sandbox.base_image_is_available_locally() == use_base_image_cache
+
+    @pytest.mark.parametrize(
+        "base_image",
+        [
+            "docker://alpine:latest",
+            f"docker://alpine@sha256:{'0123456789abcdef' * 4}",
+        ],
+    )
+    def test_remote_base_image(self, base_image, context_cotainr_cache_dir):
+        sandbox = SingularitySandbox(base_image=base_image)
+        assert not sandbox.base_image_is_available_locally()
+
+
+class TestPredictArchitecture:
+    @pytest.fixture
+    def fake_sif(self, monkeypatch):
+        base_sif = Path("base_image_6021.sif")
+        base_sif.write_bytes(b"#!/usr/bin/env run-singularity\nSIF_MAGIC_6021")
+        sif_list = {"stdout": ""}
+
+        def mock_run(args, **kwargs):
+            assert args == ["singularity", "--nocolor", "sif", "list", str(base_sif)]
+            return subprocess.CompletedProcess(
+                args=args, returncode=0, stdout=sif_list["stdout"]
+            )
+
+        monkeypatch.setattr(subprocess, "run", mock_run)
+        monkeypatch.setattr(platform, "machine", lambda: "host_arch_6021")
+        return sif_list
+
+    def test_sif_architecture(self, fake_sif):
+        fake_sif["stdout"] = (
+            "ID   |GROUP   |LINK    |SIF POSITION (start-end)  |TYPE\n"
+            "1    |1       |NONE    |32176-32211               |Def.FILE\n"
+            "4    |1       |NONE    |36864-2773237760          "
+            "|FS (Squashfs/*System/arm64)\n"
+        )
+        sandbox = SingularitySandbox(base_image="base_image_6021.sif")
+        assert sandbox.predict_architecture() == "aarch64"
+
+    def test_unknown_sif_architecture(self, fake_sif):
+        fake_sif["stdout"] = (
+            "4    |1       |NONE    |1-2    |FS (Squashfs/*System/6021)\n"
+        )
+        sandbox = SingularitySandbox(base_image="base_image_6021.sif")
+        assert sandbox.predict_architecture() == "host_arch_6021"
+
+    def test_host_architecture(self, monkeypatch):
+        monkeypatch.setattr(platform, "machine", lambda: "host_arch_6021")
+        sandbox = SingularitySandbox(base_image="docker://alpine:latest")
+        assert sandbox.predict_architecture() == "host_arch_6021"
+
+    def test_when_architecture_is_set(self):
+        sandbox = SingularitySandbox(base_image="docker://alpine:latest")
+        sandbox.architecture = "arch_6021"
+        assert sandbox.predict_architecture() == "arch_6021"
+
+
+class TestAddBindPath:
+    def test_bind_path_mounted(self, tmp_path, capsys, patch_disable_stream_subprocess):
+        host_path = tmp_path / "host_dir_6021"
+        host_path.mkdir()
+        sandbox = SingularitySandbox(base_image="my_base_image_6021")
+        sandbox.architecture = "test"
+        with sandbox:
+            sandbox.add_bind_path(host_path=host_path, container_path="/opt/mnt_6021")
+            assert (sandbox.sandbox_dir / "opt/mnt_6021").is_dir()
+            sandbox.run_command_in_container(cmd="ls /opt/mnt_6021")
+
+        stdout_lines = capsys.readouterr().out.rstrip("\n").split("\n")
+        assert f"'--bind', '{host_path}:/opt/mnt_6021'" in stdout_lines[-1]
+
+    def test_bind_point_removed_before_build(
+        self, tmp_path, patch_disable_stream_subprocess
+    ):
+        host_path = tmp_path / "host_dir_6021"
+        host_path.mkdir()
+        sandbox = SingularitySandbox(base_image="my_base_image_6021")
+        sandbox.architecture = "test"
+        with sandbox:
+            sandbox.add_bind_path(host_path=host_path, container_path="/opt/mnt_6021")
+            sandbox.build_image(path=tmp_path / "image_6021.sif")
+            assert not (sandbox.sandbox_dir / "opt/mnt_6021").exists()
+            assert sandbox.bind_paths == {}
+
+    def test_session_restarted(
+        self, tmp_path, patch_disable_stream_subprocess, monkeypatch
+    ):
+        monkeypatch.setattr(SingularitySandbox, "_exec_args", lambda self: [])
+        sandbox = SingularitySandbox(
+            base_image="my_base_image_6021", persistent_session=True
+        )
+        sandbox.architecture = "test"
+        with sandbox:
+            sandbox.run_command_in_container(cmd="true")
+            session = sandbox._session
+            sandbox.add_bind_path(host_path=tmp_path, container_path="/opt/mnt_6021")
+            assert sandbox._session is None
+            assert not session.is_alive
+
+
+class TestAddMetadata:
+    @pytest.mark.parametrize("fingerprint", [None, "sha256:fingerprint_6021"])
+    def test_labels(self, fingerprint, patch_disable_stream_subprocess):
+        sandbox = SingularitySandbox(base_image="my_base_image_6021")
+        sandbox.architecture = "test"
+        with sandbox:
+            labels_path = sandbox.sandbox_dir / ".singularity.d/labels.json"
+            labels_path.parent.mkdir(parents=True)
+            labels_path.write_text(json.dumps({"some_label_6021": "value_6021"}))
+            sandbox.add_metadata(fingerprint=fingerprint)
+            labels = json.loads(labels_path.read_text())
+
+        assert labels["some_label_6021"] == "value_6021"
+        assert labels["cotainr.url"] == "https://github.com/DeiC-HPC/cotainr"
+        assert "cotainr.version" in labels
+        assert "cotainr.command" in labels
+        if fingerprint is None:
+            assert "cotainr.fingerprint" not in labels
+        else:
+            assert labels["cotainr.fingerprint"] == fingerprint
+
+
 class TestAddToEnv:
     def test_add_twice(
         self,
@@ -124,7 +982,7 @@ class TestAddToEnv:
             with SingularitySandbox(base_image=data_cached_alpine_sif) as sandbox:
                 # Test file permissions
                 env_file = sandbox.sandbox_dir / ".singularity.d/env/92-cotainr-env.sh"
-                sandbox._create_file(f=env_file)
+                sandbox._write_file(path=env_file, content="")
                 assert env_file.exists()
                 test_file_mode = env_file.stat().st_mode
                 # file permissions extracted from the last 3 octal digits of st_mode
@@ -186,6 +1044,41 @@ class TestBuildImage:
         stdout_lines = capsys.readouterr().out.rstrip("\n").split("\n")
         assert "args=['singularity', '-q', " in stdout_lines[-1]
 
+    def test_default_no_mksquashfs_args(self, capsys, patch_disable_stream_subprocess):
+        sandbox = SingularitySandbox(base_image="my_base_image_6021")
+        sandbox.architecture = "test"
+        with sandbox:
+            sandbox.build_image(path="some_path_6021")
+        stdout_lines = capsys.readouterr().out.rstrip("\n").split("\n")
+        assert "--mksquashfs-args" not in stdout_lines[-1]
+
+    def test_mksquashfs_args(self, capsys, caplog, patch_disable_stream_subprocess):
+        sandbox = SingularitySandbox(base_image="my_base_image_6021")
+        sandbox.architecture = "test"
+        with caplog.at_level(logging.INFO, logger="cotainr.container"):
+            with sandbox:
+                sandbox.build_image(
+                    path="some_path_6021",
+                    compression="zstd",
+                    compression_level=3,
+                    block_size="1M",
+                    processors=4,
+                )
+        stdout_lines = capsys.readouterr().out.rstrip("\n").split("\n")
+        assert (
+            "'--mksquashfs-args', "
+            "'-comp zstd -Xcompression-level 3 -b 1048576 -processors 4', "
+            "'some_path_6021'"
+        ) in stdout_lines[-1]
+        log_messages = [rec.getMessage() for rec in caplog.records]
+        assert (
+            "Using mksquashfs args: -comp zstd -Xcompression-level 3 -b 1048576 "
+            "-processors 4"
+        ) in log_messages
+        assert any(
+            msg.startswith("Built SIF image some_path_6021 in ") for msg in log_messages
+        )
+
     def test_environment_not_overwritten(
         self, data_cached_alpine_sif, singularity_exec, tmp_path
     ):
@@ -273,7 +1166,35 @@ class TestBuildImage:
         assert base_image_os_release == built_image_os_release
 
 
-@pytest.mark.singularity_integration
+class TestCommandUsage:
+    def test_command_usage(self, monkeypatch):
+        def mock_stream_subprocess(*, args, log_dispatcher, **kwargs):
+            process = subprocess.CompletedProcess(args, returncode=0, stdout="")
+            process.resource_usage = cotainr.util.ResourceUsage(
+                wall_time=6.021, user_time=2.0, system_time=1.0
+            )
+            return process
+
+        monkeypatch.setattr(cotainr.util, "stream_subprocess", mock_stream_subprocess)
+        sandbox = SingularitySandbox(base_image="my_base_image_6021")
+        sandbox.architecture = "test"
+        with sandbox:
+            sandbox.add_bind_path(host_path="/tmp", container_path="/opt/tmp_6021")
+            sandbox.run_command_in_container(cmd="ls '/some dir_6021'")
+
+        unpack_usage, command_usage = sandbox.command_usage
+        assert unpack_usage["command"].startswith("singularity -q --nocolor build ")
+        assert command_usage == {
+            "command": "ls '/some dir_6021'",
+            "wall_time": 6.021,
+            "user_time": 2.0,
+            "system_time": 1.0,
+            "max_rss": None,
+            "block_input": None,
+            "block_output": None,
+        }
+
+
 class TestRunCommandInContainer:
     def test_add_verbosity_arg(self, capsys, patch_disable_stream_subprocess):
         sandbox = SingularitySandbox(base_image="my_base_image_6021")
@@ -283,6 +1204,15 @@ class TestRunCommandInContainer:
         stdout_lines = capsys.readouterr().out.rstrip("\n").split("\n")
         assert "args=['singularity', '-q', " in stdout_lines[-1]
 
+    def test_env(self, capsys, patch_disable_stream_subprocess):
+        sandbox = SingularitySandbox(base_image="my_base_image_6021")
+        sandbox.architecture = "test"
+        with sandbox:
+            sandbox.run_command_in_container(cmd="ls /", env={"VAR_6021": "some value"})
+        stdout_lines = capsys.readouterr().out.rstrip("\n").split("\n")
+        assert "'env', 'VAR_6021=some value', 'ls', '/']" in stdout_lines[-1]
+
+    @pytest.mark.singularity_integration
     def test_correct_umask(self, data_cached_alpine_sif, context_set_umask):
         test_file = "test_file_6021"
         with context_set_umask(0o007):  # default umask on LUMI
@@ -295,6 +1225,7 @@ class TestRunCommandInContainer:
                 test_file_permissions = test_file_mode & 0o777
                 assert oct(test_file_permissions) == "0o644"
 
+    @pytest.mark.singularity_integration
     def test_error_handling(self, data_cached_alpine_sif):
         cmd = "some6021 non-meaningful command"
         with SingularitySandbox(base_image=data_cached_alpine_sif) as sandbox:
@@ -303,12 +1234,83 @@ class TestRunCommandInContainer:
             ):
                 sandbox.run_command_in_container(cmd=cmd)
 
+    @pytest.mark.singularity_integration
     def test_no_home(self, data_cached_alpine_sif):
         with SingularitySandbox(base_image=data_cached_alpine_sif) as sandbox:
             process = sandbox.run_command_in_container(cmd="ls -l /home")
         assert process.stdout.strip() == "total 0"
 
 
+class TestPersistentSession:
+    @pytest.fixture
+    def patch_host_shell_session(self, monkeypatch):
+        # Run the session shell directly on the host instead of in a container
+        monkeypatch.setattr(SingularitySandbox, "_exec_args", lambda self: [])
+
+    def test_commands_share_session(
+        self, patch_disable_stream_subprocess, patch_host_shell_session
+    ):
+        sandbox = SingularitySandbox(
+            base_image="my_base_image_6021", persistent_session=True
+        )
+        sandbox.architecture = "test"
+        with sandbox:
+            first_process = sandbox.run_command_in_container(cmd="echo first_6021")
+            session = sandbox._session
+            second_process = sandbox.run_command_in_container(cmd="echo second_6021")
+            assert sandbox._session is session
+            assert session.is_alive
+
+        assert first_process.stdout == "first_6021\n"
+        assert second_process.stdout == "second_6021\n"
+        assert sandbox._session is None
+        assert not session.is_alive
+
+    def test_no_shell_interpretation(
+        self, patch_disable_stream_subprocess, patch_host_shell_session
+    ):
+        sandbox = SingularitySandbox(
+            base_image="my_base_image_6021", persistent_session=True
+        )
+        sandbox.architecture = "test"
+        with sandbox:
+            process = sandbox.run_command_in_container(cmd="echo 6021; echo $HOME")
+        assert process.stdout == "6021; echo $HOME\n"
+
+    def test_error_handling(
+        self, patch_disable_stream_subprocess, patch_host_shell_session
+    ):
+        cmd = "some6021 non-meaningful command"
+        sandbox = SingularitySandbox(
+            base_image="my_base_image_6021", persistent_session=True
+        )
+        sandbox.architecture = "test"
+        with sandbox:
+            with pytest.raises(
+                ValueError, match=f"^Invalid command {cmd=} passed to Singularity"
+            ):
+                sandbox.run_command_in_container(cmd=cmd)
+
+    def test_restart_after_add_to_env(
+        self,
+        patch_disable_stream_subprocess,
+        patch_fake_singularity_sandbox_env_folder,
+        patch_host_shell_session,
+    ):
+        sandbox = SingularitySandbox(
+            base_image="my_base_image_6021", persistent_session=True
+        )
+        sandbox.architecture = "test"
+        with sandbox:
+            sandbox.run_command_in_container(cmd="true")
+            session = sandbox._session
+            sandbox.add_to_env(shell_script="some shell script 6021")
+            assert sandbox._session is None
+            assert not session.is_alive
+            sandbox.run_command_in_container(cmd="true")
+            assert sandbox._session is not session
+
+
 class Test_AssertWithinSandboxContext:
     def test_pass_inside_sandbox(self):
         sandbox = SingularitySandbox(base_image="my_base_image_6021")
@@ -324,14 +1326,48 @@ class Test_AssertWithinSandboxContext:
             sandbox._assert_within_sandbox_context()
 
 
-class Test_CreateFile:
-    def test_broken_subprocess(self, patch_disable_stream_subprocess):
+class Test_WriteFile:
+    @pytest.mark.parametrize("umask", [0o002, 0o007, 0o022, 0o077])
+    def test_permissions_ignore_umask(
+        self, umask, context_set_umask, patch_disable_stream_subprocess
+    ):
+        sandbox = SingularitySandbox(base_image="my_base_image_6021")
+        sandbox.architecture = "test"
+        with sandbox:
+            sandbox.sandbox_dir.mkdir(exist_ok=True)
+            any_file = sandbox.sandbox_dir / "anyfile_6021.txt"
+            with context_set_umask(umask):
+                sandbox._write_file(path=any_file, content="content_6021")
+            assert any_file.read_text() == "content_6021"
+            assert oct(any_file.stat().st_mode & 0o777) == "0o644"
+
+    def test_replace_with_shorter_content(self, patch_disable_stream_subprocess):
+        sandbox = SingularitySandbox(base_image="my_base_image_6021")
+        sandbox.architecture = "test"
+        with sandbox:
+            sandbox.sandbox_dir.mkdir(exist_ok=True)
+            any_file = sandbox.sandbox_dir / "anyfile_6021.json"
+            any_file.write_text('{"some_long_key_6021": "some_long_value_6021"}')
+            sandbox._write_file(path=any_file, content='{"k": "v"}', mode=0o600)
+            assert any_file.read_text() == '{"k": "v"}'
+            assert oct(any_file.stat().st_mode & 0o777) == "0o600"
+            assert [p.name for p in sandbox.sandbox_dir.iterdir()] == [
+                "anyfile_6021.json"
+            ]
+
+    def test_no_partial_file_on_error(self, patch_disable_stream_subprocess):
         sandbox = SingularitySandbox(base_image="my_base_image_6021")
         sandbox.architecture = "test"
         with sandbox:
-            any_file = sandbox.sandbox_dir / "anyfile.txt"
-            with pytest.raises(FileNotFoundError):
-                sandbox._create_file(f=any_file)
+            sandbox.sandbox_dir.mkdir(exist_ok=True)
+            any_file = sandbox.sandbox_dir / "anyfile_6021.txt"
+            any_file.write_text("original_6021")
+            with pytest.raises(TypeError):
+                sandbox._write_file(path=any_file, content=6021)
+            assert any_file.read_text() == "original_6021"
+            assert [p.name for p in sandbox.sandbox_dir.iterdir()] == [
+                "anyfile_6021.txt"
+            ]
 
 
 class Test_SubprocessRunner:
@@ -7,7 +7,14 @@ Licensed under the European Union Public License (EUPL) 1.2
 
 """
 
+import contextlib
+import hashlib
+import io
+from pathlib import Path
+import subprocess
 import sys
+import urllib.error
+import urllib.request
 
 import pytest
 
@@ -60,15 +67,185 @@ def patch_disable_conda_install_download_miniforge_installer(monkeypatch):
 
     The installer download is replaced by a method that, in place of the
     installer, creates a file containing a line saying that this is where the
-    installer would have been downloaded to.
+    installer would have been downloaded to. Fetching the installer into the
+    installer cache, e.g. while creating the sandbox, is disabled as well and
+    the architectures it is fetched for are recorded in the returned list.
     """
+    fetched_architectures = []
 
     def mock_download_miniforge_installer(self, *, installer_path):
         installer_path.write_text("Miniforge installer downloaded to this file")
         assert installer_path.exists()
 
+    def mock_fetch_miniforge_installer(*, architecture, installer_cache_max_age):
+        fetched_architectures.append(architecture)
+
+    monkeypatch.setattr(
+        cotainr.pack.CondaInstall,
+        "_download_miniforge_installer",
+        mock_download_miniforge_installer,
+    )
+    monkeypatch.setattr(
+        cotainr.pack.CondaInstall,
+        "fetch_miniforge_installer",
+        staticmethod(mock_fetch_miniforge_installer),
+    )
+
+    return fetched_architectures
+
+
+@pytest.fixture
+def patch_fake_conda_install_run_command_in_sandbox(monkeypatch):
+    """
+    Fake the commands run in the sandbox by CondaInstall.
+
+    The commands are recorded in the returned list instead of being run. The
+    Miniforge installer command creates a fake Conda prefix, "conda info
+    --base" reports the Conda prefix, and "conda list --explicit" reports a
+    fake explicit package list.
+    """
+    cmds = []
+
+    def mock_run_command_in_sandbox(self, *, cmd, env=None, log_dispatcher=None):
+        cmds.append(cmd)
+        stdout = ""
+        if cmd.startswith("bash "):
+            prefix_dir = Path(self.sandbox.sandbox_dir) / self.prefix.lstrip("/")
+            (prefix_dir / "conda-meta").mkdir(parents=True)
+            (prefix_dir / "bin_6021").write_text("PATCH: Bootstrapped Conda")
+        elif cmd == "conda info --base":
+            stdout = self.prefix
+        elif cmd.startswith("conda list --explicit"):
+            stdout = (
+                "@EXPLICIT\n"
+                "https://conda.anaconda.org/conda-forge/noarch/pkg_6021-1.0-0.conda#6021\n"
+            )
+        return subprocess.CompletedProcess(args=cmd, returncode=0, stdout=stdout)
+
+    monkeypatch.setattr(
+        cotainr.pack.CondaInstall,
+        "_run_command_in_sandbox",
+        mock_run_command_in_sandbox,
+    )
+
+    return cmds
+
+
+@pytest.fixture
+def patch_fake_conda_install_download_miniforge_installer_with_license(
+    monkeypatch,
+):
+    """
+    Replace CondaInstall._download_minforge_installer(...) by a fake installer.
+
+    The installer download is replaced by a method that, in place of the
+    installer, creates a file with a shell script header, including a license
+    heredoc similar to the one in the Miniforge installer, followed by a
+    binary payload.
+    """
+
+    def mock_download_miniforge_installer(self, *, installer_path):
+        installer_path.write_bytes(
+            b"#!/bin/sh\n"
+            b'printf "In order to continue the installation process, please review '
+            b'the license\\n"\n'
+            b'printf "Please, press ENTER to continue\\n"\n'
+            b"read -r dummy\n"
+            b"\"$pager\" <<'EOF'\n"
+            b"STUB:\nThis is the license terms...\n"
+            b"EOF\n"
+            b'printf "Do you accept the license terms? [yes|no]\\n"\n'
+            b"exit 0\n"
+            b"@@END_HEADER@@\n"
+            b"\x00\xff PATCH: Binary payload <<EOF\nNot the license\nEOF\n"
+        )
+
     monkeypatch.setattr(
         cotainr.pack.CondaInstall,
         "_download_miniforge_installer",
         mock_download_miniforge_installer,
     )
+
+
+@pytest.fixture
+def patch_urllib_urlopen_miniforge_release(monkeypatch):
+    """
+    Fake the Miniforge GitHub releases.
+
+    The `urlopen` contextmanager is replaced by a mock that redirects the
+    "latest" release to the version in the returned dict, serves a fake
+    installer and its SHA256 digest for any release download, and records the
+    opened urls and requested ranges in the returned dict. Installer downloads
+    honor HTTP Range requests and, if "interrupt_after" in the returned dict is
+    set, the next installer download is interrupted after that many bytes. If
+    "last_modified" is set, it is reported as the installer Last-Modified time.
+    """
+    release = {
+        "last_modified": None,
+        "version": "6021.0.0-0",
+        "urls": [],
+        "ranges": [],
+        "corrupt_installer": False,
+        "interrupt_after": None,
+    }
+
+    class MockResponse(io.BytesIO):
+        def __init__(self, content, url, *, status=200, interrupt_after=None):
+            super().__init__(content)
+            self.url = url
+            self.status = status
+            self.headers = {"Content-Length": str(len(content))}
+            self.interrupt_after = interrupt_after
+
+        def geturl(self):
+            return self.url
+
+        def read(self, size=-1):
+            if self.interrupt_after is not None:
+                if self.tell() >= self.interrupt_after:
+                    raise ConnectionResetError("PATCH: Connection reset")
+                size = min(size, self.interrupt_after - self.tell())
+            return super().read(size)
+
+    @contextlib.contextmanager
+    def mock_urlopen(request, *args, **kwargs):
+        url = request.full_url
+        release["urls"].append(url)
+        releases_url = "https://github.com/conda-forge/miniforge/releases"
+        if url == f"{releases_url}/latest":
+            yield MockResponse(b"", f"{releases_url}/tag/{release['version']}")
+        elif url.startswith(f"{releases_url}/download/"):
+            installer_name = url.rsplit("/", maxsplit=1)[-1].removesuffix(".sha256")
+            installer_content = f"PATCH: Installer for {url.removesuffix('.sha256')}"
+            if url.endswith(".sha256"):
+                digest = hashlib.sha256(installer_content.encode()).hexdigest()
+                yield MockResponse(f"{digest}  {installer_name}\n".encode(), url)
+                return
+
+            content = (
+                b"PATCH: Corrupt installer"
+                if release["corrupt_installer"]
+                else installer_content.encode()
+            )
+            status = 200
+            range_header = request.get_header("Range")
+            release["ranges"].append(range_header)
+            if range_header is not None:
+                content = content[int(range_header.strip("bytes=-")) :]
+                status = 206
+            interrupt_after, release["interrupt_after"] = (
+                release["interrupt_after"],
+                None,
+            )
+            response = MockResponse(
+                content, url, status=status, interrupt_after=interrupt_after
+            )
+            if release["last_modified"] is not None:
+                response.headers["Last-Modified"] = release["last_modified"]
+            yield response
+        else:
+            raise urllib.error.URLError(f"PATCH: Unexpected {url=}")
+
+    monkeypatch.setattr(urllib.request, "urlopen", mock_urlopen)
+
+    return release
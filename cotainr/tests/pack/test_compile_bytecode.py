@@ -0,0 +1,146 @@
+"""
+cotainr - a user space Apptainer/Singularity container builder.
+
+Copyright DeiC, deic.dk
+Licensed under the European Union Public License (EUPL) 1.2
+- see the LICENSE file for details.
+
+"""
+
+import importlib.util
+import logging
+import re
+import shlex
+import subprocess
+import sys
+
+import pytest
+
+from cotainr.container import SingularitySandbox
+from cotainr.pack import compile_bytecode
+
+from ..container.patches import patch_disable_singularity_sandbox_subprocess_runner
+
+
+@pytest.fixture
+def sandbox_with_conda_env(
+    monkeypatch, patch_disable_singularity_sandbox_subprocess_runner
+):
+    """
+    Create a sandbox with a fake Conda environment at /opt/conda_env_6021.
+
+    Commands run in the sandbox are run on the host using the Python
+    interpreter running the tests, with paths in the container mapped to the
+    sandbox.
+    """
+
+    def mock_run_command_in_container(
+        self, *, cmd, env=None, custom_log_dispatcher=None
+    ):
+        python, *args = shlex.split(cmd)
+        assert python == "/opt/conda_env_6021/bin/python"
+        args = [
+            str(self.sandbox_dir) + arg if arg.startswith("/opt/") else arg
+            for arg in args
+        ]
+        return subprocess.run(
+            [sys.executable, *args], check=True, capture_output=True, text=True
+        )
+
+    with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+        monkeypatch.setattr(
+            SingularitySandbox,
+            "run_command_in_container",
+            mock_run_command_in_container,
+        )
+        site_packages_dir = (
+            sandbox.sandbox_dir / "opt/conda_env_6021/lib/python3.12/site-packages"
+        )
+        (site_packages_dir / "pkg_6021").mkdir(parents=True)
+        (site_packages_dir / "pkg_6021/__init__.py").write_text("x = 6021\n")
+        (site_packages_dir / "pkg_6021/core.py").write_text("y = 6021\n")
+        (site_packages_dir / "pkg_6021/template.py").write_text("{{ invalid 6021 }}\n")
+        yield sandbox
+
+
+class TestCompileBytecode:
+    @pytest.mark.parametrize(
+        "invalidation_mode", ["timestamp", "checked-hash", "unchecked-hash"]
+    )
+    def test_compile_site_packages(
+        self, invalidation_mode, sandbox_with_conda_env, caplog
+    ):
+        caplog.set_level(logging.INFO)
+        pkg_dir = (
+            sandbox_with_conda_env.sandbox_dir
+            / "opt/conda_env_6021/lib/python3.12/site-packages/pkg_6021"
+        )
+        modules_compiled = compile_bytecode(
+            sandbox=sandbox_with_conda_env,
+            env_prefix="/opt/conda_env_6021",
+            invalidation_mode=invalidation_mode,
+        )
+        assert modules_compiled == 2
+        pyc_paths = sorted((pkg_dir / "__pycache__").glob("*.pyc"))
+        assert [pyc_path.name.split(".")[0] for pyc_path in pyc_paths] == [
+            "__init__",
+            "core",
+        ]
+        # The flags field of the pyc header encodes the invalidation mode
+        flags = {"timestamp": 0, "checked-hash": 3, "unchecked-hash": 1}
+        assert pyc_paths[0].read_bytes()[:8] == (
+            importlib.util.MAGIC_NUMBER + flags[invalidation_mode].to_bytes(4, "little")
+        )
+        assert re.search(
+            r"Compiled 2 Python modules in /opt/conda_env_6021 to bytecode",
+            caplog.text,
+        )
+
+    def test_only_count_compiled_modules(self, sandbox_with_conda_env):
+        # Up to date timestamp based bytecode is not recompiled
+        for _ in range(2):
+            modules_compiled = compile_bytecode(
+                sandbox=sandbox_with_conda_env,
+                env_prefix="/opt/conda_env_6021",
+                invalidation_mode="timestamp",
+            )
+        assert modules_compiled == 0
+
+    @pytest.mark.parametrize(
+        ["invalidation_mode", "flags"], [("checked-hash", 3), ("unchecked-hash", 1)]
+    )
+    def test_recompile_timestamp_bytecode(
+        self, invalidation_mode, flags, sandbox_with_conda_env
+    ):
+        pkg_dir = (
+            sandbox_with_conda_env.sandbox_dir
+            / "opt/conda_env_6021/lib/python3.12/site-packages/pkg_6021"
+        )
+        compile_bytecode(
+            sandbox=sandbox_with_conda_env,
+            env_prefix="/opt/conda_env_6021",
+            invalidation_mode="timestamp",
+        )
+        modules_compiled = compile_bytecode(
+            sandbox=sandbox_with_conda_env,
+            env_prefix="/opt/conda_env_6021",
+            invalidation_mode=invalidation_mode,
+        )
+        assert modules_compiled == 2
+        for pyc_path in (pkg_dir / "__pycache__").glob("*.pyc"):
+            assert int.from_bytes(pyc_path.read_bytes()[4:8], "little") == flags
+
+    def test_no_site_packages(self, sandbox_with_conda_env, caplog):
+        assert (
+            compile_bytecode(sandbox=sandbox_with_conda_env, env_prefix="/opt/no_6021")
+            == 0
+        )
+        assert "No site-packages found in /opt/no_6021 to compile" in caplog.text
+
+    def test_invalid_invalidation_mode(self, sandbox_with_conda_env):
+        with pytest.raises(ValueError, match="^Invalid invalidation_mode='never'"):
+            compile_bytecode(
+                sandbox=sandbox_with_conda_env,
+                env_prefix="/opt/conda_env_6021",
+                invalidation_mode="never",
+            )
@@ -7,10 +7,15 @@ Licensed under the European Union Public License (EUPL) 1.2
 
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import json
 import logging
+import os
+from pathlib import Path
 import platform
 import re
 import subprocess
+import time
 import urllib.error
 
 import pytest
@@ -20,12 +25,17 @@ from cotainr.pack import CondaInstall
 from cotainr.tracing import LogSettings
 
 from ..container.data import data_cached_ubuntu_sif
-from ..container.patches import patch_disable_singularity_sandbox_subprocess_runner
+from ..container.patches import (
+    patch_disable_singularity_sandbox_subprocess_runner,
+    patch_fake_singularity_sandbox_env_folder,
+)
 from .patches import (
     patch_disable_conda_install_bootstrap_conda,
     patch_disable_conda_install_download_miniforge_installer,
+    patch_fake_conda_install_download_miniforge_installer_with_license,
+    patch_fake_conda_install_run_command_in_sandbox,
+    patch_urllib_urlopen_miniforge_release,
 )
-from .stubs import StubEmptyLicensePopen, StubShowLicensePopen
 
 
 class TestConstructor:
@@ -99,6 +109,22 @@ class TestConstructor:
         assert clean_cmd.startswith("PATCH: Ran command in sandbox:")
         assert "'conda', 'clean', '-y', '-a'" in clean_cmd
 
+    def test_record_usage(
+        self,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        with SingularitySandbox(
+            base_image="my_base_image_6021", track_usage=True
+        ) as sandbox:
+            CondaInstall(sandbox=sandbox, license_accepted=True)
+        assert [entry["stage"] for entry in sandbox.usage_report] == [
+            "base_image",
+            "conda_bootstrap",
+            "conda_cleanup",
+        ]
+
     def test_setup_log_dispatcher(
         self,
         patch_disable_conda_install_bootstrap_conda,
@@ -163,6 +189,415 @@ class TestAddEnvironment:
             )
 
 
+class TestAddEnvironments:
+    @pytest.fixture
+    def recorded_envs(
+        self, patch_fake_conda_install_run_command_in_sandbox, monkeypatch
+    ):
+        """Record the commands and environments of commands run in the sandbox."""
+        cmd_envs = {}
+        fake_run_command_in_sandbox = CondaInstall._run_command_in_sandbox
+
+        def mock_run_command_in_sandbox(self, *, cmd, env=None, log_dispatcher=None):
+            cmd_envs[cmd] = env
+            if cmd.startswith("conda env create"):
+                # Fake a download to the private package folder
+                pkgs_dir = env["CONDA_PKGS_DIRS"].split(",")[0]
+                pkgs_dir = Path(self.sandbox.sandbox_dir) / pkgs_dir.lstrip("/")
+                pkg_name = f"pkg_{cmd.split()[-2]}-1.0-0"
+                (pkgs_dir / pkg_name / "info").mkdir(parents=True)
+                (pkgs_dir / f"{pkg_name}.conda").write_text("PATCH: package")
+            return fake_run_command_in_sandbox(
+                self, cmd=cmd, env=env, log_dispatcher=log_dispatcher
+            )
+
+        monkeypatch.setattr(
+            CondaInstall, "_run_command_in_sandbox", mock_run_command_in_sandbox
+        )
+        return cmd_envs
+
+    def test_concurrent_environments(
+        self,
+        tmp_path,
+        recorded_envs,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        pkgs_cache_dir = tmp_path / "conda_pkgs_6021"
+        with SingularitySandbox(
+            base_image="my_base_image_6021", track_usage=True
+        ) as sandbox:
+            conda_install = CondaInstall(
+                sandbox=sandbox,
+                license_accepted=True,
+                env_lock="ignore",
+                pkgs_cache_dir=pkgs_cache_dir,
+            )
+            conda_install.add_environments(
+                envs={"env_6021": "env_6021.yml", "env_6022": "env_6022.yml"},
+                max_workers=2,
+            )
+            prefix_dir = sandbox.sandbox_dir / "opt/cotainr/conda"
+            assert not (prefix_dir / "pkgs_env_6021").exists()
+            assert not (prefix_dir / "pkgs_env_6022").exists()
+            stages = [usage["stage"] for usage in sandbox.usage_report]
+
+        for name in ["env_6021", "env_6022"]:
+            assert recorded_envs[f"conda env create -f {name}.yml -n {name} -q"] == {
+                "CONDA_PKGS_DIRS": (
+                    f"/opt/cotainr/conda/pkgs_{name},/opt/cotainr/conda_pkgs_cache"
+                )
+            }
+            assert (pkgs_cache_dir / f"pkg_{name}-1.0-0.conda").is_file()
+            assert (pkgs_cache_dir / f"pkg_{name}-1.0-0/info").is_dir()
+        assert stages[-2:] == [
+            "conda_add_environment[env_6021]",
+            "conda_add_environment[env_6022]",
+        ]
+
+    def test_private_pkgs_dirs_removed_without_cache(
+        self,
+        recorded_envs,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            conda_install = CondaInstall(
+                sandbox=sandbox, license_accepted=True, env_lock="ignore"
+            )
+            conda_install.add_environments(
+                envs={"env_6021": "env_6021.yml", "env_6022": "env_6022.yml"}
+            )
+            assert not list(
+                (sandbox.sandbox_dir / "opt/cotainr/conda").glob("pkgs_env_*")
+            )
+
+        assert recorded_envs["conda env create -f env_6021.yml -n env_6021 -q"] == {
+            "CONDA_PKGS_DIRS": "/opt/cotainr/conda/pkgs_env_6021,/opt/cotainr/conda/pkgs"
+        }
+
+    def test_log_dispatcher_per_environment(
+        self,
+        monkeypatch,
+        recorded_envs,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        log_dispatchers = {}
+        fake_run_command_in_sandbox = CondaInstall._run_command_in_sandbox
+
+        def mock_run_command_in_sandbox(self, *, cmd, env=None, log_dispatcher=None):
+            log_dispatchers[cmd] = log_dispatcher
+            return fake_run_command_in_sandbox(
+                self, cmd=cmd, env=env, log_dispatcher=log_dispatcher
+            )
+
+        monkeypatch.setattr(
+            CondaInstall, "_run_command_in_sandbox", mock_run_command_in_sandbox
+        )
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            conda_install = CondaInstall(
+                sandbox=sandbox,
+                license_accepted=True,
+                env_lock="ignore",
+                log_settings=LogSettings(verbosity=1),
+            )
+            conda_install.add_environments(
+                envs={"env_6021": "env_6021.yml", "env_6022": "env_6022.yml"},
+                max_workers=2,
+            )
+
+        for name in ["env_6021", "env_6022"]:
+            log_dispatcher = log_dispatchers[
+                f"conda env create -f {name}.yml -n {name}"
+            ]
+            assert log_dispatcher is not conda_install.log_dispatcher
+            assert log_dispatcher.logger_stdout.name == f"CondaInstall[{name}].out"
+            assert log_dispatcher.logger_stderr.name == f"CondaInstall[{name}].err"
+
+    @pytest.mark.parametrize(
+        "envs,persistent_session",
+        [
+            ({"env_6021": "env_6021.yml"}, False),
+            ({"env_6021": "env_6021.yml", "env_6022": "env_6022.yml"}, True),
+        ],
+    )
+    def test_sequential_environments(
+        self,
+        envs,
+        persistent_session,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_fake_conda_install_run_command_in_sandbox,
+        patch_disable_singularity_sandbox_subprocess_runner,
+        monkeypatch,
+    ):
+        cmds = patch_fake_conda_install_run_command_in_sandbox
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            conda_install = CondaInstall(
+                sandbox=sandbox, license_accepted=True, env_lock="ignore"
+            )
+            sandbox.persistent_session = persistent_session
+            cmds.clear()
+            monkeypatch.setattr(
+                ThreadPoolExecutor,
+                "submit",
+                lambda *args, **kwargs: pytest.fail("PATCH: Must not be concurrent"),
+            )
+            conda_install.add_environments(envs=envs)
+
+        assert cmds == [
+            f"conda env create -f {path} -n {name} -q" for name, path in envs.items()
+        ]
+
+
+class TestAddPipRequirements:
+    def test_pip_without_wheel_cache(
+        self,
+        capsys,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            conda_install = CondaInstall(sandbox=sandbox, license_accepted=True)
+            capsys.readouterr()
+            conda_install.add_pip_requirements(
+                path="requirements_6021.txt", name="env_6021", jobs=4
+            )
+
+        pip_install_cmd = capsys.readouterr().out.strip().split("\n")[0]
+        assert (
+            "'env', 'PIP_NO_CACHE_DIR=1', 'PIP_DISABLE_PIP_VERSION_CHECK=1', "
+            "'/opt/cotainr/conda/envs/env_6021/bin/python', '-m', 'pip', 'install', "
+            "'-r', 'requirements_6021.txt']"
+        ) in pip_install_cmd
+
+    def test_uv_with_wheel_cache(
+        self,
+        tmp_path,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_fake_conda_install_run_command_in_sandbox,
+        patch_disable_singularity_sandbox_subprocess_runner,
+        monkeypatch,
+    ):
+        envs = []
+        cmds = patch_fake_conda_install_run_command_in_sandbox
+        fake_run_command_in_sandbox = CondaInstall._run_command_in_sandbox
+
+        def mock_run_command_in_sandbox(self, *, cmd, env=None, log_dispatcher=None):
+            envs.append(env)
+            return fake_run_command_in_sandbox(
+                self, cmd=cmd, env=env, log_dispatcher=log_dispatcher
+            )
+
+        monkeypatch.setattr(
+            CondaInstall, "_run_command_in_sandbox", mock_run_command_in_sandbox
+        )
+        wheel_cache_dir = tmp_path / "pip_wheels_6021"
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            conda_install = CondaInstall(
+                sandbox=sandbox, license_accepted=True, wheel_cache_dir=wheel_cache_dir
+            )
+            cmds.clear()
+            envs.clear()
+            for _ in range(2):
+                conda_install.add_pip_requirements(
+                    path="requirements_6021.txt",
+                    name="env_6021",
+                    installer="uv",
+                    jobs=4,
+                )
+            assert sandbox.bind_paths[wheel_cache_dir] == "/opt/cotainr/pip_wheel_cache"
+
+        uv_install_cmd = (
+            "/opt/cotainr/conda/bin/uv pip install "
+            "--python /opt/cotainr/conda/envs/env_6021/bin/python "
+            "-r requirements_6021.txt"
+        )
+        # uv is not left in the Conda base environment after each install
+        assert (
+            cmds
+            == [
+                "conda install -y -n base -c conda-forge uv -q",
+                uv_install_cmd,
+                "conda remove -y -n base uv -q",
+            ]
+            * 2
+        )
+        assert envs[1] == {
+            "UV_CACHE_DIR": "/opt/cotainr/pip_wheel_cache/uv",
+            "UV_LINK_MODE": "copy",
+            "UV_CONCURRENT_DOWNLOADS": "4",
+            "UV_CONCURRENT_BUILDS": "4",
+            "UV_CONCURRENT_INSTALLS": "4",
+        }
+        assert (wheel_cache_dir / "uv").is_dir()
+
+    def test_uv_removed_after_failed_install(
+        self,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_fake_conda_install_run_command_in_sandbox,
+        patch_disable_singularity_sandbox_subprocess_runner,
+        monkeypatch,
+    ):
+        cmds = patch_fake_conda_install_run_command_in_sandbox
+        fake_run_command_in_sandbox = CondaInstall._run_command_in_sandbox
+
+        def mock_run_command_in_sandbox(self, *, cmd, env=None, log_dispatcher=None):
+            result = fake_run_command_in_sandbox(
+                self, cmd=cmd, env=env, log_dispatcher=log_dispatcher
+            )
+            if " pip install " in cmd:
+                raise subprocess.CalledProcessError(1, cmd)
+            return result
+
+        monkeypatch.setattr(
+            CondaInstall, "_run_command_in_sandbox", mock_run_command_in_sandbox
+        )
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            conda_install = CondaInstall(sandbox=sandbox, license_accepted=True)
+            cmds.clear()
+            with pytest.raises(subprocess.CalledProcessError):
+                conda_install.add_pip_requirements(
+                    path="requirements_6021.txt", name="env_6021", installer="uv"
+                )
+
+        assert cmds[-1] == "conda remove -y -n base uv -q"
+
+    def test_invalid_installer(
+        self,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            conda_install = CondaInstall(sandbox=sandbox, license_accepted=True)
+            with pytest.raises(ValueError, match="^Invalid installer='poetry'"):
+                conda_install.add_pip_requirements(
+                    path="requirements_6021.txt", name="env_6021", installer="poetry"
+                )
+
+
+class TestAddEnvironmentLock:
+    @pytest.fixture
+    def conda_env_file(self, tmp_path):
+        conda_env_file = tmp_path / "conda_env_6021.yml"
+        conda_env_file.write_text(
+            "channels:\n  - conda-forge\ndependencies:\n  - pkg_6021=1.0\n"
+        )
+        return conda_env_file
+
+    def test_lock_stored_and_used(
+        self,
+        caplog,
+        conda_env_file,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_fake_conda_install_run_command_in_sandbox,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        caplog.set_level(logging.INFO)
+        cmds = patch_fake_conda_install_run_command_in_sandbox
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            conda_install = CondaInstall(sandbox=sandbox, license_accepted=True)
+            conda_install.add_environment(path=conda_env_file, name="env_6021")
+            env_lock_path = conda_install._get_env_lock_path(path=conda_env_file)
+            assert env_lock_path.read_text().startswith("@EXPLICIT\n")
+            assert cmds[-1] == "conda list --explicit --md5 -n env_6021"
+
+            cmds.clear()
+            conda_install.add_environment(path=conda_env_file, name="env_6021")
+
+        assert cmds == [
+            f"conda create -y -n env_6021 --file "
+            f"{conda_env_file.with_name('env_6021.lock.txt')} -q"
+        ]
+        assert not conda_env_file.with_name("env_6021.lock.txt").exists()
+        assert (
+            f"Installing Conda environment from lock {env_lock_path}" in caplog.messages
+        )
+
+    def test_refresh_lock(
+        self,
+        conda_env_file,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_fake_conda_install_run_command_in_sandbox,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        cmds = patch_fake_conda_install_run_command_in_sandbox
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            conda_install = CondaInstall(sandbox=sandbox, license_accepted=True)
+            env_lock_path = conda_install._get_env_lock_path(path=conda_env_file)
+            env_lock_path.parent.mkdir(parents=True)
+            env_lock_path.write_text("@EXPLICIT\nstale_6021\n")
+            conda_install.env_lock = "refresh"
+            conda_install.add_environment(path=conda_env_file, name="env_6021")
+
+        assert cmds[-2].startswith("conda env create -f")
+        assert "stale_6021" not in env_lock_path.read_text()
+
+    def test_ignore_lock(
+        self,
+        context_cotainr_cache_dir,
+        conda_env_file,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_fake_conda_install_run_command_in_sandbox,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            conda_install = CondaInstall(
+                sandbox=sandbox, license_accepted=True, env_lock="ignore"
+            )
+            conda_install.add_environment(path=conda_env_file, name="env_6021")
+
+        assert not (context_cotainr_cache_dir / "conda_env_locks").exists()
+
+    def test_no_lock_with_pip_dependencies(
+        self,
+        conda_env_file,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        conda_env_file.write_text(
+            "dependencies:\n  - python\n  - pip\n  - pip:\n    - pkg_6021\n"
+        )
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            conda_install = CondaInstall(sandbox=sandbox, license_accepted=True)
+            assert conda_install._get_env_lock_path(path=conda_env_file) is None
+
+    def test_lock_keyed_by_architecture(
+        self,
+        conda_env_file,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            conda_install = CondaInstall(sandbox=sandbox, license_accepted=True)
+            sandbox.architecture = "x86_64"
+            x86_64_lock_path = conda_install._get_env_lock_path(path=conda_env_file)
+            sandbox.architecture = "aarch64"
+            aarch64_lock_path = conda_install._get_env_lock_path(path=conda_env_file)
+
+        assert x86_64_lock_path != aarch64_lock_path
+
+    def test_invalid_env_lock(
+        self, patch_disable_singularity_sandbox_subprocess_runner
+    ):
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            with pytest.raises(ValueError, match="^Invalid env_lock='always'"):
+                CondaInstall(sandbox=sandbox, license_accepted=True, env_lock="always")
+
+
 @pytest.mark.conda_integration
 @pytest.mark.singularity_integration
 class TestCleanupUnusedFiles:
@@ -204,6 +639,173 @@ class Test_BootstrapConda:
             assert "# All requested packages already installed." in process.stdout
 
 
+class TestCheckLocalArtifacts:
+    @pytest.fixture
+    def file_channel_mirror(self, tmp_path):
+        mirror_dir = tmp_path / "mirrors/conda-forge"
+        (mirror_dir / "noarch").mkdir(parents=True)
+        (mirror_dir / "noarch/repodata.json").write_text("{}")
+        return mirror_dir
+
+    def test_available_artifacts(self, tmp_path, file_channel_mirror):
+        local_installer = tmp_path / "Miniforge3-6021.sh"
+        local_installer.write_text("PATCH: Miniforge installer")
+        conda_env = tmp_path / "env_6021.yml"
+        conda_env.write_text("channels:\n  - conda-forge\ndependencies:\n  - python")
+        CondaInstall.check_local_artifacts(
+            local_installer=local_installer,
+            channel_mirrors=[file_channel_mirror.as_uri(), str(file_channel_mirror)],
+            env_path=conda_env,
+        )
+
+    def test_missing_local_installer(self, tmp_path):
+        with pytest.raises(
+            FileNotFoundError, match="^The local Miniforge installer .* does not exist"
+        ):
+            CondaInstall.check_local_artifacts(local_installer=tmp_path / "no_6021.sh")
+
+    def test_missing_file_channel_mirror(self, tmp_path):
+        with pytest.raises(
+            FileNotFoundError,
+            match=r"^The Conda channel mirror .*conda-forge' is not available",
+        ):
+            CondaInstall.check_local_artifacts(
+                channel_mirrors=[f"file://{tmp_path}/conda-forge"]
+            )
+
+    def test_unreachable_http_channel_mirror(self, monkeypatch):
+        def mock_urlopen(request, *args, **kwargs):
+            raise urllib.error.URLError("PATCH: Connection refused")
+
+        monkeypatch.setattr(urllib.request, "urlopen", mock_urlopen)
+        with pytest.raises(
+            FileNotFoundError,
+            match=(
+                r"Unable to access "
+                r"http://localhost:6021/conda-forge/noarch/repodata.json.$"
+            ),
+        ):
+            CondaInstall.check_local_artifacts(
+                channel_mirrors=["http://localhost:6021/conda-forge/"]
+            )
+
+    @pytest.mark.parametrize(
+        "env_content",
+        [
+            "channels:\n  - conda-forge\n  - bioconda\ndependencies:\n  - samtools\n",
+            "channels: [conda-forge, 'bioconda']\ndependencies:\n  - samtools\n",
+        ],
+    )
+    def test_unmirrored_env_channel(self, tmp_path, file_channel_mirror, env_content):
+        conda_env = tmp_path / "env_6021.yml"
+        conda_env.write_text(env_content)
+        with pytest.raises(
+            ValueError, match="^The Conda channels bioconda used in .* are not mirrored"
+        ):
+            CondaInstall.check_local_artifacts(
+                channel_mirrors=[str(file_channel_mirror)], env_path=conda_env
+            )
+
+    def test_default_channel_is_conda_forge(self, tmp_path):
+        conda_env = tmp_path / "env_6021.yml"
+        conda_env.write_text("dependencies:\n  - python\n")
+        with pytest.raises(ValueError, match="^The Conda channels conda-forge used"):
+            CondaInstall.check_local_artifacts(env_path=conda_env)
+
+
+class TestFetchMiniforgeInstaller:
+    def test_fetch_before_sandbox(
+        self,
+        context_cotainr_cache_dir,
+        patch_urllib_urlopen_miniforge_release,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        release = patch_urllib_urlopen_miniforge_release
+        cached_installer = CondaInstall.fetch_miniforge_installer(
+            architecture="aarch64"
+        )
+        assert cached_installer == (
+            context_cotainr_cache_dir
+            / "miniforge_installers/6021.0.0-0/Miniforge3-Linux-aarch64.sh"
+        )
+        assert cached_installer.read_text().startswith("PATCH: Installer for ")
+        assert len(release["urls"]) == 3
+
+        # The fetched installer is used without network access
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            sandbox.architecture = "aarch64"
+            CondaInstall(sandbox=sandbox, license_accepted=True)
+        assert len(release["urls"]) == 3
+
+    def test_unsupported_architecture(self, patch_urllib_urlopen_miniforge_release):
+        with pytest.raises(ValueError, match="only supports x86_64 and arm64/aarch64"):
+            CondaInstall.fetch_miniforge_installer(architecture="ppc64le")
+        assert patch_urllib_urlopen_miniforge_release["urls"] == []
+
+
+class TestLocalArtifacts:
+    def test_local_installer(
+        self,
+        tmp_path,
+        monkeypatch,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        def mock_urlopen(request, *args, **kwargs):
+            raise AssertionError("PATCH: No network access expected")
+
+        monkeypatch.setattr(urllib.request, "urlopen", mock_urlopen)
+        local_installer = tmp_path / "Miniforge3-6021.sh"
+        local_installer.write_text("PATCH: Local Miniforge installer 6021")
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            sandbox.architecture = "x86_64"
+            conda_install = CondaInstall(
+                sandbox=sandbox, license_accepted=True, local_installer=local_installer
+            )
+            installer_path = sandbox.sandbox_dir / "installer_6021.sh"
+            conda_install._download_miniforge_installer(installer_path=installer_path)
+            assert installer_path.read_text() == "PATCH: Local Miniforge installer 6021"
+
+    def test_channel_mirrors_mounted(
+        self,
+        tmp_path,
+        capsys,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        mirror_dir = tmp_path / "mirrors/conda-forge"
+        mirror_dir.mkdir(parents=True)
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            conda_install = CondaInstall(
+                sandbox=sandbox,
+                license_accepted=True,
+                env_lock="ignore",
+                channel_mirrors=[str(mirror_dir), "http://localhost:6021/bioconda/"],
+            )
+            assert sandbox.bind_paths[mirror_dir] == (
+                "/opt/cotainr/conda_channel_mirrors/conda-forge"
+            )
+            condarc_path = sandbox.sandbox_dir.parent / "conda_config/condarc"
+            assert (
+                sandbox.bind_paths[condarc_path.parent] == "/opt/cotainr/conda_config"
+            )
+            assert json.loads(condarc_path.read_text()) == {
+                "custom_channels": {
+                    "conda-forge": "file:///opt/cotainr/conda_channel_mirrors",
+                    "bioconda": "http://localhost:6021",
+                },
+                "notify_outdated_conda": False,
+            }
+            conda_install.add_environment(path="env_6021.yml", name="env_6021")
+
+        assert (
+            "'env', 'CONDARC=/opt/cotainr/conda_config/condarc', 'conda', 'env', "
+            "'create'"
+        ) in capsys.readouterr().out
+
+
 class Test_CheckCondaBootstrapIntegrity:
     def test_bail_on_interfering_conda_installs(
         self,
@@ -311,12 +913,11 @@ class Test_DisplayMiniforgeLicenseForAcceptance:
         answer,
         factory_mock_input,
         patch_disable_conda_install_bootstrap_conda,
-        patch_disable_conda_install_download_miniforge_installer,
+        patch_fake_conda_install_download_miniforge_installer_with_license,
         patch_disable_singularity_sandbox_subprocess_runner,
         capsys,
         monkeypatch,
     ):
-        monkeypatch.setattr(subprocess, "Popen", StubShowLicensePopen)
         monkeypatch.setattr("builtins.input", factory_mock_input(answer))
         with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
             conda_install = CondaInstall(sandbox=sandbox)
@@ -331,12 +932,11 @@ class Test_DisplayMiniforgeLicenseForAcceptance:
         answer,
         factory_mock_input,
         patch_disable_conda_install_bootstrap_conda,
-        patch_disable_conda_install_download_miniforge_installer,
+        patch_fake_conda_install_download_miniforge_installer_with_license,
         patch_disable_singularity_sandbox_subprocess_runner,
         capsys,
         monkeypatch,
     ):
-        monkeypatch.setattr(subprocess, "Popen", StubShowLicensePopen)
         monkeypatch.setattr("builtins.input", factory_mock_input(answer))
         with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
             with pytest.raises(SystemExit):
@@ -347,18 +947,16 @@ class Test_DisplayMiniforgeLicenseForAcceptance:
             "You have not accepted the Miniforge installer license. Aborting!"
         ) in stdout_lines
 
-    def test_installer_not_showing_license(
+    def test_installer_not_including_license(
         self,
         patch_disable_conda_install_bootstrap_conda,
         patch_disable_conda_install_download_miniforge_installer,
         patch_disable_singularity_sandbox_subprocess_runner,
-        monkeypatch,
     ):
-        monkeypatch.setattr(subprocess, "Popen", StubEmptyLicensePopen)
         with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
             with pytest.raises(
                 RuntimeError,
-                match="^No license seems to be displayed by the Miniforge installer.$",
+                match="^No license seems to be included in the Miniforge installer.$",
             ):
                 CondaInstall(sandbox=sandbox)
 
@@ -366,28 +964,31 @@ class Test_DisplayMiniforgeLicenseForAcceptance:
         self,
         factory_mock_input,
         patch_disable_conda_install_bootstrap_conda,
-        patch_disable_conda_install_download_miniforge_installer,
+        patch_fake_conda_install_download_miniforge_installer_with_license,
         patch_disable_singularity_sandbox_subprocess_runner,
         capsys,
         monkeypatch,
     ):
-        monkeypatch.setattr(subprocess, "Popen", StubShowLicensePopen)
+        popen = subprocess.Popen
+
+        def mock_popen(args, *popen_args, **kwargs):
+            assert "bash" not in args, "PATCH: The installer must not be run"
+            return popen(args, *popen_args, **kwargs)
+
+        monkeypatch.setattr(subprocess, "Popen", mock_popen)
         monkeypatch.setattr("builtins.input", factory_mock_input("yes"))
         with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
             CondaInstall(sandbox=sandbox)
 
         stdout = capsys.readouterr().out.strip()
-        stdout_lines = stdout.split("\n")
-
-        # Check that we send the "ENTER" and kill the process.
-        assert "StubShowLicensePopen received: input='\\n'." in stdout_lines
-        assert "StubShowLicensePopen killed." in stdout_lines
 
         # Check that the prompt for "ENTER" is not displayed to the user
-        assert "Please, press ENTER to continue\n>>> " not in stdout
+        assert "Please, press ENTER to continue" not in stdout
 
-        # Check that the license is displayed to the user
-        assert "STUB:\n\n\nThis is the license terms..." in stdout
+        # Check that the license, and only the license, is displayed to the user
+        assert "STUB:\nThis is the license terms...\n" in stdout
+        assert "Binary payload" not in stdout
+        assert "Do you accept the license terms? [yes/no]" in stdout
 
     @pytest.mark.conda_integration
     def test_miniforge_still_showing_license(
@@ -425,7 +1026,8 @@ class Test_DisplayMiniforgeLicenseForAcceptance:
 class Test_DownloadMiniforgeInstaller:
     def test_installer_download_success(
         self,
-        patch_urllib_urlopen_as_bytes_stream,
+        context_cotainr_cache_dir,
+        patch_urllib_urlopen_miniforge_release,
         patch_disable_conda_install_bootstrap_conda,
         patch_disable_singularity_sandbox_subprocess_runner,
     ):
@@ -439,13 +1041,175 @@ class Test_DownloadMiniforgeInstaller:
             conda_install._download_miniforge_installer(
                 installer_path=conda_installer_path
             )
-            conda_installer_strings = [
-                b"PATCH: Bytes returned by urlopen for url=",
-                b"'https://github.com/conda-forge/miniforge/releases/latest/download/Miniforge3-",
-            ]
-            conda_installer_bytes_string = conda_installer_path.read_bytes()
-            for installer_string in conda_installer_strings:
-                assert installer_string in conda_installer_bytes_string
+            installer_content = conda_installer_path.read_text()
+
+        assert installer_content == (
+            "PATCH: Installer for https://github.com/conda-forge/miniforge/"
+            "releases/download/6021.0.0-0/Miniforge3-Linux-x86_64.sh"
+        )
+        cached_installer = (
+            context_cotainr_cache_dir
+            / "miniforge_installers/6021.0.0-0/Miniforge3-Linux-x86_64.sh"
+        )
+        assert cached_installer.read_text() == installer_content
+
+        # Latest release resolved and installer downloaded only once
+        assert patch_urllib_urlopen_miniforge_release["urls"] == [
+            "https://github.com/conda-forge/miniforge/releases/latest",
+            "https://github.com/conda-forge/miniforge/releases/download/6021.0.0-0/"
+            "Miniforge3-Linux-x86_64.sh.sha256",
+            "https://github.com/conda-forge/miniforge/releases/download/6021.0.0-0/"
+            "Miniforge3-Linux-x86_64.sh",
+        ]
+
+    def test_interrupted_download_is_resumed(
+        self,
+        caplog,
+        context_cotainr_cache_dir,
+        monkeypatch,
+        patch_urllib_urlopen_miniforge_release,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        release = patch_urllib_urlopen_miniforge_release
+        release["interrupt_after"] = 10
+        monkeypatch.setattr("time.sleep", lambda _: None)
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            sandbox.architecture = "x86_64"
+            CondaInstall(sandbox=sandbox, license_accepted=True)
+
+        cached_installer = (
+            context_cotainr_cache_dir
+            / "miniforge_installers/6021.0.0-0/Miniforge3-Linux-x86_64.sh"
+        )
+        assert cached_installer.read_text() == (
+            "PATCH: Installer for https://github.com/conda-forge/miniforge/"
+            "releases/download/6021.0.0-0/Miniforge3-Linux-x86_64.sh"
+        )
+        assert release["ranges"] == [None, "bytes=10-"]
+        assert not list(cached_installer.parent.glob(".partial_*"))
+        log_messages = [rec.getMessage() for rec in caplog.records]
+        assert any(
+            re.match(r"^Downloaded 0\.0 MiB in \d+\.\d seconds \(.* MiB/s\)$", msg)
+            for msg in log_messages
+        )
+
+    def test_partial_download_from_earlier_build_is_resumed(
+        self,
+        context_cotainr_cache_dir,
+        patch_urllib_urlopen_miniforge_release,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        partial_installer = (
+            context_cotainr_cache_dir
+            / "miniforge_installers/6021.0.0-0/.partial_Miniforge3-Linux-x86_64.sh"
+        )
+        partial_installer.parent.mkdir(parents=True)
+        partial_installer.write_text("PATCH: ")
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            sandbox.architecture = "x86_64"
+            CondaInstall(sandbox=sandbox, license_accepted=True)
+
+        assert patch_urllib_urlopen_miniforge_release["ranges"] == ["bytes=7-"]
+        assert (
+            partial_installer.with_name("Miniforge3-Linux-x86_64.sh")
+            .read_text()
+            .startswith("PATCH: Installer for ")
+        )
+
+    def test_installer_cache_max_age(
+        self,
+        patch_urllib_urlopen_miniforge_release,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        release = patch_urllib_urlopen_miniforge_release
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            sandbox.architecture = "aarch64"
+            CondaInstall(sandbox=sandbox, license_accepted=True)
+            assert len(release["urls"]) == 3
+
+            # New release, but the cached latest release is not too old
+            release["version"] = "6022.0.0-0"
+            CondaInstall(sandbox=sandbox, license_accepted=True)
+            assert len(release["urls"]) == 3
+
+            # Cached latest release is too old, new release is downloaded
+            CondaInstall(
+                sandbox=sandbox, license_accepted=True, installer_cache_max_age=0
+            )
+            assert len(release["urls"]) == 6
+            assert release["urls"][-1].endswith(
+                "/download/6022.0.0-0/Miniforge3-Linux-aarch64.sh"
+            )
+
+    def test_offline_with_cached_installer(
+        self,
+        caplog,
+        monkeypatch,
+        patch_urllib_urlopen_miniforge_release,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            sandbox.architecture = "x86_64"
+            CondaInstall(sandbox=sandbox, license_accepted=True)
+
+            def mock_urlopen(request, *args, **kwargs):
+                raise urllib.error.URLError("PATCH: offline")
+
+            monkeypatch.setattr("urllib.request.urlopen", mock_urlopen)
+            monkeypatch.setattr("time.sleep", lambda _: None)
+            CondaInstall(
+                sandbox=sandbox, license_accepted=True, installer_cache_max_age=0
+            )
+
+        assert (
+            "Unable to check for a new Miniforge release. Using the cached release "
+            "6021.0.0-0"
+        ) in [rec.getMessage() for rec in caplog.records]
+
+    def test_corrupt_cached_installer(
+        self,
+        context_cotainr_cache_dir,
+        patch_urllib_urlopen_miniforge_release,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        release = patch_urllib_urlopen_miniforge_release
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            sandbox.architecture = "x86_64"
+            CondaInstall(sandbox=sandbox, license_accepted=True)
+            cached_installer = (
+                context_cotainr_cache_dir
+                / "miniforge_installers/6021.0.0-0/Miniforge3-Linux-x86_64.sh"
+            )
+            cached_installer.write_text("corrupt_6021")
+            CondaInstall(sandbox=sandbox, license_accepted=True)
+
+        assert len(release["urls"]) == 5
+        assert cached_installer.read_text().startswith("PATCH: Installer for ")
+
+    def test_installer_digest_mismatch(
+        self,
+        context_cotainr_cache_dir,
+        patch_urllib_urlopen_miniforge_release,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        patch_urllib_urlopen_miniforge_release["corrupt_installer"] = True
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            sandbox.architecture = "x86_64"
+            with pytest.raises(
+                RuntimeError,
+                match="^The SHA256 digest .* does not match the published digest",
+            ):
+                CondaInstall(sandbox=sandbox, license_accepted=True)
+
+        assert not list(
+            (context_cotainr_cache_dir / "miniforge_installers/6021.0.0-0").iterdir()
+        )
 
     @pytest.mark.conda_integration  # technically not a test that depends on Conda - but a very slow one...
     def test_installer_download_fail(
@@ -478,6 +1242,71 @@ class Test_DownloadMiniforgeInstaller:
                 CondaInstall(sandbox=sandbox, license_accepted=True)
 
 
+class Test_GetCreateEnvironmentCmd:
+    @pytest.mark.parametrize(
+        ["solver", "cmd"],
+        [
+            ("conda", "conda env create -f env.yml -n env_6021"),
+            ("classic", "conda env create --solver=classic -f env.yml -n env_6021"),
+            ("libmamba", "conda env create --solver=libmamba -f env.yml -n env_6021"),
+            ("mamba", "mamba create -y -f env.yml -n env_6021"),
+            (
+                "micromamba",
+                "micromamba create -y -r /opt/cotainr/conda -f env.yml -n env_6021",
+            ),
+        ],
+    )
+    def test_solver_cmd(
+        self,
+        solver,
+        cmd,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            conda_install = CondaInstall(
+                sandbox=sandbox, license_accepted=True, solver=solver
+            )
+            assert (
+                conda_install._get_create_environment_cmd(
+                    path="env.yml", name="env_6021"
+                )
+                == cmd
+            )
+
+    def test_micromamba_installed_once(
+        self,
+        capsys,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            conda_install = CondaInstall(
+                sandbox=sandbox,
+                license_accepted=True,
+                solver="micromamba",
+                env_lock="ignore",
+            )
+            conda_install.add_environment(path="env_1.yml", name="env_1")
+            conda_install.add_environment(path="env_2.yml", name="env_2")
+
+        stdout = capsys.readouterr().out
+        assert (
+            stdout.count(
+                "'install', '-y', '-n', 'base', '-c', 'conda-forge', 'micromamba'"
+            )
+            == 1
+        )
+        assert stdout.count("'micromamba', 'create', '-y'") == 2
+
+    def test_invalid_solver(self, patch_disable_singularity_sandbox_subprocess_runner):
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            with pytest.raises(ValueError, match="^Invalid solver='pip'. Must be one"):
+                CondaInstall(sandbox=sandbox, license_accepted=True, solver="pip")
+
+
 class Test_GetInstallScript:
     @pytest.mark.parametrize("arch", ["arm64", "aarch64"])
     def test_arm_success(self, arch):
@@ -519,6 +1348,236 @@ class Test_GetInstallScript:
             CondaInstall._get_install_script(arch)
 
 
+class Test_RestoreCachedBasePrefix:
+    def test_base_prefix_cached_and_restored(
+        self,
+        caplog,
+        context_cotainr_cache_dir,
+        patch_fake_conda_install_run_command_in_sandbox,
+        patch_fake_singularity_sandbox_env_folder,
+        patch_urllib_urlopen_miniforge_release,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        cmds = patch_fake_conda_install_run_command_in_sandbox
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            sandbox.architecture = "x86_64"
+            CondaInstall(sandbox=sandbox, license_accepted=True, update_base="never")
+        assert any(cmd.startswith("bash conda_installer.sh") for cmd in cmds)
+        cached_prefixes = [
+            path
+            for path in (context_cotainr_cache_dir / "conda_base_prefixes").iterdir()
+            if path.is_dir()
+        ]
+        assert len(cached_prefixes) == 1
+        assert (cached_prefixes[0] / "bin_6021").exists()
+
+        cmds.clear()
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            sandbox.architecture = "x86_64"
+            CondaInstall(sandbox=sandbox, license_accepted=True, update_base="never")
+            assert (sandbox.sandbox_dir / "opt/cotainr/conda/bin_6021").exists()
+            assert (
+                "source /opt/cotainr/conda/etc/profile.d/conda.sh"
+                in (
+                    sandbox.sandbox_dir / ".singularity.d/env/92-cotainr-env.sh"
+                ).read_text()
+            )
+        assert not any(cmd.startswith("bash ") for cmd in cmds)
+        assert (
+            f"Using cached Conda base environment {cached_prefixes[0]}"
+            in caplog.messages
+        )
+
+    def test_cached_base_prefix_updated(
+        self,
+        context_cotainr_cache_dir,
+        patch_fake_conda_install_run_command_in_sandbox,
+        patch_fake_singularity_sandbox_env_folder,
+        patch_urllib_urlopen_miniforge_release,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        cmds = patch_fake_conda_install_run_command_in_sandbox
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            sandbox.architecture = "x86_64"
+            CondaInstall(sandbox=sandbox, license_accepted=True, update_base="never")
+            CondaInstall(sandbox=sandbox, license_accepted=True, update_base="always")
+        assert sum(cmd.startswith("conda update") for cmd in cmds) == 1
+        (metadata_path,) = (context_cotainr_cache_dir / "conda_base_prefixes").glob(
+            "*.json"
+        )
+        assert time.time() - json.loads(metadata_path.read_text())["updated"] < 60
+
+    @pytest.mark.parametrize("packages_changed", [False, True])
+    def test_cached_base_prefix_only_recached_if_changed(
+        self,
+        packages_changed,
+        context_cotainr_cache_dir,
+        monkeypatch,
+        patch_fake_conda_install_run_command_in_sandbox,
+        patch_fake_singularity_sandbox_env_folder,
+        patch_urllib_urlopen_miniforge_release,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            sandbox.architecture = "x86_64"
+            CondaInstall(sandbox=sandbox, license_accepted=True, update_base="never")
+        (metadata_path,) = (context_cotainr_cache_dir / "conda_base_prefixes").glob(
+            "*.json"
+        )
+        cached_prefix_inode = metadata_path.with_suffix("").stat().st_ino
+
+        updated_package = "pkg_6021-2.0" if packages_changed else "pkg_6021-1.0"
+        package_lists = iter(["pkg_6021-1.0\n", f"{updated_package}\n"])
+        monkeypatch.setattr(
+            CondaInstall, "_list_base_packages", lambda self: next(package_lists)
+        )
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            sandbox.architecture = "x86_64"
+            CondaInstall(sandbox=sandbox, license_accepted=True, update_base="always")
+        recached = metadata_path.with_suffix("").stat().st_ino != cached_prefix_inode
+        assert recached == packages_changed
+        assert time.time() - json.loads(metadata_path.read_text())["updated"] < 60
+
+    def test_evict_cached_base_prefixes(self, tmp_path):
+        cache_dir = tmp_path / "conda_base_prefixes_6021"
+        for age in range(6):
+            cached_prefix = cache_dir / f"prefix_{age}"
+            cached_prefix.mkdir(parents=True)
+            metadata_path = cached_prefix.with_suffix(".json")
+            metadata_path.write_text("{}")
+            os.utime(metadata_path, (time.time() - age, time.time() - age))
+        CondaInstall._evict_cached_base_prefixes(cache_dir=cache_dir)
+        assert sorted(path.name for path in cache_dir.iterdir()) == [
+            f"prefix_{age}{suffix}" for age in range(4) for suffix in ("", ".json")
+        ]
+
+    def test_no_base_prefix_cache(
+        self,
+        context_cotainr_cache_dir,
+        patch_fake_conda_install_run_command_in_sandbox,
+        patch_fake_singularity_sandbox_env_folder,
+        patch_urllib_urlopen_miniforge_release,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            sandbox.architecture = "x86_64"
+            CondaInstall(
+                sandbox=sandbox, license_accepted=True, use_base_prefix_cache=False
+            )
+        assert not (context_cotainr_cache_dir / "conda_base_prefixes").exists()
+
+
+class Test_UpdateBaseIfDue:
+    @pytest.mark.parametrize(
+        ["update_base", "last_modified", "updated"],
+        [
+            ("always", None, True),
+            ("never", "Mon, 01 Jan 2001 00:00:00 GMT", False),
+            ("stale", None, False),
+            ("stale", "Mon, 01 Jan 2001 00:00:00 GMT", True),
+        ],
+    )
+    def test_update_policy(
+        self,
+        update_base,
+        last_modified,
+        updated,
+        patch_fake_conda_install_run_command_in_sandbox,
+        patch_fake_singularity_sandbox_env_folder,
+        patch_urllib_urlopen_miniforge_release,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        patch_urllib_urlopen_miniforge_release["last_modified"] = last_modified
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            sandbox.architecture = "x86_64"
+            CondaInstall(
+                sandbox=sandbox,
+                license_accepted=True,
+                update_base=update_base,
+                use_base_prefix_cache=False,
+            )
+
+        update_cmds = [
+            cmd
+            for cmd in patch_fake_conda_install_run_command_in_sandbox
+            if cmd.startswith("conda update -y -n base")
+        ]
+        assert bool(update_cmds) == updated
+
+
+class Test_UpdatePkgsCache:
+    def test_pkgs_cache_mounted_and_used(
+        self,
+        tmp_path,
+        capsys,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        pkgs_cache_dir = tmp_path / "pkgs_6021"
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            conda_install = CondaInstall(
+                sandbox=sandbox,
+                license_accepted=True,
+                pkgs_cache_dir=pkgs_cache_dir,
+                env_lock="ignore",
+            )
+            assert sandbox.bind_paths == {
+                pkgs_cache_dir: "/opt/cotainr/conda_pkgs_cache"
+            }
+            conda_install.add_environment(path="env_6021.yml", name="env_6021")
+
+        assert pkgs_cache_dir.is_dir()
+        stdout = capsys.readouterr().out
+        assert (
+            "'env', 'CONDA_PKGS_DIRS=/opt/cotainr/conda_pkgs_cache', "
+            "'conda', 'env', 'create'"
+        ) in stdout
+        # The package cache must not be cleaned by "conda clean"
+        clean_lines = [line for line in stdout.split("\n") if "'clean'" in line]
+        assert clean_lines
+        assert all("CONDA_PKGS_DIRS" not in line for line in clean_lines)
+
+    def test_lru_eviction(
+        self,
+        tmp_path,
+        patch_disable_conda_install_bootstrap_conda,
+        patch_disable_conda_install_download_miniforge_installer,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        pkgs_cache_dir = tmp_path / "pkgs_6021"
+        pkgs_cache_dir.mkdir()
+        for mtime, package in enumerate(
+            ["a-1.0-0.conda", "b-1.0-0.tar.bz2", "c-1.0-0.conda"], start=1
+        ):
+            package_path = pkgs_cache_dir / package
+            package_path.write_bytes(b"6021" * 2**14)
+            os.utime(package_path, (mtime, mtime))
+        (pkgs_cache_dir / "a-1.0-0").mkdir()
+        (pkgs_cache_dir / "urls.txt").write_text("6021")
+
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            conda_install = CondaInstall(
+                sandbox=sandbox,
+                license_accepted=True,
+                pkgs_cache_dir=pkgs_cache_dir,
+                pkgs_cache_max_size=3 * 2**16,
+            )
+            conda_meta_dir = sandbox.sandbox_dir / "opt/cotainr/conda/envs/e/conda-meta"
+            conda_meta_dir.mkdir(parents=True)
+            (conda_meta_dir / "a-1.0-0.json").write_text('{"fn": "a-1.0-0.conda"}')
+            conda_install.pkgs_cache_max_size = 2 * 2**16 + 2**12
+            conda_install._update_pkgs_cache(env_prefix="/opt/cotainr/conda/envs/e")
+
+        # The used package "a" is kept, the least recently used package "b" evicted
+        assert sorted(path.name for path in pkgs_cache_dir.iterdir()) == [
+            "a-1.0-0",
+            "a-1.0-0.conda",
+            "c-1.0-0.conda",
+            "urls.txt",
+        ]
+
+
 class Test_CondaVerbosityArg:
     @pytest.mark.parametrize(
         ["verbosity", "verbosity_arg"],
@@ -666,6 +1725,25 @@ class Test_LoggingFilters:
         assert filter_.filter(rec) == keep
 
 
+class Test_MapMambaLogLevel:
+    @pytest.mark.parametrize(
+        ["msg", "log_level"],
+        [
+            ("trace    libmamba Parsing 6021", logging.DEBUG),
+            ("debug    libmamba Parsing 6021", logging.DEBUG),
+            ("info     libmamba Parsing 6021", logging.INFO),
+            ("warning  libmamba Cache file 6021 is invalid", logging.WARNING),
+            ("error    libmamba Could not solve 6021", logging.ERROR),
+            ("critical libmamba Aborting 6021", logging.CRITICAL),
+            ("WARNING: conda message 6021", logging.WARNING),
+            ("information about 6021", logging.INFO),
+            ("errors are fine 6021", logging.INFO),
+        ],
+    )
+    def test_correct_log_level_mapping(self, msg, log_level):
+        assert CondaInstall._map_mamba_log_level(msg=msg) == log_level
+
+
 class Test_MapLogLevel:
     @pytest.mark.parametrize(
         ["msg", "log_level"],
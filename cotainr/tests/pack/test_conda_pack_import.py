@@ -0,0 +1,272 @@
+"""
+cotainr - a user space Apptainer/Singularity container builder.
+
+Copyright DeiC, deic.dk
+Licensed under the European Union Public License (EUPL) 1.2
+- see the LICENSE file for details.
+
+"""
+
+import io
+import os
+import stat
+import tarfile
+
+import pytest
+
+from cotainr.container import SingularitySandbox
+import cotainr.pack
+from cotainr.pack import CondaPackImport
+
+from ..container.patches import (
+    patch_disable_singularity_sandbox_subprocess_runner,
+    patch_fake_singularity_sandbox_env_folder,
+)
+
+
+@pytest.fixture
+def conda_pack_archive(tmp_path):
+    """Create a small conda-pack like archive."""
+    archive_path = tmp_path / "conda_env_6021.tar.gz"
+    with tarfile.open(archive_path, mode="w:gz") as archive:
+
+        def add_member(
+            name,
+            *,
+            type=tarfile.REGTYPE,
+            content=b"",
+            mode=0o644,
+            mtime=1_600_006_021,
+            **kwargs,
+        ):
+            member = tarfile.TarInfo(name=name)
+            member.type = type
+            member.mode = mode
+            member.mtime = mtime
+            member.size = len(content)
+            for key, value in kwargs.items():
+                setattr(member, key, value)
+            archive.addfile(member, io.BytesIO(content) if content else None)
+
+        add_member("bin", type=tarfile.DIRTYPE, mode=0o555)
+        add_member("bin/conda-unpack", content=b"#!/bin/sh\n", mode=0o755)
+        add_member("bin/python3.12", content=b"python 6021", mode=0o755)
+        add_member("bin/python", type=tarfile.SYMTYPE, linkname="python3.12")
+        add_member("lib/libpython.so", content=b"libpython 6021" * 1000)
+        add_member(
+            "lib/libpython_6021.so", type=tarfile.LNKTYPE, linkname="lib/libpython.so"
+        )
+
+    return archive_path
+
+
+class TestConstructor:
+    def test_attributes(self, conda_pack_archive):
+        sandbox = SingularitySandbox(base_image="my_base_image_6021")
+        conda_pack_import = CondaPackImport(
+            sandbox=sandbox, archive_path=conda_pack_archive, max_workers=2
+        )
+        assert conda_pack_import.sandbox is sandbox
+        assert conda_pack_import.archive_path == conda_pack_archive
+        assert conda_pack_import.prefix == "/opt/cotainr/conda_env"
+        assert conda_pack_import.max_workers == 2
+        assert conda_pack_import.space_estimate == CondaPackImport.estimate_space(
+            archive_path=conda_pack_archive
+        )
+
+    def test_nonexisting_archive(self, tmp_path):
+        with pytest.raises(FileNotFoundError, match="conda-pack archive .* not exist"):
+            CondaPackImport(
+                sandbox=SingularitySandbox(base_image="my_base_image_6021"),
+                archive_path=tmp_path / "no_archive_6021.tar.gz",
+            )
+
+
+class TestImportEnvironment:
+    @pytest.mark.parametrize("decompressor", [None, ["gzip", "-dc"]])
+    def test_extraction_and_activation(
+        self,
+        decompressor,
+        conda_pack_archive,
+        capsys,
+        monkeypatch,
+        patch_disable_singularity_sandbox_subprocess_runner,
+        patch_fake_singularity_sandbox_env_folder,
+    ):
+        monkeypatch.setattr(
+            cotainr.pack,
+            "_CONDA_PACK_DECOMPRESSORS",
+            {".gz": decompressor} if decompressor is not None else {},
+        )
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            conda_pack_import = CondaPackImport(
+                sandbox=sandbox, archive_path=conda_pack_archive, max_workers=2
+            )
+            conda_pack_import.import_environment()
+            prefix_dir = sandbox.sandbox_dir / "opt/cotainr/conda_env"
+            assert (prefix_dir / "bin/python3.12").read_bytes() == b"python 6021"
+            assert os.access(prefix_dir / "bin/conda-unpack", os.X_OK)
+            assert os.readlink(prefix_dir / "bin/python") == "python3.12"
+            assert (prefix_dir / "lib/libpython_6021.so").samefile(
+                prefix_dir / "lib/libpython.so"
+            )
+            assert stat.S_IMODE((prefix_dir / "bin").stat().st_mode) == 0o755
+            for path in ["bin", "bin/python3.12", "lib/libpython.so"]:
+                assert (prefix_dir / path).stat().st_mtime == 1_600_006_021
+            assert (prefix_dir / "bin/python").lstat().st_mtime == 1_600_006_021
+            env_script = (
+                sandbox.sandbox_dir / ".singularity.d/env/92-cotainr-env.sh"
+            ).read_text()
+
+        assert "export CONDA_PREFIX=/opt/cotainr/conda_env\n" in env_script
+        assert 'export PATH="/opt/cotainr/conda_env/bin:$PATH"\n' in env_script
+        assert "/opt/cotainr/conda_env/etc/conda/activate.d/*.sh" in env_script
+        stdout_lines = capsys.readouterr().out.strip().split("\n")
+        assert (
+            "'/opt/cotainr/conda_env/bin/python', "
+            "'/opt/cotainr/conda_env/bin/conda-unpack'"
+        ) in stdout_lines[-1]
+
+    def test_large_files_written_directly(
+        self,
+        conda_pack_archive,
+        monkeypatch,
+        patch_disable_singularity_sandbox_subprocess_runner,
+        patch_fake_singularity_sandbox_env_folder,
+    ):
+        monkeypatch.setattr(cotainr.pack, "_CONDA_PACK_MAX_BUFFERED_SIZE", 16)
+
+        def mock_write_member(*, path, content, mode, mtime):
+            if len(content) > 16:
+                raise AssertionError("PATCH: Large files must not be buffered")
+            path.write_bytes(content)
+
+        monkeypatch.setattr(
+            CondaPackImport, "_write_member", staticmethod(mock_write_member)
+        )
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            CondaPackImport(
+                sandbox=sandbox, archive_path=conda_pack_archive
+            ).import_environment()
+            assert (
+                sandbox.sandbox_dir / "opt/cotainr/conda_env/lib/libpython.so"
+            ).read_bytes() == b"libpython 6021" * 1000
+
+    def test_not_a_conda_pack_archive(
+        self, tmp_path, patch_disable_singularity_sandbox_subprocess_runner
+    ):
+        archive_path = tmp_path / "not_conda_pack_6021.tar"
+        with tarfile.open(archive_path, mode="w") as archive:
+            archive.addfile(tarfile.TarInfo(name="some_file_6021"), io.BytesIO())
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            with pytest.raises(ValueError, match="does not seem to be created by"):
+                CondaPackImport(
+                    sandbox=sandbox, archive_path=archive_path
+                ).import_environment()
+
+    @pytest.mark.parametrize("name", ["../outside_6021", "/etc/outside_6021"])
+    def test_member_outside_prefix(
+        self, name, tmp_path, patch_disable_singularity_sandbox_subprocess_runner
+    ):
+        archive_path = tmp_path / "evil_6021.tar"
+        with tarfile.open(archive_path, mode="w") as archive:
+            archive.addfile(tarfile.TarInfo(name=name), io.BytesIO())
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            with pytest.raises(ValueError, match="would be extracted outside"):
+                CondaPackImport(
+                    sandbox=sandbox, archive_path=archive_path
+                ).import_environment()
+
+    def test_member_through_symlink_outside_prefix(
+        self, tmp_path, patch_disable_singularity_sandbox_subprocess_runner
+    ):
+        archive_path = tmp_path / "evil_6021.tar"
+        with tarfile.open(archive_path, mode="w") as archive:
+            link = tarfile.TarInfo(name="escape")
+            link.type = tarfile.SYMTYPE
+            link.linkname = str(tmp_path)
+            archive.addfile(link)
+            archive.addfile(tarfile.TarInfo(name="escape/file_6021"), io.BytesIO())
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            with pytest.raises(ValueError, match="would be extracted outside"):
+                CondaPackImport(
+                    sandbox=sandbox, archive_path=archive_path
+                ).import_environment()
+        assert not (tmp_path / "file_6021").exists()
+
+    @pytest.mark.parametrize("size", [4, 2**10])
+    def test_file_over_symlink_outside_prefix(
+        self,
+        size,
+        tmp_path,
+        monkeypatch,
+        patch_disable_singularity_sandbox_subprocess_runner,
+    ):
+        monkeypatch.setattr(cotainr.pack, "_CONDA_PACK_MAX_BUFFERED_SIZE", 16)
+        host_file = tmp_path / "host_file_6021"
+        host_file.write_bytes(b"host 6021")
+        host_file.chmod(0o644)
+        archive_path = tmp_path / "evil_6021.tar"
+        with tarfile.open(archive_path, mode="w") as archive:
+            link = tarfile.TarInfo(name="escape")
+            link.type = tarfile.SYMTYPE
+            link.linkname = str(host_file)
+            archive.addfile(link)
+            member = tarfile.TarInfo(name="escape")
+            member.size = size
+            member.mode = 0o777
+            archive.addfile(member, io.BytesIO(b"x" * size))
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            CondaPackImport(
+                sandbox=sandbox, archive_path=archive_path
+            )._extract_archive(prefix_dir=sandbox.sandbox_dir)
+            escape = sandbox.sandbox_dir / "escape"
+            assert not escape.is_symlink()
+            assert escape.read_bytes() == b"x" * size
+        assert host_file.read_bytes() == b"host 6021"
+        assert stat.S_IMODE(host_file.stat().st_mode) == 0o644
+
+    def test_directory_over_symlink_outside_prefix(
+        self, tmp_path, patch_disable_singularity_sandbox_subprocess_runner
+    ):
+        host_dir = tmp_path / "host_dir_6021"
+        host_dir.mkdir(mode=0o755)
+        archive_path = tmp_path / "evil_6021.tar"
+        with tarfile.open(archive_path, mode="w") as archive:
+            link = tarfile.TarInfo(name="escape")
+            link.type = tarfile.SYMTYPE
+            link.linkname = str(host_dir)
+            archive.addfile(link)
+            directory = tarfile.TarInfo(name="escape")
+            directory.type = tarfile.DIRTYPE
+            directory.mode = 0o777
+            archive.addfile(directory)
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            CondaPackImport(
+                sandbox=sandbox, archive_path=archive_path
+            )._extract_archive(prefix_dir=sandbox.sandbox_dir)
+            assert not (sandbox.sandbox_dir / "escape").is_symlink()
+        assert stat.S_IMODE(host_dir.stat().st_mode) == 0o755
+
+    def test_hardlink_outside_prefix(
+        self, tmp_path, patch_disable_singularity_sandbox_subprocess_runner
+    ):
+        host_file = tmp_path / "host_file_6021"
+        host_file.write_bytes(b"host 6021")
+        archive_path = tmp_path / "evil_6021.tar"
+        with tarfile.open(archive_path, mode="w") as archive:
+            link = tarfile.TarInfo(name="escape")
+            link.type = tarfile.SYMTYPE
+            link.linkname = str(host_file)
+            archive.addfile(link)
+            hardlink = tarfile.TarInfo(name="hardlink_6021")
+            hardlink.type = tarfile.LNKTYPE
+            hardlink.linkname = "escape"
+            archive.addfile(hardlink)
+        with SingularitySandbox(base_image="my_base_image_6021") as sandbox:
+            with pytest.raises(ValueError, match="links to 'escape' outside"):
+                CondaPackImport(
+                    sandbox=sandbox, archive_path=archive_path
+                )._extract_archive(prefix_dir=sandbox.sandbox_dir)
+            assert not (sandbox.sandbox_dir / "hardlink_6021").exists()
+        assert host_file.stat().st_nlink == 1
@@ -0,0 +1,141 @@
+"""
+cotainr - a user space Apptainer/Singularity container builder.
+
+Copyright DeiC, deic.dk
+Licensed under the European Union Public License (EUPL) 1.2
+- see the LICENSE file for details.
+
+"""
+
+import logging
+import os
+from pathlib import Path
+import shutil
+import subprocess
+
+import pytest
+
+from cotainr.pack import slim_prefix
+
+
+@pytest.fixture
+def conda_prefix(tmp_path):
+    """Create a fake Conda prefix with files of all slimming categories."""
+    prefix = tmp_path / "conda_6021"
+    files = {
+        "bin/python3.12": b"\x7fELF python 6021",
+        "bin/run_6021.sh": b"#!/bin/sh\n",
+        "lib/libpython3.12.so": b"\x7fELF libpython 6021",
+        "lib/libz.a": b"static library 6021",
+        "include/zlib.h": b"header 6021",
+        "share/man/man1/python.1": b"man page 6021",
+        "share/doc/zlib/README": b"doc 6021",
+        "lib/python3.12/os.py": b"os 6021",
+        "lib/python3.12/__pycache__/os.cpython-312.pyc": b"pyc 6021",
+        "lib/python3.12/test/test_os.py": b"stdlib test 6021",
+        "lib/python3.12/site-packages/numpy/core.py": b"numpy 6021",
+        "lib/python3.12/site-packages/numpy/tests/test_core.py": b"numpy test 6021",
+        "lib/python3.12/site-packages/numpy/data_6021.csv": b"numpy data 6021",
+    }
+    for rel_path, content in files.items():
+        (prefix / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (prefix / rel_path).write_bytes(content)
+    (prefix / "share/doc/latest").symlink_to("zlib")
+
+    return prefix
+
+
+class TestSlimPrefix:
+    def test_conservative_profile(self, conda_prefix):
+        savings = slim_prefix(path=conda_prefix)
+        assert savings == {
+            "static_libraries": len(b"static library 6021"),
+            "docs": len(b"man page 6021") + len(b"doc 6021"),
+        }
+        assert not (conda_prefix / "lib/libz.a").exists()
+        assert not (conda_prefix / "share").exists()
+        assert (conda_prefix / "include/zlib.h").exists()
+        assert (conda_prefix / "lib/python3.12/__pycache__").exists()
+
+    def test_aggressive_profile(self, conda_prefix, monkeypatch):
+        stripped_paths = []
+
+        def mock_run(args, **kwargs):
+            stripped_paths.append(Path(args[-1]).relative_to(conda_prefix))
+            Path(args[-1]).write_bytes(b"\x7fELF")
+            return subprocess.CompletedProcess(args=args, returncode=0)
+
+        monkeypatch.setattr(shutil, "which", lambda cmd: f"/usr/bin/{cmd}")
+        monkeypatch.setattr(subprocess, "run", mock_run)
+        savings = slim_prefix(path=conda_prefix, profile="aggressive")
+        assert savings == {
+            "static_libraries": len(b"static library 6021"),
+            "docs": len(b"man page 6021") + len(b"doc 6021"),
+            "headers": len(b"header 6021"),
+            "tests": len(b"stdlib test 6021") + len(b"numpy test 6021"),
+            "pycache": len(b"pyc 6021"),
+            "debug_symbols": len(b" python 6021") + len(b" libpython 6021"),
+        }
+        assert sorted(stripped_paths) == [
+            Path("bin/python3.12"),
+            Path("lib/libpython3.12.so"),
+        ]
+        assert sorted(
+            str(path.relative_to(conda_prefix))
+            for path in conda_prefix.rglob("*")
+            if path.is_file()
+        ) == [
+            "bin/python3.12",
+            "bin/run_6021.sh",
+            "lib/libpython3.12.so",
+            "lib/python3.12/os.py",
+            "lib/python3.12/site-packages/numpy/core.py",
+            "lib/python3.12/site-packages/numpy/data_6021.csv",
+        ]
+
+    def test_strip_not_available(self, conda_prefix, caplog, monkeypatch):
+        monkeypatch.setattr(shutil, "which", lambda cmd: None)
+        savings = slim_prefix(path=conda_prefix, profile="aggressive")
+        assert savings["debug_symbols"] == 0
+        assert (conda_prefix / "bin/python3.12").read_bytes() == b"\x7fELF python 6021"
+        assert caplog.record_tuples == [
+            (
+                "cotainr.pack",
+                logging.WARNING,
+                "Unable to strip debug symbols as strip is not available",
+            )
+        ]
+
+    def test_keep_and_remove(self, conda_prefix):
+        savings = slim_prefix(
+            path=conda_prefix,
+            keep=["share/doc/*"],
+            remove=["*.csv", "*/numpy/tests/*"],
+        )
+        assert savings == {
+            "static_libraries": len(b"static library 6021"),
+            "docs": len(b"man page 6021"),
+            "custom": len(b"numpy data 6021") + len(b"numpy test 6021"),
+        }
+        assert (conda_prefix / "share/doc/zlib/README").exists()
+        assert os.path.islink(conda_prefix / "share/doc/latest")
+        assert not (conda_prefix / "lib/python3.12/site-packages/numpy/tests").exists()
+
+    def test_existing_empty_directories_kept(self, conda_prefix):
+        (conda_prefix / "etc/conda/activate.d").mkdir(parents=True)
+        (conda_prefix / "share/empty_6021").mkdir()
+        slim_prefix(path=conda_prefix)
+        assert (conda_prefix / "etc/conda/activate.d").is_dir()
+        assert (conda_prefix / "share/empty_6021").is_dir()
+        assert not (conda_prefix / "share/man").exists()
+        assert not (conda_prefix / "share/doc").exists()
+
+    def test_hardlinks_not_counted(self, conda_prefix):
+        os.link(conda_prefix / "lib/libz.a", conda_prefix / "lib/libz_6021.so")
+        savings = slim_prefix(path=conda_prefix)
+        assert savings["static_libraries"] == 0
+        assert (conda_prefix / "lib/libz_6021.so").exists()
+
+    def test_invalid_profile(self, conda_prefix):
+        with pytest.raises(ValueError, match="^Invalid profile='minimal'"):
+            slim_prefix(path=conda_prefix, profile="minimal")
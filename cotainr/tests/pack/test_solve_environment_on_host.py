@@ -0,0 +1,105 @@
+"""
+cotainr - a user space Apptainer/Singularity container builder.
+
+Copyright DeiC, deic.dk
+Licensed under the European Union Public License (EUPL) 1.2
+- see the LICENSE file for details.
+
+"""
+
+import json
+import logging
+import shutil
+import subprocess
+
+import pytest
+
+from cotainr.pack import solve_environment_on_host
+
+
+@pytest.fixture
+def fake_host_conda(monkeypatch):
+    """
+    Fake conda on the host.
+
+    The dry run solves are recorded in the returned dict instead of being run.
+    If "message" in the returned dict is set, the solve fails with that message
+    in the JSON output, and if "stderr" is set, it fails with that stderr.
+    """
+    host_conda = {"runs": [], "message": None, "stderr": None}
+
+    def mock_run(args, *, env, **kwargs):
+        host_conda["runs"].append({"args": args, "subdir": env["CONDA_SUBDIR"]})
+        if host_conda["message"] is not None:
+            stdout = json.dumps({"message": host_conda["message"]})
+            return subprocess.CompletedProcess(args, 1, stdout=stdout, stderr="")
+        if host_conda["stderr"] is not None:
+            return subprocess.CompletedProcess(
+                args, 1, stdout="", stderr=host_conda["stderr"]
+            )
+        return subprocess.CompletedProcess(args, 0, stdout="{}", stderr="")
+
+    monkeypatch.delenv("CONDA_EXE", raising=False)
+    monkeypatch.setattr(shutil, "which", lambda cmd: f"/host/bin/{cmd}")
+    monkeypatch.setattr(subprocess, "run", mock_run)
+
+    return host_conda
+
+
+class TestSolveEnvironmentOnHost:
+    @pytest.mark.parametrize(
+        ["architecture", "subdir"],
+        [("x86_64", "linux-64"), ("aarch64", "linux-aarch64")],
+    )
+    def test_dry_run_solve(self, architecture, subdir, caplog, fake_host_conda):
+        caplog.set_level(logging.INFO)
+        solve_environment_on_host(path="env_6021.yml", architecture=architecture)
+        (run,) = fake_host_conda["runs"]
+        assert run["subdir"] == subdir
+        assert run["args"][:7] == [
+            "/host/bin/conda",
+            "env",
+            "create",
+            "--dry-run",
+            "--json",
+            "--file",
+            "env_6021.yml",
+        ]
+        assert run["args"][7] == "--prefix"
+        assert (
+            caplog.records[-1]
+            .getMessage()
+            .startswith("Solved Conda environment env_6021.yml on the host")
+        )
+
+    def test_conda_exe(self, fake_host_conda, monkeypatch):
+        monkeypatch.setenv("CONDA_EXE", "/some/conda_6021")
+        solve_environment_on_host(path="env_6021.yml", architecture="x86_64")
+        assert fake_host_conda["runs"][0]["args"][0] == "/some/conda_6021"
+
+    def test_unsolvable_environment(self, fake_host_conda):
+        fake_host_conda["message"] = "PackagesNotFoundError: no_pkg_6021"
+        with pytest.raises(
+            RuntimeError,
+            match=(
+                "^Unable to solve the Conda environment env_6021.yml on the host: "
+                "PackagesNotFoundError: no_pkg_6021$"
+            ),
+        ):
+            solve_environment_on_host(path="env_6021.yml", architecture="x86_64")
+
+    def test_non_json_error(self, fake_host_conda):
+        fake_host_conda["stderr"] = "Some conda error 6021\n"
+        with pytest.raises(RuntimeError, match="on the host: Some conda error 6021$"):
+            solve_environment_on_host(path="env_6021.yml", architecture="x86_64")
+
+    def test_conda_not_available(self, monkeypatch):
+        monkeypatch.delenv("CONDA_EXE", raising=False)
+        monkeypatch.setattr(shutil, "which", lambda cmd: None)
+        with pytest.raises(FileNotFoundError, match="^conda must be available"):
+            solve_environment_on_host(path="env_6021.yml", architecture="x86_64")
+
+    def test_unsupported_architecture(self, fake_host_conda):
+        with pytest.raises(ValueError, match="architecture='s390x'"):
+            solve_environment_on_host(path="env_6021.yml", architecture="s390x")
+        assert fake_host_conda["runs"] == []
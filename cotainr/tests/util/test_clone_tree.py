@@ -0,0 +1,66 @@
+"""
+cotainr - a user space Apptainer/Singularity container builder.
+
+Copyright DeiC, deic.dk
+Licensed under the European Union Public License (EUPL) 1.2
+- see the LICENSE file for details.
+
+"""
+
+import subprocess
+
+import pytest
+
+from cotainr.util import clone_tree
+
+
+class TestCloneTree:
+    def test_clone_content(self, tmp_path):
+        src = tmp_path / "src_6021"
+        (src / "sub_dir").mkdir(parents=True)
+        (src / "sub_dir/file_6021").write_text("some content 6021")
+        (src / "link_6021").symlink_to("sub_dir/file_6021")
+        dst = tmp_path / "dst_6021"
+        clone_method = clone_tree(src=src, dst=dst)
+        assert clone_method in ["reflink", "hardlink", "copy"]
+        assert (dst / "sub_dir/file_6021").read_text() == "some content 6021"
+        assert (dst / "link_6021").is_symlink()
+        assert (dst / "link_6021").read_text() == "some content 6021"
+
+    def test_existing_dst(self, tmp_path):
+        src = tmp_path / "src_6021"
+        src.mkdir()
+        dst = tmp_path / "dst_6021"
+        dst.mkdir()
+        with pytest.raises(FileExistsError, match="dst_6021 already exists.$"):
+            clone_tree(src=src, dst=dst)
+
+    def test_fallback_to_copy(self, tmp_path, monkeypatch):
+        subprocess_run = subprocess.run
+
+        def mock_run(args, **kwargs):
+            if "--reflink=always" in args or "-l" in args:
+                raise subprocess.CalledProcessError(
+                    1, args, stderr="PATCH: clone method not supported"
+                )
+            return subprocess_run(args, **kwargs)
+
+        monkeypatch.setattr(subprocess, "run", mock_run)
+        src = tmp_path / "src_6021"
+        src.mkdir()
+        (src / "file_6021").write_text("some content 6021")
+        dst = tmp_path / "dst_6021"
+        assert clone_tree(src=src, dst=dst) == "copy"
+        assert (dst / "file_6021").stat().st_ino != (src / "file_6021").stat().st_ino
+
+    def test_no_hardlinks(self, tmp_path):
+        src = tmp_path / "src_6021"
+        src.mkdir()
+        (src / "file_6021").write_text("some content 6021")
+        dst = tmp_path / "dst_6021"
+        assert clone_tree(src=src, dst=dst, allow_hardlinks=False) != "hardlink"
+        assert (dst / "file_6021").stat().st_ino != (src / "file_6021").stat().st_ino
+
+    def test_all_methods_fail(self, tmp_path):
+        with pytest.raises(subprocess.CalledProcessError):
+            clone_tree(src=tmp_path / "non_existing_6021", dst=tmp_path / "dst_6021")
@@ -0,0 +1,98 @@
+"""
+cotainr - a user space Apptainer/Singularity container builder.
+
+Copyright DeiC, deic.dk
+Licensed under the European Union Public License (EUPL) 1.2
+- see the LICENSE file for details.
+
+"""
+
+import logging
+import subprocess
+
+import pytest
+
+from cotainr.tracing import LogDispatcher, LogSettings
+from cotainr.util import CommandSession
+
+
+class TestCommandSession:
+    def test_completed_process(self):
+        with CommandSession(args=["sh"]) as session:
+            process = session.run(cmd="echo some_stdout_6021")
+        assert process.args == ["sh", "echo", "some_stdout_6021"]
+        assert process.returncode == 0
+        assert process.stdout == "some_stdout_6021\n"
+        assert process.stderr == ""
+        assert process.resource_usage.wall_time >= 0
+        assert process.resource_usage.user_time is None
+
+    def test_separate_streams_per_command(self, capsys):
+        with CommandSession(args=["sh"]) as session:
+            first_process = session.run(cmd="echo out_1_6021; echo err_1_6021 >&2")
+            second_process = session.run(cmd="echo out_2_6021; echo err_2_6021 >&2")
+        assert first_process.stdout == "out_1_6021\n"
+        assert first_process.stderr == "err_1_6021\n"
+        assert second_process.stdout == "out_2_6021\n"
+        assert second_process.stderr == "err_2_6021\n"
+        stdout, stderr = capsys.readouterr()
+        assert stdout == "out_1_6021\nout_2_6021\n"
+        assert stderr == "err_1_6021\nerr_2_6021\n"
+
+    def test_partial_last_line(self):
+        with CommandSession(args=["sh"]) as session:
+            process = session.run(cmd="printf 'line_6021\\npartial_6021'")
+        assert process.stdout == "line_6021\npartial_6021"
+
+    def test_check_returncode(self):
+        with CommandSession(args=["sh"]) as session:
+            with pytest.raises(subprocess.CalledProcessError) as exc_info:
+                session.run(cmd="echo some_error_6021 >&2; exit 3")
+            assert session.is_alive
+
+            # The session is still usable after a failed command
+            assert session.run(cmd="echo 6021").stdout == "6021\n"
+
+        assert exc_info.value.returncode == 3
+        assert exc_info.value.stderr == "some_error_6021\n"
+
+    def test_commands_run_in_subshells(self):
+        with CommandSession(args=["sh"]) as session:
+            session.run(cmd="cd /; SOME_VAR_6021=6021")
+            process = session.run(cmd='echo "$SOME_VAR_6021"; pwd')
+        assert process.stdout.split("\n")[0] == ""
+        assert process.stdout.split("\n")[1] != "/"
+
+    def test_no_stdin_for_commands(self):
+        with CommandSession(args=["sh"]) as session:
+            process = session.run(cmd="cat")
+            assert session.run(cmd="echo 6021").stdout == "6021\n"
+        assert process.stdout == ""
+
+    def test_shell_exits(self):
+        with CommandSession(args=["sh"]) as session:
+            with pytest.raises(subprocess.CalledProcessError) as exc_info:
+                session.run(cmd="echo some_error_6021 >&2; kill $$")
+            assert not session.is_alive
+        assert exc_info.value.stderr == "some_error_6021\n"
+        assert exc_info.value.returncode != 0
+
+    def test_logging(self, caplog):
+        log_dispatcher = LogDispatcher(
+            name="test_dispatcher_6021",
+            map_log_level_func=lambda msg: logging.INFO,
+            log_settings=LogSettings(verbosity=1),
+        )
+        with CommandSession(args=["sh"]) as session:
+            session.run(
+                cmd="echo out_6021; echo err_6021 >&2", log_dispatcher=log_dispatcher
+            )
+        records = {
+            (rec.name, rec.msg)
+            for rec in caplog.records
+            if rec.name != "cotainr.tracing"
+        }
+        assert records == {
+            ("test_dispatcher_6021.out", "out_6021\n"),
+            ("test_dispatcher_6021.err", "err_6021\n"),
+        }
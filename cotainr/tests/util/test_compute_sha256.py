@@ -0,0 +1,31 @@
+"""
+cotainr - a user space Apptainer/Singularity container builder.
+
+Copyright DeiC, deic.dk
+Licensed under the European Union Public License (EUPL) 1.2
+- see the LICENSE file for details.
+
+"""
+
+import hashlib
+
+import pytest
+
+from cotainr.util import compute_sha256
+
+
+class TestComputeSHA256:
+    @pytest.mark.parametrize("chunk_size", [1, 7, 2**20])
+    def test_digest(self, chunk_size, tmp_path):
+        content = b"some content 6021" * 1000
+        path = tmp_path / "file_6021"
+        path.write_bytes(content)
+        assert (
+            compute_sha256(path=path, chunk_size=chunk_size)
+            == hashlib.sha256(content).hexdigest()
+        )
+
+    def test_empty_file(self, tmp_path):
+        path = tmp_path / "file_6021"
+        path.touch()
+        assert compute_sha256(path=path) == hashlib.sha256(b"").hexdigest()
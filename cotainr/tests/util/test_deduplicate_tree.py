@@ -0,0 +1,101 @@
+"""
+cotainr - a user space Apptainer/Singularity container builder.
+
+Copyright DeiC, deic.dk
+Licensed under the European Union Public License (EUPL) 1.2
+- see the LICENSE file for details.
+
+"""
+
+import os
+
+import pytest
+
+from cotainr.util import deduplicate_tree
+
+
+class TestDeduplicateTree:
+    @pytest.mark.parametrize("partial_size", [4, 2**16])
+    def test_identical_files(self, partial_size, tmp_path):
+        root = tmp_path / "tree_6021"
+        content = b"some content 6021" * 100
+        (root / "a").mkdir(parents=True)
+        (root / "b/c").mkdir(parents=True)
+        for file_path in ["f1", "a/f2", "b/c/f3"]:
+            (root / file_path).write_bytes(content)
+            os.utime(root / file_path, (6021, 6021))
+
+        bytes_saved, files_linked = deduplicate_tree(
+            path=root, partial_size=partial_size
+        )
+
+        assert bytes_saved == 2 * len(content)
+        assert files_linked == 2
+        inodes = {
+            (root / file_path).stat().st_ino for file_path in ["f1", "a/f2", "b/c/f3"]
+        }
+        assert len(inodes) == 1
+        assert (root / "b/c/f3").read_bytes() == content
+        assert sorted(p.name for p in root.rglob("*")) == [
+            "a",
+            "b",
+            "c",
+            "f1",
+            "f2",
+            "f3",
+        ]
+
+    @pytest.mark.parametrize("partial_size", [4, 2**16])
+    def test_different_files(self, partial_size, tmp_path):
+        # Same size, same prefix, different content
+        (tmp_path / "f1").write_bytes(b"6021" * 100 + b"a")
+        (tmp_path / "f2").write_bytes(b"6021" * 100 + b"b")
+
+        assert deduplicate_tree(path=tmp_path, partial_size=partial_size) == (0, 0)
+        assert (tmp_path / "f1").stat().st_ino != (tmp_path / "f2").stat().st_ino
+
+    def test_different_permissions(self, tmp_path):
+        (tmp_path / "f1").write_bytes(b"content 6021")
+        (tmp_path / "f2").write_bytes(b"content 6021")
+        (tmp_path / "f2").chmod(0o755)
+
+        assert deduplicate_tree(path=tmp_path) == (0, 0)
+        assert oct((tmp_path / "f1").stat().st_mode & 0o777) != "0o755"
+
+    def test_different_mtimes(self, tmp_path):
+        # Linking would change the mtime of one of the files, invalidating
+        # timestamp based bytecode compiled from it
+        for file_name, mtime in [("f1", 1000), ("f2", 2000)]:
+            (tmp_path / file_name).write_bytes(b"content 6021")
+            os.utime(tmp_path / file_name, (mtime, mtime))
+
+        assert deduplicate_tree(path=tmp_path) == (0, 0)
+        assert (tmp_path / "f1").stat().st_mtime == 1000
+        assert (tmp_path / "f2").stat().st_mtime == 2000
+
+    def test_existing_hardlinks(self, tmp_path):
+        content = b"content 6021"
+        (tmp_path / "f1").write_bytes(content)
+        os.link(tmp_path / "f1", tmp_path / "f1_link")
+        (tmp_path / "f2").write_bytes(content)
+        os.link(tmp_path / "f2", tmp_path / "f2_link")
+        for file_name in ["f1", "f2"]:
+            os.utime(tmp_path / file_name, (6021, 6021))
+
+        bytes_saved, files_linked = deduplicate_tree(path=tmp_path)
+
+        assert bytes_saved == len(content)
+        assert files_linked == 2
+        assert (tmp_path / "f1").stat().st_nlink == 4
+
+    def test_skips_empty_files_and_symlinks(self, tmp_path):
+        (tmp_path / "empty1").touch()
+        (tmp_path / "empty2").touch()
+        (tmp_path / "f1").write_bytes(b"content 6021")
+        (tmp_path / "symlink").symlink_to(tmp_path / "f1")
+
+        assert deduplicate_tree(path=tmp_path) == (0, 0)
+        assert (tmp_path / "symlink").is_symlink()
+        assert (tmp_path / "empty1").stat().st_ino != (
+            tmp_path / "empty2"
+        ).stat().st_ino
@@ -0,0 +1,34 @@
+"""
+cotainr - a user space Apptainer/Singularity container builder.
+
+Copyright DeiC, deic.dk
+Licensed under the European Union Public License (EUPL) 1.2
+- see the LICENSE file for details.
+
+"""
+
+from pathlib import Path
+
+from cotainr.util import get_cache_dir
+
+
+class TestGetCacheDir:
+    def test_cotainr_cache_dir(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("COTAINR_CACHE_DIR", str(tmp_path / "cache_6021"))
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "xdg_6021"))
+        assert get_cache_dir() == tmp_path / "cache_6021"
+
+    def test_xdg_cache_home(self, tmp_path, monkeypatch):
+        monkeypatch.delenv("COTAINR_CACHE_DIR")
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "xdg_6021"))
+        assert get_cache_dir() == tmp_path / "xdg_6021/cotainr"
+
+    def test_default(self, tmp_path, monkeypatch):
+        monkeypatch.delenv("COTAINR_CACHE_DIR")
+        monkeypatch.delenv("XDG_CACHE_HOME", raising=False)
+        monkeypatch.setenv("HOME", str(tmp_path / "home_6021"))
+        assert get_cache_dir() == tmp_path / "home_6021/.cache/cotainr"
+
+    def test_not_created(self):
+        assert not get_cache_dir().exists()
+        assert isinstance(get_cache_dir(), Path)
@@ -0,0 +1,57 @@
+"""
+cotainr - a user space Apptainer/Singularity container builder.
+
+Copyright DeiC, deic.dk
+Licensed under the European Union Public License (EUPL) 1.2
+- see the LICENSE file for details.
+
+"""
+
+import os
+
+import pytest
+
+from cotainr.util import get_tree_usage
+
+
+class TestGetTreeUsage:
+    @pytest.mark.parametrize("max_workers", [None, 1, 4])
+    def test_tree(self, max_workers, tmp_path):
+        root = tmp_path / "root_6021"
+        for subdir in ["a", "a/b", "a/b/c", "d"]:
+            (root / subdir).mkdir(parents=True)
+        for n, file_path in enumerate(["f1", "a/f2", "a/b/c/f3", "d/f4"]):
+            (root / file_path).write_bytes(b"6021" * 1024 * (n + 1))
+        (root / "d/symlink").symlink_to(root / "a")
+
+        usage_bytes, usage_inodes = get_tree_usage(path=root, max_workers=max_workers)
+
+        # 5 directories (incl. the root) + 4 files + 1 symlink
+        assert usage_inodes == 10
+        expected_bytes = sum(
+            os.lstat(path).st_blocks * 512 for path in [root, *root.rglob("*")]
+        )
+        assert usage_bytes == expected_bytes
+
+    def test_hardlinks_counted_once(self, tmp_path):
+        root = tmp_path / "root_6021"
+        root.mkdir()
+        (root / "file_6021").write_bytes(b"6021" * 4096)
+        os.link(root / "file_6021", root / "hardlink_6021")
+        single_file_usage = os.lstat(root / "file_6021").st_blocks * 512
+
+        usage_bytes, usage_inodes = get_tree_usage(path=root)
+
+        assert usage_inodes == 2
+        assert usage_bytes == os.lstat(root).st_blocks * 512 + single_file_usage
+
+    def test_empty_dir(self, tmp_path):
+        empty_dir = tmp_path / "empty_6021"
+        empty_dir.mkdir()
+        usage_bytes, usage_inodes = get_tree_usage(path=empty_dir)
+        assert usage_inodes == 1
+        assert usage_bytes == os.lstat(empty_dir).st_blocks * 512
+
+    def test_non_existing_path(self, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            get_tree_usage(path=tmp_path / "non_existing_6021")
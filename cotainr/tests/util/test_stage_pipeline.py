@@ -0,0 +1,114 @@
+"""
+cotainr - a user space Apptainer/Singularity container builder.
+
+Copyright DeiC, deic.dk
+Licensed under the European Union Public License (EUPL) 1.2
+- see the LICENSE file for details.
+
+"""
+
+import logging
+import re
+import threading
+
+import pytest
+
+from cotainr.util import StagePipeline
+
+
+class TestStagePipeline:
+    def test_background_stages_overlap(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def first_stage():
+            started.set()
+            assert release.wait(timeout=10)
+            return "first_6021"
+
+        with StagePipeline() as pipeline:
+            pipeline.submit(name="first", func=first_stage)
+            pipeline.submit(
+                name="second", func=lambda: "second_6021", depends_on=["first"]
+            )
+
+            # The calling thread runs while the first stage is running
+            assert started.wait(timeout=10)
+            pipeline.checkpoint(name="foreground")
+            assert "second" not in pipeline.timings
+            release.set()
+            assert pipeline.result(name="second") == "second_6021"
+            assert pipeline.result(name="first") == "first_6021"
+
+        assert pipeline.timings["second"]["start"] >= pipeline.timings["first"]["end"]
+        assert pipeline.timings["second"]["depends_on"] == ["first"]
+
+    def test_stage_exceptions(self):
+        def failing_stage():
+            raise RuntimeError("PATCH: Stage failed 6021")
+
+        with StagePipeline() as pipeline:
+            pipeline.submit(name="failing", func=failing_stage)
+            pipeline.submit(name="dependent", func=lambda: 6021, depends_on=["failing"])
+            with pytest.raises(RuntimeError, match="Stage failed 6021"):
+                pipeline.result(name="failing")
+            with pytest.raises(RuntimeError, match="Stage failed 6021"):
+                pipeline.result(name="dependent")
+
+        assert "failing" in pipeline.timings
+        assert "dependent" not in pipeline.timings
+
+    def test_critical_path(self):
+        with StagePipeline() as pipeline:
+            pipeline.submit(name="background", func=lambda: 6021)
+            pipeline.result(name="background")
+            pipeline.checkpoint(name="first")
+            pipeline.checkpoint(name="second")
+            assert pipeline.timings["first"]["depends_on"] == ["background"]
+            assert pipeline.timings["second"]["depends_on"] == ["first"]
+            assert pipeline.critical_path() == ["background", "first", "second"]
+            pipeline.submit(name="late_background", func=lambda: 6021)
+            pipeline.result(name="late_background")
+            assert pipeline.timings["late_background"]["depends_on"] == ["second"]
+            assert pipeline.critical_path() == [
+                "background",
+                "first",
+                "second",
+                "late_background",
+            ]
+
+    def test_log_timings(self, caplog):
+        with StagePipeline() as pipeline:
+            pipeline.checkpoint(name="first_6021")
+            pipeline.submit(name="background_6021", func=lambda: 6021)
+            pipeline.result(name="background_6021")
+            pipeline.checkpoint(name="second_6021")
+            with caplog.at_level(logging.INFO, logger="cotainr.util"):
+                pipeline.log_timings()
+
+        critical_path_msg, overlap_msg = [
+            rec.getMessage() for rec in caplog.records if rec.levelno == logging.INFO
+        ]
+        assert re.match(
+            r"^Critical path of the build: first_6021 \(\d+\.\d s\) -> "
+            r"background_6021 \(\d+\.\d s\) -> second_6021 \(\d+\.\d s\)$",
+            critical_path_msg,
+        )
+        assert re.match(
+            r"^Ran 3 build stages in \d+\.\d s, of which \d+\.\d s overlapped$",
+            overlap_msg,
+        )
+
+    def test_no_stages(self, caplog):
+        with StagePipeline() as pipeline:
+            assert pipeline.critical_path() == []
+            pipeline.log_timings()
+        assert not caplog.records
+
+    def test_invalid_stages(self):
+        with StagePipeline() as pipeline:
+            pipeline.checkpoint(name="stage_6021")
+            with pytest.raises(ValueError, match="stage_6021 already exists"):
+                pipeline.submit(name="stage_6021", func=lambda: None)
+            with pytest.raises(ValueError, match="depends on unknown stages: 6021"):
+                pipeline.submit(name="other", func=lambda: None, depends_on=["6021"])
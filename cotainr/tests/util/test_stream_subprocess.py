@@ -17,7 +17,7 @@ import sys
 import pytest
 
 from cotainr.tracing import LogDispatcher, LogSettings
-from cotainr.util import _print_and_capture_stream, stream_subprocess
+from cotainr.util import ResourceUsage, _print_and_capture_stream, stream_subprocess
 
 
 class TestStreamSubprocess:
@@ -32,6 +32,23 @@ class TestStreamSubprocess:
         assert process.returncode == 0
         assert process.stdout.strip() == platform.python_version()
 
+    def test_resource_usage(self):
+        process = stream_subprocess(
+            args=[
+                sys.executable,
+                "-c",
+                "import time; sum(range(10**6)); b = bytearray(2**25); time.sleep(0.1)",
+            ]
+        )
+        usage = process.resource_usage
+        assert isinstance(usage, ResourceUsage)
+        assert usage.wall_time >= 0.1
+        assert usage.user_time > 0
+        assert usage.system_time >= 0
+        assert usage.max_rss >= 2**25
+        assert usage.block_input >= 0
+        assert usage.block_output >= 0
+
     def test_check_returncode(self):
         cmd_exit = [sys.executable, "-c", "import sys; sys.exit(1)"]
         with pytest.raises(subprocess.CalledProcessError) as exc_info:
@@ -7,12 +7,31 @@ Licensed under the European Union Public License (EUPL) 1.2
 
 This module implements utility functions.
 
+Classes
+-------
+CommandSession
+    A long-lived shell session for running a sequence of commands.
+ResourceUsage
+    Dataclass containing the resources used by a subprocess.
+StagePipeline
+    A pipeline of build stages, some of which run concurrently.
+
 Functions
 ---------
 answer_is_yes()
     Ask user for confirmation ("yes") of `input_text`.
+clone_tree(\*, src, dst, allow_hardlinks=True)
+    Clone the directory tree `src` to `dst` as cheaply as possible.
+compute_sha256(\*, path)
+    Compute the SHA256 hex digest of the file at `path`.
+deduplicate_tree(\*, path)
+    Replace identical files in the directory tree `path` by hardlinks.
+get_cache_dir()
+    Get the path to the cotainr cache directory.
 get_systems()
     Get a dictionary of predefined systems, defined in systems.json
+get_tree_usage(\*, path)
+    Get the disk usage and number of inodes of the directory tree `path`.
 stream_subprocess(\*, args, \*\*kwargs)
     Run a the command described by `args` while streaming stdout and stderr.
 
@@ -22,18 +41,490 @@ systems_file
     The path to the systems.json file (if present).
 """
 
+import concurrent.futures
 from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import dataclasses
 import functools
+import hashlib
 import json
 import logging
+import os
 from pathlib import Path
+import shlex
+import shutil
+import stat
 import subprocess
 import sys
+import threading
+import time
+import typing
+import uuid
 
 logger = logging.getLogger(__name__)
 systems_file = (Path(__file__) / "../../systems.json").resolve()
 
 
+class CommandSession:
+    """
+    A long-lived shell session for running a sequence of commands.
+
+    Starts a single shell process, described by `args`, and runs each command
+    passed to :meth:`run` in that shell, avoiding the startup cost of the
+    process for every command. The stdout and stderr of each command are
+    streamed separately and the exit status of each command is returned in a
+    :class:`subprocess.CompletedProcess`, similar to :func:`stream_subprocess`.
+    As the commands are not child processes of the Python process, only the
+    wall time of their :class:`ResourceUsage` is known.
+
+    Parameters
+    ----------
+    args : list
+        Program arguments for starting a POSIX shell which reads commands from
+        its stdin, e.g. ["sh"]. See the docstring for :class:`subprocess.Popen`
+        for details.
+    kwargs : dict
+        Keyword arguments passed to :class:`subprocess.Popen` when starting
+        the shell.
+
+    Attributes
+    ----------
+    args : list
+        The program arguments used for starting the shell.
+
+    Notes
+    -----
+    Each command is run in a subshell with its stdin redirected from
+    /dev/null. After the command finishes, a unique marker, along with the
+    exit status of the command, is written to the shell stdout and stderr to
+    mark the end of the command output.
+    """
+
+    def __init__(self, *, args, **kwargs):
+        """Start the shell session."""
+        self.args = args
+        self._lock = threading.Lock()
+        self._process = subprocess.Popen(
+            args,
+            text=True,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=1,
+            **kwargs,
+        )
+
+    def __enter__(self):
+        """Enter the shell session context."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Exit the shell session context and close the session."""
+        self.close()
+
+    @property
+    def is_alive(self):
+        """Whether or not the shell process is still running."""
+        return self._process.poll() is None
+
+    def close(self):
+        """Close the shell session and wait for the shell to exit."""
+        if self.is_alive:
+            try:
+                self._process.stdin.close()
+            except BrokenPipeError:  # pragma: no cover
+                pass
+        self._process.wait()
+        self._process.stdout.close()
+        self._process.stderr.close()
+
+    def run(self, *, cmd, log_dispatcher=None):
+        """
+        Run `cmd` in the shell session while streaming stdout and stderr.
+
+        Parameters
+        ----------
+        cmd : str
+            The shell command to run in the session.
+        log_dispatcher : :class:`~cotainr.tracing.LogDispatcher`, optional
+            The log dispatcher which command stdout/stderr messages are
+            forwarded to (the default is None which implies that command
+            messages are forwarded directly to stdout/stderr).
+
+        Returns
+        -------
+        completed_process : :class:`subprocess.CompletedProcess`
+            Information about the completed command, including its
+            `resource_usage` as a :class:`ResourceUsage`. Its `args` are the
+            session `args` followed by the command.
+
+        Raises
+        ------
+        :class:`subprocess.CalledProcessError`
+            If the command returned a non-zero exit status or if the shell
+            process exited while running the command.
+        """
+        marker = f"__cotainr_command_session_{uuid.uuid4().hex}__"
+        process_args = [*self.args, *shlex.split(cmd)]
+        with self._lock:
+            t_start = time.monotonic()
+            try:
+                self._process.stdin.write(
+                    f"( {cmd}\n) </dev/null; "
+                    f"printf '%s %s\\n' '{marker}' \"$?\"; "
+                    f"printf '%s\\n' '{marker}' >&2\n"
+                )
+                self._process.stdin.flush()
+            except BrokenPipeError:
+                pass  # The shell has exited. Capture the remaining output below.
+
+            with ThreadPoolExecutor(
+                max_workers=2,
+                thread_name_prefix="cotainr_command_session_thread",
+            ) as executor:
+                stdout_future = executor.submit(
+                    _print_and_capture_stream_until_marker,
+                    stream_handle=self._process.stdout,
+                    print_dispatch=(
+                        log_dispatcher.log_to_stdout
+                        if log_dispatcher is not None
+                        else functools.partial(print, end="", file=sys.stdout)
+                    ),
+                    marker=marker,
+                )
+                stderr_future = executor.submit(
+                    _print_and_capture_stream_until_marker,
+                    stream_handle=self._process.stderr,
+                    print_dispatch=(
+                        log_dispatcher.log_to_stderr
+                        if log_dispatcher is not None
+                        else functools.partial(print, end="", file=sys.stderr)
+                    ),
+                    marker=marker,
+                )
+                captured_stdout, stdout_marker_line = stdout_future.result()
+                captured_stderr, _ = stderr_future.result()
+
+        if stdout_marker_line is None:
+            # The shell process exited before the command finished
+            returncode = self._process.wait()
+            raise subprocess.CalledProcessError(
+                returncode if returncode != 0 else -1,
+                process_args,
+                output="".join(captured_stdout),
+                stderr="".join(captured_stderr),
+            )
+
+        completed_process = subprocess.CompletedProcess(
+            process_args,
+            int(stdout_marker_line.split()[-1]),
+            stdout="".join(captured_stdout),
+            stderr="".join(captured_stderr),
+        )
+        completed_process.resource_usage = ResourceUsage(
+            wall_time=time.monotonic() - t_start
+        )
+        completed_process.check_returncode()
+
+        return completed_process
+
+
+@dataclasses.dataclass(frozen=True)
+class ResourceUsage:
+    """
+    Dataclass containing the resources used by a subprocess.
+
+    Attributes
+    ----------
+    wall_time : float
+        The wall time in seconds from starting the subprocess until it exited.
+    user_time : float or None, default=None
+        The user CPU time in seconds, if known.
+    system_time : float or None, default=None
+        The system CPU time in seconds, if known.
+    max_rss : int or None, default=None
+        The peak resident set size in bytes, if known.
+    block_input : int or None, default=None
+        The number of block input operations, i.e. reads from disk, if known.
+    block_output : int or None, default=None
+        The number of block output operations, i.e. writes to disk, if known.
+
+    Notes
+    -----
+    The resource usage is that of the subprocess and all of its descendants
+    that it waited for, except for the peak resident set size, which is the
+    largest of those of any of them.
+    """
+
+    wall_time: float
+    user_time: typing.Optional[float] = None
+    system_time: typing.Optional[float] = None
+    max_rss: typing.Optional[int] = None
+    block_input: typing.Optional[int] = None
+    block_output: typing.Optional[int] = None
+
+    @classmethod
+    def from_rusage(cls, *, wall_time, rusage):
+        """
+        Construct the resource usage from an :func:`os.wait4` rusage.
+
+        Parameters
+        ----------
+        wall_time : float
+            The wall time in seconds of the subprocess.
+        rusage : :class:`resource.struct_rusage`
+            The resource usage returned by :func:`os.wait4`.
+
+        Returns
+        -------
+        resource_usage : :class:`ResourceUsage`
+            The resource usage of the subprocess.
+        """
+        return cls(
+            wall_time=wall_time,
+            user_time=rusage.ru_utime,
+            system_time=rusage.ru_stime,
+            max_rss=rusage.ru_maxrss * 1024,  # ru_maxrss is in KiB on Linux
+            block_input=rusage.ru_inblock,
+            block_output=rusage.ru_oublock,
+        )
+
+
+class StagePipeline:
+    """
+    A pipeline of build stages, some of which run concurrently.
+
+    Stages submitted using :meth:`submit` run in background threads once the
+    stages they depend on have finished. Their results are obtained using
+    :meth:`result`. The stages run in the calling thread are marked using
+    :meth:`checkpoint`, each of them spanning the time since the previous
+    checkpoint, except for any time spent waiting for background stages.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        The maximum number of background stages that run concurrently (the
+        default is None which implies the default of
+        :class:`concurrent.futures.ThreadPoolExecutor`).
+
+    Attributes
+    ----------
+    timings : dict
+        The "start" and "end" time, in seconds since the start of the
+        pipeline, the "duration", and the names of the stages it "depends_on"
+        of each finished stage, keyed by the stage name.
+
+    Notes
+    -----
+    A stage run in the calling thread depends on the previous such stage and
+    on the background stages whose results were obtained during it. A
+    background stage depends on the stages given when submitting it and on the
+    stage that was running in the calling thread when it was submitted. The
+    critical path of the pipeline is the chain of stages, ending with the last
+    stage to finish, in which each stage is preceded by the stage it depends
+    on that finished last. It shows which stages the wall time of the
+    pipeline is spent on, i.e. which stages to speed up to speed up the
+    pipeline.
+    """
+
+    def __init__(self, *, max_workers=None):
+        """Start the stage pipeline."""
+        self.timings = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="cotainr_stage"
+        )
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._start_time = time.monotonic()
+        self._last_checkpoint = None
+        self._awaited_stages = []
+        self._wait_time = 0.0
+
+    def __enter__(self):
+        """Enter the stage pipeline context."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Exit the stage pipeline context and wait for running stages."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def checkpoint(self, *, name):
+        """
+        Mark the end of the stage `name` run in the calling thread.
+
+        Parameters
+        ----------
+        name : str
+            The name of the stage.
+
+        Raises
+        ------
+        ValueError
+            If a stage with the same name already exists.
+        """
+        self._check_new_stage(name=name)
+        end = self._elapsed_time()
+        start = (
+            self.timings[self._last_checkpoint]["end"]
+            if self._last_checkpoint is not None
+            else 0.0
+        )
+        depends_on = (
+            [self._last_checkpoint] if self._last_checkpoint is not None else []
+        ) + self._awaited_stages
+        self._record(
+            name=name,
+            start=start,
+            end=end,
+            duration=end - start - self._wait_time,
+            depends_on=depends_on,
+        )
+        self._last_checkpoint = name
+        self._awaited_stages = []
+        self._wait_time = 0.0
+
+    def critical_path(self):
+        """
+        Get the critical path of the finished stages.
+
+        Returns
+        -------
+        critical_path : list of str
+            The names of the stages on the critical path, in the order they
+            ran.
+        """
+        with self._lock:
+            timings = dict(self.timings)
+        if not timings:
+            return []
+
+        name = max(timings, key=lambda stage: timings[stage]["end"])
+        critical_path = [name]
+        while dependencies := [
+            stage for stage in timings[name]["depends_on"] if stage in timings
+        ]:
+            name = max(dependencies, key=lambda stage: timings[stage]["end"])
+            critical_path.append(name)
+
+        return critical_path[::-1]
+
+    def log_timings(self):
+        """Log the critical path and the overlap of the finished stages."""
+        critical_path = self.critical_path()
+        if not critical_path:
+            return
+
+        logger.info(
+            "Critical path of the build: %s",
+            " -> ".join(
+                f"{name} ({self.timings[name]['duration']:.1f} s)"
+                for name in critical_path
+            ),
+        )
+        wall_time = self.timings[critical_path[-1]]["end"]
+        stages_time = sum(timing["duration"] for timing in self.timings.values())
+        logger.info(
+            "Ran %d build stages in %.1f s, of which %.1f s overlapped",
+            len(self.timings),
+            wall_time,
+            max(stages_time - wall_time, 0.0),
+        )
+
+    def result(self, *, name):
+        """
+        Wait for the background stage `name` to finish and get its result.
+
+        Parameters
+        ----------
+        name : str
+            The name of the background stage.
+
+        Returns
+        -------
+        result : object
+            The return value of the function run in the background stage.
+
+        Raises
+        ------
+        Exception
+            Any exception raised in the background stage.
+        """
+        t_start = time.monotonic()
+        try:
+            return self._futures[name].result()
+        finally:
+            self._wait_time += time.monotonic() - t_start
+            self._awaited_stages.append(name)
+
+    def submit(self, *, name, func, depends_on=()):
+        """
+        Submit the stage `name` to run `func` in a background thread.
+
+        Parameters
+        ----------
+        name : str
+            The name of the stage.
+        func : callable
+            The function, taking no arguments, to run in the stage.
+        depends_on : iterable of str, default=()
+            The names of earlier submitted background stages that must finish
+            before the stage is run. The stage fails if any of them fails.
+
+        Raises
+        ------
+        ValueError
+            If a stage with the same name already exists or a stage it depends
+            on has not been submitted.
+        """
+        self._check_new_stage(name=name)
+        depends_on = list(depends_on)
+        if unknown_stages := [
+            stage for stage in depends_on if stage not in self._futures
+        ]:
+            raise ValueError(
+                f"The stage {name} depends on unknown stages: "
+                f"{', '.join(unknown_stages)}."
+            )
+        dependencies = [self._futures[stage] for stage in depends_on]
+        if self._last_checkpoint is not None:
+            # The stage could not start before it was submitted
+            depends_on = [self._last_checkpoint, *depends_on]
+
+        def run_stage():
+            for dependency in dependencies:
+                dependency.result()
+            start = self._elapsed_time()
+            try:
+                return func()
+            finally:
+                end = self._elapsed_time()
+                self._record(
+                    name=name,
+                    start=start,
+                    end=end,
+                    duration=end - start,
+                    depends_on=depends_on,
+                )
+
+        self._futures[name] = self._executor.submit(run_stage)
+
+    def _check_new_stage(self, *, name):
+        """Check that no stage named `name` exists."""
+        with self._lock:
+            if name in self._futures or name in self.timings:
+                raise ValueError(f"A stage named {name} already exists.")
+
+    def _elapsed_time(self):
+        """Get the time in seconds since the start of the pipeline."""
+        return time.monotonic() - self._start_time
+
+    def _record(self, *, name, **timing):
+        """Record the `timing` of the finished stage `name`."""
+        with self._lock:
+            self.timings[name] = timing
+        logger.debug("Finished build stage %s in %.1f s", name, timing["duration"])
+
+
 def answer_is_yes(input_text, max_attempts=1000):
     """
     Ask user for confirmation ("yes") of `input_text`.
@@ -67,6 +558,242 @@ def answer_is_yes(input_text, max_attempts=1000):
         return False
 
 
+def clone_tree(*, src, dst, allow_hardlinks=True):
+    """
+    Clone the directory tree `src` to `dst` as cheaply as possible.
+
+    The clone is attempted, in order, as a reflink (copy-on-write) copy, a
+    hardlink copy (if `allow_hardlinks` is True), and finally a regular copy.
+    In all cases, file modes, ownership, timestamps, and symlinks are
+    preserved. The `dst` path must not exist beforehand.
+
+    Parameters
+    ----------
+    src : :class:`os.PathLike`
+        The directory tree to clone.
+    dst : :class:`os.PathLike`
+        The path of the clone.
+    allow_hardlinks : bool, default=True
+        Whether or not to fall back to hardlinking files if reflinks are not
+        supported by the underlying file system.
+
+    Returns
+    -------
+    clone_method : str
+        The method used for cloning the tree: "reflink", "hardlink", or
+        "copy".
+
+    Raises
+    ------
+    :class:`FileExistsError`
+        If `dst` already exists.
+    :class:`subprocess.CalledProcessError`
+        If all attempts at cloning `src` fail.
+
+    Notes
+    -----
+    Files in a hardlink clone share their inode with the files in `src`. Thus,
+    modifying such a file in place, e.g. by appending to it, also modifies
+    the file in `src`. Replacing a file, e.g. by writing a new file and
+    renaming it, does not.
+    """
+    src, dst = Path(src), Path(dst)
+    if dst.exists():
+        raise FileExistsError(f"The clone destination {dst} already exists.")
+
+    clone_methods = {"reflink": ["cp", "-a", "--reflink=always"]}
+    if allow_hardlinks:
+        clone_methods["hardlink"] = ["cp", "-a", "-l"]
+    clone_methods["copy"] = ["cp", "-a"]
+    for clone_method, cp_args in clone_methods.items():
+        try:
+            subprocess.run(
+                [*cp_args, src, dst], check=True, capture_output=True, text=True
+            )
+            break
+        except subprocess.CalledProcessError as e:
+            logger.debug(
+                "Unable to clone %s to %s using %s: %s",
+                src,
+                dst,
+                clone_method,
+                e.stderr.strip(),
+            )
+            shutil.rmtree(dst, ignore_errors=True)
+            clone_error = e
+    else:
+        raise clone_error
+
+    return clone_method
+
+
+def compute_sha256(*, path, chunk_size=2**20):
+    """
+    Compute the SHA256 hex digest of the file at `path`.
+
+    Parameters
+    ----------
+    path : :class:`os.PathLike`
+        The path of the file to compute the digest of.
+    chunk_size : int, default=2**20
+        The number of bytes to read from the file at a time.
+
+    Returns
+    -------
+    digest : str
+        The SHA256 hex digest of the file content.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(functools.partial(f.read, chunk_size), b""):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+def deduplicate_tree(*, path, min_size=1, partial_size=2**16, max_workers=None):
+    """
+    Replace identical files in the directory tree `path` by hardlinks.
+
+    Candidate duplicates are narrowed down by file size, then by the SHA256
+    digest of the first `partial_size` bytes, and finally by the SHA256
+    digest of the full content. Only regular files on the same file system
+    with the same permissions, ownership and modification time are linked,
+    since hardlinks share these. In particular, linking files with different
+    modification times would invalidate timestamp based Python bytecode
+    compiled from them. Each duplicate is atomically replaced by a hardlink to
+    the first file found with the same content.
+
+    Parameters
+    ----------
+    path : :class:`os.PathLike`
+        The root of the directory tree.
+    min_size : int, default=1
+        The minimum size in bytes of files to deduplicate.
+    partial_size : int, default=2**16
+        The number of bytes to hash when comparing file prefixes.
+    max_workers : int, optional
+        The maximum number of threads used for hashing files (the default is
+        None which implies the :class:`ThreadPoolExecutor
+        <concurrent.futures.ThreadPoolExecutor>` default).
+
+    Returns
+    -------
+    dedup_stats : tuple of int
+        The number of (bytes saved, files replaced by hardlinks).
+    """
+
+    def partial_sha256(file_path):
+        with open(file_path, "rb") as f:
+            return hashlib.sha256(f.read(partial_size)).hexdigest()
+
+    def group_by(groups, key_func):
+        # Split each group of inodes by `key_func` applied to their first path
+        def inode_key(inode):
+            try:
+                return key_func(inode_paths[inode][0])
+            except OSError as e:
+                # Unreadable files are kept in a group of their own
+                logger.debug("Unable to read %s: %s", inode_paths[inode][0], e)
+                return inode
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            new_groups = {}
+            for group_key, inodes in groups.items():
+                keys = executor.map(inode_key, inodes)
+                for inode, key in zip(inodes, keys):
+                    new_groups.setdefault((*group_key, key), []).append(inode)
+        return {key: inodes for key, inodes in new_groups.items() if len(inodes) > 1}
+
+    # Group regular files by inode and their inodes by size and metadata
+    inode_paths = {}
+    inode_size = {}
+    groups = {}
+    for dir_path, _dir_names, file_names in os.walk(path):
+        for file_name in file_names:
+            file_path = os.path.join(dir_path, file_name)
+            try:
+                file_stat = os.lstat(file_path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(file_stat.st_mode) or file_stat.st_size < min_size:
+                continue
+            inode = (file_stat.st_dev, file_stat.st_ino)
+            if inode not in inode_paths:
+                inode_paths[inode] = []
+                inode_size[inode] = file_stat.st_size
+                groups.setdefault(
+                    (
+                        file_stat.st_dev,
+                        file_stat.st_size,
+                        file_stat.st_mode,
+                        file_stat.st_uid,
+                        file_stat.st_gid,
+                        file_stat.st_mtime_ns,
+                    ),
+                    [],
+                ).append(inode)
+            inode_paths[inode].append(file_path)
+    groups = {key: inodes for key, inodes in groups.items() if len(inodes) > 1}
+
+    # Narrow down the groups by partial and full content digests. The partial
+    # digest covers the full content of files no larger than `partial_size`.
+    groups = group_by(groups, partial_sha256)
+    small_file_groups = {
+        key: inodes for key, inodes in groups.items() if key[1] <= partial_size
+    }
+    large_file_groups = group_by(
+        {key: inodes for key, inodes in groups.items() if key[1] > partial_size},
+        lambda file_path: compute_sha256(path=file_path),
+    )
+    groups = {**small_file_groups, **large_file_groups}
+
+    # Replace duplicates by hardlinks to the first inode in each group
+    bytes_saved = 0
+    files_linked = 0
+    for inodes in groups.values():
+        target = inode_paths[inodes[0]][0]
+        for inode in inodes[1:]:
+            for file_path in inode_paths[inode]:
+                tmp_link = f"{file_path}.cotainr-dedup-{uuid.uuid4().hex}"
+                try:
+                    os.link(target, tmp_link)
+                    os.replace(tmp_link, file_path)
+                except OSError as e:
+                    logger.debug("Unable to deduplicate %s: %s", file_path, e)
+                    with contextlib.suppress(FileNotFoundError):
+                        os.unlink(tmp_link)
+                    break
+                files_linked += 1
+            else:
+                bytes_saved += inode_size[inode]
+
+    return bytes_saved, files_linked
+
+
+def get_cache_dir():
+    """
+    Get the path to the cotainr cache directory.
+
+    The cache directory is, in order of precedence, the value of the
+    COTAINR_CACHE_DIR environment variable, `$XDG_CACHE_HOME/cotainr`, or
+    `~/.cache/cotainr`. The directory is not created by this function.
+
+    Returns
+    -------
+    cache_dir : :class:`pathlib.Path`
+        The path to the cotainr cache directory.
+    """
+    if os.environ.get("COTAINR_CACHE_DIR"):
+        cache_dir = Path(os.environ["COTAINR_CACHE_DIR"])
+    elif os.environ.get("XDG_CACHE_HOME"):
+        cache_dir = Path(os.environ["XDG_CACHE_HOME"]) / "cotainr"
+    else:
+        cache_dir = Path.home() / ".cache/cotainr"
+
+    return cache_dir.expanduser().resolve()
+
+
 def get_systems():
     """
     Get a dictionary of predefined systems, defined in the systems.json file.
@@ -93,6 +820,63 @@ def get_systems():
         return {}
 
 
+def get_tree_usage(*, path, max_workers=None):
+    """
+    Get the disk usage and number of inodes of the directory tree `path`.
+
+    The directories in the tree are scanned in parallel using a thread pool.
+    Symlinks are not followed and hard linked files are only counted once,
+    like `du` does.
+
+    Parameters
+    ----------
+    path : :class:`os.PathLike`
+        The root of the directory tree.
+    max_workers : int, optional
+        The maximum number of threads used for scanning directories (the
+        default is None which implies the :class:`ThreadPoolExecutor
+        <concurrent.futures.ThreadPoolExecutor>` default).
+
+    Returns
+    -------
+    usage : tuple of int
+        The (bytes, inodes) used by the directory tree.
+    """
+
+    def scan_dir(dir_path):
+        entries, subdirs = [], []
+        try:
+            with os.scandir(dir_path) as dir_entries:
+                for entry in dir_entries:
+                    try:
+                        stat = entry.stat(follow_symlinks=False)
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                    except OSError:
+                        # Removed while scanning
+                        continue
+                    entries.append((stat.st_dev, stat.st_ino, stat.st_blocks * 512))
+        except OSError as e:
+            logger.debug("Unable to scan %s: %s", dir_path, e)
+        return entries, subdirs
+
+    root_stat = os.lstat(path)
+    inode_usage = {(root_stat.st_dev, root_stat.st_ino): root_stat.st_blocks * 512}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(scan_dir, path)}
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                entries, subdirs = future.result()
+                for dev, ino, usage in entries:
+                    inode_usage[(dev, ino)] = usage
+                pending.update(executor.submit(scan_dir, subdir) for subdir in subdirs)
+
+    return sum(inode_usage.values()), len(inode_usage)
+
+
 def stream_subprocess(*, args, log_dispatcher=None, **kwargs):
     """
     Run a the command described by `args` while streaming stdout and stderr.
@@ -115,7 +899,8 @@ def stream_subprocess(*, args, log_dispatcher=None, **kwargs):
     Returns
     -------
     completed_process : :class:`subprocess.CompletedProcess`
-        Information about the completed subprocess.
+        Information about the completed subprocess, including its
+        `resource_usage` as a :class:`ResourceUsage`.
 
     Raises
     ------
@@ -124,12 +909,16 @@ def stream_subprocess(*, args, log_dispatcher=None, **kwargs):
 
     Notes
     -----
+    The subprocess is reaped using :func:`os.wait4` to obtain its resource
+    usage.
+
     The way we handle stdout and stderr messages in separate threads introduces
     a race condition in cases where subprocesses write to stdout and stderr at
     the same time. All messages are always guaranteed to be streamed to the
     console, but they might arrive in the wrong order. We accept this "feature"
     as is.
     """
+    t_start = time.monotonic()
     with subprocess.Popen(
         args,
         text=True,
@@ -165,12 +954,20 @@ def stream_subprocess(*, args, log_dispatcher=None, **kwargs):
             captured_stdout = stdout_future.result()
             captured_stderr = stderr_future.result()
 
+        # Reap the subprocess ourselves to get its resource usage
+        _, wait_status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(wait_status)
+        resource_usage = ResourceUsage.from_rusage(
+            wall_time=time.monotonic() - t_start, rusage=rusage
+        )
+
     completed_process = subprocess.CompletedProcess(
         process.args,
         process.returncode,
         stdout="".join(captured_stdout),
         stderr="".join(captured_stderr),
     )
+    completed_process.resource_usage = resource_usage
 
     completed_process.check_returncode()
 
@@ -201,6 +998,44 @@ def _print_and_capture_stream(*, stream_handle, print_dispatch):
     return captured_stream
 
 
+def _print_and_capture_stream_until_marker(*, stream_handle, print_dispatch, marker):
+    """
+    Print a text stream while also storing it until a marker line is found.
+
+    Any text preceding the marker on the marker line is treated as the final
+    (partial) line of the stream.
+
+    Parameters
+    ----------
+    stream_handle : :py:class:`io.TextIOWrapper`
+        The text stream to print and capture.
+    print_dispatch : Callable
+        The callable to use for printing.
+    marker : str
+        The marker indicating the end of the stream.
+
+    Returns
+    -------
+    captured_stream : list of str
+        The lines captured from the stream before the marker.
+    marker_line : str or None
+        The line starting with the marker or None if the stream ended without
+        a marker.
+    """
+    captured_stream = []
+    for line in stream_handle:
+        marker_idx = line.find(marker)
+        if marker_idx >= 0:
+            if marker_idx > 0:
+                print_dispatch(line[:marker_idx])
+                captured_stream.append(line[:marker_idx])
+            return captured_stream, line[marker_idx:]
+        print_dispatch(line)
+        captured_stream.append(line)
+
+    return captured_stream, None
+
+
 def _flush_stdin_buffer():
     """
     Discard queued data on stdin file descriptor.